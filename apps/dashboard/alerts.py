@@ -0,0 +1,104 @@
+"""
+Buffered, de-duplicated system alerts.
+
+``AlertBuffer`` collects alerts in memory, coalescing repeats by fingerprint,
+and flushes them in one transaction: open alerts with the same fingerprint
+get their occurrence counter and last-seen time bumped with ``bulk_update``,
+the rest are inserted with ``bulk_create``. Flushes hold a transaction-level
+advisory lock so concurrent writers never race on the same open alert.
+"""
+import zlib
+from django.db import connection, transaction
+from django.utils import timezone
+from .events import publish_on_commit
+from .models import SystemAlert
+
+FLUSH_LOCK_KEY = zlib.crc32(b'dashboard.systemalert')
+
+
+class AlertBuffer:
+    FLUSH_SIZE = 500
+
+    def __init__(self):
+        self.pending = {}
+        # Every alert written by this buffer, by fingerprint
+        self.alerts = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def add(self, alert_type, title, message, priority='medium',
+            related_product=None, related_order=None, related_user=None, fingerprint=None):
+        """
+        Queue an alert and return its fingerprint. ``fingerprint`` overrides
+        the default (type + related objects) for alerts about other things.
+        """
+        fingerprint = fingerprint or SystemAlert.make_fingerprint(
+            alert_type, related_product, related_order, related_user
+        )
+        entry = self.pending.get(fingerprint)
+        if entry is None:
+            self.pending[fingerprint] = entry = {
+                'alert_type': alert_type,
+                'related_product_id': getattr(related_product, 'pk', related_product),
+                'related_order_id': getattr(related_order, 'pk', related_order),
+                'related_user_id': getattr(related_user, 'pk', related_user),
+                'count': 0,
+            }
+        entry.update(title=title, message=message, priority=priority, last_seen_at=timezone.now())
+        entry['count'] += 1
+        if len(self.pending) >= self.FLUSH_SIZE:
+            self.flush()
+        return fingerprint
+
+    def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        now = timezone.now()
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)', [FLUSH_LOCK_KEY])
+            existing = {
+                alert.fingerprint: alert
+                for alert in SystemAlert.objects.filter(fingerprint__in=pending.keys(), is_resolved=False)
+            }
+            updated, created = [], []
+            for fingerprint, entry in pending.items():
+                count = entry.pop('count')
+                alert = existing.get(fingerprint)
+                if alert is None:
+                    alert = SystemAlert(fingerprint=fingerprint, occurrences=count, **entry)
+                    created.append(alert)
+                else:
+                    alert.occurrences += count
+                    alert.title = entry['title']
+                    alert.message = entry['message']
+                    alert.priority = entry['priority']
+                    alert.last_seen_at = entry['last_seen_at']
+                    alert.updated_at = now
+                    updated.append(alert)
+                self.alerts[fingerprint] = alert
+
+            SystemAlert.objects.bulk_update(
+                updated,
+                ['occurrences', 'title', 'message', 'priority', 'last_seen_at', 'updated_at'],
+                batch_size=self.FLUSH_SIZE,
+            )
+            SystemAlert.objects.bulk_create(created, batch_size=self.FLUSH_SIZE)
+
+            for event_type, alerts in (('alert.created', created), ('alert.updated', updated)):
+                for alert in alerts:
+                    publish_on_commit(event_type, {
+                        'id': alert.pk,
+                        'alert_type': alert.alert_type,
+                        'priority': alert.priority,
+                        'title': alert.title,
+                        'occurrences': alert.occurrences,
+                        'last_seen_at': alert.last_seen_at,
+                    })
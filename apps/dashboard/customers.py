@@ -0,0 +1,177 @@
+"""
+Per-customer order statistics and RFM segmentation.
+
+``CustomerStatsService.refresh_users`` recomputes the stats of a few customers
+after their orders change; ``rebuild`` recomputes everyone with one grouped
+INSERT ... SELECT and ``rescore`` recomputes the RFM quintile breakpoints and
+scores everyone against them. Between rescores, refreshed customers are
+scored against the breakpoints cached by the last rescore, the same way.
+"""
+from bisect import bisect_left
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Sum, Count, Min, Max, F, Q, Case, When, Value
+from apps.orders.models import Order, OrderItem
+from .models import CustomerStats
+from .rollups import REVENUE_STATUSES
+
+# First matching rule wins; customers matching none are 'regular'
+SEGMENT_RULES = [
+    ('champions', Q(recency_score__gte=4, frequency_score__gte=4)),
+    ('new', Q(recency_score__gte=4, order_count=1)),
+    ('loyal', Q(frequency_score__gte=4)),
+    ('at_risk', Q(recency_score__lte=2, frequency_score__gte=3)),
+    ('hibernating', Q(recency_score__lte=2)),
+]
+
+
+def segment_expression():
+    return Case(*[When(rule, then=Value(segment)) for segment, rule in SEGMENT_RULES], default=Value('regular'))
+
+
+class CustomerStatsService:
+    DEBOUNCE_SECONDS = 30
+    BREAKPOINTS_KEY = 'customer_rfm_breakpoints'
+
+    @classmethod
+    def mark_dirty(cls, user_ids):
+        from .tasks import refresh_customer_stats_task
+
+        pending = [user_id for user_id in set(user_ids)
+                   if user_id and cache.add(f'customer_stats_dirty:{user_id}', 1, cls.DEBOUNCE_SECONDS * 2)]
+        if pending:
+            refresh_customer_stats_task.apply_async(args=[pending], countdown=cls.DEBOUNCE_SECONDS)
+
+    @classmethod
+    def refresh_users(cls, user_ids):
+        """Recompute the stats of ``user_ids`` from their orders."""
+        cache.delete_many([f'customer_stats_dirty:{user_id}' for user_id in user_ids])
+        orders = (
+            Order.objects.filter(user_id__in=user_ids, status__in=REVENUE_STATUSES)
+            .values('user_id')
+            .annotate(first=Min('created_at'), last=Max('created_at'), count=Count('id'), revenue=Sum('total'))
+            .order_by()
+        )
+        profits = dict(
+            OrderItem.objects.filter(order__user_id__in=user_ids, order__status__in=REVENUE_STATUSES)
+            .values('order__user_id')
+            .annotate(profit=Sum((F('selling_price') - F('cost_price')) * F('quantity')))
+            .order_by()
+            .values_list('order__user_id', 'profit')
+        )
+        breakpoints = cache.get(cls.BREAKPOINTS_KEY)
+
+        stats = []
+        for row in orders:
+            stat = CustomerStats(
+                user_id=row['user_id'],
+                first_order_at=row['first'],
+                last_order_at=row['last'],
+                order_count=row['count'],
+                lifetime_revenue=row['revenue'],
+                lifetime_profit=profits.get(row['user_id']) or 0,
+                average_order_value=row['revenue'] / row['count'],
+            )
+            if breakpoints:
+                stat.recency_score = 1 + bisect_left(breakpoints['recency'], stat.last_order_at.timestamp())
+                stat.frequency_score = 1 + bisect_left(breakpoints['frequency'], stat.order_count)
+                stat.monetary_score = 1 + bisect_left(breakpoints['monetary'], float(stat.lifetime_revenue))
+            stats.append(stat)
+
+        with transaction.atomic():
+            kept = [stat.user_id for stat in stats]
+            CustomerStats.objects.filter(user_id__in=user_ids).exclude(user_id__in=kept).delete()
+            CustomerStats.objects.bulk_create(
+                stats,
+                update_conflicts=True,
+                unique_fields=['user'],
+                update_fields=['first_order_at', 'last_order_at', 'order_count', 'lifetime_revenue',
+                               'lifetime_profit', 'average_order_value', 'recency_score',
+                               'frequency_score', 'monetary_score', 'updated_at'],
+            )
+            if breakpoints:
+                CustomerStats.objects.filter(user_id__in=kept).update(segment=segment_expression())
+        return len(stats)
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every customer with one grouped query, then rescore."""
+        stats = CustomerStats._meta.db_table
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {stats} (user_id, first_order_at, last_order_at, order_count, lifetime_revenue,
+                                     lifetime_profit, average_order_value, recency_score, frequency_score,
+                                     monetary_score, segment, updated_at)
+                SELECT o.user_id, MIN(o.created_at), MAX(o.created_at), COUNT(*), SUM(o.total),
+                       COALESCE(SUM(i.profit), 0), SUM(o.total) / COUNT(*), 0, 0, 0, 'regular', now()
+                FROM {Order._meta.db_table} o
+                LEFT JOIN (
+                    SELECT order_id, SUM((selling_price - cost_price) * quantity) AS profit
+                    FROM {OrderItem._meta.db_table} GROUP BY order_id
+                ) i ON i.order_id = o.id
+                WHERE o.user_id IS NOT NULL AND o.status = ANY(%s)
+                GROUP BY o.user_id
+                ON CONFLICT (user_id) DO UPDATE SET
+                    first_order_at = EXCLUDED.first_order_at,
+                    last_order_at = EXCLUDED.last_order_at,
+                    order_count = EXCLUDED.order_count,
+                    lifetime_revenue = EXCLUDED.lifetime_revenue,
+                    lifetime_profit = EXCLUDED.lifetime_profit,
+                    average_order_value = EXCLUDED.average_order_value,
+                    updated_at = EXCLUDED.updated_at
+                """,
+                [REVENUE_STATUSES],
+            )
+            rows = cursor.rowcount
+            cursor.execute(
+                f"""
+                DELETE FROM {stats} s WHERE NOT EXISTS (
+                    SELECT 1 FROM {Order._meta.db_table} o WHERE o.user_id = s.user_id AND o.status = ANY(%s)
+                )
+                """,
+                [REVENUE_STATUSES],
+            )
+        cls.rescore()
+        return rows
+
+    @classmethod
+    def rescore(cls):
+        """
+        Score all customers against RFM quintile breakpoints and cache them.
+        A score is 1 + the number of breakpoints below the value, exactly as
+        ``refresh_users`` scores with ``bisect_left``, so tied values always
+        share a score and segments only move when the breakpoints do.
+        """
+        stats = CustomerStats._meta.db_table
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    SELECT percentile_disc(ARRAY[0.2, 0.4, 0.6, 0.8]) WITHIN GROUP (ORDER BY extract(epoch FROM last_order_at)),
+                           percentile_disc(ARRAY[0.2, 0.4, 0.6, 0.8]) WITHIN GROUP (ORDER BY order_count),
+                           percentile_disc(ARRAY[0.2, 0.4, 0.6, 0.8]) WITHIN GROUP (ORDER BY lifetime_revenue)
+                    FROM {stats}
+                    """
+                )
+                recency, frequency, monetary = cursor.fetchone()
+                if not recency:
+                    return
+                breakpoints = {
+                    'recency': [float(value) for value in recency],
+                    'frequency': [float(value) for value in frequency],
+                    'monetary': [float(value) for value in monetary],
+                }
+                cursor.execute(
+                    f"""
+                    UPDATE {stats} SET
+                        recency_score = 1 + (SELECT count(*) FROM unnest(%s::float8[]) b
+                                             WHERE b < extract(epoch FROM last_order_at)::float8),
+                        frequency_score = 1 + (SELECT count(*) FROM unnest(%s::float8[]) b WHERE b < order_count),
+                        monetary_score = 1 + (SELECT count(*) FROM unnest(%s::float8[]) b
+                                              WHERE b < lifetime_revenue::float8)
+                    """,
+                    [breakpoints['recency'], breakpoints['frequency'], breakpoints['monetary']],
+                )
+            CustomerStats.objects.update(segment=segment_expression())
+        cache.set(cls.BREAKPOINTS_KEY, breakpoints, None)
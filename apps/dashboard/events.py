@@ -0,0 +1,107 @@
+"""
+Live dashboard events over Redis pub/sub.
+
+Writers call ``publish_on_commit`` from signal handlers; the event goes out on
+``CHANNEL`` once the transaction commits. Each ASGI process holds a single
+subscription through ``broadcaster`` and fans every message, formatted once
+as an SSE frame, out to the in-process queues of its connected streams, so
+open dashboards cost one Redis connection per process instead of one query
+loop per browser.
+"""
+import asyncio
+import json
+import logging
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+import redis
+import redis.asyncio
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'dashboard:events'
+
+_client = None
+
+
+def get_redis():
+    """Process-wide synchronous Redis client for publishing."""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL)
+    return _client
+
+
+def publish(event_type, data):
+    """Publish an event now; failures are logged, never raised to the writer."""
+    message = json.dumps({'type': event_type, 'data': data}, cls=DjangoJSONEncoder)
+    try:
+        get_redis().publish(CHANNEL, message)
+    except redis.RedisError:
+        logger.warning(f"Could not publish dashboard event {event_type}", exc_info=True)
+
+
+def publish_on_commit(event_type, data):
+    transaction.on_commit(lambda: publish(event_type, data))
+
+
+def sse_frame(message):
+    """Server-sent-events frame of a published message."""
+    event = json.loads(message)
+    return f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+class EventBroadcaster:
+    """
+    One pub/sub subscription per process, fanned out to per-stream queues.
+    The subscription is opened with the first subscriber and closed with the
+    last. A stream that stops reading loses its oldest events rather than
+    holding back the others.
+    """
+
+    RECONNECT_DELAY = 1.0
+
+    def __init__(self, connect=None, queue_size=None):
+        self.connect = connect or (lambda: redis.asyncio.Redis.from_url(settings.REDIS_URL).pubsub())
+        self.queue_size = queue_size or settings.DASHBOARD_STREAM_QUEUE_SIZE
+        self.queues = set()
+        self.listener = None
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.queues.add(queue)
+        if self.listener is None or self.listener.done():
+            self.listener = asyncio.get_running_loop().create_task(self._listen())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.queues.discard(queue)
+        if not self.queues and self.listener is not None:
+            self.listener.cancel()
+            self.listener = None
+
+    def dispatch(self, frame):
+        for queue in self.queues:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(frame)
+
+    async def _listen(self):
+        while True:
+            pubsub = self.connect()
+            try:
+                await pubsub.subscribe(CHANNEL)
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message is not None:
+                        self.dispatch(sse_frame(message['data']))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("Dashboard event subscription lost, reconnecting", exc_info=True)
+                await asyncio.sleep(self.RECONNECT_DELAY)
+            finally:
+                await pubsub.aclose()
+
+
+broadcaster = EventBroadcaster()
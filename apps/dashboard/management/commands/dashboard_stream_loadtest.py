@@ -0,0 +1,106 @@
+import asyncio
+import json
+import statistics
+import time
+from types import SimpleNamespace
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from apps.dashboard.events import CHANNEL, broadcaster
+from apps.dashboard.views import dashboard_stream
+
+
+class LocalBroker:
+    """In-process stand-in for Redis pub/sub, counting upstream subscriptions."""
+
+    def __init__(self):
+        self.subscribers = set()
+        self.subscriptions = 0
+
+    def publish(self, channel, message):
+        for subscriber in self.subscribers:
+            if channel in subscriber.channels:
+                subscriber.messages.put_nowait({'type': 'message', 'channel': channel, 'data': message})
+
+    def pubsub(self):
+        return LocalPubSub(self)
+
+
+class LocalPubSub:
+    def __init__(self, broker):
+        self.broker = broker
+        self.channels = set()
+        self.messages = asyncio.Queue()
+
+    async def subscribe(self, channel):
+        self.channels.add(channel)
+        self.broker.subscribers.add(self)
+        self.broker.subscriptions += 1
+
+    async def get_message(self, ignore_subscribe_messages=True, timeout=1.0):
+        try:
+            return await asyncio.wait_for(self.messages.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def aclose(self):
+        self.broker.subscribers.discard(self)
+
+
+class Command(BaseCommand):
+    help = 'Load test the live dashboard stream with many clients against an in-memory pub/sub broker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=500)
+        parser.add_argument('--events', type=int, default=200)
+        parser.add_argument('--rate', type=float, default=500, help='Events published per second')
+
+    def handle(self, *args, **options):
+        result = asyncio.run(self.run(options['clients'], options['events'], options['rate']))
+        latencies = sorted(result['latencies'])
+        expected = options['clients'] * options['events']
+        self.stdout.write(f"Clients: {options['clients']}, events published: {options['events']}")
+        self.stdout.write(f"Upstream pub/sub subscriptions: {result['subscriptions']}")
+        self.stdout.write(f"Events delivered: {len(latencies)}/{expected} in {result['elapsed']:.2f}s "
+                          f"({len(latencies) / result['elapsed']:.0f} deliveries/sec)")
+        if latencies:
+            self.stdout.write(
+                f"Latency ms: p50 {statistics.median(latencies) * 1000:.2f}, "
+                f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f}, max {latencies[-1] * 1000:.2f}"
+            )
+        style = self.style.SUCCESS if len(latencies) == expected else self.style.WARNING
+        self.stdout.write(style('All events delivered.' if len(latencies) == expected else 'Some events were dropped.'))
+
+    async def run(self, clients, events, rate):
+        broker = LocalBroker()
+        broadcaster.connect = broker.pubsub
+        broadcaster.queue_size = max(broadcaster.queue_size, events)
+        request = RequestFactory().get('/api/dashboard/stream/')
+        request.user = SimpleNamespace(is_authenticated=True, is_staff=True)
+        latencies = []
+
+        async def client():
+            response = await dashboard_stream(request)
+            received = 0
+            async for chunk in response.streaming_content:
+                for line in chunk.decode().splitlines():
+                    if line.startswith('data: '):
+                        latencies.append(time.perf_counter() - json.loads(line[6:])['sent_at'])
+                        received += 1
+                if received >= events:
+                    break
+
+        tasks = [asyncio.create_task(client()) for _ in range(clients)]
+        # Let every client connect before publishing
+        while len(broadcaster.queues) < clients:
+            await asyncio.sleep(0.01)
+
+        started = time.perf_counter()
+        for seq in range(events):
+            message = json.dumps({'type': 'loadtest', 'data': {'seq': seq, 'sent_at': time.perf_counter()}})
+            broker.publish(CHANNEL, message)
+            await asyncio.sleep(1 / rate)
+        await asyncio.wait(tasks, timeout=30)
+        elapsed = time.perf_counter() - started
+        for task in tasks:
+            task.cancel()
+        return {'latencies': latencies, 'subscriptions': broker.subscriptions, 'elapsed': elapsed}
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from apps.dashboard.customers import CustomerStatsService
+
+
+class Command(BaseCommand):
+    help = 'Recompute the statistics and RFM segments of every customer from their orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rescore-only', action='store_true', help='Only re-rank the existing statistics')
+
+    def handle(self, *args, **options):
+        if options['rescore_only']:
+            CustomerStatsService.rescore()
+            self.stdout.write(self.style.SUCCESS('Customers rescored.'))
+            return
+
+        self.stdout.write('Rebuilding customer statistics...')
+        rows = CustomerStatsService.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'{rows} customers written and rescored.'))
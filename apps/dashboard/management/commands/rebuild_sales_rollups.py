@@ -0,0 +1,31 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+from apps.orders.models import Order
+from apps.dashboard.rollups import SalesRollupService
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily sales rollups for a date range (defaults to all orders up to today)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='First day (YYYY-MM-DD)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day (YYYY-MM-DD)')
+        parser.add_argument('--chunk-days', type=int, default=31)
+
+    def handle(self, *args, **options):
+        start = options['start']
+        if start is None:
+            first_order = Order.objects.aggregate(first=Min('created_at'))['first']
+            if first_order is None:
+                self.stdout.write('No orders to roll up.')
+                return
+            start = timezone.localdate(first_order)
+        end = options['end'] or timezone.localdate()
+        if start > end:
+            raise CommandError('--start must not be after --end')
+
+        self.stdout.write(f'Rebuilding sales rollups from {start} to {end}...')
+        rows = SalesRollupService.rebuild(start, end, chunk_days=options['chunk_days'])
+        self.stdout.write(self.style.SUCCESS(f'{rows} rollup rows written.'))
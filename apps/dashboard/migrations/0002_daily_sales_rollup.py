@@ -0,0 +1,81 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:19
+
+from datetime import datetime, time
+from dateutil.relativedelta import relativedelta
+from django.db import migrations, models
+from django.db.models import Count, F, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def backfill_rollups(apps, schema_editor):
+    """Roll up the existing orders one month at a time, as SalesRollupService does per day range."""
+    Order, OrderItem = apps.get_model('orders', 'Order'), apps.get_model('orders', 'OrderItem')
+    DailySalesRollup = apps.get_model('dashboard', 'DailySalesRollup')
+    first = Order.objects.aggregate(first=Min('created_at'))['first']
+    if first is None:
+        return
+    month, today = timezone.localdate(first).replace(day=1), timezone.localdate()
+    while month <= today:
+        start = timezone.make_aware(datetime.combine(month, time.min))
+        end = timezone.make_aware(datetime.combine(month + relativedelta(months=1), time.min))
+        rows = {}
+        orders = (
+            Order.objects.filter(created_at__gte=start, created_at__lt=end)
+            .annotate(day=TruncDate('created_at')).values('day', 'status')
+            .annotate(orders=Count('id'), revenue=Sum('total'), subtotal=Sum('subtotal'),
+                      discounts=Sum('discount_amount'), shipping=Sum('shipping_cost'), tax=Sum('tax'))
+            .order_by()
+        )
+        for row in orders:
+            key = (row.pop('day'), row.pop('status'))
+            rows[key] = DailySalesRollup(day=key[0], status=key[1], units=0, cost=0, profit=0, **row)
+        items = (
+            OrderItem.objects.filter(order__created_at__gte=start, order__created_at__lt=end, created_at__gte=start)
+            .annotate(day=TruncDate('order__created_at')).values('day', 'order__status')
+            .annotate(units=Sum('quantity'), items_revenue=Sum(F('selling_price') * F('quantity')),
+                      cost=Sum(F('cost_price') * F('quantity')))
+            .order_by()
+        )
+        for row in items:
+            rollup = rows.get((row['day'], row['order__status']))
+            if rollup is not None:
+                rollup.units, rollup.cost = row['units'] or 0, row['cost'] or 0
+                rollup.profit = (row['items_revenue'] or 0) - rollup.cost
+        DailySalesRollup.objects.bulk_create(rows.values(), batch_size=1000)
+        month += relativedelta(months=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='day')),
+                ('status', models.CharField(max_length=20, verbose_name='status')),
+                ('orders', models.IntegerField(default=0, verbose_name='orders')),
+                ('units', models.IntegerField(default=0, verbose_name='units')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='revenue')),
+                ('subtotal', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='subtotal')),
+                ('cost', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='cost')),
+                ('profit', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='profit')),
+                ('discounts', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='discounts')),
+                ('shipping', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='shipping')),
+                ('tax', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='tax')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='updated at')),
+            ],
+            options={
+                'verbose_name': 'daily sales rollup',
+                'verbose_name_plural': 'daily sales rollups',
+                'ordering': ['-day', 'status'],
+                'unique_together': {('day', 'status')},
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:21
+
+from datetime import datetime, time
+from dateutil.relativedelta import relativedelta
+from django.db import migrations, models
+from django.db.models import Count, F, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+import django.db.models.deletion
+
+# Order statuses counted as sales, as in dashboard.rollups
+REVENUE_STATUSES = ['processing', 'shipped', 'delivered']
+
+
+def backfill_rankings(apps, schema_editor):
+    """Roll up the existing order items per product and category, one month at a time."""
+    Order, OrderItem = apps.get_model('orders', 'Order'), apps.get_model('orders', 'OrderItem')
+    targets = [
+        (apps.get_model('dashboard', 'ProductDailySales'), 'product_id', 'product'),
+        (apps.get_model('dashboard', 'CategoryDailySales'), 'category_id', 'product__category'),
+    ]
+    first = Order.objects.aggregate(first=Min('created_at'))['first']
+    if first is None:
+        return
+    month, today = timezone.localdate(first).replace(day=1), timezone.localdate()
+    while month <= today:
+        start = timezone.make_aware(datetime.combine(month, time.min))
+        end = timezone.make_aware(datetime.combine(month + relativedelta(months=1), time.min))
+        for model, key_field, group_by in targets:
+            items = (
+                OrderItem.objects.filter(
+                    order__created_at__gte=start, order__created_at__lt=end, created_at__gte=start,
+                    order__status__in=REVENUE_STATUSES, **{f'{group_by}__isnull': False}
+                )
+                .annotate(day=TruncDate('order__created_at')).values('day', group_by)
+                .annotate(orders=Count('order_id', distinct=True), units=Sum('quantity'),
+                          revenue=Sum(F('selling_price') * F('quantity')), cost=Sum(F('cost_price') * F('quantity')))
+                .order_by()
+            )
+            model.objects.bulk_create([
+                model(day=row['day'], orders=row['orders'], units=row['units'], revenue=row['revenue'],
+                      cost=row['cost'], profit=row['revenue'] - row['cost'], **{key_field: row[group_by]})
+                for row in items
+            ], batch_size=1000)
+        month += relativedelta(months=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+        ('dashboard', '0002_daily_sales_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='day')),
+                ('orders', models.IntegerField(default=0, verbose_name='orders')),
+                ('units', models.IntegerField(default=0, verbose_name='units')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='revenue')),
+                ('cost', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='cost')),
+                ('profit', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='profit')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='updated at')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='products.product', verbose_name='product')),
+            ],
+            options={
+                'verbose_name': 'product daily sales',
+                'verbose_name_plural': 'product daily sales',
+                'ordering': ['-day', '-revenue'],
+                'indexes': [models.Index(fields=['day', '-revenue'], name='product_sales_day_revenue_idx')],
+                'unique_together': {('day', 'product')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CategoryDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='day')),
+                ('orders', models.IntegerField(default=0, verbose_name='orders')),
+                ('units', models.IntegerField(default=0, verbose_name='units')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='revenue')),
+                ('cost', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='cost')),
+                ('profit', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='profit')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='updated at')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='products.category', verbose_name='category')),
+            ],
+            options={
+                'verbose_name': 'category daily sales',
+                'verbose_name_plural': 'category daily sales',
+                'ordering': ['-day', '-revenue'],
+                'indexes': [models.Index(fields=['day', '-revenue'], name='category_sales_day_revenue_idx')],
+                'unique_together': {('day', 'category')},
+            },
+        ),
+        migrations.RunPython(backfill_rankings, migrations.RunPython.noop),
+    ]
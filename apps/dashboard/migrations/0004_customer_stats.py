@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+        ('dashboard', '0003_product_and_category_daily_sales'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='customer_stats', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='user')),
+                ('first_order_at', models.DateTimeField(verbose_name='first order at')),
+                ('last_order_at', models.DateTimeField(verbose_name='last order at')),
+                ('order_count', models.IntegerField(default=0, verbose_name='order count')),
+                ('lifetime_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='lifetime revenue')),
+                ('lifetime_profit', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='lifetime profit')),
+                ('average_order_value', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='average order value')),
+                ('recency_score', models.PositiveSmallIntegerField(default=0, verbose_name='recency score')),
+                ('frequency_score', models.PositiveSmallIntegerField(default=0, verbose_name='frequency score')),
+                ('monetary_score', models.PositiveSmallIntegerField(default=0, verbose_name='monetary score')),
+                ('segment', models.CharField(choices=[('champions', 'Champions'), ('new', 'New'), ('loyal', 'Loyal'), ('at_risk', 'At Risk'), ('hibernating', 'Hibernating'), ('regular', 'Regular')], default='regular', max_length=20, verbose_name='segment')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='updated at')),
+            ],
+            options={
+                'verbose_name': 'customer statistics',
+                'verbose_name_plural': 'customer statistics',
+                'indexes': [models.Index(fields=['first_order_at'], name='dashboard_c_first_o_fae9df_idx'), models.Index(fields=['order_count'], name='dashboard_c_order_c_00c52f_idx'), models.Index(fields=['segment'], name='dashboard_c_segment_82f40f_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0004_customer_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systemalert',
+            name='fingerprint',
+            field=models.CharField(blank=True, max_length=100, verbose_name='fingerprint'),
+        ),
+        migrations.AddField(
+            model_name='systemalert',
+            name='last_seen_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='last seen at'),
+        ),
+        migrations.AddField(
+            model_name='systemalert',
+            name='occurrences',
+            field=models.PositiveIntegerField(default=1, verbose_name='occurrences'),
+        ),
+        migrations.AddConstraint(
+            model_name='systemalert',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_resolved', False), models.Q(('fingerprint', ''), _negated=True)), fields=('fingerprint',), name='unique_open_alert_fingerprint'),
+        ),
+    ]
@@ -1,11 +1,12 @@
+from django.conf import settings
 from django.db import models
 from django.utils.translation import gettext_lazy as _
-from django.db.models import Sum, Count, Avg
+from django.db.models import Sum, Count
 from django.utils import timezone
 from datetime import datetime, timedelta
 from apps.accounts.models import User
 from apps.products.models import Product
-from apps.orders.models import Order, OrderItem
+from apps.orders.models import Order
 from apps.payments.models import Payment
 
 class Dashboard:
@@ -16,55 +17,105 @@ class Dashboard:
     
     @staticmethod
     def get_sales_summary(start_date=None, end_date=None):
-        """Get sales summary for date range."""
+        """Get sales summary for date range, read from the daily rollup."""
+        from .rollups import REVENUE_STATUSES
+
         if not start_date:
             start_date = timezone.now() - timedelta(days=30)
         if not end_date:
             end_date = timezone.now()
-        
-        orders = Order.objects.filter(
-            created_at__range=[start_date, end_date],
-            status__in=['processing', 'shipped', 'delivered']
+
+        totals = DailySalesRollup.objects.filter(
+            day__range=[Dashboard._as_day(start_date), Dashboard._as_day(end_date)],
+            status__in=REVENUE_STATUSES
+        ).aggregate(
+            total_orders=Sum('orders'),
+            total_revenue=Sum('revenue'),
+            total_profit=Sum('profit'),
         )
-        
+        total_orders = totals['total_orders'] or 0
+        total_revenue = totals['total_revenue'] or 0
+
         return {
-            'total_orders': orders.count(),
-            'total_revenue': orders.aggregate(Sum('total'))['total__sum'] or 0,
-            'total_profit': sum(order.total_profit for order in orders),
-            'average_order_value': orders.aggregate(Avg('total'))['total__avg'] or 0,
+            'total_orders': total_orders,
+            'total_revenue': total_revenue,
+            'total_profit': totals['total_profit'] or 0,
+            'average_order_value': (total_revenue / total_orders) if total_orders else 0,
         }
+
+    @staticmethod
+    def _as_day(value):
+        """Rollups are keyed by local date; accept dates or datetimes."""
+        if isinstance(value, datetime):
+            return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+        return value
     
     @staticmethod
-    def get_product_performance():
-        """Get top performing products."""
-        from django.db.models import F
-        
-        top_products = OrderItem.objects.values(
-            'product__id',
-            'product__translations__name',
-            'product__sku'
-        ).annotate(
-            total_sold=Sum('quantity'),
-            total_revenue=Sum(F('selling_price') * F('quantity')),
-            total_profit=Sum((F('selling_price') - F('cost_price')) * F('quantity'))
-        ).order_by('-total_revenue')[:10]
-        
-        return list(top_products)
+    def get_product_performance(start_date=None, end_date=None, limit=10, language=None):
+        """Get top performing products from the product rollup (all time by default)."""
+        top_products = list(
+            Dashboard._rollup_window(ProductDailySales, start_date, end_date)
+            .values('product_id')
+            .annotate(
+                total_sold=Sum('units'),
+                total_revenue=Sum('revenue'),
+                total_profit=Sum('profit')
+            ).order_by('-total_revenue')[:limit]
+        )
+        ids = [row['product_id'] for row in top_products]
+        names = Dashboard._translated_names(Product, ids, language)
+        skus = dict(Product.objects.filter(pk__in=ids).values_list('id', 'sku'))
+
+        return [{
+            'product__id': row['product_id'],
+            'product__translations__name': names.get(row['product_id']),
+            'product__sku': skus.get(row['product_id']),
+            'total_sold': row['total_sold'],
+            'total_revenue': row['total_revenue'],
+            'total_profit': row['total_profit'],
+        } for row in top_products]
+
+    @staticmethod
+    def _rollup_window(model, start_date=None, end_date=None):
+        queryset = model.objects.all()
+        if start_date:
+            queryset = queryset.filter(day__gte=Dashboard._as_day(start_date))
+        if end_date:
+            queryset = queryset.filter(day__lte=Dashboard._as_day(end_date))
+        return queryset
+
+    @staticmethod
+    def _translated_names(model, ids, language=None):
+        """
+        Names of ``ids`` in ``language`` (default: active language), falling
+        back to the default language, looked up separately so the
+        aggregation never joins the translation table.
+        """
+        from django.utils.translation import get_language
+
+        language = language or get_language() or settings.LANGUAGE_CODE
+        fallback = settings.LANGUAGE_CODE
+        translations = model._parler_meta.root_model.objects.filter(
+            master_id__in=ids, language_code__in={language, fallback}
+        ).values_list('master_id', 'language_code', 'name')
+        names = {}
+        for master_id, language_code, name in translations:
+            if language_code == language or master_id not in names:
+                names[master_id] = name
+        return names
     
     @staticmethod
-    def get_low_stock_products():
-        """Get products with low stock."""
-        from apps.products.models import Inventory
+    def get_low_stock_products(language=None):
+        """Get products with low stock, named in ``language`` (default: active language)."""
+        from apps.products.models import Inventory, LOW_STOCK
         
-        low_stock = Inventory.objects.filter(
-            quantity__lte=F('low_stock_threshold')
-        ).select_related('product')
+        low_stock = Inventory.objects.filter(LOW_STOCK).select_related('product')
         
         return [{
             'product_id': inv.product.id,
-            'product_name': inv.product.name,
+            'product_name': inv.product.safe_translation_getter('name', language_code=language, any_language=True),
             'sku': inv.product.sku,
-            'current_stock': inv.quantity,
+            'current_stock': inv.available_quantity,
             'threshold': inv.low_stock_threshold,
             'is_out_of_stock': inv.is_out_of_stock
         } for inv in low_stock]
@@ -72,7 +123,7 @@ class Dashboard:
     @staticmethod
     def get_recent_orders(limit=10):
         """Get recent orders."""
-        orders = Order.objects.select_related('user').order_by('-created_at')[:limit]
+        orders = Order.objects.select_related('user').prefetch_related('items').order_by('-created_at')[:limit]
         
         return [{
             'order_number': order.order_number,
@@ -92,61 +143,108 @@ class Dashboard:
             created_at__gte=timezone.now() - timedelta(days=30)
         ).count()
         
-        returning_customers = User.objects.filter(
-            is_staff=False,
-            orders__isnull=False
-        ).annotate(
-            order_count=Count('orders')
-        ).filter(order_count__gt=1).count()
+        returning_customers = CustomerStats.objects.filter(
+            user__is_staff=False,
+            order_count__gt=1
+        ).count()
         
         return {
             'total_customers': total_customers,
             'new_customers_month': new_customers_month,
             'returning_customers': returning_customers,
-            'customer_retention_rate': (returning_customers / total_customers * 100) if total_customers > 0 else 0
+            'customer_retention_rate': (returning_customers / total_customers * 100) if total_customers > 0 else 0,
+            'segments': dict(
+                CustomerStats.objects.values_list('segment').annotate(count=Count('pk')).order_by()
+            ),
         }
-    
+
     @staticmethod
-    def get_monthly_sales_chart(months=12):
-        """Get monthly sales data for chart."""
+    def get_customer_cohorts(months=12):
+        """First-order cohorts of the last ``months`` calendar months with their lifetime totals."""
+        from dateutil.relativedelta import relativedelta
         from django.db.models.functions import TruncMonth
-        
-        end_date = timezone.now()
-        start_date = end_date - timedelta(days=months * 30)
-        
-        monthly_data = Order.objects.filter(
-            created_at__range=[start_date, end_date],
-            status__in=['processing', 'shipped', 'delivered']
-        ).annotate(
-            month=TruncMonth('created_at')
-        ).values('month').annotate(
-            revenue=Sum('total'),
-            profit=Sum('total') - Sum('subtotal')  # Simplified calculation
-        ).order_by('month')
-        
-        return list(monthly_data)
+        from .rollups import day_start
+
+        start = timezone.localdate().replace(day=1) - relativedelta(months=months - 1)
+        return list(
+            CustomerStats.objects.filter(first_order_at__gte=day_start(start))
+            .annotate(month=TruncMonth('first_order_at'))
+            .values('month')
+            .annotate(
+                customers=Count('pk'),
+                orders=Sum('order_count'),
+                revenue=Sum('lifetime_revenue'),
+                returning=Count('pk', filter=models.Q(order_count__gt=1)),
+            )
+            .order_by('month')
+        )
+    
+    @staticmethod
+    def get_monthly_sales_chart(months=12, compare_previous_year=False):
+        """Get monthly sales data for chart: the last ``months`` calendar months, gaps filled."""
+        from dateutil.relativedelta import relativedelta
+        from .rollups import SalesSeries
+
+        end_date = timezone.localdate()
+        start_date = end_date.replace(day=1) - relativedelta(months=months - 1)
+        return [
+            {'month': point.pop('period'), **point}
+            for point in SalesSeries.series('month', start_date, end_date, compare_previous_year=compare_previous_year)
+        ]
+
+    @staticmethod
+    def get_sales_series(period='month', start_date=None, end_date=None, compare_previous_year=False):
+        """Sales per day/week/month/quarter for charts, optionally year over year."""
+        from .rollups import SalesSeries
+
+        return SalesSeries.series(
+            period,
+            Dashboard._as_day(start_date) if start_date else None,
+            Dashboard._as_day(end_date) if end_date else None,
+            compare_previous_year=compare_previous_year,
+        )
     
     @staticmethod
-    def get_top_categories():
-        """Get top selling categories."""
-        from django.db.models import F
+    def get_top_categories(start_date=None, end_date=None, limit=5, language=None):
+        """Get top selling categories from the category rollup (all time by default)."""
         from apps.products.models import Category
-        
-        category_sales = OrderItem.objects.select_related(
-            'product__category'
-        ).values(
-            'product__category__id',
-            'product__category__translations__name'
-        ).annotate(
-            total_sold=Sum('quantity'),
-            total_revenue=Sum(F('selling_price') * F('quantity'))
-        ).order_by('-total_revenue')[:5]
-        
-        return list(category_sales)
+
+        category_sales = list(
+            Dashboard._rollup_window(CategoryDailySales, start_date, end_date)
+            .values('category_id')
+            .annotate(
+                total_sold=Sum('units'),
+                total_revenue=Sum('revenue')
+            ).order_by('-total_revenue')[:limit]
+        )
+        names = Dashboard._translated_names(Category, [row['category_id'] for row in category_sales], language)
+
+        return [{
+            'product__category__id': row['category_id'],
+            'product__category__translations__name': names.get(row['category_id']),
+            'total_sold': row['total_sold'],
+            'total_revenue': row['total_revenue'],
+        } for row in category_sales]
+
+
+class SystemAlertQuerySet(models.QuerySet):
+    def mark_as_read(self):
+        return self.update(is_read=True, updated_at=timezone.now())
+
+    def resolve(self, resolved_by=None):
+        now = timezone.now()
+        return self.filter(is_resolved=False).update(
+            is_resolved=True, resolved_by=resolved_by, resolved_at=now, updated_at=now
+        )
 
 
 class SystemAlert(models.Model):
-    """System alerts for dashboard notifications."""
+    """
+    System alerts for dashboard notifications.
+    Repeats of an open alert (same fingerprint) are coalesced into it by
+    ``raise_alert``: the occurrence counter and last-seen time go up instead
+    of a new row being inserted.
+    """
     
     ALERT_TYPE_CHOICES = [
         ('low_stock', _('Low Stock')),
@@ -212,11 +310,18 @@ class SystemAlert(models.Model):
         verbose_name=_('resolved by')
     )
     resolved_at = models.DateTimeField(_('resolved at'), null=True, blank=True)
+
+    # De-duplication: alert type + related objects
+    fingerprint = models.CharField(_('fingerprint'), max_length=100, blank=True)
+    occurrences = models.PositiveIntegerField(_('occurrences'), default=1)
+    last_seen_at = models.DateTimeField(_('last seen at'), default=timezone.now)
     
     # Timestamps
     created_at = models.DateTimeField(_('created at'), auto_now_add=True)
     updated_at = models.DateTimeField(_('updated at'), auto_now=True)
 
+    objects = SystemAlertQuerySet.as_manager()
+
     class Meta:
         verbose_name = _('system alert')
         verbose_name_plural = _('system alerts')
@@ -227,37 +332,63 @@ class SystemAlert(models.Model):
             models.Index(fields=['is_read']),
             models.Index(fields=['is_resolved']),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['fingerprint'],
+                condition=models.Q(is_resolved=False) & ~models.Q(fingerprint=''),
+                name='unique_open_alert_fingerprint'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.get_priority_display()} - {self.title}'
 
     def mark_as_read(self):
         """Mark alert as read."""
+        SystemAlert.objects.filter(pk=self.pk).mark_as_read()
         self.is_read = True
-        self.save()
 
     def resolve(self, resolved_by=None):
         """Mark alert as resolved."""
+        SystemAlert.objects.filter(pk=self.pk).resolve(resolved_by)
         self.is_resolved = True
         self.resolved_by = resolved_by
         self.resolved_at = timezone.now()
-        self.save()
+
+    @staticmethod
+    def make_fingerprint(alert_type, related_product=None, related_order=None, related_user=None):
+        ids = [getattr(obj, 'pk', obj) or '' for obj in (related_product, related_order, related_user)]
+        return ':'.join([alert_type, *map(str, ids)])
+
+    @classmethod
+    def raise_alert(cls, alert_type, title, message, priority='medium', **related):
+        """Open an alert, or count one more occurrence of the matching open alert."""
+        from .alerts import AlertBuffer
+
+        with AlertBuffer() as buffer:
+            fingerprint = buffer.add(alert_type, title, message, priority, **related)
+        return buffer.alerts[fingerprint]
+
+    @classmethod
+    def low_stock_alert_kwargs(cls, product):
+        name = product.safe_translation_getter('name', any_language=True)
+        return {
+            'alert_type': 'low_stock',
+            'priority': 'medium',
+            'title': f'Low Stock: {name}',
+            'message': f'Product {product.sku} has low stock ({product.inventory.available_quantity} remaining).',
+            'related_product': product,
+        }
 
     @classmethod
     def create_low_stock_alert(cls, product):
         """Create low stock alert for product."""
-        return cls.objects.create(
-            alert_type='low_stock',
-            priority='medium',
-            title=f'Low Stock: {product.name}',
-            message=f'Product {product.sku} has low stock ({product.inventory.available_quantity} remaining).',
-            related_product=product
-        )
+        return cls.raise_alert(**cls.low_stock_alert_kwargs(product))
 
     @classmethod
     def create_payment_failed_alert(cls, payment):
         """Create payment failed alert."""
-        return cls.objects.create(
+        return cls.raise_alert(
             alert_type='payment_failed',
             priority='high',
             title=f'Payment Failed: {payment.transaction_id}',
@@ -310,3 +441,143 @@ class DashboardWidget(models.Model):
 
     def __str__(self):
         return f'{self.user.email} - {self.get_widget_type_display()}'
+
+
+class DailySalesRollup(models.Model):
+    """
+    Per-day, per-status order totals.
+    Kept up to date from order writes by ``SalesRollupService`` so that
+    dashboard range queries read one row per day and status.
+    """
+
+    day = models.DateField(_('day'))
+    status = models.CharField(_('status'), max_length=20)
+    orders = models.IntegerField(_('orders'), default=0)
+    units = models.IntegerField(_('units'), default=0)
+    revenue = models.DecimalField(_('revenue'), max_digits=14, decimal_places=2, default=0)
+    subtotal = models.DecimalField(_('subtotal'), max_digits=14, decimal_places=2, default=0)
+    cost = models.DecimalField(_('cost'), max_digits=14, decimal_places=2, default=0)
+    profit = models.DecimalField(_('profit'), max_digits=14, decimal_places=2, default=0)
+    discounts = models.DecimalField(_('discounts'), max_digits=14, decimal_places=2, default=0)
+    shipping = models.DecimalField(_('shipping'), max_digits=14, decimal_places=2, default=0)
+    tax = models.DecimalField(_('tax'), max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('daily sales rollup')
+        verbose_name_plural = _('daily sales rollups')
+        ordering = ['-day', 'status']
+        unique_together = ('day', 'status')
+
+    def __str__(self):
+        return f'{self.day} - {self.status}'
+
+
+class ProductDailySales(models.Model):
+    """Per-day sales of one product across orders in a revenue status."""
+
+    day = models.DateField(_('day'))
+    product = models.ForeignKey(
+        'products.Product',
+        on_delete=models.CASCADE,
+        related_name='daily_sales',
+        verbose_name=_('product')
+    )
+    orders = models.IntegerField(_('orders'), default=0)
+    units = models.IntegerField(_('units'), default=0)
+    revenue = models.DecimalField(_('revenue'), max_digits=14, decimal_places=2, default=0)
+    cost = models.DecimalField(_('cost'), max_digits=14, decimal_places=2, default=0)
+    profit = models.DecimalField(_('profit'), max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('product daily sales')
+        verbose_name_plural = _('product daily sales')
+        ordering = ['-day', '-revenue']
+        unique_together = ('day', 'product')
+        indexes = [
+            models.Index(fields=['day', '-revenue'], name='product_sales_day_revenue_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.day} - product {self.product_id}'
+
+
+class CategoryDailySales(models.Model):
+    """Per-day sales of the products in one category."""
+
+    day = models.DateField(_('day'))
+    category = models.ForeignKey(
+        'products.Category',
+        on_delete=models.CASCADE,
+        related_name='daily_sales',
+        verbose_name=_('category')
+    )
+    orders = models.IntegerField(_('orders'), default=0)
+    units = models.IntegerField(_('units'), default=0)
+    revenue = models.DecimalField(_('revenue'), max_digits=14, decimal_places=2, default=0)
+    cost = models.DecimalField(_('cost'), max_digits=14, decimal_places=2, default=0)
+    profit = models.DecimalField(_('profit'), max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('category daily sales')
+        verbose_name_plural = _('category daily sales')
+        ordering = ['-day', '-revenue']
+        unique_together = ('day', 'category')
+        indexes = [
+            models.Index(fields=['day', '-revenue'], name='category_sales_day_revenue_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.day} - category {self.category_id}'
+
+
+class CustomerStats(models.Model):
+    """
+    Lifetime order statistics and RFM scores of one customer.
+    Only orders in a revenue status count; maintained by ``CustomerStatsService``.
+    """
+
+    SEGMENT_CHOICES = [
+        ('champions', _('Champions')),
+        ('new', _('New')),
+        ('loyal', _('Loyal')),
+        ('at_risk', _('At Risk')),
+        ('hibernating', _('Hibernating')),
+        ('regular', _('Regular')),
+    ]
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='customer_stats',
+        verbose_name=_('user')
+    )
+    first_order_at = models.DateTimeField(_('first order at'))
+    last_order_at = models.DateTimeField(_('last order at'))
+    order_count = models.IntegerField(_('order count'), default=0)
+    lifetime_revenue = models.DecimalField(_('lifetime revenue'), max_digits=14, decimal_places=2, default=0)
+    lifetime_profit = models.DecimalField(_('lifetime profit'), max_digits=14, decimal_places=2, default=0)
+    average_order_value = models.DecimalField(_('average order value'), max_digits=12, decimal_places=2, default=0)
+
+    # RFM quintiles, 1 (worst) to 5 (best); 0 until first scored
+    recency_score = models.PositiveSmallIntegerField(_('recency score'), default=0)
+    frequency_score = models.PositiveSmallIntegerField(_('frequency score'), default=0)
+    monetary_score = models.PositiveSmallIntegerField(_('monetary score'), default=0)
+    segment = models.CharField(_('segment'), max_length=20, choices=SEGMENT_CHOICES, default='regular')
+
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('customer statistics')
+        verbose_name_plural = _('customer statistics')
+        indexes = [
+            models.Index(fields=['first_order_at']),
+            models.Index(fields=['order_count']),
+            models.Index(fields=['segment']),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} - {self.order_count} orders'
@@ -0,0 +1,251 @@
+"""
+Rollup maintenance for dashboard analytics.
+
+Order writes mark the affected days dirty; ``SalesRollupService.refresh_days``
+recomputes those days from the raw tables with grouped queries bounded to the
+day range and upserts the result, so rollups stay correct whatever path
+modified the orders (admin, bulk transitions, webhooks).
+"""
+from datetime import datetime, time, timedelta
+from django.core.cache import cache
+from django.db import transaction
+from dateutil.relativedelta import relativedelta
+from django.db.models import Sum, Count, F, Q
+from django.db.models.functions import TruncDate, TruncWeek, TruncMonth, TruncQuarter
+from django.utils import timezone
+from apps.orders.models import Order, OrderItem
+from .models import DailySalesRollup, ProductDailySales, CategoryDailySales
+
+# Order statuses counted as sales
+REVENUE_STATUSES = ['processing', 'shipped', 'delivered']
+
+
+def day_start(day):
+    """Aware start of ``day`` in the current time zone."""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def day_ranges(days):
+    """Collapse a set of dates into ``(first, last)`` runs of consecutive days."""
+    ranges = []
+    for day in sorted(set(days)):
+        if ranges and day - ranges[-1][1] == timedelta(days=1):
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return [tuple(r) for r in ranges]
+
+
+class SalesRollupService:
+    DEBOUNCE_SECONDS = 30
+
+    @classmethod
+    def mark_dirty(cls, days):
+        """Schedule a refresh of ``days``; repeated marks within the debounce window collapse."""
+        from .tasks import refresh_sales_rollups_task
+
+        pending = [day for day in set(days) if cache.add(f'sales_rollup_dirty:{day.isoformat()}', 1, cls.DEBOUNCE_SECONDS * 2)]
+        if pending:
+            refresh_sales_rollups_task.apply_async(
+                args=[[day.isoformat() for day in pending]], countdown=cls.DEBOUNCE_SECONDS
+            )
+
+    @classmethod
+    def refresh_days(cls, days):
+        """Recompute the rollup rows of ``days`` from orders and order items."""
+        from .events import publish
+
+        cache.delete_many([f'sales_rollup_dirty:{day.isoformat()}' for day in days])
+        for first, last in day_ranges(days):
+            cls._refresh_range(first, last)
+
+        # Push the refreshed day totals to live dashboards
+        totals = (
+            DailySalesRollup.objects.filter(day__in=days, status__in=REVENUE_STATUSES)
+            .values('day')
+            .annotate(orders=Sum('orders'), units=Sum('units'), revenue=Sum('revenue'), profit=Sum('profit'))
+            .order_by('day')
+        )
+        publish('sales.updated', {'days': list(totals)})
+
+    @classmethod
+    def _refresh_range(cls, first, last):
+        start, end = day_start(first), day_start(last + timedelta(days=1))
+
+        rows = {}
+        orders = (
+            Order.objects.filter(created_at__gte=start, created_at__lt=end)
+            .annotate(day=TruncDate('created_at'))
+            .values('day', 'status')
+            .annotate(
+                orders=Count('id'),
+                revenue=Sum('total'),
+                subtotal=Sum('subtotal'),
+                discounts=Sum('discount_amount'),
+                shipping=Sum('shipping_cost'),
+                tax=Sum('tax'),
+            )
+            .order_by()
+        )
+        for row in orders:
+            key = (row.pop('day'), row.pop('status'))
+            rows[key] = DailySalesRollup(day=key[0], status=key[1], units=0, cost=0, profit=0, **row)
+
+        # Items are never older than their order; the lower bound on the
+        # item's own created_at lets Postgres prune older partitions.
+        items = (
+            OrderItem.objects.filter(order__created_at__gte=start, order__created_at__lt=end, created_at__gte=start)
+            .annotate(day=TruncDate('order__created_at'))
+            .values('day', 'order__status')
+            .annotate(
+                units=Sum('quantity'),
+                items_revenue=Sum(F('selling_price') * F('quantity')),
+                cost=Sum(F('cost_price') * F('quantity')),
+            )
+            .order_by()
+        )
+        for row in items:
+            rollup = rows.get((row['day'], row['order__status']))
+            if rollup is None:
+                continue
+            rollup.units = row['units'] or 0
+            rollup.cost = row['cost'] or 0
+            rollup.profit = (row['items_revenue'] or 0) - rollup.cost
+
+        products = cls._item_rollups(ProductDailySales, 'product_id', 'product', start, end)
+        categories = cls._item_rollups(CategoryDailySales, 'category_id', 'product__category', start, end)
+
+        measures = ['orders', 'revenue', 'cost', 'profit', 'units', 'updated_at']
+        with transaction.atomic():
+            cls._replace_rows(DailySalesRollup, first, last, rows, ['day', 'status'],
+                              measures + ['subtotal', 'discounts', 'shipping', 'tax'])
+            cls._replace_rows(ProductDailySales, first, last, products, ['day', 'product_id'], measures)
+            cls._replace_rows(CategoryDailySales, first, last, categories, ['day', 'category_id'], measures)
+        return len(rows)
+
+    @classmethod
+    def _item_rollups(cls, model, key_field, group_by, start, end):
+        """Per-day totals of items in revenue orders, grouped by ``group_by``."""
+        items = (
+            OrderItem.objects.filter(
+                order__created_at__gte=start, order__created_at__lt=end, created_at__gte=start,
+                order__status__in=REVENUE_STATUSES, **{f'{group_by}__isnull': False}
+            )
+            .annotate(day=TruncDate('order__created_at'))
+            .values('day', group_by)
+            .annotate(
+                orders=Count('order_id', distinct=True),
+                units=Sum('quantity'),
+                revenue=Sum(F('selling_price') * F('quantity')),
+                cost=Sum(F('cost_price') * F('quantity')),
+            )
+            .order_by()
+        )
+        rows = {}
+        for row in items:
+            key = (row['day'], row[group_by])
+            rows[key] = model(
+                day=row['day'], orders=row['orders'], units=row['units'], revenue=row['revenue'],
+                cost=row['cost'], profit=row['revenue'] - row['cost'], **{key_field: row[group_by]}
+            )
+        return rows
+
+    @classmethod
+    def _replace_rows(cls, model, first, last, rows, key_fields, update_fields):
+        """Upsert ``rows`` (keyed by ``key_fields``) and drop the range's rows that vanished."""
+        existing = model.objects.filter(day__range=(first, last)).values_list('pk', *key_fields)
+        stale = [pk for pk, *key in existing if tuple(key) not in rows]
+        if stale:
+            model.objects.filter(pk__in=stale).delete()
+        if rows:
+            model.objects.bulk_create(
+                rows.values(),
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=[field.removesuffix('_id') for field in key_fields],
+                update_fields=update_fields,
+            )
+
+    @classmethod
+    def rebuild(cls, first, last, chunk_days=31):
+        """Recompute every day between ``first`` and ``last`` in chunks."""
+        refreshed = 0
+        while first <= last:
+            chunk_last = min(first + timedelta(days=chunk_days - 1), last)
+            refreshed += cls._refresh_range(first, chunk_last)
+            first = chunk_last + timedelta(days=1)
+        return refreshed
+
+
+class SalesSeries:
+    """
+    Period sales series (day/week/month/quarter) read from ``DailySalesRollup``.
+    Rollup days are local dates in ``TIME_ZONE``, so periods follow the
+    calendar of the shop's time zone; weeks start on Monday.
+    """
+
+    PERIODS = {
+        'day': (None, relativedelta(days=1)),
+        'week': (TruncWeek, relativedelta(weeks=1)),
+        'month': (TruncMonth, relativedelta(months=1)),
+        'quarter': (TruncQuarter, relativedelta(months=3)),
+    }
+    MEASURES = ['revenue', 'cost', 'profit', 'orders', 'units']
+
+    @classmethod
+    def period_start(cls, day, period):
+        if period == 'week':
+            return day - timedelta(days=day.weekday())
+        if period == 'month':
+            return day.replace(day=1)
+        if period == 'quarter':
+            return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+        return day
+
+    @classmethod
+    def series(cls, period='month', start=None, end=None, statuses=None, compare_previous_year=False):
+        """
+        Gap-filled list of ``{'period', 'revenue', 'cost', 'profit', 'orders', 'units'}``
+        from the period containing ``start`` through the one containing ``end``.
+        With ``compare_previous_year`` each point also carries the whole
+        period containing its start one year earlier (``previous_*``) and the
+        revenue change in percent; both windows are read in a single query.
+        """
+        if period not in cls.PERIODS:
+            raise ValueError(f'Unknown period: {period}')
+        trunc, step = cls.PERIODS[period]
+        end = end or timezone.localdate()
+        start = cls.period_start(start or end, period)
+        statuses = statuses or REVENUE_STATUSES
+
+        window = Q(day__range=(start, end))
+        if compare_previous_year:
+            # Whole periods the points map to: a year back is another weekday, so weeks shift
+            previous_last = cls.period_start(cls.period_start(end, period) - relativedelta(years=1), period)
+            window |= Q(day__range=(
+                cls.period_start(start - relativedelta(years=1), period),
+                previous_last + step - timedelta(days=1),
+            ))
+        queryset = DailySalesRollup.objects.filter(window, status__in=statuses)
+        queryset = queryset.annotate(period=trunc('day')) if trunc else queryset.annotate(period=F('day'))
+        totals = {
+            row['period']: row
+            for row in queryset.values('period').annotate(**{m: Sum(m) for m in cls.MEASURES}).order_by()
+        }
+
+        points = []
+        current = start
+        while current <= end:
+            row = totals.get(current, {})
+            point = {'period': current, **{m: row.get(m) or 0 for m in cls.MEASURES}}
+            if compare_previous_year:
+                previous = totals.get(cls.period_start(current - relativedelta(years=1), period), {})
+                for m in cls.MEASURES:
+                    point[f'previous_{m}'] = previous.get(m) or 0
+                point['revenue_change'] = (
+                    (point['revenue'] - point['previous_revenue']) / point['previous_revenue'] * 100
+                    if point['previous_revenue'] else None
+                )
+            points.append(point)
+            current += step
+        return points
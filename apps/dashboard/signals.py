@@ -0,0 +1,72 @@
+from django.db import transaction
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from apps.orders.models import Order, OrderItem
+from apps.orders.signals import order_status_changed
+from apps.payments.models import Payment
+from .customers import CustomerStatsService
+from .events import publish_on_commit
+from .rollups import SalesRollupService
+
+
+def _mark_order_day(created_at):
+    if created_at:
+        day = timezone.localdate(created_at)
+        transaction.on_commit(lambda: SalesRollupService.mark_dirty([day]))
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def order_changed(sender, instance, **kwargs):
+    _mark_order_day(instance.created_at)
+    if kwargs.get('created'):
+        publish_on_commit('order.created', {
+            'id': instance.pk,
+            'order_number': instance.order_number,
+            'status': instance.status,
+            'total': instance.total,
+            'created_at': instance.created_at,
+        })
+    if instance.user_id:
+        user_id = instance.user_id
+        transaction.on_commit(lambda: CustomerStatsService.mark_dirty([user_id]))
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def order_item_changed(sender, instance, **kwargs):
+    created_at = Order.objects.filter(pk=instance.order_id).values_list('created_at', flat=True).first()
+    _mark_order_day(created_at)
+
+
+@receiver(order_status_changed)
+def orders_transitioned(sender, order_ids, status, **kwargs):
+    days = (
+        Order.objects.filter(pk__in=order_ids)
+        .annotate(day=TruncDate('created_at'))
+        .values_list('day', flat=True)
+        .distinct()
+        .order_by()
+    )
+    SalesRollupService.mark_dirty(list(days))
+    user_ids = (
+        Order.objects.filter(pk__in=order_ids, user__isnull=False)
+        .values_list('user_id', flat=True)
+        .distinct()
+        .order_by()
+    )
+    CustomerStatsService.mark_dirty(list(user_ids))
+
+
+@receiver(post_save, sender=Payment)
+def payment_saved(sender, instance, **kwargs):
+    if instance.status == 'failed' and getattr(instance, 'status_changed', False):
+        publish_on_commit('payment.failed', {
+            'id': instance.pk,
+            'transaction_id': instance.transaction_id,
+            'order_id': instance.order_id,
+            'amount': instance.amount,
+            'currency': instance.currency,
+        })
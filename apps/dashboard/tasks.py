@@ -0,0 +1,43 @@
+from datetime import date, timedelta
+from celery import shared_task
+from django.core.cache import cache
+from django.utils import timezone
+
+
+@shared_task
+def refresh_sales_rollups_task(days):
+    """Recompute the sales rollups of the given ISO dates."""
+    from .rollups import SalesRollupService
+    SalesRollupService.refresh_days([date.fromisoformat(day) for day in days])
+
+
+@shared_task
+def rebuild_recent_sales_rollups_task(days=3):
+    """Safety net for writes that bypass signals (raw SQL, queryset.update)."""
+    from .rollups import SalesRollupService
+    today = timezone.localdate()
+    return SalesRollupService.rebuild(today - timedelta(days=days), today)
+
+
+@shared_task
+def refresh_customer_stats_task(user_ids):
+    """Recompute the customer statistics of the given users."""
+    from .customers import CustomerStatsService
+    return CustomerStatsService.refresh_users(user_ids)
+
+
+@shared_task
+def rescore_customers_task():
+    """Re-rank every customer into RFM quintiles and reassign segments."""
+    from .customers import CustomerStatsService
+    CustomerStatsService.rescore()
+
+
+@shared_task
+def refresh_widget_task(widget_type, params):
+    """Recompute a cached widget before it expires."""
+    from .widgets import WidgetRenderer
+    try:
+        WidgetRenderer.compute(widget_type, params)
+    finally:
+        cache.delete(f'{WidgetRenderer.cache_key(widget_type, params)}:refreshing')
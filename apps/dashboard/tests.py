@@ -1,3 +1,120 @@
-from django.test import TestCase
+from datetime import date, timedelta
+from decimal import Decimal
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from apps.accounts.models import User
+from apps.orders.models import Order
+from apps.products.models import Product
+from .customers import CustomerStatsService
+from .models import CustomerStats, DailySalesRollup, ProductDailySales
+from .rollups import SalesSeries
+from .widgets import InvalidWidgetParams, WidgetRenderer
 
-# Create your tests here.
+
+class WidgetParamsTests(TestCase):
+    def test_limit_is_clamped(self):
+        self.assertEqual(WidgetRenderer.clean_params('recent_orders', {'limit': '1000000'}), {'limit': '100'})
+        self.assertEqual(WidgetRenderer.clean_params('recent_orders', {'limit': '-5'}), {'limit': '1'})
+
+    def test_dates_are_normalised(self):
+        self.assertEqual(
+            WidgetRenderer.clean_params('sales_summary', {'start_date': '2026-01-05', 'end_date': '', 'limit': '5'}),
+            {'start_date': '2026-01-05'},
+        )
+
+    def test_bad_values_are_rejected(self):
+        with self.assertRaises(InvalidWidgetParams):
+            WidgetRenderer.clean_params('sales_summary', {'start_date': 'yesterday'})
+        with self.assertRaises(InvalidWidgetParams):
+            WidgetRenderer.clean_params('alerts', {'limit': 'ten'})
+
+    def test_bad_query_params_give_400(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('staff@example.com', 'x', is_staff=True))
+        response = client.get(reverse('dashboard:widgets'), {'start_date': '2026-13-40'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('start_date', response.json()['detail'])
+
+
+class WidgetLanguageTests(TransactionTestCase):
+    # Misses are computed in worker threads, on their own connections: the rows must be committed
+    def setUp(self):
+        product = Product.objects.create(slug='lang-card', sku='LANG-CARD', cost_price=Decimal('1.00'),
+                                         selling_price=Decimal('4.00'))
+        # Straight inserts: parler's cache is shared with dev and may hold rows for this pk
+        product.translations.create(language_code='en', name='Energy card')
+        product.translations.create(language_code='es', name='Carta de energía')
+        ProductDailySales.objects.create(day=timezone.localdate(), product=product, orders=1, units=2,
+                                         revenue=Decimal('8.00'))
+        self.keys = [WidgetRenderer.cache_key('top_products', {'language': language}) for language in ('en', 'es')]
+        cache.delete_many(self.keys)
+
+    def tearDown(self):
+        cache.delete_many(self.keys)
+
+    def test_language_is_a_parameter(self):
+        self.assertEqual(WidgetRenderer.clean_params('top_products', {'language': 'es-mx'}), {'language': 'es'})
+        self.assertEqual(WidgetRenderer.clean_params('top_products', {'language': 'fr'}), {'language': 'en'})
+        self.assertEqual(WidgetRenderer.clean_params('top_products', {}), {'language': 'en'})
+        self.assertNotIn('language', WidgetRenderer.clean_params('recent_orders', {'language': 'es'}))
+
+    def test_each_language_gets_its_own_entry(self):
+        spanish, = WidgetRenderer.render_many([('top_products', {'language': 'es'})])
+        english, = WidgetRenderer.render_many([('top_products', {'language': 'en'})])
+        self.assertEqual(spanish[0]['product__translations__name'], 'Carta de energía')
+        self.assertEqual(english[0]['product__translations__name'], 'Energy card')
+
+    def test_view_uses_the_request_language(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('lang@example.com', 'x', is_staff=True))
+        response = client.get(reverse('dashboard:widgets'), HTTP_ACCEPT_LANGUAGE='es')
+        widget = next(widget for widget in response.json()['widgets'] if widget['widget_type'] == 'top_products')
+        self.assertEqual(widget['data'][0]['product__translations__name'], 'Carta de energía')
+
+
+class SalesSeriesTests(TestCase):
+    def test_previous_year_weeks_are_read_whole(self):
+        for day, revenue in [(date(2026, 3, 3), 10), (date(2026, 3, 10), 20),
+                             (date(2025, 2, 25), 100), (date(2025, 3, 5), 50), (date(2025, 3, 12), 70)]:
+            DailySalesRollup.objects.create(day=day, status='delivered', orders=1, revenue=Decimal(revenue))
+
+        # 2025-03-02 and 2025-03-09 are Sundays: the weeks they fall in start on Feb 24 and Mar 3
+        points = SalesSeries.series('week', start=date(2026, 3, 2), end=date(2026, 3, 11), compare_previous_year=True)
+        self.assertEqual([(point['period'], point['revenue'], point['previous_revenue']) for point in points], [
+            (date(2026, 3, 2), Decimal('10'), Decimal('100')),
+            (date(2026, 3, 9), Decimal('20'), Decimal('50')),
+        ])
+        self.assertEqual(points[0]['revenue_change'], Decimal('-90'))
+
+
+class CustomerScoreTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        # Most customers ordered once, as in a real shop: ties everywhere
+        counts = [1] * 12 + [2, 2, 3, 8]
+        for index, count in enumerate(counts):
+            user = User.objects.create_user(f'rfm-{index}@example.com', 'x')
+            for number in range(count):
+                order = Order.objects.create(order_number=f'RFM-{index}-{number}', user=user, email=user.email,
+                                             phone_number='0', status='delivered',
+                                             subtotal=Decimal('20.00'), total=Decimal('20.00') * (1 + index % 3))
+                Order.objects.filter(pk=order.pk).update(created_at=now - timedelta(days=index % 4 * 30 + number))
+
+    def snapshot(self):
+        return {row[0]: row[1:] for row in CustomerStats.objects.values_list(
+            'user_id', 'recency_score', 'frequency_score', 'monetary_score', 'segment')}
+
+    def test_ties_share_a_score(self):
+        CustomerStatsService.rebuild()
+        single = CustomerStats.objects.filter(order_count=1)
+        self.assertEqual(set(single.values_list('frequency_score', flat=True)), {1})
+        self.assertFalse(single.filter(segment='champions').exists())
+
+    def test_incremental_refresh_matches_rescore(self):
+        CustomerStatsService.rebuild()
+        nightly = self.snapshot()
+        CustomerStatsService.refresh_users(list(nightly))
+        self.assertEqual(self.snapshot(), nightly)
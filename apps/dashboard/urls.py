@@ -0,0 +1,9 @@
+from django.urls import path
+from . import views
+
+app_name = 'dashboard'
+
+urlpatterns = [
+    path('widgets/', views.DashboardWidgetsView.as_view(), name='widgets'),
+    path('stream/', views.dashboard_stream, name='stream'),
+]
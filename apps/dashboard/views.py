@@ -1,3 +1,57 @@
-from django.shortcuts import render
+import asyncio
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponseForbidden, StreamingHttpResponse
+from django.utils.translation import get_language_from_request
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .events import broadcaster
+from .widgets import InvalidWidgetParams, WidgetRenderer
 
-# Create your views here.
+
+class DashboardWidgetsView(APIView):
+    """All visible widgets of the current staff user in one response."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        params = {key: request.query_params.get(key) for key in ('start_date', 'end_date', 'limit')}
+        # Explicit: misses are computed in worker threads, where no language is active
+        params['language'] = get_language_from_request(request)
+        try:
+            widgets = WidgetRenderer.render_for_user(request.user, params)
+        except InvalidWidgetParams as exc:
+            raise ValidationError({'detail': str(exc)})
+        return Response({'widgets': widgets})
+
+
+async def dashboard_stream(request):
+    """
+    Server-sent events for staff dashboards: new orders, failed payments,
+    alerts and sales rollup updates. Streams end after
+    ``DASHBOARD_STREAM_MAX_SECONDS`` and the browser reconnects, so
+    connections of clients that went away are always reclaimed.
+    """
+    is_staff = await sync_to_async(lambda: request.user.is_authenticated and request.user.is_staff)()
+    if not is_staff:
+        return HttpResponseForbidden()
+
+    async def stream():
+        queue = broadcaster.subscribe()
+        deadline = time.monotonic() + settings.DASHBOARD_STREAM_MAX_SECONDS
+        try:
+            yield 'retry: 3000\n\n'
+            while time.monotonic() < deadline:
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout=settings.DASHBOARD_STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+        finally:
+            broadcaster.unsubscribe(queue)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,184 @@
+"""
+Cached rendering of dashboard widgets.
+
+Each widget type maps to a ``Dashboard`` computation with its own TTL. Results
+are cached per (widget type, parameters) and shared by every staff user.
+Entries older than ``REFRESH_AHEAD`` of their TTL are still served but get
+recomputed in the background, so hot widgets rarely expire under load.
+Parameters are validated and normalised first (``limit`` capped at
+``MAX_LIMIT``), so bad input is rejected and equivalent requests share an
+entry. Widgets showing translated names take the language as a parameter:
+it is part of their cache key and reaches the thread pool and the refresh
+task explicitly, never through the active language. A user's whole
+dashboard is served by ``WidgetRenderer.render_many`` with one cache round
+trip; misses are computed concurrently in a thread pool.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+import hashlib
+import json
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils.translation import get_supported_language_variant
+from .models import Dashboard, SystemAlert, DashboardWidget
+
+
+class InvalidWidgetParams(ValueError):
+    pass
+
+
+def _sales_summary(params):
+    start = params.get('start_date')
+    end = params.get('end_date')
+    return Dashboard.get_sales_summary(
+        date.fromisoformat(start) if start else None,
+        date.fromisoformat(end) if end else None,
+    )
+
+
+def _alerts(params):
+    return list(
+        SystemAlert.objects.filter(is_resolved=False)
+        .order_by('-created_at')
+        .values('id', 'alert_type', 'priority', 'title', 'is_read', 'created_at')[:int(params.get('limit', 20))]
+    )
+
+
+# widget type -> (computation, TTL in seconds, accepted parameters)
+WIDGETS = {
+    'sales_summary': (_sales_summary, 300, ('start_date', 'end_date')),
+    'recent_orders': (lambda params: Dashboard.get_recent_orders(int(params.get('limit', 10))), 30, ('limit',)),
+    'low_stock': (lambda params: Dashboard.get_low_stock_products(params['language']), 120, ('language',)),
+    'top_products': (lambda params: Dashboard.get_product_performance(language=params['language']), 900, ('language',)),
+    'customer_stats': (lambda params: Dashboard.get_customer_stats(), 900, ()),
+    'alerts': (_alerts, 30, ('limit',)),
+}
+
+
+class WidgetRenderer:
+    REFRESH_AHEAD = 0.8
+    LOCK_TIMEOUT = 60
+    WAIT_TIMEOUT = 5.0
+
+    MAX_LIMIT = 100
+
+    @classmethod
+    def clean_params(cls, widget_type, params):
+        """The parameters ``widget_type`` accepts, in canonical form; raises ``InvalidWidgetParams``."""
+        accepted = WIDGETS[widget_type][2]
+        cleaned = {}
+        for key, value in (params or {}).items():
+            if key not in accepted or value in (None, ''):
+                continue
+            if key in ('start_date', 'end_date'):
+                try:
+                    cleaned[key] = date.fromisoformat(str(value)).isoformat()
+                except ValueError:
+                    raise InvalidWidgetParams(f'{key} must be a date (YYYY-MM-DD)')
+            elif key == 'limit':
+                try:
+                    cleaned[key] = str(min(max(int(value), 1), cls.MAX_LIMIT))
+                except ValueError:
+                    raise InvalidWidgetParams('limit must be an integer')
+            elif key != 'language':
+                cleaned[key] = str(value)
+        if 'language' in accepted:
+            try:
+                cleaned['language'] = get_supported_language_variant(str((params or {}).get('language') or ''))
+            except LookupError:
+                cleaned['language'] = settings.LANGUAGE_CODE
+        return cleaned
+
+    @classmethod
+    def cache_key(cls, widget_type, params):
+        digest = hashlib.md5(json.dumps(params, sort_keys=True).encode()).hexdigest()
+        return f'dashboard_widget:{widget_type}:{digest}'
+
+    @classmethod
+    def compute(cls, widget_type, params):
+        """Run the computation and cache it; returns the value."""
+        render, ttl, _accepted = WIDGETS[widget_type]
+        value = render(params)
+        cache.set(cls.cache_key(widget_type, params), {'value': value, 'computed_at': time.time()}, ttl)
+        return value
+
+    @classmethod
+    def _compute_once(cls, widget_type, params):
+        """
+        Compute a missing entry, letting only one caller do the work: the
+        others wait for its result instead of repeating the query.
+        """
+        key = cls.cache_key(widget_type, params)
+        try:
+            if cache.add(f'{key}:lock', 1, cls.LOCK_TIMEOUT):
+                try:
+                    return cls.compute(widget_type, params)
+                finally:
+                    cache.delete(f'{key}:lock')
+            deadline = time.monotonic() + cls.WAIT_TIMEOUT
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                entry = cache.get(key)
+                if entry is not None:
+                    return entry['value']
+            return cls.compute(widget_type, params)
+        finally:
+            # Worker threads get their own connection; don't leak it
+            connection.close()
+
+    @classmethod
+    def _schedule_refresh(cls, widget_type, params, key):
+        from .tasks import refresh_widget_task
+
+        if cache.add(f'{key}:refreshing', 1, cls.LOCK_TIMEOUT):
+            refresh_widget_task.delay(widget_type, params)
+
+    @classmethod
+    def render_many(cls, requests):
+        """
+        Render ``[(widget_type, params), ...]`` and return the values in the
+        same order. Fresh entries come from one ``get_many``; misses run
+        concurrently.
+        """
+        requests = [(widget_type, cls.clean_params(widget_type, params)) for widget_type, params in requests]
+        keys = [cls.cache_key(widget_type, params) for widget_type, params in requests]
+        cached = cache.get_many(keys)
+        now = time.time()
+
+        results = [None] * len(requests)
+        missing = []
+        for index, ((widget_type, params), key) in enumerate(zip(requests, keys)):
+            entry = cached.get(key)
+            if entry is None:
+                missing.append(index)
+                continue
+            results[index] = entry['value']
+            if now - entry['computed_at'] > WIDGETS[widget_type][1] * cls.REFRESH_AHEAD:
+                cls._schedule_refresh(widget_type, params, key)
+
+        if missing:
+            workers = min(len(missing), settings.DASHBOARD_WIDGET_WORKERS)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {index: pool.submit(cls._compute_once, *requests[index]) for index in missing}
+                for index, future in futures.items():
+                    results[index] = future.result()
+        return results
+
+    @classmethod
+    def render_for_user(cls, user, params=None):
+        """All visible widgets of ``user`` in position order, rendered in one batch."""
+        rows = list(
+            DashboardWidget.objects.filter(user=user)
+            .order_by('position')
+            .values('widget_type', 'position', 'size', 'is_visible')
+        )
+        if not rows:
+            # No layout saved yet: show every widget in the default order
+            rows = [{'widget_type': widget_type, 'position': position, 'size': 'medium', 'is_visible': True}
+                    for position, widget_type in enumerate(WIDGETS)]
+        widgets = [{key: row[key] for key in ('widget_type', 'position', 'size')}
+                   for row in rows if row['is_visible'] and row['widget_type'] in WIDGETS]
+        values = cls.render_many([(widget['widget_type'], params) for widget in widgets])
+        return [{**widget, 'data': value} for widget, value in zip(widgets, values)]
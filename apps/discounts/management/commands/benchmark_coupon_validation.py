@@ -0,0 +1,89 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from apps.accounts.models import User
+from apps.discounts.models import Coupon
+from apps.discounts.services import CouponRules, CouponValidator
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark validating a coupon restricted to many users (default 1M), '
+        'seeded inside a rolled-back transaction'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1_000_000)
+        parser.add_argument('--checks', type=int, default=1000, help='Validations per timed run')
+        parser.add_argument('--skip-legacy', action='store_true', help='Skip the list-loading Coupon.can_user_use')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            coupon, sample = self.seed(options['users'])
+            checks = options['checks']
+
+            if not options['skip_legacy']:
+                # What can_user_use used to do: load every exclusive user
+                started = time.perf_counter()
+                sample[0] in coupon.applicable_users.all()
+                self.report('legacy membership (1 check)', 1, time.perf_counter() - started)
+
+            started = time.perf_counter()
+            for index in range(checks):
+                coupon.can_user_use(sample[index % len(sample)])
+            self.report('Coupon.can_user_use', checks, time.perf_counter() - started)
+
+            CouponRules.invalidate()
+            started = time.perf_counter()
+            for index in range(checks):
+                CouponValidator.validate(coupon.code, sample[index % len(sample)], Decimal('50.00'))
+            self.report('CouponValidator.validate', checks, time.perf_counter() - started)
+
+            started = time.perf_counter()
+            results = CouponValidator.validate_many(
+                [(coupon.code, sample[index % len(sample)], Decimal('50.00')) for index in range(checks)]
+            )
+            self.report('CouponValidator.validate_many (one batch)', checks, time.perf_counter() - started)
+            assert all(ok for ok, _message, _rules in results[:len(sample) // 2])
+            transaction.set_rollback(True)
+        CouponRules.invalidate()
+
+    def report(self, label, count, elapsed):
+        self.stdout.write(f'{label}: {elapsed * 1000:.1f} ms total, {elapsed / count * 1e6:.0f} us per check')
+
+    def seed(self, users):
+        now = timezone.now()
+        self.stdout.write(f'Seeding {users} users restricted to one coupon...')
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO accounts_user (password, is_superuser, first_name, last_name, is_staff, is_active,
+                                           date_joined, email, phone_number, is_subscribed_newsletter,
+                                           created_at, updated_at)
+                SELECT '!', false, '', '', false, true, now(), 'bench-' || n || '@example.com', '', false, now(), now()
+                FROM generate_series(1, %s) AS n
+                """,
+                [users],
+            )
+        coupon = Coupon.objects.create(
+            code='BENCH-EXCLUSIVE', discount_type='percentage', discount_value=Decimal('10.00'),
+            usage_limit_per_user=1, valid_from=now - timedelta(days=1), valid_until=now + timedelta(days=1),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {Coupon.applicable_users.through._meta.db_table} (coupon_id, user_id)
+                SELECT %s, id FROM accounts_user WHERE email LIKE 'bench-%%'
+                """,
+                [coupon.pk],
+            )
+            cursor.execute(f'ANALYZE {Coupon.applicable_users.through._meta.db_table}')
+        # Half the sample is on the list, half is not
+        listed = list(User.objects.filter(email__startswith='bench-').order_by('?')[:50])
+        unlisted = list(User.objects.exclude(email__startswith='bench-')[:50])
+        self.stdout.write(f'Seeded in {time.perf_counter() - started:.1f}s')
+        return coupon, listed + unlisted
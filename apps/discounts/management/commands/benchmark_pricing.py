@@ -0,0 +1,112 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import TestCase
+from django.utils import timezone
+from apps.products.models import Category, Product
+from apps.discounts.models import Coupon, Sale
+from apps.discounts.pricing import EligibleProducts, PricingEngine
+from apps.discounts.services import CouponRules
+
+PREFIX = 'pricing-bench'
+
+
+class Command(BaseCommand):
+    help = (
+        'Time pricing 100-line carts, cold and warm cache; seeded in a rolled-back transaction. '
+        'Correctness is covered by apps.discounts.tests'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--lines', type=int, default=100, help='Lines per benchmarked cart')
+        parser.add_argument('--runs', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                rng = random.Random(options['seed'])
+                # Drop the seed's on-commit callbacks (they would schedule the sales) and invalidate directly
+                with TestCase.captureOnCommitCallbacks():
+                    products, coupons = self.seed(options['products'])
+                self.invalidate()
+                self.benchmark(rng, products, coupons, options['lines'], options['runs'])
+                transaction.set_rollback(True)
+        finally:
+            # Nothing compiled from the rolled-back rows stays current
+            self.invalidate()
+
+    def invalidate(self):
+        CouponRules.invalidate()
+        EligibleProducts.invalidate_sales()
+        EligibleProducts.invalidate_catalog()
+
+    def seed(self, count):
+        now = timezone.now()
+        # Three-level tree: 4 roots, 3 children each, 2 grandchildren each
+        categories = []
+        for root in range(4):
+            top = Category.objects.create(slug=f'{PREFIX}-{root}')
+            categories.append(top)
+            for child in range(3):
+                middle = Category.objects.create(slug=f'{PREFIX}-{root}-{child}', parent=top)
+                categories.append(middle)
+                for leaf in range(2):
+                    categories.append(Category.objects.create(slug=f'{PREFIX}-{root}-{child}-{leaf}', parent=middle))
+        products = Product.objects.bulk_create([
+            Product(slug=f'{PREFIX}-{i}', sku=f'{PREFIX}-{i}', category=categories[i % len(categories)],
+                    cost_price=Decimal('1.00'), selling_price=Decimal(i % 997 + 1) / 7 + Decimal('0.99'))
+            for i in range(count)
+        ], batch_size=5000)
+        products = list(Product.objects.filter(slug__startswith=f'{PREFIX}-'))
+
+        window = {'valid_from': now - timedelta(days=1), 'valid_until': now + timedelta(days=1)}
+        coupons = {
+            'root category 15%': self.coupon('ROOT', 'percentage', '15.00', categories=[categories[0]], **window),
+            'products fixed 25': self.coupon('FIXED', 'fixed', '25.00', products=products[:300:3], **window),
+            'all 30% capped': self.coupon('CAPPED', 'percentage', '30.00', maximum_discount=Decimal('40.00'), **window),
+            'free shipping leaf': self.coupon('SHIP', 'free_shipping', '0.00', categories=[categories[2]], **window),
+            'minimum 100000': self.coupon('MIN', 'fixed', '5.00', minimum_purchase=Decimal('100000.00'), **window),
+            'expired': self.coupon('OLD', 'percentage', '50.00', valid_from=now - timedelta(days=3),
+                                   valid_until=now - timedelta(days=2)),
+        }
+        sale = Sale.objects.create(name=f'{PREFIX}-middle', discount_percentage=Decimal('20.00'), priority=2, **window)
+        sale.applicable_categories.add(categories[1], categories[12])
+        sale = Sale.objects.create(name=f'{PREFIX}-picked', discount_percentage=Decimal('12.50'), priority=1, **window)
+        sale.applicable_products.set(products[::11])
+        Sale.objects.create(name=f'{PREFIX}-everything', discount_percentage=Decimal('5.00'), priority=0, **window)
+        Sale.objects.create(name=f'{PREFIX}-over', discount_percentage=Decimal('90.00'), priority=9,
+                            valid_from=now - timedelta(days=3), valid_until=now - timedelta(days=2))
+        return products, coupons
+
+    def coupon(self, code, discount_type, value, products=(), categories=(), **fields):
+        coupon = Coupon.objects.create(code=f'{PREFIX}-{code}'.upper(), discount_type=discount_type,
+                                       discount_value=Decimal(value), **fields)
+        coupon.applicable_products.set(products)
+        coupon.applicable_categories.set(categories)
+        return coupon
+
+    def cart(self, rng, products, lines):
+        return [(product, rng.randint(1, 5)) for product in rng.sample(products, lines)]
+
+    def benchmark(self, rng, products, coupons, lines, runs):
+        coupon = coupons['root category 15%']
+        carts = [self.cart(rng, products, lines) for _ in range(runs)]
+        self.stdout.write(f'Benchmarking {runs} carts of {lines} lines...')
+
+        EligibleProducts.invalidate_catalog()
+        started = time.perf_counter()
+        PricingEngine.price_cart(carts[0], coupon.code)
+        self.report('PricingEngine, cold cache', 1, time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for cart in carts:
+            PricingEngine.price_cart(cart, coupon.code)
+        self.report('PricingEngine, warm cache', runs, time.perf_counter() - started)
+
+    def report(self, label, count, elapsed):
+        self.stdout.write(f'{label}: {elapsed / count * 1000:.2f} ms per cart')
@@ -0,0 +1,70 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from apps.discounts.models import Coupon
+from apps.discounts.services import CouponBatchGenerator
+
+
+def _ids(value):
+    return [int(pk) for pk in value.split(',') if pk.strip()] if value else []
+
+
+class Command(BaseCommand):
+    help = 'Generate a batch of random unique coupon codes sharing the same terms, e.g. for a newsletter campaign'
+
+    def add_arguments(self, parser):
+        parser.add_argument('count', type=int)
+        parser.add_argument('--type', dest='discount_type', default='percentage',
+                            choices=[choice for choice, _label in Coupon.DISCOUNT_TYPE_CHOICES])
+        parser.add_argument('--value', type=Decimal, default=Decimal('10.00'))
+        parser.add_argument('--prefix', default='', help='Prepended to every code, e.g. NEWS-')
+        parser.add_argument('--length', type=int, default=10, help='Random characters per code')
+        parser.add_argument('--valid-from', help='ISO datetime (default now)')
+        parser.add_argument('--valid-until', help='ISO datetime (default --days from --valid-from)')
+        parser.add_argument('--days', type=int, default=30)
+        parser.add_argument('--usage-limit', type=int, default=1, help='Uses per code (0 for unlimited)')
+        parser.add_argument('--usage-limit-per-user', type=int)
+        parser.add_argument('--minimum-purchase', type=Decimal)
+        parser.add_argument('--maximum-discount', type=Decimal)
+        parser.add_argument('--description', default='')
+        parser.add_argument('--products', help='Comma-separated product ids')
+        parser.add_argument('--categories', help='Comma-separated category ids')
+        parser.add_argument('--users', help='Comma-separated user ids')
+        parser.add_argument('--output', help='Write the generated codes to this file, one per line')
+
+    def handle(self, *args, **options):
+        valid_from = parse_datetime(options['valid_from']) if options['valid_from'] else timezone.now()
+        valid_until = (parse_datetime(options['valid_until']) if options['valid_until']
+                       else valid_from + timedelta(days=options['days']))
+        if valid_from is None or valid_until is None or valid_until <= valid_from:
+            raise CommandError('Invalid validity window')
+
+        output = open(options['output'], 'w') if options['output'] else None
+
+        def on_chunk(codes, created, elapsed):
+            if output:
+                output.write('\n'.join(codes) + '\n')
+            self.stdout.write(f"{created}/{options['count']} codes, {created / elapsed:.0f} codes/sec")
+
+        try:
+            stats = CouponBatchGenerator.generate(
+                options['count'], options['discount_type'], options['value'], valid_from, valid_until,
+                prefix=options['prefix'], length=options['length'],
+                products=_ids(options['products']), categories=_ids(options['categories']),
+                users=_ids(options['users']), on_chunk=on_chunk,
+                description=options['description'], usage_limit=options['usage_limit'] or None,
+                usage_limit_per_user=options['usage_limit_per_user'],
+                minimum_purchase=options['minimum_purchase'], maximum_discount=options['maximum_discount'],
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        finally:
+            if output:
+                output.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {stats['created']} coupons in {stats['elapsed']:.1f}s ({stats['codes_per_sec']:.0f} codes/sec); "
+            f"redrawn: {stats['duplicates']} duplicates, {stats['existing']} existing codes"
+        ))
@@ -0,0 +1,107 @@
+import multiprocessing
+import time
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.utils import timezone
+from apps.accounts.models import User
+from apps.discounts.models import Coupon, CouponUsage
+from apps.discounts.services import CouponRedemption, CouponRules
+from apps.orders.models import Order
+
+CODE = 'STRESS-FLASH'
+
+
+def _worker(order_ids, user_ids, start, results):
+    connections.close_all()
+    start.wait()
+    users = {user.pk: user for user in User.objects.filter(pk__in=set(user_ids))}
+    outcome = Counter()
+    for order_id, user_id in zip(order_ids, user_ids):
+        ok, message, _usage = CouponRedemption.redeem(
+            CODE, users[user_id], Order(pk=order_id), Decimal('5.00')
+        )
+        outcome[message] += 1
+    results.put(dict(outcome))
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        'Redeem one limited coupon from many processes at once and check that '
+        'neither the global nor the per-user limit is ever exceeded; runs in a throwaway test database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8)
+        parser.add_argument('--attempts', type=int, default=250, help='Redemptions per process')
+        parser.add_argument('--limit', type=int, default=500, help='Coupon usage limit')
+        parser.add_argument('--users', type=int, default=1000, help='Distinct users, each limited to one use')
+
+    def handle(self, *args, **options):
+        # The workers only see committed rows, so rather than a rolled-back
+        # transaction the run gets its own database, dropped afterwards
+        live_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.stress(options)
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(live_name, verbosity=0)
+            CouponRules.invalidate()
+
+    def stress(self, options):
+        processes, attempts = options['processes'], options['attempts']
+        now = timezone.now()
+        coupon = Coupon.objects.create(
+            code=CODE, discount_type='fixed', discount_value=Decimal('5.00'),
+            usage_limit=options['limit'], usage_limit_per_user=1,
+            valid_from=now - timedelta(hours=1), valid_until=now + timedelta(hours=1),
+        )
+        users = User.objects.bulk_create([
+            User(email=f'stress-{i}@example.com') for i in range(options['users'])
+        ])
+        orders = Order.objects.bulk_create([
+            Order(order_number=f'STRESS-{i}', email='stress@example.com', phone_number='0',
+                  subtotal=Decimal('50.00'), total=Decimal('50.00'))
+            for i in range(processes * attempts)
+        ], batch_size=5000)
+
+        connections.close_all()
+        start = multiprocessing.Barrier(processes)
+        results = multiprocessing.Queue()
+        workers = []
+        for index in range(processes):
+            chunk = orders[index * attempts:(index + 1) * attempts]
+            user_ids = [users[(index * attempts + offset) % len(users)].pk for offset in range(attempts)]
+            workers.append(multiprocessing.Process(
+                target=_worker, args=([order.pk for order in chunk], user_ids, start, results)
+            ))
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        outcome = Counter()
+        for _worker_process in workers:
+            outcome.update(results.get())
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        coupon.refresh_from_db()
+        usages = CouponUsage.objects.filter(coupon=coupon)
+        per_user = Counter(usages.values_list('user_id', flat=True))
+        self.stdout.write(f'{processes * attempts} redemption attempts from {processes} processes '
+                          f'in {elapsed:.2f}s ({processes * attempts / elapsed:.0f}/s)')
+        for message, count in sorted(outcome.items()):
+            self.stdout.write(f'  {message}: {count}')
+        self.stdout.write(f'usage_count={coupon.usage_count} usages={usages.count()} '
+                          f'limit={coupon.usage_limit} max per user={max(per_user.values(), default=0)}')
+
+        expected = min(coupon.usage_limit, len(users), processes * attempts)
+        if not (coupon.usage_count == usages.count() == outcome['Redeemed'] == expected):
+            raise CommandError('Redemptions do not match the limit')
+        if max(per_user.values(), default=0) > 1:
+            raise CommandError('Per-user limit exceeded')
+        self.stdout.write(self.style.SUCCESS('Limits held under contention.'))
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:30
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('discounts', '0001_initial'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='coupon',
+            index=models.Index(django.db.models.functions.text.Upper('code'), condition=models.Q(('is_active', True)), name='coupon_active_code_idx'),
+        ),
+    ]
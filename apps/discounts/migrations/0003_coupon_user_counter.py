@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:34
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('discounts', '0002_coupon_active_code_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CouponUserCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uses', models.IntegerField(default=0, verbose_name='uses')),
+                ('coupon', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_counters', to='discounts.coupon', verbose_name='coupon')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='coupon_counters', to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+            options={
+                'verbose_name': 'coupon user counter',
+                'verbose_name_plural': 'coupon user counters',
+                'unique_together': {('coupon', 'user')},
+            },
+        ),
+        migrations.RunSQL(
+            """
+            INSERT INTO discounts_couponusercounter (coupon_id, user_id, uses)
+            SELECT coupon_id, user_id, COUNT(*) FROM discounts_couponusage GROUP BY coupon_id, user_id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
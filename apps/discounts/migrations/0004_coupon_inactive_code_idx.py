@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:52
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('discounts', '0003_coupon_user_counter'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='coupon',
+            index=models.Index(django.db.models.functions.text.Upper('code'), condition=models.Q(('is_active', False)), name='coupon_inactive_code_idx'),
+        ),
+    ]
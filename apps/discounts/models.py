@@ -1,8 +1,10 @@
-from django.db import models
+from django.db import models, connection
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator,MaxValueValidator
 from decimal import Decimal
 from django.utils import timezone
+from django.db.models import F
+from django.db.models.functions import Greatest, Upper
 from apps.accounts.models import User
 from apps.products.models import Product, Category
 
@@ -28,6 +30,10 @@ class Coupon(models.Model):
 
     class Meta:
         verbose_name=_('coupon'); verbose_name_plural=_('coupons'); ordering=['-created_at']
+        # Case-insensitive lookups of redeemable codes (code__iexact=..., is_active=True),
+        # and of inactive ones, to report them as not active
+        indexes=[models.Index(Upper('code'),condition=models.Q(is_active=True),name='coupon_active_code_idx'),
+                 models.Index(Upper('code'),condition=models.Q(is_active=False),name='coupon_inactive_code_idx')]
 
     def __str__(self): return self.code
 
@@ -42,22 +48,31 @@ class Coupon(models.Model):
     def can_user_use(self,user):
         valid,msg=self.is_valid()
         if not valid: return False,msg
-        if self.applicable_users.exists() and user not in self.applicable_users.all(): return False,'Not for your account'
+        if self.applicable_users.exists() and not self.applicable_users.filter(pk=user.pk).exists(): return False,'Not for your account'
         if self.usage_limit_per_user:
-            from .models import CouponUsage
-            count=CouponUsage.objects.filter(coupon=self,user=user).count()
-            if count>=self.usage_limit_per_user: return False,'Per-user limit reached'
+            uses=CouponUserCounter.objects.filter(coupon=self,user=user).values_list('uses',flat=True).first() or 0
+            if uses>=self.usage_limit_per_user: return False,'Per-user limit reached'
         return True,'Can use'
 
-    def calculate_discount(self,order_total,products=None):
+    def calculate_discount(self,order_total,products=None,shipping_cost=None):
+        """
+        Discount on ``order_total``. With ``products`` (``(product or id, line total)`` pairs) only the
+        lines the coupon applies to are discounted; ``free_shipping`` waives ``shipping_cost``.
+        Use ``pricing.PricingEngine`` to price whole carts with per-line shares and sales.
+        """
         if self.minimum_purchase and order_total<self.minimum_purchase: return Decimal('0.00')
+        base=order_total
+        if products is not None:
+            from .pricing import EligibleProducts, contains
+            eligible=EligibleProducts.for_coupon(self.pk)
+            base=sum((total for product,total in products if contains(eligible,getattr(product,'pk',product))),Decimal('0.00'))
         if self.discount_type=='percentage':
-            amount=order_total*self.discount_value/100
+            amount=base*self.discount_value/100
             if self.maximum_discount: amount=min(amount,self.maximum_discount)
         elif self.discount_type=='fixed':
-            amount=min(self.discount_value,order_total)
+            amount=min(self.discount_value,base)
         else:
-            amount=Decimal('0.00')
+            amount=shipping_cost if shipping_cost and base>0 else Decimal('0.00')
         return amount
 
 class CouponUsage(models.Model):
@@ -72,6 +87,30 @@ class CouponUsage(models.Model):
 
     def __str__(self): return f"{self.coupon.code} – {self.user.email}"
 
+class CouponUserCounter(models.Model):
+    """Uses of a coupon per user, kept in step with ``CouponUsage`` so per-user limits are one lookup."""
+    coupon=models.ForeignKey(Coupon,on_delete=models.CASCADE,related_name='user_counters',verbose_name=_('coupon'))
+    user=models.ForeignKey(User,on_delete=models.CASCADE,related_name='coupon_counters',verbose_name=_('user'))
+    uses=models.IntegerField(_('uses'),default=0)
+
+    class Meta:
+        verbose_name=_('coupon user counter'); verbose_name_plural=_('coupon user counters'); unique_together=('coupon','user')
+
+    def __str__(self): return f"{self.coupon_id} – {self.user_id}: {self.uses}"
+
+    @classmethod
+    def bump(cls,coupon_id,user_id,delta=1):
+        """Atomically add ``delta`` (never going below zero); only increments create the row."""
+        if delta<0:
+            return cls.objects.filter(coupon_id=coupon_id,user_id=user_id).update(uses=Greatest(F('uses')+delta,0))
+        table=cls._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (coupon_id,user_id,uses) VALUES (%s,%s,%s) '
+                f'ON CONFLICT (coupon_id,user_id) DO UPDATE SET uses={table}.uses+%s',
+                [coupon_id,user_id,delta,delta])
+            return cursor.rowcount
+
 class Sale(models.Model):
     name=models.CharField(_('name'),max_length=100)
     description=models.TextField(_('description'),blank=True)
@@ -0,0 +1,376 @@
+"""
+Line-level cart pricing: active sales, then a coupon, per line.
+
+What a coupon or sale applies to (its products plus every product in its
+categories and their descendants) is compiled once into a sorted
+``array('q')`` of product ids and cached under version numbers, so pricing a
+cart never touches the M2M tables: one query for the line prices, one cache
+round trip for the eligibility sets, and membership tests by bisection.
+An empty applicability list means every product, cached as ``ALL``.
+"""
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+from apps.products.models import Category, Product
+from .models import Coupon, Sale
+from .services import CouponRules, CouponValidator
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+ALL = '*'
+
+
+def _versions(*keys):
+    versions = cache.get_many(keys)
+    missing = {key: 1 for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def contains(ids, product_id):
+    """Whether a compiled eligibility set (``None`` meaning all products) includes ``product_id``."""
+    if ids is None:
+        return True
+    index = bisect_left(ids, product_id)
+    return index < len(ids) and ids[index] == product_id
+
+
+def sale_price(product_id, price, sales, eligible):
+    """``(sale id, unit price)`` under the first of ``sales`` (by priority) that applies to the product."""
+    for sale in sales:
+        if contains(eligible[(Sale, sale['id'])], product_id):
+            return sale['id'], (price * (100 - sale['discount_percentage']) / 100).quantize(CENT, ROUND_HALF_UP)
+    return None, price
+
+
+class EligibleProducts:
+    """Compiled, cached product-id sets of coupons and sales."""
+    CATALOG_VERSION_KEY = 'pricing_catalog_version'
+    SALES_VERSION_KEY = 'pricing_sales_version'
+    TIMEOUT = 60 * 60
+
+    @classmethod
+    def invalidate_catalog(cls):
+        """Products moved between categories or the category tree changed."""
+        _bump(cls.CATALOG_VERSION_KEY)
+
+    @classmethod
+    def invalidate_sales(cls):
+        _bump(cls.SALES_VERSION_KEY)
+
+    @classmethod
+    def versions(cls):
+        """``(coupon, sales, catalog)`` version numbers, in one cache round trip."""
+        return _versions(CouponRules.VERSION_KEY, cls.SALES_VERSION_KEY, cls.CATALOG_VERSION_KEY)
+
+    @classmethod
+    def keys(cls, versions, coupon_ids=(), sale_ids=()):
+        coupon_version, sales_version, catalog_version = versions
+        keys = {f'pricing:coupon:{coupon_version}:{catalog_version}:{pk}': (Coupon, pk) for pk in coupon_ids}
+        keys.update({f'pricing:sale:{sales_version}:{catalog_version}:{pk}': (Sale, pk) for pk in sale_ids})
+        return keys
+
+    @classmethod
+    def get_many(cls, keys):
+        """Eligibility sets by ``(model, pk)`` for keys from ``keys()``, compiling what isn't cached."""
+        cached = cache.get_many(keys.keys())
+        result = {keys[key]: None if value == ALL else value for key, value in cached.items()}
+        missing = {key: target for key, target in keys.items() if key not in cached}
+        if missing:
+            compiled = {key: cls.compile(*target) for key, target in missing.items()}
+            cache.set_many({key: ALL if ids is None else ids for key, ids in compiled.items()}, cls.TIMEOUT)
+            result.update({missing[key]: ids for key, ids in compiled.items()})
+        return result
+
+    @classmethod
+    def for_coupon(cls, coupon_id):
+        return cls.get_many(cls.keys(cls.versions(), coupon_ids=[coupon_id]))[(Coupon, coupon_id)]
+
+    @classmethod
+    def compile(cls, model, pk):
+        """Sorted product ids ``model`` ``pk`` applies to, or ``None`` for every product."""
+        owner = f'{model._meta.model_name}_id'
+        product_ids = set(
+            model.applicable_products.through.objects.filter(**{owner: pk}).values_list('product_id', flat=True)
+        )
+        category_ids = set(
+            model.applicable_categories.through.objects.filter(**{owner: pk}).values_list('category_id', flat=True)
+        )
+        if not product_ids and not category_ids:
+            return None
+        if category_ids:
+            product_ids.update(
+                Product.objects.filter(category_id__in=cls.descendants(category_ids)).values_list('pk', flat=True)
+            )
+        return array('q', sorted(product_ids))
+
+    @classmethod
+    def category_tree(cls, catalog_version=None):
+        """``(children, parents)`` maps of the whole category tree, cached per catalog version."""
+        catalog_version = catalog_version or cls.versions()[2]
+        key = f'pricing:categories:{catalog_version}'
+        tree = cache.get(key)
+        if tree is None:
+            children, parents = defaultdict(list), {}
+            for pk, parent_id in Category.objects.values_list('pk', 'parent_id'):
+                children[parent_id].append(pk)
+                parents[pk] = parent_id
+            tree = (dict(children), parents)
+            cache.set(key, tree, cls.TIMEOUT)
+        return tree
+
+    @classmethod
+    def ancestors(cls, category_id, parents):
+        """``category_id`` and every category above it."""
+        found = []
+        while category_id is not None and category_id not in found:
+            found.append(category_id)
+            category_id = parents.get(category_id)
+        return found
+
+    @classmethod
+    def descendants(cls, category_ids, children=None):
+        """``category_ids`` and every category below them."""
+        children = children if children is not None else cls.category_tree()[0]
+        found, frontier = set(category_ids), list(category_ids)
+        while frontier:
+            for child in children.get(frontier.pop(), ()):
+                if child not in found:
+                    found.add(child)
+                    frontier.append(child)
+        return found
+
+
+class PricingEngine:
+    SALES_TIMEOUT = 60 * 60
+
+    @classmethod
+    def active_sales(cls, sales_version, now):
+        """Sales valid at ``now``, highest priority first."""
+        key = f'pricing:sales:{sales_version}'
+        sales = cache.get(key)
+        if sales is None:
+            # Upcoming sales are kept too; their window is checked per call
+            sales = list(
+                Sale.objects.filter(is_active=True, valid_until__gte=timezone.now())
+                .values('id', 'discount_percentage', 'valid_from', 'valid_until')
+            )
+            cache.set(key, sales, cls.SALES_TIMEOUT)
+        return [sale for sale in sales if sale['valid_from'] <= now <= sale['valid_until']]
+
+    @classmethod
+    def price_cart(cls, lines, coupon_code=None, user=None, shipping_cost=ZERO, now=None):
+        """
+        Price ``[(product or product id, quantity), ...]``. Each line gets the
+        best-priority sale that applies to it, then its share of the coupon's
+        discount if the coupon applies to it; ``free_shipping`` coupons waive
+        ``shipping_cost`` when any line is eligible. Lines of the same product
+        are merged.
+        """
+        now = now or timezone.now()
+        quantities = defaultdict(int)
+        for product, quantity in lines:
+            quantities[getattr(product, 'pk', product)] += quantity
+        prices = dict(Product.objects.filter(pk__in=quantities).values_list('pk', 'selling_price'))
+
+        priced = []
+        for product_id, quantity in quantities.items():
+            if product_id not in prices:
+                continue
+            priced.append({
+                'product_id': product_id,
+                'quantity': quantity,
+                'unit_price': prices[product_id],
+                'sale_id': None,
+                'sale_unit_price': prices[product_id],
+                'eligible': False,
+                'discount': ZERO,
+            })
+
+        coupon = {'code': coupon_code, 'ok': False, 'message': None, 'rules': None}
+        if coupon_code:
+            # The minimum purchase is checked below, against sale prices
+            ok, message, rules = CouponValidator.validate(coupon_code, user)
+            coupon.update(ok=ok, message=message, rules=rules)
+
+        versions = EligibleProducts.versions()
+        sales = cls.active_sales(versions[1], now)
+        eligible = EligibleProducts.get_many(EligibleProducts.keys(
+            versions,
+            coupon_ids=[coupon['rules']['id']] if coupon['ok'] else [],
+            sale_ids=[sale['id'] for sale in sales],
+        ))
+
+        for line in priced:
+            line['sale_id'], line['sale_unit_price'] = sale_price(line['product_id'], line['unit_price'], sales, eligible)
+            line['line_total'] = line['sale_unit_price'] * line['quantity']
+            if coupon['ok']:
+                line['eligible'] = contains(eligible[(Coupon, coupon['rules']['id'])], line['product_id'])
+
+        subtotal = sum((line['line_total'] for line in priced), ZERO)
+        shipping_discount = ZERO
+        if coupon['ok']:
+            rules = coupon['rules']
+            eligible_lines = [line for line in priced if line['eligible']]
+            if rules['minimum_purchase'] and subtotal < rules['minimum_purchase']:
+                coupon.update(ok=False, message='Minimum purchase not reached')
+            elif not eligible_lines:
+                coupon.update(ok=False, message='Not applicable to these products')
+            elif rules['discount_type'] == 'free_shipping':
+                shipping_discount = shipping_cost
+            else:
+                cls.allocate(eligible_lines, cls.coupon_amount(rules, eligible_lines))
+            if not coupon['ok']:
+                for line in priced:
+                    line['eligible'] = False
+
+        discount = sum((line['discount'] for line in priced), ZERO)
+        return {
+            'lines': priced,
+            'subtotal': subtotal,
+            'sale_savings': sum(((line['unit_price'] - line['sale_unit_price']) * line['quantity'] for line in priced), ZERO),
+            'discount': discount,
+            'shipping_cost': shipping_cost,
+            'shipping_discount': shipping_discount,
+            'total': subtotal - discount + shipping_cost - shipping_discount,
+            'coupon': {key: coupon[key] for key in ('code', 'ok', 'message')},
+        }
+
+    @classmethod
+    def price_items(cls, cart, **kwargs):
+        """``price_cart`` for a ``Cart``'s items."""
+        return cls.price_cart(cart.items.values_list('product_id', 'quantity'), user=cart.user, **kwargs)
+
+    @classmethod
+    def coupon_amount(cls, rules, lines):
+        base = sum((line['line_total'] for line in lines), ZERO)
+        if rules['discount_type'] == 'percentage':
+            amount = (base * rules['discount_value'] / 100).quantize(CENT, ROUND_HALF_UP)
+            if rules['maximum_discount']:
+                amount = min(amount, rules['maximum_discount'])
+        else:
+            amount = min(rules['discount_value'], base)
+        return amount
+
+    @classmethod
+    def allocate(cls, lines, amount):
+        """
+        Split ``amount`` across ``lines`` in proportion to their totals. Shares
+        are rounded down to the cent and the leftover cents go to the largest
+        remainders (earlier lines first on ties), so shares always add up.
+        """
+        base = sum((line['line_total'] for line in lines), ZERO)
+        if not base or not amount:
+            return
+        exact = [amount * line['line_total'] / base for line in lines]
+        shares = [share.quantize(CENT, ROUND_DOWN) for share in exact]
+        leftover = int((amount - sum(shares)) / CENT)
+        order = sorted(range(len(lines)), key=lambda index: (shares[index] - exact[index], index))
+        for index in order[:leftover]:
+            shares[index] += CENT
+        for line, share in zip(lines, shares):
+            line['discount'] = share
+
+
+class EffectivePrices:
+    """
+    Cached sale prices of products and of category listings. Keys carry the
+    sales and catalog versions and the ids of the sales active at the time,
+    so a sale starting or ending switches readers to a new set of keys, which
+    ``SaleScheduler`` fills just before the boundary.
+    """
+    TIMEOUT = 60 * 60 * 6
+    BATCH_SIZE = 2000
+
+    @classmethod
+    def context(cls, now=None):
+        """``(key prefix, active sales, eligibility sets, catalog version)`` for pricing at ``now``."""
+        now = now or timezone.now()
+        versions = EligibleProducts.versions()
+        sales = PricingEngine.active_sales(versions[1], now)
+        eligible = EligibleProducts.get_many(EligibleProducts.keys(versions, sale_ids=[sale['id'] for sale in sales]))
+        window = '-'.join(str(pk) for pk in sorted(sale['id'] for sale in sales)) or 'none'
+        return f'{versions[1]}:{versions[2]}:{window}', sales, eligible, versions[2]
+
+    @classmethod
+    def get_many(cls, product_ids, now=None):
+        """``{product id: (price, sale price, sale id)}`` of active products."""
+        prefix, sales, eligible, _catalog_version = cls.context(now)
+        keys = {f'pricing:price:{prefix}:{pk}': pk for pk in product_ids}
+        prices = {keys[key]: value for key, value in cache.get_many(keys.keys()).items()}
+        missing = [pk for pk in keys.values() if pk not in prices]
+        if missing:
+            computed = cls.compute(Product.objects.filter(pk__in=missing, is_active=True), sales, eligible)
+            cache.set_many({f'pricing:price:{prefix}:{pk}': value for pk, value in computed.items()}, cls.TIMEOUT)
+            prices.update(computed)
+        return prices
+
+    @classmethod
+    def listing(cls, category_id, now=None):
+        """``{product id: (price, sale price, sale id)}`` of the active products in a category and below it."""
+        prefix, sales, eligible, catalog_version = cls.context(now)
+        key = f'pricing:listing:{prefix}:{category_id}'
+        prices = cache.get(key)
+        if prices is None:
+            children, _parents = EligibleProducts.category_tree(catalog_version)
+            categories = EligibleProducts.descendants([category_id], children)
+            prices = cls.compute(Product.objects.filter(category_id__in=categories, is_active=True), sales, eligible)
+            cache.set(key, prices, cls.TIMEOUT)
+        return prices
+
+    @classmethod
+    def compute(cls, products, sales, eligible):
+        return {
+            pk: (price, *reversed(sale_price(pk, price, sales, eligible)))
+            for pk, price in products.values_list('pk', 'selling_price').iterator(chunk_size=cls.BATCH_SIZE)
+        }
+
+    @classmethod
+    def warm(cls, product_ids=None, category_ids=None, now=None):
+        """
+        Compute and cache the prices of ``product_ids`` (``None`` for every
+        active product) and the listings of ``category_ids`` and their
+        ancestors, as they will be at ``now``. One product query feeds both.
+        Returns ``(products, categories)`` written.
+        """
+        prefix, sales, eligible, catalog_version = cls.context(now)
+        children, parents = EligibleProducts.category_tree(catalog_version)
+        categories = set()
+        for category_id in category_ids or ():
+            categories.update(EligibleProducts.ancestors(category_id, parents))
+
+        products = Product.objects.filter(is_active=True)
+        if product_ids is not None:
+            # Listings need every product under the warmed categories, not only the affected ones
+            below = EligibleProducts.descendants(categories, children)
+            products = products.filter(Q(pk__in=product_ids) | Q(category_id__in=below))
+        rows = list(products.values_list('pk', 'selling_price', 'category_id').iterator(chunk_size=cls.BATCH_SIZE))
+
+        prices, listings = {}, {category_id: {} for category_id in categories}
+        wanted = set(product_ids) if product_ids is not None else None
+        for pk, price, category_id in rows:
+            value = (price, *reversed(sale_price(pk, price, sales, eligible)))
+            if wanted is None or pk in wanted:
+                prices[f'pricing:price:{prefix}:{pk}'] = value
+            for ancestor in EligibleProducts.ancestors(category_id, parents):
+                if ancestor in listings:
+                    listings[ancestor][pk] = value
+
+        keys = list(prices)
+        for start in range(0, len(keys), cls.BATCH_SIZE):
+            cache.set_many({key: prices[key] for key in keys[start:start + cls.BATCH_SIZE]}, cls.TIMEOUT)
+        cache.set_many({f'pricing:listing:{prefix}:{pk}': value for pk, value in listings.items()}, cls.TIMEOUT)
+        return len(prices), len(listings)
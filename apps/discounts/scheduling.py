@@ -0,0 +1,127 @@
+"""
+Sale boundaries as scheduled events.
+
+A sale starting or ending changes the effective price of every product it
+covers at one instant. Rather than letting the first requests after that
+instant recompute them all, ``SaleScheduler`` enqueues a Celery task with an
+ETA shortly before each boundary; the task prices the affected products and
+category listings as they will be at the boundary and writes them under the
+keys readers switch to at that moment.
+
+Only boundaries within ``SALE_SCHEDULE_HORIZON_HOURS`` are enqueued (ETA
+tasks far in the future are redelivered by the Redis broker after its
+visibility timeout); an hourly task enqueues the next ones and re-enqueues
+any lost to a broker restart. Duplicate tasks are harmless: each boundary is
+warmed once.
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+from apps.dashboard.events import publish
+from apps.products.models import Product
+from .models import Sale
+from .pricing import EffectivePrices, EligibleProducts
+
+logger = logging.getLogger(__name__)
+
+
+class SaleScheduler:
+    METRICS_KEY = 'sale_scheduler:runs'
+    METRICS_KEPT = 50
+
+    @classmethod
+    def schedule(cls, sale, now=None):
+        """Enqueue the warm-ups of ``sale``'s boundaries within the horizon; returns how many."""
+        from .tasks import sale_boundary_task
+
+        now = now or timezone.now()
+        horizon = now + timedelta(hours=settings.SALE_SCHEDULE_HORIZON_HOURS)
+        lead = timedelta(seconds=settings.SALE_WARMUP_LEAD_SECONDS)
+        enqueued = 0
+        for boundary in (sale.valid_from, sale.valid_until):
+            if not sale.is_active or not now < boundary <= horizon:
+                continue
+            # Saves and the hourly sweep enqueue a boundary at most once an hour
+            if not cache.add(f'sale_boundary:queued:{sale.pk}:{boundary.timestamp()}', 1, 60 * 60):
+                continue
+            sale_boundary_task.apply_async((sale.pk, boundary.isoformat()), eta=max(boundary - lead, now))
+            enqueued += 1
+        return enqueued
+
+    @classmethod
+    def schedule_upcoming(cls):
+        now = timezone.now()
+        window = (now, now + timedelta(hours=settings.SALE_SCHEDULE_HORIZON_HOURS))
+        sales = Sale.objects.filter(is_active=True).filter(Q(valid_from__range=window) | Q(valid_until__range=window))
+        return sum(cls.schedule(sale, now) for sale in sales)
+
+    @classmethod
+    def warm(cls, sale_id, boundary):
+        """
+        Price what ``sale_id`` affects as it will be at ``boundary`` (an ISO
+        datetime), unless the sale no longer has that boundary or it was
+        already warmed. Returns the run's metrics, or ``None``.
+        """
+        boundary = datetime.fromisoformat(boundary)
+        sale = Sale.objects.filter(pk=sale_id).first()
+        if sale is None or boundary not in (sale.valid_from, sale.valid_until):
+            return None
+        if not cache.add(f'sale_boundary:warmed:{sale_id}:{boundary.timestamp()}', 1, 60 * 60 * 48):
+            return None
+
+        # Sales include both ends of their window, so an ending sale is gone just after it
+        at = boundary if boundary == sale.valid_from else boundary + timedelta(microseconds=1)
+        started = time.perf_counter()
+        product_ids = EligibleProducts.get_many(
+            EligibleProducts.keys(EligibleProducts.versions(), sale_ids=[sale_id])
+        )[(Sale, sale_id)]
+        if product_ids is None:
+            products, categories = EffectivePrices.warm(category_ids=cls._all_categories(), now=at)
+        else:
+            product_ids = list(product_ids)
+            categories = set(sale.applicable_categories.values_list('pk', flat=True))
+            categories.update(
+                Product.objects.filter(pk__in=product_ids, category__isnull=False)
+                .values_list('category_id', flat=True).distinct()
+            )
+            products, categories = EffectivePrices.warm(product_ids, categories, now=at)
+
+        metrics = {
+            'sale_id': sale_id,
+            'boundary': boundary.isoformat(),
+            'kind': 'start' if at == boundary else 'end',
+            'products': products,
+            'categories': categories,
+            'duration': round(time.perf_counter() - started, 3),
+            'lead': round((boundary - timezone.now()).total_seconds(), 3),
+        }
+        cls._record(metrics)
+        return metrics
+
+    @classmethod
+    def _all_categories(cls):
+        # Every listing, not just the roots: warm() expands ancestors, not descendants
+        _children, parents = EligibleProducts.category_tree()
+        return list(parents)
+
+    @classmethod
+    def _record(cls, metrics):
+        logger.info(
+            f"Warmed sale {metrics['sale_id']} {metrics['kind']} at {metrics['boundary']}: "
+            f"{metrics['products']} products, {metrics['categories']} listings in {metrics['duration']}s, "
+            f"{metrics['lead']}s ahead"
+        )
+        if metrics['lead'] < 0:
+            logger.warning(f"Sale {metrics['sale_id']} warm-up finished {-metrics['lead']}s after its boundary")
+        runs = cache.get(cls.METRICS_KEY) or []
+        cache.set(cls.METRICS_KEY, [metrics, *runs][:cls.METRICS_KEPT], None)
+        publish('sale.warmed', metrics)
+
+    @classmethod
+    def metrics(cls):
+        """The latest warm-up runs, newest first."""
+        return cache.get(cls.METRICS_KEY) or []
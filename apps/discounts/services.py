@@ -0,0 +1,334 @@
+"""
+Coupon validation against carts, and redemption at checkout.
+
+Coupon rules are compiled once into plain dicts and cached by code under a
+global version number, which any coupon change bumps. Validation then needs
+no coupon rows: the volatile parts (global usage, exclusive users, per-user
+uses) are checked with indexed lookups batched across every coupon and user
+of a ``validate_many`` call, never by loading a coupon's user list.
+
+Campaign codes are generated in bulk by ``CouponBatchGenerator``.
+"""
+import io
+import secrets
+import time
+from collections import Counter
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q, F
+from django.db.models.functions import Greatest, Upper
+from django.utils import timezone
+from .models import Coupon, CouponUsage, CouponUserCounter
+
+
+class CouponRules:
+    VERSION_KEY = 'coupon_rules_version'
+    TIMEOUT = 60 * 60
+    MISSING_TIMEOUT = 60
+
+    FIELDS = ['id', 'code', 'discount_type', 'discount_value', 'minimum_purchase', 'maximum_discount',
+              'usage_limit', 'usage_limit_per_user', 'valid_from', 'valid_until', 'is_active']
+
+    @classmethod
+    def version(cls):
+        return cache.get_or_set(cls.VERSION_KEY, 1, None)
+
+    @classmethod
+    def invalidate(cls):
+        try:
+            cache.incr(cls.VERSION_KEY)
+        except ValueError:
+            cache.set(cls.VERSION_KEY, 1, None)
+
+    @classmethod
+    def get_many(cls, codes):
+        """Compiled rules by normalized code; unknown codes map to ``None``."""
+        codes = {code.strip().upper() for code in codes if code}
+        version = cls.version()
+        keys = {f'coupon_rules:{version}:{code}': code for code in codes}
+        cached = cache.get_many(keys.keys())
+        rules = {keys[key]: value or None for key, value in cached.items()}
+
+        missing = codes - rules.keys()
+        if missing:
+            through = Coupon.applicable_users.through
+            compiled = {
+                coupon['code'].upper(): coupon
+                for coupon in (
+                    # Codes match case-insensitively (partial indexes on upper(code)). Codes are
+                    # unique as stored, so "Save10" and "SAVE10" may both exist: active rows come
+                    # last and win, and inactive ones are only reported as not active
+                    Coupon.objects.annotate(code_upper=Upper('code'))
+                    .filter(Q(code_upper__in=missing, is_active=True) | Q(code_upper__in=missing, is_active=False))
+                    .annotate(restricted=Exists(through.objects.filter(coupon_id=OuterRef('pk'))))
+                    .order_by('is_active', 'id')
+                    .values(*cls.FIELDS, 'restricted')
+                )
+            }
+            cache.set_many({f'coupon_rules:{version}:{code}': compiled[code]
+                            for code in missing if code in compiled}, cls.TIMEOUT)
+            # Remember unknown codes briefly so guessing doesn't hit the database
+            cache.set_many({f'coupon_rules:{version}:{code}': False
+                            for code in missing if code not in compiled}, cls.MISSING_TIMEOUT)
+            rules.update({code: compiled.get(code) for code in missing})
+        return rules
+
+
+class CouponValidator:
+
+    @classmethod
+    def validate(cls, code, user=None, subtotal=None):
+        """``(ok, message, rules)`` for one coupon code."""
+        return cls.validate_many([(code, user, subtotal)])[0]
+
+    @classmethod
+    def validate_many(cls, requests):
+        """
+        Validate ``[(code, user or user id or None, subtotal or None), ...]``
+        and return ``(ok, message, rules)`` per request, in order. Besides
+        compiling uncached rules, a batch costs at most three queries whatever
+        its size.
+        """
+        requests = [(code, getattr(user, 'pk', user), subtotal) for code, user, subtotal in requests]
+        rules = CouponRules.get_many(code for code, _user, _subtotal in requests)
+        found = [rule for rule in rules.values() if rule]
+        user_ids = {user_id for _code, user_id, _subtotal in requests if user_id}
+
+        limited = [rule['id'] for rule in found if rule['usage_limit']]
+        usage_counts = dict(Coupon.objects.filter(pk__in=limited).values_list('pk', 'usage_count')) if limited else {}
+
+        restricted = [rule['id'] for rule in found if rule['restricted']]
+        allowed = set()
+        if restricted and user_ids:
+            allowed = set(
+                Coupon.applicable_users.through.objects
+                .filter(coupon_id__in=restricted, user_id__in=user_ids)
+                .values_list('coupon_id', 'user_id')
+            )
+
+        per_user = [rule['id'] for rule in found if rule['usage_limit_per_user']]
+        uses = {}
+        if per_user and user_ids:
+            uses = {
+                (coupon_id, user_id): count
+                for coupon_id, user_id, count in CouponUserCounter.objects
+                .filter(coupon_id__in=per_user, user_id__in=user_ids)
+                .values_list('coupon_id', 'user_id', 'uses')
+            }
+
+        now = timezone.now()
+        results = []
+        for code, user_id, subtotal in requests:
+            rule = rules.get(code.strip().upper()) if code else None
+            results.append((*cls._check(rule, user_id, subtotal, now, usage_counts, allowed, uses), rule))
+        return results
+
+    @classmethod
+    def _check(cls, rule, user_id, subtotal, now, usage_counts, allowed, uses):
+        if rule is None:
+            return False, 'Invalid code'
+        if not rule['is_active']:
+            return False, 'Not active'
+        if now < rule['valid_from']:
+            return False, 'Not yet valid'
+        if now > rule['valid_until']:
+            return False, 'Expired'
+        if rule['usage_limit'] and usage_counts.get(rule['id'], 0) >= rule['usage_limit']:
+            return False, 'Usage limit reached'
+        if rule['restricted'] and (rule['id'], user_id) not in allowed:
+            return False, 'Not for your account'
+        if rule['usage_limit_per_user'] and uses.get((rule['id'], user_id), 0) >= rule['usage_limit_per_user']:
+            return False, 'Per-user limit reached'
+        if subtotal is not None and rule['minimum_purchase'] and subtotal < rule['minimum_purchase']:
+            return False, 'Minimum purchase not reached'
+        return True, 'Can use'
+
+
+class CouponRedemption:
+    """
+    Race-free coupon redemption. A use is claimed with conditional UPDATEs
+    that only succeed while the coupon (and the user's counter) is under its
+    limit; Postgres re-checks the condition after waiting for the row lock,
+    so concurrent checkouts can never overshoot. The claims and the
+    ``CouponUsage`` row commit or roll back together.
+    """
+
+    @classmethod
+    def redeem(cls, code, user, order, discount_amount):
+        """Claim one use for ``order``; returns ``(ok, message, usage)``."""
+        rule = CouponRules.get_many([code]).get(code.strip().upper())
+        if rule is None:
+            return False, 'Invalid code', None
+        now = timezone.now()
+        with transaction.atomic():
+            claimed = (
+                Coupon.objects.filter(pk=rule['id'], is_active=True, valid_from__lte=now, valid_until__gte=now)
+                .filter(Q(usage_limit__isnull=True) | Q(usage_count__lt=F('usage_limit')))
+                .update(usage_count=F('usage_count') + 1)
+            )
+            if not claimed:
+                ok, message, _rule = CouponValidator.validate(code, user)
+                return False, message if not ok else 'Usage limit reached', None
+            if rule['restricted'] and not Coupon.applicable_users.through.objects.filter(
+                coupon_id=rule['id'], user_id=user.pk
+            ).exists():
+                transaction.set_rollback(True)
+                return False, 'Not for your account', None
+            if not cls._claim_user_use(rule, user.pk):
+                transaction.set_rollback(True)
+                return False, 'Per-user limit reached', None
+            # bulk_create skips the post_save receiver: the counter was claimed above
+            usage, = CouponUsage.objects.bulk_create([
+                CouponUsage(coupon_id=rule['id'], user=user, order=order, discount_amount=discount_amount)
+            ])
+        return True, 'Redeemed', usage
+
+    @classmethod
+    def _claim_user_use(cls, rule, user_id):
+        table = CouponUserCounter._meta.db_table
+        limit = rule['usage_limit_per_user']
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (coupon_id, user_id, uses) VALUES (%s, %s, 1) '
+                f'ON CONFLICT (coupon_id, user_id) DO UPDATE SET uses = {table}.uses + 1 '
+                f'WHERE %s IS NULL OR {table}.uses < %s RETURNING uses',
+                [rule['id'], user_id, limit, limit],
+            )
+            return cursor.fetchone() is not None
+
+    @classmethod
+    def release(cls, orders):
+        """Give back the coupon uses of ``orders`` (a queryset or ids), e.g. after a failed checkout."""
+        with transaction.atomic():
+            usages = list(
+                CouponUsage.objects.filter(order__in=orders).select_for_update()
+                .values_list('pk', 'coupon_id')
+            )
+            if not usages:
+                return 0
+            released = Counter(coupon_id for _pk, coupon_id in usages)
+            for coupon_id, count in sorted(released.items()):
+                Coupon.objects.filter(pk=coupon_id).update(usage_count=Greatest(F('usage_count') - count, 0))
+            # post_delete gives back the per-user counters
+            CouponUsage.objects.filter(pk__in=[pk for pk, _coupon_id in usages]).delete()
+        return len(usages)
+
+
+CODE_ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+# Byte -> letter; 256 is a multiple of 32, so every letter is equally likely
+CODE_TRANSLATION = bytes(ord(CODE_ALPHABET[byte % len(CODE_ALPHABET)]) for byte in range(256))
+
+
+class CouponBatchGenerator:
+    """
+    Mass generation of random coupon codes sharing the same terms. Codes come
+    from ``secrets`` over a 32-letter alphabet without look-alikes (5 bits per
+    character, so 10 characters give 50 bits) and are de-duplicated within the
+    run with a set. Each chunk is ``COPY``-ed into a temporary table and moved
+    over with ``INSERT ... ON CONFLICT (code) DO NOTHING RETURNING id``, which
+    skips codes that already exist (redrawn in the next round) and yields the
+    ids for ``COPY``-ing the M2M rows. Signals are bypassed; the rules cache is
+    invalidated at the end.
+    """
+    ALPHABET = CODE_ALPHABET
+    CHUNK_SIZE = 20000
+    STAGING_TABLE = 'coupon_batch_codes'
+    FIELDS = ['description', 'discount_type', 'discount_value', 'minimum_purchase', 'maximum_discount',
+              'usage_limit', 'usage_limit_per_user', 'usage_count', 'valid_from', 'valid_until',
+              'is_active', 'created_at', 'updated_at']
+
+    @classmethod
+    def random_codes(cls, count, prefix='', length=10):
+        letters = secrets.token_bytes(count * length).translate(CODE_TRANSLATION).decode()
+        return [prefix + letters[index:index + length] for index in range(0, count * length, length)]
+
+    @classmethod
+    def generate(cls, count, discount_type, discount_value, valid_from, valid_until, prefix='', length=10,
+                 products=(), categories=(), users=(), on_chunk=None, **fields):
+        """
+        Create ``count`` coupons sharing the given terms (other ``Coupon``
+        fields go in ``fields``) and attach ``products``, ``categories`` and
+        ``users`` (ids or instances) to each. ``on_chunk(codes, created,
+        elapsed)`` is called after every committed chunk. Returns stats.
+        """
+        prefix = prefix.upper()
+        max_length = Coupon._meta.get_field('code').max_length
+        if len(prefix) + length > max_length:
+            raise ValueError(f'Codes longer than {max_length} characters')
+        # Keep the code space far larger than the batch so random draws rarely collide
+        if len(cls.ALPHABET) ** length < count * 1000:
+            raise ValueError(f'{length} random characters are too few for {count} unique codes')
+
+        now = timezone.now()
+        values = {
+            'description': '', 'minimum_purchase': None, 'maximum_discount': None, 'usage_limit': None,
+            'usage_limit_per_user': None, 'usage_count': 0, 'is_active': True,
+            **fields,
+            'discount_type': discount_type, 'discount_value': discount_value,
+            'valid_from': valid_from, 'valid_until': valid_until, 'created_at': now, 'updated_at': now,
+        }
+        related = []
+        for field, targets in (('applicable_products', products), ('applicable_categories', categories),
+                               ('applicable_users', users)):
+            model = Coupon._meta.get_field(field).related_model
+            targets = {getattr(obj, 'pk', obj) for obj in targets}
+            unknown = targets - set(model.objects.filter(pk__in=targets).values_list('pk', flat=True))
+            if unknown:
+                raise ValueError(f'Unknown {model._meta.verbose_name} ids: {sorted(unknown)}')
+            related.append((getattr(Coupon, field).through, f'{model._meta.model_name}_id', sorted(targets)))
+
+        seen = set()
+        stats = {'created': 0, 'duplicates': 0, 'existing': 0}
+        started = time.perf_counter()
+        while stats['created'] < count:
+            wanted = min(cls.CHUNK_SIZE, count - stats['created'])
+            codes = []
+            with transaction.atomic():
+                while len(codes) < wanted:
+                    drawn = cls.random_codes(wanted - len(codes), prefix, length)
+                    fresh = set(drawn) - seen
+                    stats['duplicates'] += len(drawn) - len(fresh)
+                    seen.update(fresh)
+                    inserted = cls._insert_chunk(fresh, values, related)
+                    stats['existing'] += len(fresh) - len(inserted)
+                    codes.extend(inserted)
+            stats['created'] += len(codes)
+            if on_chunk:
+                on_chunk(codes, stats['created'], time.perf_counter() - started)
+
+        transaction.on_commit(CouponRules.invalidate)
+        stats['elapsed'] = time.perf_counter() - started
+        stats['codes_per_sec'] = stats['created'] / stats['elapsed'] if stats['elapsed'] else 0
+        return stats
+
+    @classmethod
+    def _insert_chunk(cls, codes, values, related):
+        """Insert ``codes`` not taken yet and attach ``related``; returns the inserted codes."""
+        table = Coupon._meta.db_table
+        columns = ', '.join(cls.FIELDS)
+        # Typed placeholders: bare NULLs and strings would be read as text
+        placeholders = ', '.join(f'%s::{Coupon._meta.get_field(field).db_type(connection)}' for field in cls.FIELDS)
+        with connection.cursor() as cursor:
+            cursor.execute(f'CREATE TEMPORARY TABLE IF NOT EXISTS {cls.STAGING_TABLE} (code varchar(50)) ON COMMIT DELETE ROWS')
+            cls._copy(cursor, cls.STAGING_TABLE, ['code'], codes)
+            cursor.execute(
+                f'INSERT INTO {table} (code, {columns}) SELECT code, {placeholders} FROM {cls.STAGING_TABLE} '
+                f'ON CONFLICT (code) DO NOTHING RETURNING id, code',
+                [values[field] for field in cls.FIELDS],
+            )
+            inserted = cursor.fetchall()
+            cursor.execute(f'TRUNCATE {cls.STAGING_TABLE}')
+            for through, column, targets in related:
+                if targets:
+                    cls._copy(cursor, through._meta.db_table, ['coupon_id', column],
+                              (f'{pk}\t{target}' for pk, _code in inserted for target in targets))
+        return [code for _pk, code in inserted]
+
+    @classmethod
+    def _copy(cls, cursor, table, columns, lines):
+        buffer = io.StringIO()
+        for line in lines:
+            buffer.write(line)
+            buffer.write('\n')
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
@@ -0,0 +1,57 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from apps.orders.signals import order_status_changed
+from apps.products.models import Category, Product
+from .models import Coupon, CouponUsage, CouponUserCounter, Sale
+from .pricing import EligibleProducts
+from .scheduling import SaleScheduler
+from .services import CouponRules, CouponRedemption
+
+
+@receiver(post_save, sender=Coupon)
+@receiver(post_delete, sender=Coupon)
+@receiver(m2m_changed, sender=Coupon.applicable_users.through)
+@receiver(m2m_changed, sender=Coupon.applicable_products.through)
+@receiver(m2m_changed, sender=Coupon.applicable_categories.through)
+def coupon_changed(sender, **kwargs):
+    transaction.on_commit(CouponRules.invalidate)
+
+
+@receiver(post_save, sender=Sale)
+@receiver(post_delete, sender=Sale)
+@receiver(m2m_changed, sender=Sale.applicable_products.through)
+@receiver(m2m_changed, sender=Sale.applicable_categories.through)
+def sale_changed(sender, **kwargs):
+    transaction.on_commit(EligibleProducts.invalidate_sales)
+
+
+@receiver(post_save, sender=Sale)
+def sale_saved(sender, instance, **kwargs):
+    transaction.on_commit(lambda: SaleScheduler.schedule(instance))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def catalog_changed(sender, **kwargs):
+    # Category-based eligibility depends on product categories and the tree
+    transaction.on_commit(EligibleProducts.invalidate_catalog)
+
+
+@receiver(post_save, sender=CouponUsage)
+def coupon_used(sender, instance, created, **kwargs):
+    if created:
+        CouponUserCounter.bump(instance.coupon_id, instance.user_id, 1)
+
+
+@receiver(post_delete, sender=CouponUsage)
+def coupon_usage_deleted(sender, instance, **kwargs):
+    CouponUserCounter.bump(instance.coupon_id, instance.user_id, -1)
+
+
+@receiver(order_status_changed)
+def orders_cancelled(sender, order_ids, status, **kwargs):
+    if status == 'cancelled':
+        CouponRedemption.release(order_ids)
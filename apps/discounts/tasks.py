@@ -0,0 +1,15 @@
+from celery import shared_task
+
+
+@shared_task
+def sale_boundary_task(sale_id, boundary):
+    """Pre-warm the prices a sale changes at one of its boundaries (ISO datetime)."""
+    from .scheduling import SaleScheduler
+    return SaleScheduler.warm(sale_id, boundary)
+
+
+@shared_task
+def schedule_sale_boundaries_task():
+    """Enqueue the warm-ups of sale boundaries coming up within the horizon."""
+    from .scheduling import SaleScheduler
+    return SaleScheduler.schedule_upcoming()
@@ -1,3 +1,246 @@
+import random
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
 from django.test import TestCase
+from django.utils import timezone
+from apps.products.models import Category, Product
+from .models import Coupon, Sale
+from .pricing import CENT, ZERO, EligibleProducts, PricingEngine
+from .scheduling import SaleScheduler
+from .services import CouponRules, CouponValidator
 
-# Create your tests here.
+
+class SaleWarmupTests(TestCase):
+    def setUp(self):
+        EligibleProducts.invalidate_catalog()
+        root = Category.objects.create(slug='warm-root')
+        child = Category.objects.create(slug='warm-child', parent=root)
+        self.leaf = Category.objects.create(slug='warm-leaf', parent=child)
+        Product.objects.create(slug='warm-card', sku='WARM-CARD', category=self.leaf,
+                               cost_price=Decimal('1.00'), selling_price=Decimal('4.00'))
+
+    def tearDown(self):
+        # Nothing cached from the rolled-back test rows stays current
+        EligibleProducts.invalidate_catalog()
+        EligibleProducts.invalidate_sales()
+
+    def test_catalog_wide_sale_warms_every_listing(self):
+        now = timezone.now()
+        sale = Sale.objects.create(name='Everything', discount_percentage=Decimal('10.00'),
+                                   valid_from=now + timedelta(minutes=5), valid_until=now + timedelta(days=1))
+        metrics = SaleScheduler.warm(sale.pk, sale.valid_from.isoformat())
+        self.assertEqual(metrics['categories'], Category.objects.count())
+
+
+# Reference: the straightforward per-line evaluation, with M2M queries for every line
+
+def applies(obj, product):
+    products = obj.applicable_products.all()
+    categories = obj.applicable_categories.all()
+    if not products.exists() and not categories.exists():
+        return True
+    if products.filter(pk=product.pk).exists():
+        return True
+    category = product.category
+    while category is not None:
+        if categories.filter(pk=category.pk).exists():
+            return True
+        category = category.parent
+    return False
+
+
+def reference(lines, coupon, shipping_cost):
+    now = timezone.now()
+    sales = Sale.objects.filter(is_active=True, valid_from__lte=now, valid_until__gte=now).order_by('-priority', '-created_at')
+    result = []
+    for product, quantity in lines:
+        sale = next((sale for sale in sales if applies(sale, product)), None)
+        unit = product.selling_price
+        if sale:
+            unit = (unit * (100 - sale.discount_percentage) / 100).quantize(CENT, ROUND_HALF_UP)
+        result.append((product.pk, sale.pk if sale else None, unit, unit * quantity, applies(coupon, product)))
+    subtotal = sum(total for _pk, _sale, _unit, total, _eligible in result)
+    base = sum(total for _pk, _sale, _unit, total, eligible in result if eligible)
+    ok, _message = coupon.is_valid()
+    if not ok or (coupon.minimum_purchase and subtotal < coupon.minimum_purchase) or not base:
+        return result, ZERO, ZERO
+    if coupon.discount_type == 'free_shipping':
+        return result, ZERO, shipping_cost
+    if coupon.discount_type == 'percentage':
+        amount = (base * coupon.discount_value / 100).quantize(CENT, ROUND_HALF_UP)
+        if coupon.maximum_discount:
+            amount = min(amount, coupon.maximum_discount)
+    else:
+        amount = min(coupon.discount_value, base)
+    return result, amount, ZERO
+
+
+class CouponRulesTests(TestCase):
+    def setUp(self):
+        CouponRules.invalidate()
+
+    def tearDown(self):
+        CouponRules.invalidate()
+
+    def coupon(self, code, is_active=True):
+        now = timezone.now()
+        return Coupon.objects.create(code=code, discount_type='fixed', discount_value=Decimal('5.00'),
+                                     valid_from=now - timedelta(days=1), valid_until=now + timedelta(days=1),
+                                     is_active=is_active)
+
+    def test_codes_match_case_insensitively(self):
+        active, inactive = self.coupon('Save10'), self.coupon('Old5', is_active=False)
+        rules = CouponRules.get_many(['save10', ' OLD5 ', 'nope'])
+        self.assertEqual(rules['SAVE10']['id'], active.pk)
+        self.assertEqual(rules['OLD5']['id'], inactive.pk)
+        self.assertIsNone(rules['NOPE'])
+        self.assertEqual(CouponValidator.validate('old5')[:2], (False, 'Not active'))
+
+    def test_active_row_wins_a_case_collision(self):
+        self.coupon('spring', is_active=False)
+        active = self.coupon('Spring')
+        self.coupon('SPRING', is_active=False)
+        self.assertEqual(CouponRules.get_many(['SPRING'])['SPRING']['id'], active.pk)
+        self.assertEqual(CouponValidator.validate('spring')[:2], (True, 'Can use'))
+
+
+class PricingTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        # Three-level tree: 4 roots, 3 children each, 2 grandchildren each
+        categories = []
+        for root in range(4):
+            top = Category.objects.create(slug=f'price-{root}')
+            categories.append(top)
+            for child in range(3):
+                middle = Category.objects.create(slug=f'price-{root}-{child}', parent=top)
+                categories.append(middle)
+                for leaf in range(2):
+                    categories.append(Category.objects.create(slug=f'price-{root}-{child}-{leaf}', parent=middle))
+        Product.objects.bulk_create([
+            Product(slug=f'price-{i}', sku=f'PRICE-{i}', category=categories[i % len(categories)],
+                    cost_price=Decimal('1.00'), selling_price=Decimal(i % 997 + 1) / 7 + Decimal('0.99'))
+            for i in range(600)
+        ])
+        cls.products = list(Product.objects.select_related('category').order_by('pk'))
+
+        window = {'valid_from': now - timedelta(days=1), 'valid_until': now + timedelta(days=1)}
+        cls.coupons = {
+            'root category 15%': cls.coupon('ROOT', 'percentage', '15.00', categories=[categories[0]], **window),
+            'products fixed 25': cls.coupon('FIXED', 'fixed', '25.00', products=cls.products[:300:3], **window),
+            'all 30% capped': cls.coupon('CAPPED', 'percentage', '30.00', maximum_discount=Decimal('40.00'), **window),
+            'free shipping leaf': cls.coupon('SHIP', 'free_shipping', '0.00', categories=[categories[2]], **window),
+            'minimum 100000': cls.coupon('MIN', 'fixed', '5.00', minimum_purchase=Decimal('100000.00'), **window),
+            'expired': cls.coupon('OLD', 'percentage', '50.00', valid_from=now - timedelta(days=3),
+                                  valid_until=now - timedelta(days=2)),
+        }
+        sale = Sale.objects.create(name='Middle', discount_percentage=Decimal('20.00'), priority=2, **window)
+        sale.applicable_categories.add(categories[1], categories[12])
+        sale = Sale.objects.create(name='Picked', discount_percentage=Decimal('12.50'), priority=1, **window)
+        sale.applicable_products.set(cls.products[::11])
+        Sale.objects.create(name='Everything', discount_percentage=Decimal('5.00'), priority=0, **window)
+        Sale.objects.create(name='Over', discount_percentage=Decimal('90.00'), priority=9,
+                            valid_from=now - timedelta(days=3), valid_until=now - timedelta(days=2))
+
+    @classmethod
+    def coupon(cls, code, discount_type, value, products=(), categories=(), **fields):
+        coupon = Coupon.objects.create(code=f'PRICE-{code}', discount_type=discount_type,
+                                       discount_value=Decimal(value), **fields)
+        coupon.applicable_products.set(products)
+        coupon.applicable_categories.set(categories)
+        return coupon
+
+    def setUp(self):
+        self.invalidate()
+
+    def tearDown(self):
+        # Nothing compiled from the rolled-back test rows stays current
+        self.invalidate()
+
+    def invalidate(self):
+        CouponRules.invalidate()
+        EligibleProducts.invalidate_sales()
+        EligibleProducts.invalidate_catalog()
+
+
+class PricingEngineTests(PricingTestCase):
+    def assertMatchesReference(self, lines, coupon, shipping_cost=Decimal('7.50')):
+        priced = PricingEngine.price_cart(lines, coupon.code, shipping_cost=shipping_cost)
+        expected, discount, shipping_discount = reference(lines, coupon, shipping_cost)
+        got = [(line['product_id'], line['sale_id'], line['sale_unit_price'], line['line_total'], line['eligible'])
+               for line in priced['lines']]
+        self.assertEqual([row[:4] for row in got], [row[:4] for row in expected], 'sale prices differ')
+        if priced['coupon']['ok']:
+            self.assertEqual([row[4] for row in got], [row[4] for row in expected], 'coupon eligibility differs')
+            legacy = coupon.calculate_discount(
+                priced['subtotal'], [(line['product_id'], line['line_total']) for line in priced['lines']], shipping_cost
+            )
+            self.assertEqual(legacy.quantize(CENT, ROUND_HALF_UP), discount + shipping_discount)
+        self.assertEqual(priced['discount'], discount)
+        self.assertEqual(priced['shipping_discount'], shipping_discount)
+        self.assertEqual(sum(line['discount'] for line in priced['lines']), priced['discount'], 'line shares')
+        for line in priced['lines']:
+            self.assertLessEqual(line['discount'], line['line_total'])
+            self.assertTrue(line['eligible'] or not line['discount'])
+        self.assertEqual(priced['total'],
+                         priced['subtotal'] - priced['discount'] + shipping_cost - priced['shipping_discount'])
+
+    def test_random_carts_match_the_reference(self):
+        rng = random.Random(42)
+        for label, coupon in self.coupons.items():
+            for index in range(5):
+                lines = [(product, rng.randint(1, 5)) for product in rng.sample(self.products, rng.randint(1, 60))]
+                with self.subTest(coupon=label, cart=index):
+                    self.assertMatchesReference(lines, coupon)
+
+    def test_empty_cart(self):
+        self.assertMatchesReference([], self.coupons['all 30% capped'])
+
+    def test_repeated_lines_are_merged(self):
+        product = self.products[0]
+        priced = PricingEngine.price_cart([(product, 1), (product.pk, 2), (0, 3)], self.coupons['all 30% capped'].code)
+        self.assertEqual([(line['product_id'], line['quantity']) for line in priced['lines']], [(product.pk, 3)])
+
+    def test_unknown_coupon_code(self):
+        priced = PricingEngine.price_cart([(self.products[1], 1)], 'NO-SUCH-CODE')
+        self.assertFalse(priced['coupon']['ok'])
+        self.assertEqual(priced['coupon']['message'], 'Invalid code')
+        self.assertEqual(priced['discount'], ZERO)
+
+
+class PricingInvalidationTests(PricingTestCase):
+    """Edits to products, categories and coupons show up in the next price."""
+
+    def setUp(self):
+        super().setUp()
+        self.coupon = self.coupons['root category 15%']
+        self.outside = next(product for product in self.products if not applies(self.coupon, product))
+
+    def eligible(self):
+        return PricingEngine.price_cart([(self.outside, 1)], self.coupon.code)['lines'][0]['eligible']
+
+    def change(self, change, expected):
+        self.eligible()
+        # Invalidation runs on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        self.assertEqual(self.eligible(), expected)
+
+    def move(self, slug):
+        self.outside.category = Category.objects.get(slug=slug)
+        self.outside.save()
+
+    def test_product_moved_into_and_out_of_a_descendant(self):
+        self.change(lambda: self.move('price-0-1-0'), True)
+        self.change(lambda: self.move('price-1'), False)
+
+    def test_product_added_to_and_removed_from_the_coupon(self):
+        self.change(lambda: self.coupon.applicable_products.add(self.outside), True)
+        self.change(lambda: self.coupon.applicable_products.remove(self.outside), False)
+
+    def test_category_reparented_under_the_root(self):
+        self.change(lambda: self.move('price-2-0'), False)
+        category = Category.objects.get(slug='price-2-0')
+        category.parent = Category.objects.get(slug='price-0')
+        self.change(category.save, True)
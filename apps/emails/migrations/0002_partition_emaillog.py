@@ -0,0 +1,15 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:16
+
+from django.db import migrations
+from apps.orders.partitioning import partition_table_sql, unpartition_table_sql
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunSQL(partition_table_sql('emails_emaillog'), unpartition_table_sql('emails_emaillog')),
+    ]
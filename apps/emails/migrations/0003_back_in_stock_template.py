@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0002_partition_emaillog'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='emailtemplate',
+            name='template_type',
+            field=models.CharField(choices=[('welcome', 'Welcome Email'), ('order_confirmation', 'Order Confirmation'), ('order_shipped', 'Order Shipped'), ('order_delivered', 'Order Delivered'), ('password_reset', 'Password Reset'), ('newsletter', 'Newsletter'), ('promotional', 'Promotional'), ('low_stock_alert', 'Low Stock Alert'), ('invoice', 'Invoice'), ('back_in_stock', 'Back in Stock')], max_length=50, unique=True, verbose_name='template type'),
+        ),
+    ]
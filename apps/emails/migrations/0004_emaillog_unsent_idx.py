@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:30
+
+from django.db import migrations, models
+from apps.orders.partitioning import create_index_concurrently
+
+
+def create_index(apps, schema_editor):
+    create_index_concurrently(
+        'emails_emaillog', 'emaillog_unsent_idx',
+        "(status, created_at) WHERE status IN ('pending', 'failed')",
+        using=schema_editor.connection,
+    )
+
+
+def drop_index(apps, schema_editor):
+    schema_editor.execute('DROP INDEX IF EXISTS emaillog_unsent_idx')
+
+
+class Migration(migrations.Migration):
+    # emails_emaillog is partitioned (see orders.partitioning), so the index is
+    # built per partition with CONCURRENTLY, outside a transaction
+    atomic = False
+
+    dependencies = [
+        ('emails', '0003_back_in_stock_template'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='emaillog',
+                    index=models.Index(condition=models.Q(('status__in', ['pending', 'failed'])), fields=['status', 'created_at'], name='emaillog_unsent_idx'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(create_index, drop_index),
+            ],
+        ),
+    ]
@@ -13,7 +13,7 @@ class EmailTemplate(models.Model):
         ('order_shipped',_('Order Shipped')),('order_delivered',_('Order Delivered')),
         ('password_reset',_('Password Reset')),('newsletter',_('Newsletter')),
         ('promotional',_('Promotional')),('low_stock_alert',_('Low Stock Alert')),
-        ('invoice',_('Invoice'))
+        ('invoice',_('Invoice')),('back_in_stock',_('Back in Stock'))
     ]
     name=models.CharField(_('name'),max_length=100)
     template_type=models.CharField(_('template type'),max_length=50,choices=TEMPLATE_TYPE_CHOICES,unique=True)
@@ -45,6 +45,8 @@ class EmailLog(models.Model):
 
     class Meta:
         verbose_name=_('email log'); verbose_name_plural=_('email logs'); ordering=['-created_at']
+        # Sent logs are the bulk of the table; only unsent ones are looked up by status
+        indexes=[models.Index(fields=['status','created_at'],condition=models.Q(status__in=['pending','failed']),name='emaillog_unsent_idx')]
 
     def __str__(self): return f"{self.recipient} – {self.subject}"
 
@@ -0,0 +1,32 @@
+from celery import shared_task
+import logging
+
+logger=logging.getLogger(__name__)
+
+
+@shared_task
+def send_order_status_emails_task(order_ids, template_type):
+    """Send one status notification per order for a batch of orders."""
+    from apps.orders.models import Order
+    from .models import EmailService
+
+    orders=Order.objects.filter(pk__in=order_ids).only('order_number','email','status','tracking_number','total')
+    sent=failed=0
+    for order in orders.iterator():
+        context={
+            'order_number':order.order_number,
+            'status':order.status,
+            'tracking_number':order.tracking_number,
+            'total':str(order.total),
+        }
+        ok,_=EmailService.send_email(
+            to_email=order.email,
+            subject=f"Order #{order.order_number} – {order.get_status_display()}",
+            html_content=f"<p>Your order #{order.order_number} is now {order.get_status_display()}.</p>",
+            template_type=template_type,
+            context=context,
+        )
+        if ok: sent+=1
+        else: failed+=1
+    logger.info(f"{template_type} emails: {sent} sent, {failed} failed")
+    return {'sent':sent,'failed':failed}
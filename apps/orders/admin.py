@@ -1,4 +1,5 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.utils.translation import gettext_lazy as _
 from .models import Cart, CartItem, Order, OrderItem, OrderStatusHistory, Wishlist
 
 class CartItemInline(admin.TabularInline):
@@ -24,6 +25,34 @@ class OrderAdmin(admin.ModelAdmin):
     search_fields = ['order_number','email']
     readonly_fields = ['order_number','subtotal','total','total_profit','created_at','updated_at','paid_at','shipped_at','delivered_at']
     inlines = [OrderItemInline]
+    actions = ['mark_processing','mark_shipped','mark_delivered','mark_cancelled','refund_payments']
+
+    def _transition(self, request, queryset, status):
+        from .services import OrderStateMachine
+        result = OrderStateMachine.transition(queryset, status, user=request.user)
+        self.message_user(request, _('%(count)d orders moved to %(status)s.') % {'count':len(result['updated']),'status':status})
+        if result['skipped']:
+            self.message_user(request, _('Skipped (invalid transition): %(orders)s') % {'orders':', '.join(result['skipped'][:50])}, messages.WARNING)
+
+    @admin.action(description=_('Mark selected orders as processing'))
+    def mark_processing(self, request, queryset): self._transition(request, queryset, 'processing')
+
+    @admin.action(description=_('Mark selected orders as shipped'))
+    def mark_shipped(self, request, queryset): self._transition(request, queryset, 'shipped')
+
+    @admin.action(description=_('Mark selected orders as delivered'))
+    def mark_delivered(self, request, queryset): self._transition(request, queryset, 'delivered')
+
+    @admin.action(description=_('Mark selected orders as cancelled'))
+    def mark_cancelled(self, request, queryset): self._transition(request, queryset, 'cancelled')
+
+    @admin.action(description=_('Refund the payments of selected orders in full'))
+    def refund_payments(self, request, queryset):
+        from apps.payments.services import BulkRefunder
+        from apps.payments.tasks import bulk_refund_task
+        payment_ids = list(BulkRefunder.refundable(queryset).values_list('pk', flat=True))
+        bulk_refund_task.delay(payment_ids, 'customer_request', request.user.pk, 'Bulk refund from the admin')
+        self.message_user(request, _('Refunding %(count)d payments; progress is shown on the dashboard.') % {'count':len(payment_ids)})
 
 @admin.register(OrderStatusHistory)
 class OrderStatusHistoryAdmin(admin.ModelAdmin):
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from apps.orders.partitioning import PARTITIONED_TABLES, ensure_partitions, archive_partitions, list_partitions
+
+
+class Command(BaseCommand):
+    help = 'Create upcoming monthly partitions and archive the ones past their retention'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=None, help='Months to create ahead of the current one')
+        parser.add_argument('--no-archive', action='store_true', help='Only create partitions')
+
+    def handle(self, *args, **options):
+        for name in ensure_partitions(options['months_ahead']):
+            self.stdout.write(f'  Created {name}')
+        if not options['no_archive']:
+            for name in archive_partitions():
+                self.stdout.write(f'  Archived {name}')
+        for table in PARTITIONED_TABLES:
+            months = sorted(list_partitions(table).values())
+            span = f'{months[0]:%Y-%m} .. {months[-1]:%Y-%m}' if months else 'none'
+            self.stdout.write(f'{table}: {len(months)} monthly partitions ({span})')
+        self.stdout.write(self.style.SUCCESS('Partition maintenance done.'))
@@ -0,0 +1,75 @@
+"""
+Move orders listed in a CSV file to a new status in bulk.
+
+The CSV needs an ``order_number`` column and may carry a ``tracking_number``
+column, e.g. the export of a packing run:
+
+    order_number,tracking_number
+    PKM-10001,1Z999AA10123456784
+"""
+import csv
+from django.core.management.base import BaseCommand, CommandError
+from apps.accounts.models import User
+from apps.orders.models import Order
+from apps.orders.services import OrderStateMachine
+
+
+class Command(BaseCommand):
+    help = 'Transition the orders listed in a CSV file (order_number[,tracking_number]) to a new status'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', help='Path to the CSV file')
+        parser.add_argument('--status', default='shipped', choices=[s for s, _ in Order.STATUS_CHOICES])
+        parser.add_argument('--notes', default='', help='Notes stored on every history row')
+        parser.add_argument('--user', help='Email of the staff user recorded on the history rows')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--no-email', action='store_true', help='Do not send notification emails')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(email=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User not found: {options['user']}")
+
+        updated = skipped = missing = 0
+        for batch in self._read_batches(options['csv_file'], options['batch_size']):
+            queryset = Order.objects.filter(order_number__in=batch.keys())
+            result = OrderStateMachine.transition(
+                queryset, options['status'], user=user, notes=options['notes'],
+                tracking_numbers=batch, notify=not options['no_email'],
+            )
+            found = set(queryset.values_list('order_number', flat=True))
+            for number in batch.keys() - found:
+                self.stdout.write(self.style.WARNING(f'  Unknown order: {number}'))
+            for number in result['skipped']:
+                self.stdout.write(self.style.WARNING(f'  Skipped (invalid transition): {number}'))
+            updated += len(result['updated'])
+            skipped += len(result['skipped'])
+            missing += len(batch.keys() - found)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{updated} orders moved to {options['status']}, {skipped} skipped, {missing} not found."
+        ))
+
+    def _read_batches(self, path, batch_size):
+        try:
+            handle = open(path, newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError(f'Cannot open {path}: {e}')
+        with handle:
+            reader = csv.DictReader(handle)
+            if 'order_number' not in (reader.fieldnames or []):
+                raise CommandError('CSV file must have an order_number column')
+            batch = {}
+            for row in reader:
+                number = (row.get('order_number') or '').strip()
+                if not number:
+                    continue
+                batch[number] = (row.get('tracking_number') or '').strip()
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = {}
+            if batch:
+                yield batch
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:15
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+from apps.orders.partitioning import partition_table_sql, unpartition_table_sql
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['created_at'], name='orders_created_brin'),
+        ),
+        migrations.RunSQL(partition_table_sql('orders_orderitem'), unpartition_table_sql('orders_orderitem')),
+        migrations.RunSQL(partition_table_sql('orders_orderstatushistory'), unpartition_table_sql('orders_orderstatushistory')),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0002_order_created_brin_and_partitions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='wishlist',
+            index=models.Index(fields=['product', 'id'], name='wishlist_product_id_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:30
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('orders', '0003_wishlist_product_id_idx'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='cart',
+            index=models.Index(condition=models.Q(('session_key__isnull', False)), fields=['session_key'], name='cart_session_key_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='cart',
+            index=models.Index(fields=['updated_at'], name='cart_updated_at_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['status', 'created_at'], name='orders_status_created_idx'),
+        ),
+    ]
@@ -2,6 +2,7 @@ from django.db import models
 from django.utils.translation import gettext_lazy as _
 from decimal import Decimal
 from django.core.validators import MinValueValidator
+from django.contrib.postgres.indexes import BrinIndex
 from apps.accounts.models import User, Address
 from apps.products.models import Product
 
@@ -12,6 +13,10 @@ class Cart(models.Model):
     updated_at=models.DateTimeField(_('updated at'),auto_now=True)
     class Meta:
         verbose_name=_('cart'); verbose_name_plural=_('carts')
+        indexes=[
+            models.Index(fields=['session_key'],condition=models.Q(session_key__isnull=False),name='cart_session_key_idx'),
+            models.Index(fields=['updated_at'],name='cart_updated_at_idx'),
+        ]
     def __str__(self): return f"Cart for {self.user.email}" if self.user else f"Anonymous {self.session_key}"
     @property
     def total_items(self): return sum(item.quantity for item in self.items.all())
@@ -57,6 +62,10 @@ class Order(models.Model):
 
     class Meta:
         verbose_name=_('order'); verbose_name_plural=_('orders'); ordering=['-created_at']
+        indexes=[
+            BrinIndex(fields=['created_at'],name='orders_created_brin'),
+            models.Index(fields=['status','created_at'],name='orders_status_created_idx'),
+        ]
 
     def __str__(self): return f"Order #{self.order_number}"
     @property
@@ -100,5 +109,6 @@ class Wishlist(models.Model):
 
     class Meta:
         verbose_name=_('wishlist'); verbose_name_plural=_('wishlists'); unique_together=('user','product'); ordering=['-created_at']
+        indexes=[models.Index(fields=['product','id'],name='wishlist_product_id_idx')]
 
     def __str__(self): return f"{self.user.email} – {self.product}"
@@ -0,0 +1,232 @@
+"""
+Monthly range partitioning on ``created_at`` for the append-only tables.
+
+Partitions are named ``<table>_pYYYYMM`` and cover one calendar month in UTC.
+Every table also has a ``<table>_default`` partition so inserts never fail if
+the maintenance task falls behind; ``ensure_partitions`` keeps it empty by
+creating future months ahead of time.
+
+``orders_order`` is deliberately not partitioned: Postgres cannot enforce the
+unique ``order_number`` or the foreign keys pointing at it (payments, items,
+history, coupon usages, alerts, shipping rates) on a partitioned table. It
+gets a BRIN index on ``created_at`` instead, so date range queries on orders
+(the dashboard's) read only the block ranges of those dates rather than
+pruning partitions; queries joining items should also bound the item's own
+``created_at`` to prune the item partitions.
+"""
+from datetime import date
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLES = ['orders_orderitem', 'orders_orderstatushistory', 'emails_emaillog']
+ARCHIVE_SCHEMA = 'archive'
+
+
+def partition_table_sql(table, months_ahead=3):
+    """
+    SQL converting a plain table into a partitioned one, keeping its rows,
+    secondary indexes and foreign keys. The primary key becomes
+    ``(id, created_at)`` as Postgres requires the partition key in it.
+    """
+    return f"""
+DO $$
+DECLARE
+    rec record;
+    index_defs text[] := ARRAY[]::text[];
+    fk_defs text[] := ARRAY[]::text[];
+    def text;
+    month date;
+    last_month date;
+BEGIN
+    FOR rec IN SELECT pg_get_indexdef(indexrelid) AS indexdef FROM pg_index
+               WHERE indrelid = '{table}'::regclass AND NOT indisprimary LOOP
+        index_defs := index_defs || rec.indexdef;
+    END LOOP;
+    FOR rec IN SELECT conname, pg_get_constraintdef(oid) AS condef FROM pg_constraint
+               WHERE conrelid = '{table}'::regclass AND contype = 'f' LOOP
+        fk_defs := fk_defs || format('ALTER TABLE {table} ADD CONSTRAINT %I %s', rec.conname, rec.condef);
+    END LOOP;
+
+    ALTER TABLE {table} RENAME TO {table}_legacy;
+    CREATE TABLE {table} (LIKE {table}_legacy INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS)
+        PARTITION BY RANGE (created_at);
+
+    SELECT date_trunc('month', coalesce(min(created_at), now()))::date INTO month FROM {table}_legacy;
+    last_month := (date_trunc('month', now()) + interval '{months_ahead} months')::date;
+    WHILE month <= last_month LOOP
+        EXECUTE format('CREATE TABLE %I PARTITION OF {table} FOR VALUES FROM (%L) TO (%L)',
+                       '{table}_p' || to_char(month, 'YYYYMM'), month, (month + interval '1 month')::date);
+        month := (month + interval '1 month')::date;
+    END LOOP;
+    CREATE TABLE {table}_default PARTITION OF {table} DEFAULT;
+
+    INSERT INTO {table} SELECT * FROM {table}_legacy;
+    PERFORM setval(pg_get_serial_sequence('{table}', 'id'), coalesce((SELECT max(id) FROM {table}), 0) + 1, false);
+    DROP TABLE {table}_legacy;
+    ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, created_at);
+
+    FOREACH def IN ARRAY index_defs LOOP EXECUTE def; END LOOP;
+    FOREACH def IN ARRAY fk_defs LOOP EXECUTE def; END LOOP;
+END $$;
+"""
+
+
+def unpartition_table_sql(table):
+    """Reverse of ``partition_table_sql``: back to a plain table keyed on ``id``."""
+    return f"""
+DO $$
+DECLARE
+    rec record;
+    index_defs text[] := ARRAY[]::text[];
+    fk_defs text[] := ARRAY[]::text[];
+    def text;
+BEGIN
+    FOR rec IN SELECT pg_get_indexdef(indexrelid) AS indexdef FROM pg_index
+               WHERE indrelid = '{table}'::regclass AND NOT indisprimary LOOP
+        index_defs := index_defs || rec.indexdef;
+    END LOOP;
+    FOR rec IN SELECT conname, pg_get_constraintdef(oid) AS condef FROM pg_constraint
+               WHERE conrelid = '{table}'::regclass AND contype = 'f' LOOP
+        fk_defs := fk_defs || format('ALTER TABLE {table} ADD CONSTRAINT %I %s', rec.conname, rec.condef);
+    END LOOP;
+
+    ALTER TABLE {table} RENAME TO {table}_partitioned;
+    CREATE TABLE {table} (LIKE {table}_partitioned INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS);
+    INSERT INTO {table} SELECT * FROM {table}_partitioned;
+    PERFORM setval(pg_get_serial_sequence('{table}', 'id'), coalesce((SELECT max(id) FROM {table}), 0) + 1, false);
+    DROP TABLE {table}_partitioned CASCADE;
+    ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id);
+
+    FOREACH def IN ARRAY index_defs LOOP EXECUTE def; END LOOP;
+    FOREACH def IN ARRAY fk_defs LOOP EXECUTE def; END LOOP;
+END $$;
+"""
+
+
+def create_index_concurrently(table, name, definition, using=connection):
+    """
+    Build an index on a partitioned table without blocking writes, which a
+    plain CREATE INDEX CONCURRENTLY cannot do: create it invalid on the parent
+    only, build one index per partition concurrently and attach each to it.
+    The parent index becomes valid once every partition is attached, and
+    partitions created later get it automatically. Must run outside a
+    transaction; safe to re-run after an interruption.
+    """
+    with using.cursor() as cursor:
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON ONLY "{table}" {definition}')
+        cursor.execute(
+            """
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+            """,
+            [table],
+        )
+        for (partition,) in cursor.fetchall():
+            child = f'{partition}_{name}'[:63]
+            cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{child}" ON "{partition}" {definition}')
+            cursor.execute(f'ALTER INDEX "{name}" ATTACH PARTITION "{child}"')
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f'{table}_p{month:%Y%m}'
+
+
+def list_partitions(table):
+    """Monthly partitions currently attached to ``table`` as ``{name: month}``."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+            """,
+            [table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = {}
+    prefix = f'{table}_p'
+    for name in names:
+        suffix = name[len(prefix):]
+        if name.startswith(prefix) and len(suffix) == 6 and suffix.isdigit():
+            partitions[name] = date(int(suffix[:4]), int(suffix[4:]), 1)
+    return partitions
+
+
+def ensure_partitions(months_ahead=None):
+    """Create the partitions for the current month and the next ``months_ahead``."""
+    months_ahead = settings.PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    current = timezone.now().date().replace(day=1)
+    created = []
+    for table in PARTITIONED_TABLES:
+        existing = list_partitions(table)
+        for offset in range(months_ahead + 1):
+            month = add_months(current, offset)
+            name = partition_name(table, month)
+            if name in existing:
+                continue
+            create_partition(table, name, month)
+            created.append(name)
+            logger.info(f"Created partition {name}")
+    return created
+
+
+def create_partition(table, name, month):
+    """
+    Create the partition of ``month``. Rows of that month already in the
+    default partition (the task fell behind) would make a plain CREATE fail,
+    so the default is detached while they move over, then attached back.
+    """
+    bounds = [month.isoformat(), add_months(month, 1).isoformat()]
+    default = f'{table}_default'
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'SELECT EXISTS (SELECT 1 FROM "{default}" WHERE created_at >= %s AND created_at < %s)', bounds)
+        stray = cursor.fetchone()[0]
+        if stray:
+            cursor.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{default}"')
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table}" FOR VALUES FROM (%s) TO (%s)', bounds)
+        if stray:
+            cursor.execute(
+                f'WITH moved AS (DELETE FROM "{default}" WHERE created_at >= %s AND created_at < %s RETURNING *) '
+                f'INSERT INTO "{table}" SELECT * FROM moved',
+                bounds,
+            )
+            moved = cursor.rowcount
+            cursor.execute(f'ALTER TABLE "{table}" ATTACH PARTITION "{default}" DEFAULT')
+            logger.warning(f"Moved {moved} rows of {name} out of {default}")
+
+
+def archive_partitions(retention=None):
+    """
+    Detach partitions older than each table's retention (in months) and move
+    them to the ``archive`` schema, where they can be dumped and dropped.
+    Tables without a configured retention keep every partition.
+    """
+    retention = settings.PARTITION_RETENTION_MONTHS if retention is None else retention
+    current = timezone.now().date().replace(day=1)
+    archived = []
+    for table, months in retention.items():
+        if not months or table not in PARTITIONED_TABLES:
+            continue
+        cutoff = add_months(current, -months)
+        for name, month in sorted(list_partitions(table).items(), key=lambda item: item[1]):
+            if month >= cutoff:
+                continue
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f'CREATE SCHEMA IF NOT EXISTS "{ARCHIVE_SCHEMA}"')
+                cursor.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"')
+                cursor.execute(f'ALTER TABLE "{name}" SET SCHEMA "{ARCHIVE_SCHEMA}"')
+            archived.append(name)
+            logger.info(f"Archived partition {name} to schema {ARCHIVE_SCHEMA}")
+    return archived
@@ -0,0 +1,222 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, When, Value, F, CharField, DateTimeField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from .models import Order, OrderStatusHistory, Wishlist
+from .signals import order_status_changed
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class OrderStateMachine:
+    """
+    Validated order status transitions applied to whole querysets.
+    Each call issues a single UPDATE for the target state, bulk-inserts the
+    history rows and enqueues the notification emails in batches.
+    """
+
+    TRANSITIONS = {
+        'pending': ('processing', 'cancelled'),
+        'processing': ('shipped', 'cancelled', 'refunded'),
+        'shipped': ('delivered', 'refunded'),
+        'delivered': ('refunded',),
+        'cancelled': (),
+        'refunded': (),
+    }
+
+    # Timestamp stamped the first time an order reaches the status
+    TIMESTAMP_FIELDS = {
+        'processing': 'paid_at',
+        'shipped': 'shipped_at',
+        'delivered': 'delivered_at',
+    }
+
+    EMAIL_TEMPLATES = {
+        'shipped': 'order_shipped',
+        'delivered': 'order_delivered',
+    }
+
+    HISTORY_BATCH_SIZE = 1000
+    EMAIL_BATCH_SIZE = 200
+
+    @classmethod
+    def can_transition(cls, from_status, to_status):
+        return to_status in cls.TRANSITIONS.get(from_status, ())
+
+    @classmethod
+    def allowed_sources(cls, to_status):
+        """Statuses an order may be in to move to ``to_status``."""
+        return [source for source, targets in cls.TRANSITIONS.items() if to_status in targets]
+
+    @classmethod
+    def transition(cls, queryset, to_status, user=None, notes='', tracking_numbers=None, notify=True, timestamps=None):
+        """
+        Move every order in ``queryset`` that may legally reach ``to_status``.
+
+        ``tracking_numbers`` maps order numbers to tracking numbers and is
+        written in the same UPDATE, as is ``timestamps``, mapping order ids to
+        the time to stamp (e.g. a carrier's delivery scan) instead of now.
+        Orders in a status that cannot reach ``to_status`` are left untouched
+        and reported as skipped.
+        Returns a dict with the updated order ids and the skipped order numbers.
+        """
+        if to_status not in dict(Order.STATUS_CHOICES):
+            raise ValueError(_('Unknown order status: %(status)s') % {'status': to_status})
+
+        sources = cls.allowed_sources(to_status)
+        now = timezone.now()
+        queryset = queryset.order_by()
+
+        with transaction.atomic():
+            # Lock in pk order so concurrent bulk runs cannot deadlock
+            order_ids = list(
+                queryset.filter(status__in=sources)
+                .select_for_update()
+                .order_by('pk')
+                .values_list('pk', flat=True)
+            )
+            skipped = list(queryset.exclude(status__in=sources).values_list('order_number', flat=True))
+            if not order_ids:
+                return {'updated': [], 'skipped': skipped}
+
+            updates = {'status': to_status, 'updated_at': now}
+            timestamp_field = cls.TIMESTAMP_FIELDS.get(to_status)
+            if timestamp_field:
+                locked = set(order_ids)
+                stamp_cases = [When(pk=order_id, then=Value(stamp))
+                               for order_id, stamp in (timestamps or {}).items() if stamp and order_id in locked]
+                stamp = Case(*stamp_cases, default=Value(now), output_field=DateTimeField()) if stamp_cases else Value(now)
+                updates[timestamp_field] = Coalesce(F(timestamp_field), stamp)
+            tracking_cases = [When(order_number=number, then=Value(tracking))
+                              for number, tracking in (tracking_numbers or {}).items() if tracking]
+            if tracking_cases:
+                updates['tracking_number'] = Case(*tracking_cases, default=F('tracking_number'), output_field=CharField())
+            Order.objects.filter(pk__in=order_ids).update(**updates)
+
+            OrderStatusHistory.objects.bulk_create(
+                [OrderStatusHistory(order_id=order_id, status=to_status, notes=notes, created_by=user)
+                 for order_id in order_ids],
+                batch_size=cls.HISTORY_BATCH_SIZE,
+            )
+
+            transaction.on_commit(
+                lambda: order_status_changed.send(sender=Order, order_ids=order_ids, status=to_status)
+            )
+
+            template_type = cls.EMAIL_TEMPLATES.get(to_status)
+            if notify and template_type:
+                transaction.on_commit(lambda: cls._enqueue_emails(order_ids, template_type))
+
+        return {'updated': order_ids, 'skipped': skipped}
+
+    @classmethod
+    def _enqueue_emails(cls, order_ids, template_type):
+        from apps.emails.tasks import send_order_status_emails_task
+
+        for start in range(0, len(order_ids), cls.EMAIL_BATCH_SIZE):
+            send_order_status_emails_task.delay(order_ids[start:start + cls.EMAIL_BATCH_SIZE], template_type)
+
+
+class RestockNotifier:
+    """
+    Back-in-stock notifications for wishlisted products.
+    ``fan_out`` walks the product's wishlist rows with keyset pagination and
+    hands fixed-size user batches to Celery; ``notify_batch`` sends them,
+    skipping users already notified for the product within ``DEDUP_TIMEOUT``
+    and users who already got ``USER_DAILY_LIMIT`` restock emails today.
+    """
+
+    PAGE_SIZE = 2000
+    BATCH_SIZE = 500
+    DEDUP_TIMEOUT = 60 * 60 * 24 * 7
+    USER_DAILY_LIMIT = 5
+
+    @classmethod
+    def fan_out(cls, product_id):
+        from .tasks import send_back_in_stock_batch_task
+
+        last_id = 0
+        batches = 0
+        while True:
+            page = list(
+                Wishlist.objects.filter(product_id=product_id, id__gt=last_id)
+                .order_by('id')
+                .values_list('id', 'user_id')[:cls.PAGE_SIZE]
+            )
+            if not page:
+                break
+            last_id = page[-1][0]
+            user_ids = [user_id for _, user_id in page]
+            for start in range(0, len(user_ids), cls.BATCH_SIZE):
+                send_back_in_stock_batch_task.delay(product_id, user_ids[start:start + cls.BATCH_SIZE])
+                batches += 1
+        logger.info(f"Back-in-stock fan-out for product {product_id}: {batches} batches")
+        return batches
+
+    @classmethod
+    def notify_batch(cls, product_id, user_ids):
+        from apps.accounts.models import User
+        from apps.emails.models import EmailService
+        from apps.products.models import Product
+
+        product = Product.objects.select_related('inventory').filter(pk=product_id, is_active=True).first()
+        # Sold out again (or deactivated) before the batch ran
+        if product is None or not hasattr(product, 'inventory') or product.inventory.is_out_of_stock:
+            return 0
+
+        dedup_keys = {f'back_in_stock:{product_id}:{user_id}': user_id for user_id in user_ids}
+        notified = cache.get_many(dedup_keys.keys())
+        today = timezone.now().date().isoformat()
+        throttle_keys = {f'back_in_stock_daily:{user_id}:{today}': user_id
+                         for key, user_id in dedup_keys.items() if key not in notified}
+        counts = cache.get_many(throttle_keys.keys())
+        # Cheap pre-filter in two round trips; the claims below are what's authoritative
+        allowed = [user_id for key, user_id in throttle_keys.items() if counts.get(key, 0) < cls.USER_DAILY_LIMIT]
+        if not allowed:
+            return 0
+
+        name = product.safe_translation_getter('name', any_language=True)
+        sent = []
+        for user in User.objects.filter(pk__in=allowed, is_active=True).only('email', 'first_name'):
+            dedup_key = f'back_in_stock:{product_id}:{user.pk}'
+            daily_key = f'back_in_stock_daily:{user.pk}:{today}'
+            if not cls._claim(dedup_key, daily_key):
+                continue
+            ok, _log = EmailService.send_email(
+                to_email=user.email,
+                subject=f'{name} is back in stock',
+                html_content=f'<p>{name} is available again.</p>',
+                template_type='back_in_stock',
+                context={'product_name': name, 'product_slug': product.slug, 'first_name': user.first_name},
+            )
+            if ok:
+                sent.append(user.pk)
+            else:
+                cls._release(dedup_key, daily_key)
+        return len(sent)
+
+    @classmethod
+    def _claim(cls, dedup_key, daily_key):
+        """
+        Reserve one email before sending it: ``add`` and ``incr`` are atomic,
+        so concurrent batches (e.g. two products restocked at once) can
+        neither notify a user twice nor overshoot the daily limit.
+        """
+        if not cache.add(dedup_key, 1, cls.DEDUP_TIMEOUT):
+            return False
+        cache.add(daily_key, 0, 60 * 60 * 24)
+        if cache.incr(daily_key) > cls.USER_DAILY_LIMIT:
+            cls._release(dedup_key, daily_key)
+            return False
+        return True
+
+    @classmethod
+    def _release(cls, dedup_key, daily_key):
+        cache.delete(dedup_key)
+        try:
+            cache.decr(daily_key)
+        except ValueError:
+            pass
@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent after a bulk status transition commits its UPDATE.
+# Receivers get ``order_ids`` and ``status``.
+order_status_changed = Signal()
@@ -0,0 +1,21 @@
+from celery import shared_task
+
+
+@shared_task
+def maintain_partitions_task():
+    """Pre-create upcoming monthly partitions and archive expired ones."""
+    from .partitioning import ensure_partitions, archive_partitions
+    return {'created': ensure_partitions(), 'archived': archive_partitions()}
+
+
+@shared_task
+def notify_back_in_stock_task(product_id):
+    """Fan a restock of ``product_id`` out to its wishlisters in batches."""
+    from .services import RestockNotifier
+    return RestockNotifier.fan_out(product_id)
+
+
+@shared_task
+def send_back_in_stock_batch_task(product_id, user_ids):
+    from .services import RestockNotifier
+    return RestockNotifier.notify_batch(product_id, user_ids)
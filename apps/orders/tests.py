@@ -1,3 +1,338 @@
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Q
+from django.db.models.functions import Upper
 from django.test import TestCase
+from django.utils import timezone
+from apps.accounts.models import User
+from apps.discounts.models import Coupon
+from apps.emails.models import EmailLog
+from apps.payments.models import Payment
+from apps.products.models import Inventory, Product, LOW_STOCK
+from apps.reviews.models import Review
+from .models import Cart, Order, OrderItem, OrderStatusHistory
+from .partitioning import add_months, ensure_partitions, list_partitions, partition_name
+from .services import OrderStateMachine, RestockNotifier
 
-# Create your tests here.
+
+def month_start(month):
+    return datetime.combine(month, time.min, tzinfo=dt_timezone.utc)
+
+
+class PartitionTests(TestCase):
+    def setUp(self):
+        self.current = timezone.now().date().replace(day=1)
+        self.order = Order.objects.create(order_number='PART-1', email='part@example.com', phone_number='0',
+                                          subtotal=Decimal('10.00'), total=Decimal('10.00'))
+
+    def add_item(self, created_at):
+        item = OrderItem.objects.create(order=self.order, product_name='Card', product_sku='CARD', quantity=1,
+                                        cost_price=Decimal('1.00'), selling_price=Decimal('2.00'))
+        OrderItem.objects.filter(pk=item.pk).update(created_at=created_at)
+        return item
+
+    def partition_of(self, item):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT tableoid::regclass::text FROM orders_orderitem WHERE id = %s', [item.pk])
+            return cursor.fetchone()[0]
+
+    def test_month_range_prunes_to_its_partition(self):
+        ensure_partitions(months_ahead=1)
+        start = month_start(self.current)
+        plan = OrderItem.objects.filter(created_at__gte=start, created_at__lt=month_start(add_months(self.current, 1))).explain()
+        self.assertIn(partition_name('orders_orderitem', self.current), plan)
+        self.assertNotIn(partition_name('orders_orderitem', add_months(self.current, 1)), plan)
+        self.assertNotIn('orders_orderitem_default', plan)
+
+    def test_lower_bound_prunes_older_partitions(self):
+        ensure_partitions(months_ahead=1)
+        older = [name for name, month in list_partitions('orders_orderitem').items() if month < self.current]
+        plan = OrderItem.objects.filter(created_at__gte=month_start(self.current)).explain()
+        self.assertIn(partition_name('orders_orderitem', self.current), plan)
+        for name in older:
+            self.assertNotIn(name, plan)
+
+    def test_rows_in_default_move_to_the_new_partition(self):
+        ensure_partitions(months_ahead=1)
+        month = add_months(self.current, 24)
+        item = self.add_item(month_start(month))
+        self.assertEqual(self.partition_of(item), 'orders_orderitem_default')
+
+        created = ensure_partitions(months_ahead=24)
+        name = partition_name('orders_orderitem', month)
+        self.assertIn(name, created)
+        self.assertEqual(self.partition_of(item), name)
+        self.assertEqual(OrderItem.objects.filter(order=self.order).count(), 1)
+        self.assertTrue(self.default_attached())
+
+    def default_attached(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT pg_get_expr(child.relpartbound, child.oid) FROM pg_inherits
+                JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+                JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                WHERE parent.relname = 'orders_orderitem' AND child.relname = 'orders_orderitem_default'
+                """
+            )
+            row = cursor.fetchone()
+        return row is not None and row[0] == 'DEFAULT'
+
+
+class OrderStateMachineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('states@example.com', 'x', is_staff=True)
+
+    def order(self, number, status, **fields):
+        return Order.objects.create(order_number=number, email='states@example.com', phone_number='0',
+                                    status=status, subtotal=Decimal('10.00'), total=Decimal('10.00'), **fields)
+
+    def transition(self, numbers, to_status, **kwargs):
+        # Keep the callbacks: the signal receivers enqueue Celery tasks
+        with self.captureOnCommitCallbacks() as callbacks:
+            orders = Order.objects.filter(order_number__in=numbers)
+            result = OrderStateMachine.transition(orders, to_status, **kwargs)
+        return result, callbacks
+
+    def test_only_allowed_transitions_are_applied(self):
+        self.assertTrue(OrderStateMachine.can_transition('pending', 'cancelled'))
+        self.assertFalse(OrderStateMachine.can_transition('shipped', 'cancelled'))
+        self.assertFalse(OrderStateMachine.can_transition('refunded', 'processing'))
+        pending = self.order('SM-1', 'pending')
+        self.order('SM-2', 'shipped')
+        self.order('SM-3', 'cancelled')
+
+        result, _callbacks = self.transition(['SM-1', 'SM-2', 'SM-3'], 'cancelled')
+        self.assertEqual(result['updated'], [pending.pk])
+        self.assertEqual(sorted(result['skipped']), ['SM-2', 'SM-3'])
+        statuses = dict(Order.objects.values_list('order_number', 'status'))
+        self.assertEqual(statuses, {'SM-1': 'cancelled', 'SM-2': 'shipped', 'SM-3': 'cancelled'})
+
+        self.assertEqual(self.transition(['SM-2'], 'processing')[0], {'updated': [], 'skipped': ['SM-2']})
+        with self.assertRaises(ValueError):
+            OrderStateMachine.transition(Order.objects.all(), 'lost')
+
+    def test_timestamps_are_stamped_once(self):
+        scanned = timezone.now() - timedelta(days=2)
+        earlier = timezone.now() - timedelta(days=5)
+        fresh = self.order('TS-1', 'processing')
+        stamped = self.order('TS-2', 'processing', shipped_at=earlier)
+        default = self.order('TS-3', 'processing')
+        other = self.order('TS-4', 'pending')
+
+        before = timezone.now()
+        self.transition(['TS-1', 'TS-2', 'TS-3', 'TS-4'], 'shipped',
+                        timestamps={fresh.pk: scanned, stamped.pk: scanned, other.pk: scanned},
+                        tracking_numbers={'TS-1': 'TRACK-1', 'TS-3': ''})
+        orders = Order.objects.in_bulk([fresh.pk, stamped.pk, default.pk, other.pk])
+        self.assertEqual(orders[fresh.pk].shipped_at, scanned)
+        self.assertEqual(orders[stamped.pk].shipped_at, earlier)
+        self.assertGreaterEqual(orders[default.pk].shipped_at, before)
+        self.assertIsNone(orders[other.pk].shipped_at)
+        self.assertEqual([orders[pk].tracking_number for pk in (fresh.pk, default.pk)], ['TRACK-1', ''])
+        self.assertIsNone(orders[fresh.pk].delivered_at)
+
+    def test_history_rows_for_updated_orders_only(self):
+        moved, kept = self.order('HI-1', 'pending'), self.order('HI-2', 'delivered')
+        self.transition(['HI-1', 'HI-2'], 'processing', user=self.user, notes='Paid by bank transfer')
+        history = list(OrderStatusHistory.objects.values_list('order_id', 'status', 'notes', 'created_by'))
+        self.assertEqual(history, [(moved.pk, 'processing', 'Paid by bank transfer', self.user.pk)])
+        self.assertFalse(OrderStatusHistory.objects.filter(order=kept).exists())
+
+    def test_emails_are_enqueued_in_batches_on_commit(self):
+        ids = [self.order(f'EM-{n}', 'processing').pk for n in range(5)]
+        with mock.patch.object(OrderStateMachine, 'EMAIL_BATCH_SIZE', 2):
+            _result, callbacks = self.transition([f'EM-{n}' for n in range(5)], 'shipped')
+            with mock.patch('apps.orders.services.order_status_changed') as signal, \
+                    mock.patch('apps.emails.tasks.send_order_status_emails_task.delay') as delay:
+                for callback in callbacks:
+                    callback()
+        signal.send.assert_called_once_with(sender=Order, order_ids=ids, status='shipped')
+        self.assertEqual(delay.call_args_list, [
+            mock.call(ids[0:2], 'order_shipped'),
+            mock.call(ids[2:4], 'order_shipped'),
+            mock.call(ids[4:], 'order_shipped'),
+        ])
+
+        # No email for a silent transition, nor for statuses without a template
+        self.assertEqual(len(self.transition([f'EM-{n}' for n in range(5)], 'delivered', notify=False)[1]), 1)
+        self.order('EM-5', 'pending')
+        self.assertEqual(len(self.transition(['EM-5'], 'cancelled')[1]), 1)
+
+
+class RestockNotifierTests(TestCase):
+    def setUp(self):
+        self.products = [
+            Product.objects.create(slug=f'restock-{n}', sku=f'RESTOCK-{n}', cost_price=Decimal('1.00'),
+                                   selling_price=Decimal('2.00'))
+            for n in range(2)
+        ]
+        for product in self.products:
+            Inventory.objects.create(product=product, quantity=5)
+        self.users = [User.objects.create_user(f'restock{n}@example.com', 'x') for n in range(3)]
+        today = timezone.now().date().isoformat()
+        # The cache is shared: clear whatever earlier runs left for these ids
+        self.keys = [f'back_in_stock_daily:{user.pk}:{today}' for user in self.users] + [
+            f'back_in_stock:{product.pk}:{user.pk}' for product in self.products for user in self.users]
+        cache.delete_many(self.keys)
+        self.daily_key = self.keys[0]
+
+    def tearDown(self):
+        cache.delete_many(self.keys)
+
+    def notify(self, product, failing=()):
+        def send_email(to_email, **kwargs):
+            return to_email not in failing, None
+        with mock.patch('apps.emails.models.EmailService.send_email', side_effect=send_email) as send:
+            count = RestockNotifier.notify_batch(product.pk, [user.pk for user in self.users])
+        return count, sorted(call.kwargs['to_email'] for call in send.call_args_list)
+
+    def test_each_user_is_notified_once(self):
+        self.assertEqual(self.notify(self.products[0])[0], 3)
+        self.assertEqual(self.notify(self.products[0]), (0, []))
+        # A batch that read the cache before the first one claimed its users
+        with mock.patch.object(cache, 'get_many', return_value={}):
+            self.assertEqual(self.notify(self.products[0]), (0, []))
+
+    def test_daily_limit_holds_against_a_stale_read(self):
+        cache.set(self.daily_key, RestockNotifier.USER_DAILY_LIMIT - 1, 60)
+        self.assertEqual(self.notify(self.products[0])[0], 3)
+        self.assertEqual(cache.get(self.daily_key), RestockNotifier.USER_DAILY_LIMIT)
+        with mock.patch.object(cache, 'get_many', return_value={}):
+            count, sent = self.notify(self.products[1])
+        self.assertEqual((count, sent), (2, ['restock1@example.com', 'restock2@example.com']))
+        self.assertEqual(cache.get(self.daily_key), RestockNotifier.USER_DAILY_LIMIT)
+
+    def test_failed_send_releases_the_claim(self):
+        self.assertEqual(self.notify(self.products[0], failing={'restock0@example.com'})[0], 2)
+        self.assertEqual(cache.get(self.daily_key), 0)
+        self.assertEqual(self.notify(self.products[0]), (1, ['restock0@example.com']))
+
+
+class OrderRangeScanTests(TestCase):
+    """orders_order is not partitioned: date ranges go through the BRIN index on created_at."""
+
+    def test_created_at_range_uses_brin_index(self):
+        start = month_start(timezone.now().date().replace(day=1))
+        with connection.cursor() as cursor:
+            # Two years of orders, appended in created_at order as in production
+            cursor.execute(
+                """
+                INSERT INTO orders_order (order_number, email, phone_number, status, payment_status, subtotal,
+                    shipping_cost, tax, discount_amount, total, customer_notes, admin_notes, tracking_number,
+                    created_at, updated_at)
+                SELECT 'BRIN-' || n, 'brin@example.com', '0', 'delivered', 'completed', 10, 0, 0, 0, 10, '', '', '',
+                       %s - interval '730 days' + n * interval '1 hour', now()
+                FROM generate_series(1, 730 * 24) AS n
+                """,
+                [start],
+            )
+            cursor.execute('ANALYZE orders_order')
+        plan = Order.objects.order_by().filter(created_at__gte=start - timedelta(days=7), created_at__lt=start).explain()
+        self.assertIn('orders_created_brin', plan)
+        self.assertNotIn('Seq Scan', plan)
+
+
+class HotQueryIndexTests(TestCase):
+    """Each hot filter path uses its index on a realistic dataset."""
+
+    ROWS = 20000
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        rows = cls.ROWS
+        users = User.objects.bulk_create([User(email=f'explain-{i}@example.com') for i in range(1000)])
+        orders = Order.objects.bulk_create([
+            Order(order_number=f'EXPLAIN-{i}', email='explain@example.com', phone_number='0',
+                  status=('pending', 'processing', 'shipped', 'delivered', 'cancelled')[i % 5],
+                  subtotal=Decimal('10.00'), total=Decimal('10.00'))
+            for i in range(rows)
+        ], batch_size=5000)
+        Cart.objects.bulk_create([Cart(session_key=f'session-{i}' if i % 2 else None) for i in range(rows)],
+                                 batch_size=5000)
+        EmailLog.objects.bulk_create([
+            EmailLog(recipient='explain@example.com', subject='s', status='failed' if i % 50 == 0 else 'sent')
+            for i in range(rows)
+        ], batch_size=5000)
+        Payment.objects.bulk_create([
+            Payment(transaction_id=f'explain-{i}', gateway_transaction_id=f'gw-{i}' if i % 4 else '',
+                    order=order, amount=Decimal('10.00'), status='completed')
+            for i, order in enumerate(orders)
+        ], batch_size=5000)
+        Coupon.objects.bulk_create([
+            Coupon(code=f'CODE-{i}', discount_type='fixed', discount_value=Decimal('1.00'),
+                   valid_from=now, valid_until=now + timedelta(days=30), is_active=i % 3 != 0)
+            for i in range(rows // 4)
+        ], batch_size=5000)
+        products = Product.objects.bulk_create([
+            Product(slug=f'explain-{i}', sku=f'EXPLAIN-{i}', cost_price=Decimal('1.00'), selling_price=Decimal('2.00'))
+            for i in range(rows // 20)
+        ], batch_size=5000)
+        Inventory.objects.bulk_create([
+            Inventory(product=product, quantity=5 if i % 40 == 0 else 100, low_stock_threshold=10)
+            for i, product in enumerate(products)
+        ], batch_size=5000)
+        # Few products with many reviews each, like the popular product pages
+        Review.objects.bulk_create([
+            Review(product=product, user=user, rating=5, title='t', comment='c', is_approved=bool(j % 5))
+            for product in products[:rows // len(users)] for j, user in enumerate(users)
+        ], batch_size=5000)
+        cls.reviewed_product = products[0]
+
+        with connection.cursor() as cursor:
+            # Spread timestamps over two years so date filters are selective
+            cursor.execute("UPDATE orders_order SET created_at = now() - (id % 730) * interval '1 day'")
+            cursor.execute("UPDATE orders_cart SET updated_at = now() - (id % 8760) * interval '1 hour'")
+            for table in ('orders_order', 'orders_cart', 'emails_emaillog', 'products_inventory',
+                          'discounts_coupon', 'payments_payment', 'reviews_review'):
+                cursor.execute(f'ANALYZE {table}')
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+
+    def test_recent_orders_by_status(self):
+        self.assertUsesIndex(
+            Order.objects.filter(status__in=['processing', 'shipped', 'delivered'],
+                                 created_at__gte=timezone.now() - timedelta(days=2))
+            .values('status').annotate(orders=Count('id')),
+            'orders_status_created_idx',
+        )
+
+    def test_cart_by_session(self):
+        self.assertUsesIndex(Cart.objects.filter(session_key='session-17'), 'cart_session_key_idx')
+
+    def test_abandoned_carts(self):
+        now = timezone.now()
+        self.assertUsesIndex(Cart.objects.filter(updated_at__range=(now - timedelta(hours=25), now - timedelta(hours=24))),
+                             'cart_updated_at_idx')
+
+    def test_unsent_emails(self):
+        self.assertUsesIndex(EmailLog.objects.filter(status='failed').order_by('created_at')[:100], 'emaillog_unsent_idx')
+
+    def test_low_stock(self):
+        self.assertUsesIndex(Inventory.objects.filter(LOW_STOCK), 'inventory_low_stock_idx')
+
+    def test_active_coupon_by_code(self):
+        self.assertUsesIndex(Coupon.objects.filter(code__iexact='code-17', is_active=True), 'coupon_active_code_idx')
+
+    def test_coupon_rules_by_code(self):
+        codes = ['CODE-17', 'CODE-18']
+        queryset = Coupon.objects.annotate(code_upper=Upper('code')).filter(
+            Q(code_upper__in=codes, is_active=True) | Q(code_upper__in=codes, is_active=False))
+        self.assertUsesIndex(queryset, 'coupon_active_code_idx')
+        self.assertUsesIndex(queryset, 'coupon_inactive_code_idx')
+
+    def test_payment_by_gateway_transaction(self):
+        self.assertUsesIndex(Payment.objects.filter(gateway_transaction_id='gw-17'), 'payment_gateway_txn_idx')
+
+    def test_approved_reviews_of_a_product(self):
+        self.assertUsesIndex(
+            Review.objects.filter(product=self.reviewed_product, is_approved=True).order_by('-created_at')[:20],
+            'review_product_approved_idx',
+        )
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import PaymentGateway, Payment, Refund
+from .models import PaymentGateway, Payment, Refund, WebhookEvent
+from .webhooks import WebhookInbox
 
 @admin.register(PaymentGateway)
 class PaymentGatewayAdmin(admin.ModelAdmin):
@@ -11,8 +12,29 @@ class PaymentAdmin(admin.ModelAdmin):
     list_display = ['transaction_id','order','gateway','amount','status','created_at']
     list_filter = ['status','gateway','created_at']
     search_fields = ['transaction_id','gateway_transaction_id']
+    actions = ['refund']
+
+    @admin.action(description='Refund selected payments in full')
+    def refund(self, request, queryset):
+        from .services import BulkRefunder
+        from .tasks import bulk_refund_task
+        payment_ids = list(BulkRefunder.refundable(queryset).values_list('pk', flat=True))
+        bulk_refund_task.delay(payment_ids, 'customer_request', request.user.pk, 'Bulk refund from the admin')
+        self.message_user(request, f'Refunding {len(payment_ids)} payments; progress is shown on the dashboard.')
 
 @admin.register(Refund)
 class RefundAdmin(admin.ModelAdmin):
     list_display = ['refund_id','payment','amount','status','created_at']
     list_filter = ['status','reason','created_at']
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ['event_id','gateway','event_type','action','ordering_key','status','attempts','received_at']
+    list_filter = ['status','action','gateway','received_at']
+    search_fields = ['event_id','object_id','ordering_key']
+    readonly_fields = ['processed_at','received_at']
+    actions = ['replay']
+
+    @admin.action(description='Replay selected webhook events')
+    def replay(self, request, queryset):
+        self.message_user(request, f'{WebhookInbox.replay(queryset)} events queued for processing.')
@@ -0,0 +1,14 @@
+from .adapters import ADAPTERS, GatewayAdapter
+from .client import CircuitOpenError, GatewayError, get_breaker
+
+
+def get_adapter(gateway):
+    """Adapter of a ``PaymentGateway``; ``config['adapter']`` overrides the one named after it (e.g. 'stub')."""
+    name = (gateway.config or {}).get('adapter', gateway.name)
+    try:
+        return ADAPTERS[name](gateway)
+    except KeyError:
+        raise GatewayError(f'No adapter for payment gateway {name!r}')
+
+
+__all__ = ['ADAPTERS', 'CircuitOpenError', 'GatewayAdapter', 'GatewayError', 'get_adapter', 'get_breaker']
@@ -0,0 +1,408 @@
+"""
+Adapters of the supported payment gateways.
+
+Each operation (``charge``, ``capture``, ``refund``, ``status``) is a
+generator over ``GatewayRequest`` objects returning a result dict::
+
+    {'status': <Payment/Refund status>, 'gateway_id': <gateway's id>, 'response': <gateway JSON>}
+
+Call them through ``adapter.call('charge', payment, ...)`` from synchronous
+code or ``await adapter.acall(...)`` from async code.
+
+Webhooks are checked with ``verify_webhook(body, headers)`` and normalized
+by ``parse_webhook(payload)`` into::
+
+    {'event_id', 'event_type', 'action', 'object_id', 'ordering_key'}
+
+where ``action`` is one of ``WebhookEvent.ACTION_CHOICES`` (or '' for events
+we do not act on) and ``ordering_key`` is the payment's gateway transaction id.
+"""
+import base64
+import hashlib
+import hmac
+import time
+import uuid
+from django.conf import settings
+from decimal import Decimal
+from django.core.cache import cache
+from .client import GatewayError, GatewayRequest, get_async_client, get_client
+
+
+def _minor_units(amount):
+    return int((Decimal(amount) * 100).to_integral_value())
+
+
+def _hmac(secret, message):
+    return hmac.new(secret.encode(), message, hashlib.sha256)
+
+
+def _json(response):
+    try:
+        return response.json()
+    except ValueError:
+        return {'body': response.text[:1000]}
+
+
+class GatewayAdapter:
+    name = None
+    live_url = None
+    sandbox_url = None
+    # gateway status -> Payment status
+    PAYMENT_STATUSES = {}
+    # gateway status -> Refund status
+    REFUND_STATUSES = {}
+    # Headers kept with stored webhooks, for signatures verified later
+    WEBHOOK_HEADERS = ()
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+        self.config = gateway.config or {}
+        self.base_url = self.config.get('base_url') or (self.sandbox_url if gateway.is_test_mode else self.live_url)
+
+    def call(self, operation, *args, **kwargs):
+        return get_client(self.name, self.base_url).run(getattr(self, operation)(*args, **kwargs))
+
+    async def acall(self, operation, *args, **kwargs):
+        return await get_async_client(self.name, self.base_url).run(getattr(self, operation)(*args, **kwargs))
+
+    def idempotency_key(self, obj, action):
+        """Stable per object and action, so retried requests are never applied twice."""
+        return f"{action}-{getattr(obj, 'transaction_id', None) or getattr(obj, 'refund_id', None) or uuid.uuid4()}"
+
+    def result(self, response, statuses, gateway_status, gateway_id):
+        body = _json(response)
+        if response.is_error:
+            return {'status': 'failed', 'gateway_id': gateway_id or '', 'response': body,
+                    'error': f'{self.name} returned {response.status_code}'}
+        return {'status': statuses.get(gateway_status(body), 'processing'), 'gateway_id': gateway_id or '',
+                'response': body}
+
+    def charge(self, payment, source=None):
+        raise NotImplementedError
+
+    def capture(self, payment):
+        raise NotImplementedError
+
+    def refund(self, refund):
+        raise NotImplementedError
+
+    def status(self, payment):
+        raise NotImplementedError
+
+    def verify_webhook(self, body, headers):
+        """
+        True or False for a signature checked locally, ``None`` when only the
+        gateway can tell (see ``confirm_webhook``). Always False without a
+        configured signing secret: an empty key would let anyone sign.
+        """
+        return False
+
+    def confirm_webhook(self, payload, headers):
+        """Operation asking the gateway whether a stored webhook is genuine."""
+        raise NotImplementedError
+
+    def parse_webhook(self, payload):
+        raise NotImplementedError
+
+
+class StripeAdapter(GatewayAdapter):
+    name = 'stripe'
+    live_url = sandbox_url = 'https://api.stripe.com'
+    PAYMENT_STATUSES = {
+        'succeeded': 'completed', 'processing': 'processing', 'canceled': 'cancelled',
+        'requires_payment_method': 'failed', 'requires_action': 'pending',
+        'requires_confirmation': 'pending', 'requires_capture': 'processing',
+    }
+    REFUND_STATUSES = {'succeeded': 'completed', 'pending': 'processing', 'failed': 'failed', 'canceled': 'failed'}
+
+    def headers(self, obj=None, action=None):
+        headers = {'Authorization': f"Bearer {self.config.get('secret_key', '')}"}
+        if obj is not None:
+            headers['Idempotency-Key'] = self.idempotency_key(obj, action)
+        return headers
+
+    def charge(self, payment, source=None):
+        response = yield GatewayRequest('POST', '/v1/payment_intents', headers=self.headers(payment, 'charge'), data={
+            'amount': _minor_units(payment.amount), 'currency': payment.currency.lower(),
+            'payment_method': source, 'confirm': 'true', 'metadata[transaction_id]': payment.transaction_id,
+        })
+        body = _json(response)
+        return self.result(response, self.PAYMENT_STATUSES, lambda b: b.get('status'), body.get('id'))
+
+    def capture(self, payment):
+        response = yield GatewayRequest(
+            'POST', f'/v1/payment_intents/{payment.gateway_transaction_id}/capture',
+            headers=self.headers(payment, 'capture'),
+        )
+        return self.result(response, self.PAYMENT_STATUSES, lambda b: b.get('status'), payment.gateway_transaction_id)
+
+    def refund(self, refund):
+        response = yield GatewayRequest('POST', '/v1/refunds', headers=self.headers(refund, 'refund'), data={
+            'payment_intent': refund.payment.gateway_transaction_id, 'amount': _minor_units(refund.amount),
+        })
+        return self.result(response, self.REFUND_STATUSES, lambda b: b.get('status'), _json(response).get('id'))
+
+    def status(self, payment):
+        response = yield GatewayRequest('GET', f'/v1/payment_intents/{payment.gateway_transaction_id}', headers=self.headers())
+        return self.result(response, self.PAYMENT_STATUSES, lambda b: b.get('status'), payment.gateway_transaction_id)
+
+    def verify_webhook(self, body, headers):
+        items = [item.split('=', 1) for item in headers.get('Stripe-Signature', '').split(',') if '=' in item]
+        timestamp = next((value for key, value in items if key == 't'), '')
+        secret = self.config.get('webhook_secret')
+        if not secret or not timestamp.isdigit() \
+                or abs(time.time() - int(timestamp)) > settings.PAYMENT_WEBHOOK_TOLERANCE_SECONDS:
+            return False
+        expected = _hmac(secret, timestamp.encode() + b'.' + body).hexdigest()
+        return any(hmac.compare_digest(expected, value) for key, value in items if key == 'v1')
+
+    def parse_webhook(self, payload):
+        obj = payload.get('data', {}).get('object', {})
+        event_type = payload.get('type', '')
+        if obj.get('object') == 'refund':
+            action = {'succeeded': 'refund.completed', 'failed': 'refund.failed', 'canceled': 'refund.failed'}.get(obj.get('status'), '')
+            ordering_key = obj.get('payment_intent') or ''
+        else:
+            action = {'payment_intent.succeeded': 'payment.completed',
+                      'payment_intent.payment_failed': 'payment.failed'}.get(event_type, '')
+            ordering_key = obj.get('id', '') if obj.get('object') == 'payment_intent' else ''
+        return {'event_id': payload.get('id', ''), 'event_type': event_type, 'action': action,
+                'object_id': obj.get('id', ''), 'ordering_key': ordering_key}
+
+
+class PayPalAdapter(GatewayAdapter):
+    name = 'paypal'
+    live_url = 'https://api-m.paypal.com'
+    sandbox_url = 'https://api-m.sandbox.paypal.com'
+    PAYMENT_STATUSES = {
+        'COMPLETED': 'completed', 'APPROVED': 'processing', 'CREATED': 'pending',
+        'SAVED': 'pending', 'PAYER_ACTION_REQUIRED': 'pending', 'VOIDED': 'cancelled',
+    }
+    REFUND_STATUSES = {'COMPLETED': 'completed', 'PENDING': 'processing', 'CANCELLED': 'failed', 'FAILED': 'failed'}
+    WEBHOOK_HEADERS = ('Paypal-Auth-Algo', 'Paypal-Cert-Url', 'Paypal-Transmission-Id',
+                       'Paypal-Transmission-Sig', 'Paypal-Transmission-Time')
+
+    def token(self):
+        """OAuth access token, shared through the cache until shortly before it expires."""
+        key = f'paypal_token:{self.base_url}:{self.config.get("client_id", "")}'
+        token = cache.get(key)
+        if token is None:
+            response = yield GatewayRequest(
+                'POST', '/v1/oauth2/token', data={'grant_type': 'client_credentials'},
+                auth=(self.config.get('client_id', ''), self.config.get('client_secret', '')),
+            )
+            if response.is_error:
+                raise GatewayError(f'PayPal authentication failed ({response.status_code})', response.status_code, response)
+            body = response.json()
+            token = body['access_token']
+            cache.set(key, token, max(int(body.get('expires_in', 0)) - 60, 60))
+        return token
+
+    def headers(self, token, obj=None, action=None):
+        headers = {'Authorization': f'Bearer {token}'}
+        if obj is not None:
+            headers['PayPal-Request-Id'] = self.idempotency_key(obj, action)
+        return headers
+
+    def charge(self, payment, source=None):
+        token = yield from self.token()
+        response = yield GatewayRequest('POST', '/v2/checkout/orders', headers=self.headers(token, payment, 'charge'), json={
+            'intent': 'CAPTURE',
+            'purchase_units': [{
+                'reference_id': payment.transaction_id,
+                'amount': {'currency_code': payment.currency, 'value': f'{payment.amount:.2f}'},
+            }],
+        })
+        return self.result(response, self.PAYMENT_STATUSES, lambda b: b.get('status'), _json(response).get('id'))
+
+    def capture(self, payment):
+        token = yield from self.token()
+        response = yield GatewayRequest(
+            'POST', f'/v2/checkout/orders/{payment.gateway_transaction_id}/capture',
+            headers=self.headers(token, payment, 'capture'), json={},
+        )
+        return self.result(response, self.PAYMENT_STATUSES, lambda b: b.get('status'), payment.gateway_transaction_id)
+
+    def refund(self, refund):
+        token = yield from self.token()
+        # Refunds go against the capture, recorded in the payment's gateway response
+        capture_id = (refund.payment.gateway_response.get('purchase_units') or [{}])[0] \
+            .get('payments', {}).get('captures', [{}])[0].get('id', refund.payment.gateway_transaction_id)
+        response = yield GatewayRequest(
+            'POST', f'/v2/payments/captures/{capture_id}/refund', headers=self.headers(token, refund, 'refund'),
+            json={'amount': {'currency_code': refund.payment.currency, 'value': f'{refund.amount:.2f}'}},
+        )
+        return self.result(response, self.REFUND_STATUSES, lambda b: b.get('status'), _json(response).get('id'))
+
+    def status(self, payment):
+        token = yield from self.token()
+        response = yield GatewayRequest(
+            'GET', f'/v2/checkout/orders/{payment.gateway_transaction_id}', headers=self.headers(token),
+        )
+        return self.result(response, self.PAYMENT_STATUSES, lambda b: b.get('status'), payment.gateway_transaction_id)
+
+    def verify_webhook(self, body, headers):
+        # PayPal signatures are checked by PayPal's API, off the request path
+        return None if all(headers.get(header) for header in self.WEBHOOK_HEADERS) else False
+
+    def confirm_webhook(self, payload, headers):
+        token = yield from self.token()
+        response = yield GatewayRequest(
+            'POST', '/v1/notifications/verify-webhook-signature', headers=self.headers(token), json={
+                'auth_algo': headers.get('Paypal-Auth-Algo'), 'cert_url': headers.get('Paypal-Cert-Url'),
+                'transmission_id': headers.get('Paypal-Transmission-Id'),
+                'transmission_sig': headers.get('Paypal-Transmission-Sig'),
+                'transmission_time': headers.get('Paypal-Transmission-Time'),
+                'webhook_id': self.config.get('webhook_id', ''), 'webhook_event': payload,
+            },
+        )
+        if response.is_error:
+            raise GatewayError(f'PayPal webhook verification failed ({response.status_code})', response.status_code,
+                               response, retryable=True)
+        return response.json().get('verification_status') == 'SUCCESS'
+
+    def parse_webhook(self, payload):
+        resource = payload.get('resource', {})
+        event_type = payload.get('event_type', '')
+        action = {'PAYMENT.CAPTURE.COMPLETED': 'payment.completed', 'PAYMENT.CAPTURE.DENIED': 'payment.failed',
+                  'PAYMENT.CAPTURE.DECLINED': 'payment.failed'}.get(event_type, '')
+        if event_type == 'PAYMENT.CAPTURE.REFUNDED' or event_type.startswith('PAYMENT.REFUND.'):
+            action = {'COMPLETED': 'refund.completed', 'FAILED': 'refund.failed',
+                      'CANCELLED': 'refund.failed'}.get(resource.get('status'), '')
+        # Payments are recorded under the PayPal order id
+        ordering_key = resource.get('supplementary_data', {}).get('related_ids', {}).get('order_id', '')
+        return {'event_id': payload.get('id', ''), 'event_type': event_type, 'action': action,
+                'object_id': resource.get('id', ''), 'ordering_key': ordering_key}
+
+
+class SquareAdapter(GatewayAdapter):
+    name = 'square'
+    live_url = 'https://connect.squareup.com'
+    sandbox_url = 'https://connect.squareupsandbox.com'
+    API_VERSION = '2023-12-13'
+    PAYMENT_STATUSES = {'COMPLETED': 'completed', 'APPROVED': 'processing', 'PENDING': 'pending',
+                        'CANCELED': 'cancelled', 'FAILED': 'failed'}
+    REFUND_STATUSES = {'COMPLETED': 'completed', 'PENDING': 'processing', 'REJECTED': 'failed', 'FAILED': 'failed'}
+
+    def headers(self):
+        return {'Authorization': f"Bearer {self.config.get('access_token', '')}", 'Square-Version': self.API_VERSION}
+
+    def charge(self, payment, source=None):
+        response = yield GatewayRequest('POST', '/v2/payments', headers=self.headers(), json={
+            'source_id': source, 'idempotency_key': self.idempotency_key(payment, 'charge'),
+            'amount_money': {'amount': _minor_units(payment.amount), 'currency': payment.currency},
+            'reference_id': payment.transaction_id, 'autocomplete': True,
+        })
+        payment_body = _json(response).get('payment', {})
+        return self.result(response, self.PAYMENT_STATUSES, lambda b: b.get('payment', {}).get('status'), payment_body.get('id'))
+
+    def capture(self, payment):
+        response = yield GatewayRequest(
+            'POST', f'/v2/payments/{payment.gateway_transaction_id}/complete', headers=self.headers(), json={},
+        )
+        return self.result(response, self.PAYMENT_STATUSES, lambda b: b.get('payment', {}).get('status'),
+                           payment.gateway_transaction_id)
+
+    def refund(self, refund):
+        response = yield GatewayRequest('POST', '/v2/refunds', headers=self.headers(), json={
+            'idempotency_key': self.idempotency_key(refund, 'refund'),
+            'payment_id': refund.payment.gateway_transaction_id,
+            'amount_money': {'amount': _minor_units(refund.amount), 'currency': refund.payment.currency},
+        })
+        refund_body = _json(response).get('refund', {})
+        return self.result(response, self.REFUND_STATUSES, lambda b: b.get('refund', {}).get('status'), refund_body.get('id'))
+
+    def status(self, payment):
+        response = yield GatewayRequest('GET', f'/v2/payments/{payment.gateway_transaction_id}', headers=self.headers())
+        return self.result(response, self.PAYMENT_STATUSES, lambda b: b.get('payment', {}).get('status'),
+                           payment.gateway_transaction_id)
+
+    def verify_webhook(self, body, headers):
+        # Signed over the notification URL configured in the Square dashboard followed by the body
+        key = self.config.get('webhook_signature_key')
+        if not key:
+            return False
+        message = self.config.get('webhook_url', '').encode() + body
+        expected = base64.b64encode(_hmac(key, message).digest()).decode()
+        return hmac.compare_digest(expected, headers.get('X-Square-Hmacsha256-Signature', ''))
+
+    def parse_webhook(self, payload):
+        data = payload.get('data', {})
+        obj = data.get('object', {}).get(data.get('type', ''), {})
+        if data.get('type') == 'refund':
+            action = {'COMPLETED': 'refund.completed', 'REJECTED': 'refund.failed', 'FAILED': 'refund.failed'}.get(obj.get('status'), '')
+            ordering_key = obj.get('payment_id', '')
+        else:
+            action = {'COMPLETED': 'payment.completed', 'FAILED': 'payment.failed',
+                      'CANCELED': 'payment.failed'}.get(obj.get('status'), '') if data.get('type') == 'payment' else ''
+            ordering_key = obj.get('id', '')
+        return {'event_id': payload.get('event_id', ''), 'event_type': payload.get('type', ''), 'action': action,
+                'object_id': obj.get('id', ''), 'ordering_key': ordering_key}
+
+
+class ManualAdapter(GatewayAdapter):
+    """Bank transfers: nothing to call, staff confirm payments and refunds by hand."""
+    name = 'manual'
+
+    def call(self, operation, *args, **kwargs):
+        return getattr(self, operation)(*args, **kwargs)
+
+    async def acall(self, operation, *args, **kwargs):
+        return getattr(self, operation)(*args, **kwargs)
+
+    def charge(self, payment, source=None):
+        return {'status': 'pending', 'gateway_id': '', 'response': {}}
+
+    def capture(self, payment):
+        return self.status(payment)
+
+    def refund(self, refund):
+        return {'status': 'processing', 'gateway_id': '', 'response': {}}
+
+    def status(self, payment):
+        return {'status': payment.status, 'gateway_id': payment.gateway_transaction_id, 'response': {}}
+
+
+class StubAdapter(GatewayAdapter):
+    """Talks to the local stub gateway (``run_stub_gateway``) for offline load tests."""
+    name = 'stub'
+    live_url = sandbox_url = 'http://127.0.0.1:8765'
+    PAYMENT_STATUSES = {'succeeded': 'completed', 'pending': 'pending', 'declined': 'failed'}
+    REFUND_STATUSES = {'succeeded': 'completed', 'pending': 'processing', 'declined': 'failed'}
+
+    def charge(self, payment, source=None):
+        response = yield GatewayRequest('POST', '/charges', headers={'Idempotency-Key': self.idempotency_key(payment, 'charge')},
+                                        json={'amount': _minor_units(payment.amount), 'currency': payment.currency,
+                                              'reference': payment.transaction_id, 'source': source})
+        return self.result(response, self.PAYMENT_STATUSES, lambda b: b.get('status'), _json(response).get('id'))
+
+    def capture(self, payment):
+        return (yield from self.status(payment))
+
+    def refund(self, refund):
+        response = yield GatewayRequest('POST', '/refunds', headers={'Idempotency-Key': self.idempotency_key(refund, 'refund')},
+                                        json={'charge': refund.payment.gateway_transaction_id,
+                                              'amount': _minor_units(refund.amount)})
+        return self.result(response, self.REFUND_STATUSES, lambda b: b.get('status'), _json(response).get('id'))
+
+    def status(self, payment):
+        response = yield GatewayRequest('GET', f'/charges/{payment.gateway_transaction_id}')
+        return self.result(response, self.PAYMENT_STATUSES, lambda b: b.get('status'), payment.gateway_transaction_id)
+
+    def sign_webhook(self, body):
+        return _hmac(self.config['webhook_secret'], body).hexdigest()
+
+    def verify_webhook(self, body, headers):
+        if not self.config.get('webhook_secret'):
+            return False
+        return hmac.compare_digest(self.sign_webhook(body), headers.get('X-Stub-Signature', ''))
+
+    def parse_webhook(self, payload):
+        obj = payload.get('data', {})
+        action = {'charge.succeeded': 'payment.completed', 'charge.declined': 'payment.failed',
+                  'refund.succeeded': 'refund.completed', 'refund.declined': 'refund.failed'}.get(payload.get('type'), '')
+        return {'event_id': payload.get('id', ''), 'event_type': payload.get('type', ''), 'action': action,
+                'object_id': obj.get('id', ''), 'ordering_key': obj.get('charge') or obj.get('id', '')}
+
+
+ADAPTERS = {adapter.name: adapter for adapter in (StripeAdapter, PayPalAdapter, SquareAdapter, ManualAdapter, StubAdapter)}
@@ -0,0 +1,255 @@
+"""
+HTTP plumbing shared by the gateway adapters.
+
+Adapters describe an operation as a generator that yields ``GatewayRequest``
+objects and receives the responses, so the same code runs on the pooled
+blocking client (gunicorn workers, Celery) and on the asyncio client (ASGI).
+Both clients keep one keep-alive connection pool per gateway and process,
+apply strict timeouts, retry transient failures with full-jitter exponential
+backoff and go through the gateway's circuit breaker, which fails fast while
+a gateway is down instead of tying up workers on timeouts.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+from dataclasses import dataclass, field
+from django.conf import settings
+import httpx
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class GatewayError(Exception):
+    def __init__(self, message, status=None, response=None, retryable=False):
+        super().__init__(message)
+        self.status = status
+        self.response = response
+        self.retryable = retryable
+
+
+class CircuitOpenError(GatewayError):
+    pass
+
+
+@dataclass
+class GatewayRequest:
+    method: str
+    path: str
+    json: dict = None
+    data: dict = None
+    headers: dict = field(default_factory=dict)
+    auth: tuple = None
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after ``failure_threshold`` consecutive failures; after
+    ``reset_timeout`` seconds one trial call is let through (half-open), which
+    closes the circuit on success or re-opens it on failure. A trial ending
+    in any other error is released with ``end_trial`` so a later call can try.
+    """
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if time.monotonic() - self.opened_at >= self.reset_timeout else 'open'
+
+    def allow(self):
+        """Whether a call may go out; ``'trial'`` for the half-open trial call."""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.trial:
+                return False
+            self.trial = True
+            return 'trial'
+
+    def end_trial(self):
+        with self.lock:
+            self.trial = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.trial:
+                    logger.warning(f"Circuit opened for payment gateway {self.name} after {self.failures} failures")
+                self.opened_at = time.monotonic()
+                self.trial = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(
+                name, settings.PAYMENT_GATEWAY_BREAKER_FAILURES, settings.PAYMENT_GATEWAY_BREAKER_RESET_SECONDS
+            )
+        return _breakers[name]
+
+
+def _timeout():
+    return httpx.Timeout(settings.PAYMENT_GATEWAY_TIMEOUT, connect=settings.PAYMENT_GATEWAY_CONNECT_TIMEOUT)
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=settings.PAYMENT_GATEWAY_POOL_SIZE,
+        max_keepalive_connections=settings.PAYMENT_GATEWAY_POOL_SIZE,
+        keepalive_expiry=30,
+    )
+
+
+def _backoff(attempt, response=None):
+    """Full jitter, or the gateway's ``Retry-After`` when it sends one."""
+    cap = settings.PAYMENT_GATEWAY_BACKOFF_MAX
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), cap)
+    return random.uniform(0, min(cap, settings.PAYMENT_GATEWAY_BACKOFF * 2 ** attempt))
+
+
+def _check(response):
+    if response.status_code in RETRYABLE_STATUSES:
+        raise GatewayError(f'Gateway returned {response.status_code}', response.status_code, response, retryable=True)
+    return response
+
+
+class GatewayClient:
+    """Pooled blocking client of one gateway; share it through ``get_client``."""
+
+    def __init__(self, name, base_url):
+        self.name = name
+        self.breaker = get_breaker(name)
+        self.http = httpx.Client(base_url=base_url, timeout=_timeout(), limits=_limits())
+
+    def send(self, request):
+        attempts = settings.PAYMENT_GATEWAY_RETRIES + 1
+        for attempt in range(attempts):
+            allowed = self.breaker.allow()
+            if not allowed:
+                raise CircuitOpenError(f'Circuit open for payment gateway {self.name}')
+            response = None
+            try:
+                response = _check(self.http.request(
+                    request.method, request.path, json=request.json, data=request.data,
+                    headers=request.headers, auth=request.auth,
+                ))
+            except (httpx.TransportError, GatewayError) as exc:
+                self.breaker.record_failure()
+                response = getattr(exc, 'response', None)
+                if attempt + 1 == attempts:
+                    raise GatewayError(f'{self.name}: {exc}', getattr(response, 'status_code', None), response) from exc
+                time.sleep(_backoff(attempt, response))
+                continue
+            else:
+                self.breaker.record_success()
+                return response
+            finally:
+                if allowed == 'trial':
+                    self.breaker.end_trial()
+
+    def run(self, operation):
+        """Drive an adapter operation generator to its result."""
+        try:
+            request = next(operation)
+            while True:
+                request = operation.send(self.send(request))
+        except StopIteration as stop:
+            return stop.value
+
+    def close(self):
+        self.http.close()
+
+
+class AsyncGatewayClient:
+    """asyncio counterpart of ``GatewayClient``; one per gateway and event loop."""
+
+    def __init__(self, name, base_url):
+        self.name = name
+        self.breaker = get_breaker(name)
+        self.http = httpx.AsyncClient(base_url=base_url, timeout=_timeout(), limits=_limits())
+
+    async def send(self, request):
+        attempts = settings.PAYMENT_GATEWAY_RETRIES + 1
+        for attempt in range(attempts):
+            allowed = self.breaker.allow()
+            if not allowed:
+                raise CircuitOpenError(f'Circuit open for payment gateway {self.name}')
+            response = None
+            try:
+                response = _check(await self.http.request(
+                    request.method, request.path, json=request.json, data=request.data,
+                    headers=request.headers, auth=request.auth,
+                ))
+            except (httpx.TransportError, GatewayError) as exc:
+                self.breaker.record_failure()
+                response = getattr(exc, 'response', None)
+                if attempt + 1 == attempts:
+                    raise GatewayError(f'{self.name}: {exc}', getattr(response, 'status_code', None), response) from exc
+                await asyncio.sleep(_backoff(attempt, response))
+                continue
+            else:
+                self.breaker.record_success()
+                return response
+            finally:
+                if allowed == 'trial':
+                    self.breaker.end_trial()
+
+    async def run(self, operation):
+        try:
+            request = next(operation)
+            while True:
+                request = operation.send(await self.send(request))
+        except StopIteration as stop:
+            return stop.value
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_client(name, base_url):
+    """The process-wide pooled client of a gateway (thread-safe, shared by all threads)."""
+    with _clients_lock:
+        client = _clients.get((name, base_url))
+        if client is None:
+            client = _clients[(name, base_url)] = GatewayClient(name, base_url)
+        return client
+
+
+def get_async_client(name, base_url):
+    """The pooled asyncio client of a gateway for the running event loop."""
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get((name, base_url))
+    if client is None:
+        client = clients[(name, base_url)] = AsyncGatewayClient(name, base_url)
+    return client
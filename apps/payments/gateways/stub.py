@@ -0,0 +1,103 @@
+"""
+A local stand-in for a payment gateway, for offline load tests.
+
+``StubGatewayServer`` speaks the small JSON API of ``StubAdapter`` over
+keep-alive HTTP/1.1, one thread per connection, with configurable latency,
+decline rate and error rate (HTTP 503, which clients retry). Charges and
+refunds live in memory and honour ``Idempotency-Key``.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubGatewayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def simulate(self):
+        """Wait out the configured latency; ``True`` if this request should fail with a 503."""
+        server = self.server
+        time.sleep(max(0.0, random.gauss(server.latency, server.latency * server.jitter)))
+        with server.lock:
+            server.requests += 1
+        return random.random() < server.error_rate
+
+    def do_GET(self):
+        if self.simulate():
+            return self.reply(503, {'error': 'unavailable'})
+        charge = self.server.charges.get(self.path.rsplit('/', 1)[-1]) if self.path.startswith('/charges/') else None
+        if charge is None:
+            return self.reply(404, {'error': 'not found'})
+        self.reply(200, charge)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        if self.simulate():
+            return self.reply(503, {'error': 'unavailable'})
+        server = self.server
+        key = (self.path, self.headers.get('Idempotency-Key'))
+        with server.lock:
+            if key[1] and key in server.idempotent:
+                return self.reply(200, server.idempotent[key])
+
+        if self.path == '/charges':
+            declined = random.random() < server.decline_rate
+            record = {'id': f'ch_{uuid.uuid4().hex[:24]}', 'amount': body.get('amount'), 'currency': body.get('currency'),
+                      'reference': body.get('reference'), 'status': 'declined' if declined else 'succeeded'}
+            status, store = (402 if declined else 200), server.charges
+        elif self.path == '/refunds':
+            if body.get('charge') not in server.charges:
+                return self.reply(404, {'error': 'no such charge'})
+            record = {'id': f're_{uuid.uuid4().hex[:24]}', 'charge': body['charge'], 'amount': body.get('amount'),
+                      'status': 'succeeded'}
+            status, store = 200, server.refunds
+        else:
+            return self.reply(404, {'error': 'not found'})
+
+        with server.lock:
+            store[record['id']] = record
+            if key[1]:
+                server.idempotent[key] = record
+        self.reply(status, record)
+
+
+class StubGatewayServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Many concurrent keep-alive clients during load tests
+    request_queue_size = 1024
+
+    def __init__(self, address=('127.0.0.1', 8765), latency=0.05, jitter=0.2, decline_rate=0.0, error_rate=0.0):
+        super().__init__(address, StubGatewayHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.decline_rate = decline_rate
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.charges = {}
+        self.refunds = {}
+        self.idempotent = {}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """Serve from a background thread; returns the server."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
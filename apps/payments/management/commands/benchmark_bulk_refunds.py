@@ -0,0 +1,100 @@
+import time
+import uuid
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from apps.orders.models import Order
+from apps.payments.gateways.stub import StubGatewayServer
+from apps.payments.models import Payment, PaymentGateway, Refund
+from apps.payments.services import BulkRefunder
+
+GATEWAY = 'refund-bench'
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Refund payments charged on an in-process stub gateway serially, through the bounded pool, '
+        'and under a rate limit; checks the resulting statuses. Everything is rolled back'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payments', type=int, default=400, help='Payments per run')
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--rate-limit', type=float, default=50, help='Calls/sec of the rate-limited run')
+        parser.add_argument('--latency-ms', type=float, default=50)
+
+    def handle(self, *args, **options):
+        server = StubGatewayServer(('127.0.0.1', 0), latency=options['latency_ms'] / 1000, jitter=0.2).start()
+        failures = []
+        try:
+            with transaction.atomic():
+                gateway = PaymentGateway.objects.create(name=GATEWAY, display_name='Refund benchmark',
+                                                        config={'adapter': 'stub', 'base_url': server.url})
+                count = options['payments']
+                runs = [
+                    # label, workers, rate limit, partial amount
+                    ('serial', 1, 0, None),
+                    (f"pool of {options['workers']}", options['workers'], 0, Decimal('5.00')),
+                    (f"pool, {options['rate_limit']:g}/s limit", options['workers'], options['rate_limit'], None),
+                ]
+                for label, workers, rate, amount in runs:
+                    payments = self.seed(server, gateway, count)
+                    PaymentGateway.objects.filter(pk=gateway.pk).update(config={**gateway.config, 'refund_rate_limit': rate})
+                    started = time.perf_counter()
+                    stats = BulkRefunder.refund(Payment.objects.filter(pk__in=[p.pk for p in payments]), 'other',
+                                                amount=amount, workers=workers)
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(
+                        f"{label}: {stats['total']} refunds in {elapsed:.2f}s = {stats['total'] / elapsed:.0f}/s "
+                        f"({stats['completed']} completed, {stats['failed']} failed)"
+                    )
+                    self.verify(label, payments, amount, failures)
+                    if rate and stats['total'] / elapsed > rate * 1.1:
+                        failures.append(f'{label}: rate limit exceeded')
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            server.shutdown()
+        for failure in failures:
+            self.stdout.write(self.style.ERROR(f'FAIL {failure}'))
+        if failures:
+            raise CommandError(f'{len(failures)} bulk refund checks failed')
+        self.stdout.write(self.style.SUCCESS('All bulk refund checks passed.'))
+
+    def seed(self, server, gateway, count):
+        batch = uuid.uuid4().hex[:8]
+        orders = Order.objects.bulk_create([
+            Order(order_number=f'REFUND-{batch}-{i}', email='refund@example.com', phone_number='0',
+                  subtotal=Decimal('40.00'), total=Decimal('40.00'), status='cancelled', payment_status='completed')
+            for i in range(count)
+        ])
+        payments = []
+        for i, order in enumerate(orders):
+            charge = f'ch_{batch}_{i}'
+            server.charges[charge] = {'id': charge, 'amount': 4000, 'currency': 'USD', 'status': 'succeeded'}
+            payments.append(Payment(transaction_id=f'REFUND-{batch}-{i}', gateway_transaction_id=charge, order=order,
+                                    gateway=gateway, amount=Decimal('40.00'), status='completed'))
+        return Payment.objects.bulk_create(payments)
+
+    def verify(self, label, payments, amount, failures):
+        pks = [payment.pk for payment in payments]
+        expected = 'partially_refunded' if amount else 'refunded'
+        if Payment.objects.filter(pk__in=pks).exclude(status=expected).exists():
+            failures.append(f'{label}: payments not {expected}')
+        refunds = Refund.objects.filter(payment__in=pks)
+        if refunds.count() != len(pks) or refunds.exclude(status='completed').exists() \
+                or refunds.filter(gateway_refund_id='').exists():
+            failures.append(f'{label}: refunds not all completed with a gateway id')
+        if not amount and Order.objects.filter(payments__in=pks).exclude(payment_status='refunded').exists():
+            failures.append(f'{label}: orders not marked refunded')
+        # A second run finds nothing left to refund (or only the remaining balance)
+        again = BulkRefunder.create(Payment.objects.filter(pk__in=pks), 'other')
+        if (len(again) != (len(pks) if amount else 0)
+                or any(refund.amount != Decimal('40.00') - amount for refund in again if amount)):
+            failures.append(f'{label}: refundable balance wrong after the run')
+        Refund.objects.filter(pk__in=[refund.pk for refund in again]).delete()
@@ -0,0 +1,164 @@
+import json
+import logging
+import random
+import time
+from collections import Counter
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from apps.orders.models import Order
+from apps.payments.gateways import get_adapter
+from apps.payments.models import Payment, PaymentGateway, Refund, WebhookEvent
+from apps.payments.webhooks import WebhookInbox
+
+GATEWAY = 'webhook-bench'
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Post signed stub-gateway webhooks (with redeliveries and forged signatures) through the '
+        'webhook view, process them, check the outcome and report events/sec; everything is rolled back'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payments', type=int, default=2000)
+        parser.add_argument('--refund-share', type=float, default=0.2)
+        parser.add_argument('--redelivery-share', type=float, default=0.1)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        failures = []
+        try:
+            # Nothing commits, so neither processing tasks nor emails are enqueued
+            with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver']):
+                gateway, payments, refunds = self.seed(options['payments'], options['refund_share'])
+                deliveries = self.deliveries(rng, gateway, payments, refunds, options['redelivery_share'])
+                self.ingest(gateway, deliveries, failures)
+                self.process(gateway, failures)
+                self.verify(payments, refunds, failures)
+                raise Rollback
+        except Rollback:
+            pass
+        if failures:
+            for failure in failures:
+                self.stdout.write(self.style.ERROR(f'FAIL {failure}'))
+            raise CommandError(f'{len(failures)} webhook checks failed')
+        self.stdout.write(self.style.SUCCESS('All webhook checks passed.'))
+
+    def seed(self, count, refund_share):
+        gateway = PaymentGateway.objects.create(name=GATEWAY, display_name='Webhook benchmark',
+                                                config={'adapter': 'stub', 'webhook_secret': 'bench-secret'})
+        orders = Order.objects.bulk_create([
+            Order(order_number=f'WEBHOOK-{i}', email='webhook@example.com', phone_number='0',
+                  subtotal=Decimal('50.00'), total=Decimal('50.00'))
+            for i in range(count)
+        ])
+        payments = Payment.objects.bulk_create([
+            Payment(transaction_id=f'WEBHOOK-{i}', gateway_transaction_id=f'ch_bench_{i}', order=order,
+                    gateway=gateway, amount=Decimal('50.00'), status='processing')
+            for i, order in enumerate(orders)
+        ])
+        # Refunds requested right after payment: half full, half partial
+        step = max(1, round(1 / refund_share)) if refund_share else 0
+        refunds = Refund.objects.bulk_create([
+            Refund(refund_id=f'WEBHOOK-R-{i}', gateway_refund_id=f're_bench_{i}', payment=payment,
+                   amount=payment.amount if i % 2 else Decimal('10.00'), reason='customer_request', status='processing')
+            for i, payment in enumerate(payments[::step] if step else [])
+        ])
+        with connection.cursor() as cursor:
+            # Let the planner see the seeded rows, as it would see real tables
+            cursor.execute(f'ANALYZE {Order._meta.db_table}, {Payment._meta.db_table}, {Refund._meta.db_table}')
+        return gateway, payments, refunds
+
+    def deliveries(self, rng, gateway, payments, refunds, redelivery_share):
+        """Signed bodies in delivery order: each payment's refund after its charge, payments interleaved."""
+        refund_of = {refund.payment_id: refund for refund in refunds}
+        streams = []
+        for payment in payments:
+            events = [('charge.succeeded', {'id': payment.gateway_transaction_id})]
+            refund = refund_of.get(payment.pk)
+            if refund:
+                events.append(('refund.succeeded', {'id': refund.gateway_refund_id,
+                                                    'charge': payment.gateway_transaction_id}))
+            streams.append([{'id': f'evt_{kind}_{data["id"]}', 'type': kind, 'data': data} for kind, data in events])
+
+        adapter = get_adapter(gateway)
+        deliveries = []
+        while streams:
+            stream = streams[rng.randrange(len(streams))]
+            event = stream.pop(0)
+            if not stream:
+                streams.remove(stream)
+            body = json.dumps(event).encode()
+            deliveries.append(('new', body, adapter.sign_webhook(body)))
+            if rng.random() < redelivery_share:
+                deliveries.append(('redelivery', body, adapter.sign_webhook(body)))
+            if rng.random() < redelivery_share:
+                # The same notification resent under a new event id
+                resent = json.dumps({**event, 'id': f"{event['id']}_resent"}).encode()
+                deliveries.append(('resent', resent, adapter.sign_webhook(resent)))
+            if rng.random() < redelivery_share / 2:
+                deliveries.append(('forged', body, '0' * 64))
+        return deliveries
+
+    def ingest(self, gateway, deliveries, failures):
+        client = Client()
+        url = reverse('payments:webhook', args=[gateway.name])
+        statuses = Counter()
+        # Forged deliveries are expected; keep their 400s out of the output
+        request_logger = logging.getLogger('django.request')
+        level, request_logger.level = request_logger.level, logging.ERROR
+        started = time.perf_counter()
+        try:
+            for kind, body, signature in deliveries:
+                response = client.post(url, data=body, content_type='application/json', HTTP_X_STUB_SIGNATURE=signature)
+                statuses[kind, response.status_code] += 1
+        finally:
+            request_logger.level = level
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.MIGRATE_HEADING('ingestion:'))
+        self.stdout.write(f'  {len(deliveries)} deliveries in {elapsed:.2f}s = {len(deliveries) / elapsed:.0f} events/sec, '
+                          f'{elapsed / len(deliveries) * 1000:.2f} ms per request')
+        self.stdout.write(f"  responses: {', '.join(f'{kind} {status}: {count}' for (kind, status), count in sorted(statuses.items()))}")
+        if any(status != (400 if kind == 'forged' else 200) for kind, status in statuses):
+            failures.append('unexpected response status')
+        stored = WebhookEvent.objects.filter(gateway=gateway).count()
+        if stored != statuses['new', 200]:
+            failures.append(f'{stored} events stored for {statuses["new", 200]} distinct deliveries')
+
+    def process(self, gateway, failures):
+        keys = list(WebhookEvent.objects.filter(gateway=gateway, status='pending')
+                    .order_by().values_list('ordering_key', flat=True).distinct())
+        pending = WebhookEvent.objects.filter(gateway=gateway, status='pending').count()
+        started = time.perf_counter()
+        retries = sum(WebhookInbox.process(gateway.pk, key) is not None for key in keys)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.MIGRATE_HEADING('processing:'))
+        self.stdout.write(f'  {pending} events of {len(keys)} payments in {elapsed:.2f}s = {pending / elapsed:.0f} events/sec')
+        if retries:
+            failures.append(f'{retries} payments left waiting for a retry')
+
+    def verify(self, payments, refunds, failures):
+        refunded = {refund.payment_id: refund.amount for refund in refunds}
+        expected = Counter('refunded' if refunded.get(p.pk) == p.amount else 'partially_refunded' if p.pk in refunded
+                           else 'completed' for p in payments)
+        got = Counter(Payment.objects.filter(pk__in=[p.pk for p in payments]).values_list('status', flat=True))
+        if got != expected:
+            failures.append(f'payment statuses {dict(got)} != {dict(expected)}')
+        if Refund.objects.filter(pk__in=[r.pk for r in refunds]).exclude(status='completed').exists():
+            failures.append('refunds not completed')
+        orders = Order.objects.filter(payments__in=payments)
+        if orders.exclude(status='processing').exists() or orders.filter(paid_at__isnull=True).exists():
+            failures.append('orders not moved to processing with paid_at')
+        order_statuses = Counter(orders.values_list('payment_status', flat=True))
+        if order_statuses != Counter({'completed': len(payments) - expected['refunded'], 'refunded': expected['refunded']}):
+            failures.append(f'order payment statuses {dict(order_statuses)}')
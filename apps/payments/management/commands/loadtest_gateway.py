@@ -0,0 +1,138 @@
+import asyncio
+import multiprocessing
+import statistics
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+import httpx
+from apps.payments.gateways import CircuitOpenError, GatewayError, get_adapter, get_breaker
+from apps.payments.gateways.stub import StubGatewayServer
+from apps.payments.models import Payment, PaymentGateway
+
+
+def serve(port, latency, decline_rate, error_rate):
+    StubGatewayServer(('127.0.0.1', port), latency=latency, decline_rate=decline_rate,
+                      error_rate=error_rate).serve_forever()
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test payment charges against the stub gateway through the pooled sync client, '
+        'the asyncio client and (optionally) unpooled one-off requests'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--mode', choices=['sync', 'async', 'naive', 'all'], default='all')
+        parser.add_argument('--url', help='Use a running stub gateway instead of starting one')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency-ms', type=float, default=20)
+        parser.add_argument('--decline-rate', type=float, default=0.05)
+        parser.add_argument('--error-rate', type=float, default=0.02, help='Share of 503s, retried by the client')
+        parser.add_argument('--outage', action='store_true', help='Also show the circuit breaker during an outage')
+
+    def handle(self, *args, **options):
+        server = None
+        url = options['url']
+        if not url:
+            server = multiprocessing.Process(target=serve, daemon=True, args=(
+                options['port'], options['latency_ms'] / 1000, options['decline_rate'], options['error_rate'],
+            ))
+            server.start()
+            url = f"http://127.0.0.1:{options['port']}"
+            self.wait_for(url)
+        gateway = PaymentGateway(name='stub', display_name='Stub', config={'adapter': 'stub', 'base_url': url})
+        adapter = get_adapter(gateway)
+        try:
+            modes = ['naive', 'sync', 'async'] if options['mode'] == 'all' else [options['mode']]
+            for mode in modes:
+                payments = [
+                    Payment(transaction_id=f'LOAD-{mode}-{time.time_ns()}-{i}', amount=Decimal('19.99'), currency='USD')
+                    for i in range(options['requests'])
+                ]
+                started = time.perf_counter()
+                if mode == 'async':
+                    results = asyncio.run(self.run_async(adapter, payments, options['concurrency']))
+                else:
+                    call = self.naive_charge(url) if mode == 'naive' else (lambda payment: self.timed(adapter.call, payment))
+                    with ThreadPoolExecutor(options['concurrency']) as pool:
+                        results = list(pool.map(call, payments))
+                self.report(mode, results, time.perf_counter() - started)
+            if options['outage'] and server is not None:
+                self.outage(adapter, options)
+        finally:
+            if server is not None:
+                server.terminate()
+
+    def wait_for(self, url):
+        for _ in range(100):
+            try:
+                httpx.get(f'{url}/charges/ping', timeout=1)
+                return
+            except httpx.TransportError:
+                time.sleep(0.05)
+
+    def timed(self, call, payment):
+        started = time.perf_counter()
+        try:
+            outcome = call('charge', payment, 'tok_stub')['status']
+        except CircuitOpenError:
+            outcome = 'circuit open'
+        except GatewayError:
+            outcome = 'error'
+        return outcome, time.perf_counter() - started
+
+    async def run_async(self, adapter, payments, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(payment):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    outcome = (await adapter.acall('charge', payment, 'tok_stub'))['status']
+                except CircuitOpenError:
+                    outcome = 'circuit open'
+                except GatewayError:
+                    outcome = 'error'
+                return outcome, time.perf_counter() - started
+
+        return await asyncio.gather(*(one(payment) for payment in payments))
+
+    def naive_charge(self, url):
+        """A fresh connection per request and no retries: what calling httpx.post inline would do."""
+        def charge(payment):
+            started = time.perf_counter()
+            try:
+                response = httpx.post(f'{url}/charges', json={'amount': 1999, 'currency': 'USD',
+                                                             'reference': payment.transaction_id}, timeout=10)
+                outcome = {200: 'completed', 402: 'failed'}.get(response.status_code, 'error')
+            except httpx.TransportError:
+                outcome = 'error'
+            return outcome, time.perf_counter() - started
+        return charge
+
+    def report(self, mode, results, elapsed):
+        latencies = sorted(latency for _outcome, latency in results)
+        outcomes = Counter(outcome for outcome, _latency in results)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f'{mode}:'))
+        self.stdout.write(
+            f'  {len(results)} charges in {elapsed:.2f}s = {len(results) / elapsed:.0f}/s; latency ms '
+            f'p50 {statistics.median(latencies) * 1000:.1f}, p95 {percentile(0.95):.1f}, p99 {percentile(0.99):.1f}'
+        )
+        self.stdout.write(f"  outcomes: {', '.join(f'{outcome} {count}' for outcome, count in outcomes.most_common())}")
+
+    def outage(self, adapter, options):
+        """Point the adapter at a dead port: the breaker should turn timeouts into instant failures."""
+        self.stdout.write(self.style.MIGRATE_HEADING('outage (gateway unreachable):'))
+        adapter.base_url = 'http://127.0.0.1:9'
+        results = [self.timed(adapter.call, Payment(transaction_id=f'OUTAGE-{i}', amount=Decimal('1.00'), currency='USD'))
+                   for i in range(20)]
+        self.report('outage', results, sum(latency for _outcome, latency in results))
+        self.stdout.write(f"  breaker state: {get_breaker(adapter.name).state}")
@@ -0,0 +1,77 @@
+"""
+Reconcile payments and refunds with a gateway settlement file.
+
+    python manage.py reconcile_settlement settlement-2024-03-01.csv --gateway stripe \
+        --since 2024-03-01 --until 2024-03-02 --report mismatches.csv --fix
+
+See ``apps.payments.reconciliation`` for the file format.
+"""
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from apps.payments.models import PaymentGateway
+from apps.payments.reconciliation import SettlementReconciler
+
+ISSUES = ('amount', 'currency', 'status', 'missing_in_database', 'missing_in_file',
+          'duplicate_in_file', 'duplicate_in_database', 'invalid_row')
+
+
+def _moment(value):
+    moment = parse_datetime(value)
+    if moment is None and parse_date(value) is not None:
+        moment = parse_datetime(f'{value}T00:00:00')
+    if moment is None:
+        raise CommandError(f'Invalid date: {value}')
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+class Command(BaseCommand):
+    help = 'Stream a gateway settlement file against payments and refunds, report mismatches and fix safe ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('settlement_file')
+        parser.add_argument('--gateway', required=True, help='Gateway name, e.g. stripe')
+        parser.add_argument('--since', help='Report settled rows missing from the file only if created from this date')
+        parser.add_argument('--until', help='... and before this date')
+        parser.add_argument('--report', help='Write every mismatch to this CSV file ("-" for stdout)')
+        parser.add_argument('--fix', action='store_true',
+                            help='Complete or fail pending/processing rows the file shows as settled or failed')
+        parser.add_argument('--presorted', action='store_true', help='The file is already sorted by id')
+        parser.add_argument('--chunk-rows', type=int, help='Rows per sorted run held in memory')
+
+    def handle(self, *args, **options):
+        gateway = PaymentGateway.objects.filter(name=options['gateway']).first()
+        if gateway is None:
+            raise CommandError(f"Unknown gateway: {options['gateway']}")
+        report = None
+        if options['report']:
+            report = sys.stdout if options['report'] == '-' else open(options['report'], 'w', newline='')
+
+        def progress(rows, elapsed):
+            self.stderr.write(f'{rows} rows, {rows / elapsed:.0f} rows/sec')
+
+        reconciler = SettlementReconciler(
+            gateway, since=_moment(options['since']) if options['since'] else None,
+            until=_moment(options['until']) if options['until'] else None, fix=options['fix'], report=report,
+            chunk_rows=options['chunk_rows'], on_progress=progress,
+        )
+        try:
+            stats = reconciler.run(options['settlement_file'], presorted=options['presorted'])
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
+        finally:
+            if report not in (None, sys.stdout):
+                report.close()
+
+        self.stdout.write(
+            f"{stats['file_rows']} settlement rows, {stats['db_rows']} database rows, {stats['matched']} matched "
+            f"in {stats['elapsed']:.1f}s ({stats['rows_per_sec']:.0f} rows/sec)"
+        )
+        issues = {issue: stats[issue] for issue in ISSUES if stats[issue]}
+        for issue, count in issues.items():
+            self.stdout.write(self.style.WARNING(f'  {issue.replace("_", " ")}: {count}'))
+        if options['fix']:
+            self.stdout.write(f"  fixed: {stats['fixed']}")
+        style = self.style.WARNING if issues else self.style.SUCCESS
+        self.stdout.write(style(f"{sum(issues.values())} mismatches" if issues else 'Settlement reconciled.'))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from apps.payments.models import WebhookEvent
+from apps.payments.webhooks import WebhookInbox
+
+
+class Command(BaseCommand):
+    help = 'Reset stored gateway webhooks to pending and enqueue them for processing again'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--status', action='append', choices=[choice for choice, _label in WebhookEvent.STATUS_CHOICES],
+                            help='Replay events in this status (repeatable, default failed)')
+        parser.add_argument('--gateway', help='Gateway name, e.g. stripe')
+        parser.add_argument('--since', help='Only events received after this ISO datetime')
+        parser.add_argument('--until', help='Only events received before this ISO datetime')
+        parser.add_argument('--event-id', action='append', help='Replay this event (repeatable); ignores --status')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        events = WebhookEvent.objects.all()
+        if options['event_id']:
+            events = events.filter(event_id__in=options['event_id'])
+        else:
+            events = events.filter(status__in=options['status'] or ['failed'])
+        if options['gateway']:
+            events = events.filter(gateway__name=options['gateway'])
+        for option, lookup in (('since', 'received_at__gte'), ('until', 'received_at__lt')):
+            if options[option]:
+                moment = parse_datetime(options[option])
+                if moment is None:
+                    raise CommandError(f'Invalid --{option}: {options[option]}')
+                events = events.filter(**{lookup: moment})
+
+        if options['dry_run']:
+            self.stdout.write(f"{events.exclude(action='').count()} events would be replayed")
+            return
+        with transaction.atomic():
+            count = WebhookInbox.replay(events)
+        self.stdout.write(self.style.SUCCESS(f'{count} events queued for processing'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from apps.payments.gateways.stub import StubGatewayServer
+
+
+class Command(BaseCommand):
+    help = 'Run the local stub payment gateway (use a gateway with config {"adapter": "stub", "base_url": ...})'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency-ms', type=float, default=50)
+        parser.add_argument('--decline-rate', type=float, default=0.0)
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with a 503')
+
+    def handle(self, *args, **options):
+        server = StubGatewayServer(
+            (options['host'], options['port']), latency=options['latency_ms'] / 1000,
+            decline_rate=options['decline_rate'], error_rate=options['error_rate'],
+        )
+        self.stdout.write(f'Stub gateway listening on {server.url}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
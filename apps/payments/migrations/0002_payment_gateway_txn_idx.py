@@ -0,0 +1,20 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:30
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('payments', '0001_initial'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('gateway_transaction_id', ''), _negated=True), fields=['gateway_transaction_id'], name='payment_gateway_txn_idx'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:35
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY on the refunds table cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('payments', '0002_payment_gateway_txn_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, verbose_name='event ID')),
+                ('event_type', models.CharField(max_length=100, verbose_name='event type')),
+                ('action', models.CharField(blank=True, choices=[('payment.completed', 'Payment completed'), ('payment.failed', 'Payment failed'), ('refund.completed', 'Refund completed'), ('refund.failed', 'Refund failed')], max_length=30, verbose_name='action')),
+                ('object_id', models.CharField(blank=True, help_text='Gateway transaction or refund ID', max_length=255, verbose_name='object ID')),
+                ('ordering_key', models.CharField(blank=True, help_text='Gateway transaction ID of the payment', max_length=255, verbose_name='ordering key')),
+                ('payload', models.JSONField(verbose_name='payload')),
+                ('headers', models.JSONField(blank=True, default=dict, verbose_name='headers')),
+                ('verified', models.BooleanField(default=False, verbose_name='signature verified')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processed', 'Processed'), ('ignored', 'Ignored'), ('failed', 'Failed')], default='pending', max_length=20, verbose_name='status')),
+                ('attempts', models.IntegerField(default=0, verbose_name='attempts')),
+                ('error', models.TextField(blank=True, verbose_name='error')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='received at')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='processed at')),
+            ],
+            options={
+                'verbose_name': 'webhook event',
+                'verbose_name_plural': 'webhook events',
+                'ordering': ['-received_at'],
+            },
+        ),
+        AddIndexConcurrently(
+            model_name='refund',
+            index=models.Index(condition=models.Q(('gateway_refund_id', ''), _negated=True), fields=['gateway_refund_id'], name='refund_gateway_refund_idx'),
+        ),
+        migrations.AddField(
+            model_name='webhookevent',
+            name='gateway',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='webhook_events', to='payments.paymentgateway', verbose_name='payment gateway'),
+        ),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['gateway', 'ordering_key', 'id'], name='webhook_event_pending_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='webhookevent',
+            constraint=models.UniqueConstraint(fields=('gateway', 'event_id'), name='webhook_event_unique_id'),
+        ),
+        migrations.AddConstraint(
+            model_name='webhookevent',
+            constraint=models.UniqueConstraint(condition=models.Q(('object_id', ''), _negated=True), fields=('gateway', 'action', 'object_id'), name='webhook_event_unique_object'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:38
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.functions.comparison
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('payments', '0003_webhook_event'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(models.F('gateway'), django.db.models.functions.comparison.Collate('gateway_transaction_id', 'C'), condition=models.Q(('gateway_transaction_id', ''), _negated=True), name='payment_gateway_txn_c_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='refund',
+            index=models.Index(django.db.models.functions.comparison.Collate('gateway_refund_id', 'C'), condition=models.Q(('gateway_refund_id', ''), _negated=True), name='refund_gateway_refund_c_idx'),
+        ),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:41
+
+import json
+import zlib
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import migrations, models, transaction
+import django.db.models.deletion
+import django.utils.timezone
+
+BATCH_SIZE = 2000
+
+# owner model -> side model
+TABLES = (('Payment', 'PaymentResponse'), ('Refund', 'RefundResponse'))
+
+
+def _compress(payload):
+    raw = json.dumps(payload, cls=DjangoJSONEncoder, separators=(',', ':'), sort_keys=True).encode()
+    return zlib.compress(raw, 6), len(raw)
+
+
+def move_responses(apps, schema_editor):
+    """Copy non-empty payloads to the side tables, one committed batch at a time."""
+    for owner_name, side_name in TABLES:
+        owner, side = apps.get_model('payments', owner_name), apps.get_model('payments', side_name)
+        last_pk = 0
+        while True:
+            rows = list(
+                owner.objects.filter(pk__gt=last_pk).exclude(gateway_response={})
+                .order_by('pk').values_list('pk', 'gateway_response', 'updated_at')[:BATCH_SIZE]
+            )
+            if not rows:
+                break
+            with transaction.atomic():
+                side.objects.bulk_create([
+                    side(pk=pk, data=data, size=size, stored_at=updated_at)
+                    for pk, payload, updated_at in rows
+                    for data, size in [_compress(payload)]
+                ], ignore_conflicts=True)
+            last_pk = rows[-1][0]
+
+
+def restore_responses(apps, schema_editor):
+    for owner_name, side_name in TABLES:
+        owner, side = apps.get_model('payments', owner_name), apps.get_model('payments', side_name)
+        last_pk = 0
+        while True:
+            rows = list(side.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'data')[:BATCH_SIZE])
+            if not rows:
+                break
+            with transaction.atomic():
+                owner.objects.bulk_update([
+                    owner(pk=pk, gateway_response=json.loads(zlib.decompress(data))) for pk, data in rows
+                ], ['gateway_response'])
+            last_pk = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+    # Payloads are moved in separately committed batches
+    atomic = False
+
+    dependencies = [
+        ('payments', '0004_settlement_order_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentResponse',
+            fields=[
+                ('data', models.BinaryField(verbose_name='data')),
+                ('size', models.IntegerField(default=0, verbose_name='uncompressed size')),
+                ('stored_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='stored at')),
+                ('payment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='response_payload', serialize=False, to='payments.payment', verbose_name='payment')),
+            ],
+            options={
+                'verbose_name': 'payment gateway response',
+                'verbose_name_plural': 'payment gateway responses',
+            },
+        ),
+        migrations.CreateModel(
+            name='RefundResponse',
+            fields=[
+                ('data', models.BinaryField(verbose_name='data')),
+                ('size', models.IntegerField(default=0, verbose_name='uncompressed size')),
+                ('stored_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='stored at')),
+                ('refund', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='response_payload', serialize=False, to='payments.refund', verbose_name='refund')),
+            ],
+            options={
+                'verbose_name': 'refund gateway response',
+                'verbose_name_plural': 'refund gateway responses',
+            },
+        ),
+        migrations.RunPython(move_responses, restore_responses),
+        migrations.RemoveField(
+            model_name='payment',
+            name='gateway_response',
+        ),
+        migrations.RemoveField(
+            model_name='refund',
+            name='gateway_response',
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The unique indexes are swapped with CREATE/DROP INDEX CONCURRENTLY, outside a transaction
+    atomic = False
+
+    dependencies = [
+        ('payments', '0005_gateway_response_side_tables'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookevent',
+            name='retry_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='retry at'),
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS webhook_event_verified_id '
+                    'ON payments_webhookevent (gateway_id, event_id) WHERE verified',
+                    'DROP INDEX CONCURRENTLY IF EXISTS webhook_event_verified_id',
+                ),
+                migrations.RunSQL(
+                    'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS webhook_event_verified_object '
+                    "ON payments_webhookevent (gateway_id, action, object_id) WHERE verified AND NOT (object_id = '')",
+                    'DROP INDEX CONCURRENTLY IF EXISTS webhook_event_verified_object',
+                ),
+                migrations.RunSQL(
+                    'ALTER TABLE payments_webhookevent DROP CONSTRAINT IF EXISTS webhook_event_unique_id',
+                    'ALTER TABLE payments_webhookevent ADD CONSTRAINT webhook_event_unique_id UNIQUE (gateway_id, event_id)',
+                ),
+                migrations.RunSQL(
+                    'DROP INDEX CONCURRENTLY IF EXISTS webhook_event_unique_object',
+                    'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS webhook_event_unique_object '
+                    "ON payments_webhookevent (gateway_id, action, object_id) WHERE NOT (object_id = '')",
+                ),
+            ],
+            state_operations=[
+                migrations.RemoveConstraint(
+                    model_name='webhookevent',
+                    name='webhook_event_unique_id',
+                ),
+                migrations.RemoveConstraint(
+                    model_name='webhookevent',
+                    name='webhook_event_unique_object',
+                ),
+                migrations.AddConstraint(
+                    model_name='webhookevent',
+                    constraint=models.UniqueConstraint(condition=models.Q(('verified', True)), fields=('gateway', 'event_id'), name='webhook_event_verified_id'),
+                ),
+                migrations.AddConstraint(
+                    model_name='webhookevent',
+                    constraint=models.UniqueConstraint(condition=models.Q(('verified', True), models.Q(('object_id', ''), _negated=True)), fields=('gateway', 'action', 'object_id'), name='webhook_event_verified_object'),
+                ),
+            ],
+        ),
+    ]
@@ -1,6 +1,12 @@
+import json
+import zlib
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator
+from django.db.models.functions import Collate
 from decimal import Decimal
 from apps.accounts.models import User
 from apps.orders.models import Order
@@ -21,7 +27,109 @@ class PaymentGateway(models.Model):
 
     def __str__(self): return self.display_name
 
-class Payment(models.Model):
+def _encode_response(payload):
+    return json.dumps(payload,cls=DjangoJSONEncoder,separators=(',',':'),sort_keys=True).encode()
+
+class GatewayResponseMixin:
+    """
+    ``gateway_response`` kept in a compressed side row (``response_payload``):
+    read on first access (or from ``select_related('response_payload')``) and
+    written by ``save`` when it changed. ``bulk_create``/``update`` do not
+    touch it; use ``store_many`` of the side model.
+    """
+    @property
+    def gateway_response(self):
+        if '_gateway_response' not in self.__dict__:
+            payload={}
+            if self.pk is not None:
+                try: payload=self.response_payload.payload
+                except ObjectDoesNotExist: pass
+            self._gateway_response=payload
+            self._gateway_response_saved=_encode_response(payload)
+        return self._gateway_response
+
+    @gateway_response.setter
+    def gateway_response(self,value):
+        if '_gateway_response_saved' not in self.__dict__ and self.pk is not None:
+            self._gateway_response_saved=None  # stored value unknown: always write
+        self._gateway_response=value or {}
+
+    def save(self,*args,**kwargs):
+        update_fields=kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields']=[name for name in update_fields if name!='gateway_response']
+        super().save(*args,**kwargs)
+        if update_fields is None or 'gateway_response' in update_fields:
+            self._store_gateway_response()
+
+    def _store_gateway_response(self):
+        if '_gateway_response' not in self.__dict__: return
+        encoded=_encode_response(self._gateway_response)
+        if encoded==self.__dict__.get('_gateway_response_saved',b'{}'): return
+        self._meta.get_field('response_payload').related_model.store_many({self.pk:self._gateway_response})
+        self._gateway_response_saved=encoded
+        self.__dict__.pop('response_payload',None); self._state.fields_cache.pop('response_payload',None)
+
+class StatusTrackingMixin:
+    """
+    Sets ``status_changed`` on ``save`` for post_save receivers (the anomaly
+    detector; the live dashboard for payments): whether ``status`` differs
+    from the value loaded from the database. New instances count as changed.
+    """
+    @classmethod
+    def from_db(cls,db,field_names,values):
+        instance=super().from_db(db,field_names,values)
+        if 'status' in field_names:
+            instance._loaded_status=values[field_names.index('status')]
+        return instance
+
+    def save(self,*args,**kwargs):
+        self.status_changed=getattr(self,'_loaded_status',None)!=self.status
+        super().save(*args,**kwargs)
+        self._loaded_status=self.status
+
+class CompressedResponse(models.Model):
+    """A gateway payload as zlib-compressed JSON, out of the payment tables' rows."""
+    data=models.BinaryField(_('data'))
+    size=models.IntegerField(_('uncompressed size'),default=0)
+    stored_at=models.DateTimeField(_('stored at'),default=timezone.now,db_index=True)
+
+    class Meta:
+        abstract=True
+
+    @property
+    def payload(self): return json.loads(zlib.decompress(self.data)) if self.data else {}
+
+    @classmethod
+    def compress(cls,payload):
+        raw=_encode_response(payload)
+        return zlib.compress(raw,6),len(raw)
+
+    @classmethod
+    def store_many(cls,payloads):
+        """Upsert ``{owner pk: payload}`` in one statement; empty payloads delete the row."""
+        owner=cls._meta.pk.attname
+        rows=[]
+        for pk,payload in payloads.items():
+            if payload:
+                data,size=cls.compress(payload)
+                rows.append(cls(**{owner:pk},data=data,size=size,stored_at=timezone.now()))
+        if rows:
+            cls.objects.bulk_create(rows,update_conflicts=True,unique_fields=[cls._meta.pk.name],update_fields=['data','size','stored_at'])
+        empty=[pk for pk,payload in payloads.items() if not payload]
+        if empty:
+            cls.objects.filter(pk__in=empty).delete()
+
+    @classmethod
+    def prune(cls,before,batch_size=5000):
+        """Delete payloads stored before ``before``, in batches; returns how many."""
+        deleted=0
+        while True:
+            batch=list(cls.objects.filter(stored_at__lt=before).values_list('pk',flat=True)[:batch_size])
+            if not batch: return deleted
+            deleted+=cls.objects.filter(pk__in=batch).delete()[0]
+
+class Payment(StatusTrackingMixin,GatewayResponseMixin,models.Model):
     STATUS_CHOICES=[('pending',_('Pending')),('processing',_('Processing')),('completed',_('Completed')),('failed',_('Failed')),('cancelled',_('Cancelled')),('refunded',_('Refunded')),('partially_refunded',_('Partially Refunded'))]
     transaction_id=models.CharField(_('transaction ID'),max_length=100,unique=True)
     gateway_transaction_id=models.CharField(_('gateway transaction ID'),max_length=255,blank=True)
@@ -31,7 +139,6 @@ class Payment(models.Model):
     amount=models.DecimalField(_('amount'),max_digits=10,decimal_places=2,validators=[MinValueValidator(Decimal('0.00'))])
     currency=models.CharField(_('currency'),max_length=3,default='USD')
     status=models.CharField(_('status'),max_length=20,choices=STATUS_CHOICES,default='pending')
-    gateway_response=models.JSONField(_('gateway response'),default=dict,blank=True)
     notes=models.TextField(_('notes'),blank=True)
     created_at=models.DateTimeField(_('created at'),auto_now_add=True)
     updated_at=models.DateTimeField(_('updated at'),auto_now=True)
@@ -39,10 +146,15 @@ class Payment(models.Model):
 
     class Meta:
         verbose_name=_('payment'); verbose_name_plural=_('payments'); ordering=['-created_at']
+        indexes=[
+            models.Index(fields=['gateway_transaction_id'],condition=~models.Q(gateway_transaction_id=''),name='payment_gateway_txn_idx'),
+            # Byte order, as settlement reconciliation merge-joins sorted files against it
+            models.Index(models.F('gateway'),Collate('gateway_transaction_id','C'),condition=~models.Q(gateway_transaction_id=''),name='payment_gateway_txn_c_idx'),
+        ]
 
     def __str__(self): return f"Payment {self.transaction_id} – {self.status}"
 
-class Refund(models.Model):
+class Refund(StatusTrackingMixin,GatewayResponseMixin,models.Model):
     STATUS_CHOICES=[('pending',_('Pending')),('processing',_('Processing')),('completed',_('Completed')),('failed',_('Failed'))]
     REASON_CHOICES=[('customer_request',_('Customer Request')),('duplicate',_('Duplicate Payment')),('fraudulent',_('Fraudulent')),('product_issue',_('Product Issue')),('other',_('Other'))]
     refund_id=models.CharField(_('refund ID'),max_length=100,unique=True)
@@ -53,12 +165,59 @@ class Refund(models.Model):
     reason=models.CharField(_('reason'),max_length=20,choices=REASON_CHOICES)
     status=models.CharField(_('status'),max_length=20,choices=STATUS_CHOICES,default='pending')
     notes=models.TextField(_('notes'),blank=True)
-    gateway_response=models.JSONField(_('gateway response'),default=dict,blank=True)
     created_at=models.DateTimeField(_('created at'),auto_now_add=True)
     updated_at=models.DateTimeField(_('updated at'),auto_now=True)
     completed_at=models.DateTimeField(_('completed at'),null=True,blank=True)
 
     class Meta:
         verbose_name=_('refund'); verbose_name_plural=_('refunds'); ordering=['-created_at']
+        indexes=[
+            models.Index(fields=['gateway_refund_id'],condition=~models.Q(gateway_refund_id=''),name='refund_gateway_refund_idx'),
+            models.Index(Collate('gateway_refund_id','C'),condition=~models.Q(gateway_refund_id=''),name='refund_gateway_refund_c_idx'),
+        ]
 
     def __str__(self): return f"Refund {self.refund_id} – {self.amount}"
+
+class PaymentResponse(CompressedResponse):
+    payment=models.OneToOneField(Payment,on_delete=models.CASCADE,primary_key=True,related_name='response_payload',verbose_name=_('payment'))
+
+    class Meta:
+        verbose_name=_('payment gateway response'); verbose_name_plural=_('payment gateway responses')
+
+class RefundResponse(CompressedResponse):
+    refund=models.OneToOneField(Refund,on_delete=models.CASCADE,primary_key=True,related_name='response_payload',verbose_name=_('refund'))
+
+    class Meta:
+        verbose_name=_('refund gateway response'); verbose_name_plural=_('refund gateway responses')
+
+class WebhookEvent(models.Model):
+    """A gateway webhook as received: stored before acknowledging, processed in order per payment by workers."""
+    STATUS_CHOICES=[('pending',_('Pending')),('processed',_('Processed')),('ignored',_('Ignored')),('failed',_('Failed'))]
+    ACTION_CHOICES=[('payment.completed',_('Payment completed')),('payment.failed',_('Payment failed')),('refund.completed',_('Refund completed')),('refund.failed',_('Refund failed'))]
+    gateway=models.ForeignKey(PaymentGateway,on_delete=models.PROTECT,related_name='webhook_events',verbose_name=_('payment gateway'))
+    event_id=models.CharField(_('event ID'),max_length=255)
+    event_type=models.CharField(_('event type'),max_length=100)
+    action=models.CharField(_('action'),max_length=30,choices=ACTION_CHOICES,blank=True)
+    object_id=models.CharField(_('object ID'),max_length=255,blank=True,help_text=_('Gateway transaction or refund ID'))
+    ordering_key=models.CharField(_('ordering key'),max_length=255,blank=True,help_text=_('Gateway transaction ID of the payment'))
+    payload=models.JSONField(_('payload'))
+    headers=models.JSONField(_('headers'),default=dict,blank=True)
+    verified=models.BooleanField(_('signature verified'),default=False)
+    status=models.CharField(_('status'),max_length=20,choices=STATUS_CHOICES,default='pending')
+    attempts=models.IntegerField(_('attempts'),default=0)
+    error=models.TextField(_('error'),blank=True)
+    received_at=models.DateTimeField(_('received at'),auto_now_add=True)
+    processed_at=models.DateTimeField(_('processed at'),null=True,blank=True)
+    retry_at=models.DateTimeField(_('retry at'),null=True,blank=True)
+
+    class Meta:
+        verbose_name=_('webhook event'); verbose_name_plural=_('webhook events'); ordering=['-received_at']
+        # Verified events only: an unverified (possibly forged) delivery must not take the genuine one's slot
+        constraints=[
+            models.UniqueConstraint(fields=['gateway','event_id'],condition=models.Q(verified=True),name='webhook_event_verified_id'),
+            # Gateways resend the same notification under new event ids
+            models.UniqueConstraint(fields=['gateway','action','object_id'],condition=models.Q(verified=True)&~models.Q(object_id=''),name='webhook_event_verified_object'),
+        ]
+        indexes=[models.Index(fields=['gateway','ordering_key','id'],condition=models.Q(status='pending'),name='webhook_event_pending_idx')]
+
+    def __str__(self): return f"{self.gateway_id}:{self.event_id} {self.event_type} – {self.status}"
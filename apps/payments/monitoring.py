@@ -0,0 +1,135 @@
+"""
+Streaming anomaly detection for payment failures and refunds.
+
+Every settled payment (completed or failed) and every completed refund bumps
+per-minute and per-hour counters in Redis, globally and per gateway. After
+each event the detector compares the rate over the last
+``PAYMENT_ANOMALY_WINDOW_MINUTES`` minutes with the baseline rate over the
+preceding ``PAYMENT_ANOMALY_BASELINE_HOURS`` hours, reading a fixed number of
+bucket keys in one ``MGET``: constant work per event, no table scans.
+"""
+import logging
+import time
+from django.conf import settings
+from django.core.cache import cache
+import redis
+from apps.dashboard.events import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'payment_anomaly'
+
+# metric -> (alert type, priority, failing counter, counters of the denominator, settings prefix)
+METRICS = {
+    'failure': ('payment_failed', 'high', 'failed', ('failed', 'completed'), 'PAYMENT_ANOMALY_FAILURE'),
+    'refund': ('high_refund_rate', 'medium', 'refunded', ('completed',), 'PAYMENT_ANOMALY_REFUND'),
+}
+
+# counter -> metrics it affects
+COUNTER_METRICS = {
+    'completed': ('failure',),
+    'failed': ('failure',),
+    'refunded': ('refund',),
+}
+
+
+def _scopes(gateway_id):
+    return ['all', f'gateway:{gateway_id}'] if gateway_id else ['all']
+
+
+def _minute_key(scope, counter, minute):
+    return f'{KEY_PREFIX}:{scope}:{counter}:m{minute}'
+
+
+def _hour_key(scope, counter, hour):
+    return f'{KEY_PREFIX}:{scope}:{counter}:h{hour}'
+
+
+class AnomalyDetector:
+
+    @classmethod
+    def record(cls, counter, gateway_id=None, now=None):
+        """Count one ``counter`` event ('completed', 'failed' or 'refunded') and check its metrics."""
+        now = int(now or time.time())
+        minute, hour = now // 60, now // 3600
+        window = settings.PAYMENT_ANOMALY_WINDOW_MINUTES
+        baseline = settings.PAYMENT_ANOMALY_BASELINE_HOURS
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for scope in _scopes(gateway_id):
+                pipe.incr(_minute_key(scope, counter, minute))
+                pipe.expire(_minute_key(scope, counter, minute), (window + 2) * 60)
+                pipe.incr(_hour_key(scope, counter, hour))
+                pipe.expire(_hour_key(scope, counter, hour), (baseline + 2) * 3600)
+            pipe.execute()
+
+            for metric in COUNTER_METRICS[counter]:
+                for scope in _scopes(gateway_id):
+                    result = cls.evaluate(metric, scope, now)
+                    if result['anomalous']:
+                        cls._raise(metric, scope, gateway_id if scope != 'all' else None, result)
+        except redis.RedisError:
+            logger.warning(f"Payment anomaly detector unavailable, dropped {counter} event", exc_info=True)
+
+    @classmethod
+    def evaluate(cls, metric, scope, now=None):
+        """Window and baseline rates of ``metric`` for ``scope``, and whether they are anomalous."""
+        _alert_type, _priority, numerator, denominator, prefix = METRICS[metric]
+        now = int(now or time.time())
+        minute, hour = now // 60, now // 3600
+        window = settings.PAYMENT_ANOMALY_WINDOW_MINUTES
+        baseline = settings.PAYMENT_ANOMALY_BASELINE_HOURS
+
+        counters = sorted({numerator, *denominator})
+        window_keys = [(c, _minute_key(scope, c, m)) for c in counters for m in range(minute - window + 1, minute + 1)]
+        # The baseline stops at the last complete hour so a spike doesn't raise its own bar
+        baseline_keys = [(c, _hour_key(scope, c, h)) for c in counters for h in range(hour - baseline, hour)]
+        values = get_redis().mget([key for _, key in window_keys + baseline_keys])
+
+        totals = {'window': dict.fromkeys(counters, 0), 'baseline': dict.fromkeys(counters, 0)}
+        for (counter, _key), value in zip(window_keys, values[:len(window_keys)]):
+            totals['window'][counter] += int(value or 0)
+        for (counter, _key), value in zip(baseline_keys, values[len(window_keys):]):
+            totals['baseline'][counter] += int(value or 0)
+
+        def rate(counts):
+            total = sum(counts[c] for c in denominator)
+            return (counts[numerator] / total if total else 0.0), total
+
+        window_rate, window_events = rate(totals['window'])
+        baseline_rate, baseline_events = rate(totals['baseline'])
+        threshold = getattr(settings, f'{prefix}_RATE')
+        if baseline_events >= settings.PAYMENT_ANOMALY_MIN_EVENTS:
+            threshold = max(threshold, baseline_rate * getattr(settings, f'{prefix}_MULTIPLIER'))
+        return {
+            'rate': window_rate,
+            'events': window_events,
+            'baseline_rate': baseline_rate,
+            'threshold': threshold,
+            'anomalous': window_events >= settings.PAYMENT_ANOMALY_MIN_EVENTS and window_rate >= threshold,
+        }
+
+    @classmethod
+    def _raise(cls, metric, scope, gateway_id, result):
+        from apps.dashboard.models import SystemAlert
+        from .models import PaymentGateway
+
+        # One alert write per metric and scope per cooldown, however many events arrive
+        if not cache.add(f'{KEY_PREFIX}:alerted:{metric}:{scope}', 1, settings.PAYMENT_ANOMALY_COOLDOWN_MINUTES * 60):
+            return
+        alert_type, priority, _numerator, _denominator, _prefix = METRICS[metric]
+        label = 'all gateways'
+        if gateway_id:
+            label = PaymentGateway.objects.filter(pk=gateway_id).values_list('display_name', flat=True).first() or scope
+        what = 'Payment failure' if metric == 'failure' else 'Refund'
+        SystemAlert.raise_alert(
+            alert_type=alert_type,
+            priority=priority,
+            title=f'{what} rate anomaly: {label}',
+            message=(
+                f"{what} rate {result['rate']:.1%} over the last {settings.PAYMENT_ANOMALY_WINDOW_MINUTES} minutes "
+                f"({result['events']} events); baseline {result['baseline_rate']:.1%}, "
+                f"threshold {result['threshold']:.1%}."
+            ),
+            fingerprint=f'{alert_type}:{scope}',
+        )
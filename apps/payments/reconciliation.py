@@ -0,0 +1,283 @@
+"""
+Streaming reconciliation of payments and refunds against gateway settlement files.
+
+A settlement file is a CSV with a header and one row per settled charge or
+refund::
+
+    type,id,amount,currency,status
+    charge,pi_3Nx...,49.90,USD,succeeded
+    refund,re_3Nx...,10.00,USD,succeeded
+
+``id`` is the gateway's transaction or refund id and ``status`` the
+gateway's status, mapped through the gateway adapter. Rows are sorted by id
+in chunks written to temporary files (unless the file is already sorted)
+and merged back with ``heapq.merge``; the database side is read through a
+server-side cursor in the same byte order (``COLLATE "C"``). Both streams
+are merge-joined, so memory stays bounded by the chunk size whatever the
+size of the file or of the tables.
+"""
+import csv
+import heapq
+import os
+import tempfile
+import time
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce, Collate
+from django.utils import timezone
+from apps.orders.models import Order
+from apps.orders.services import OrderStateMachine
+from .gateways import get_adapter
+from .models import Payment, Refund
+from .monitoring import AnomalyDetector
+from .services import RefundRollup
+
+COLUMNS = ('type', 'id', 'amount', 'currency', 'status')
+REPORT_COLUMNS = ('issue', 'type', 'gateway_id', 'pk', 'settlement', 'database', 'line')
+
+# Database statuses that mean money moved, and how a settlement reports them
+SETTLED = {
+    'charge': {'completed': 'completed', 'refunded': 'completed', 'partially_refunded': 'completed'},
+    'refund': {'completed': 'completed'},
+}
+FIXABLE = ('pending', 'processing')
+
+
+def merge_join(left, right):
+    """Pairs of rows of two iterables sorted by their first item, ``None`` on the side lacking the key."""
+    left, right = iter(left), iter(right)
+    a, b = next(left, None), next(right, None)
+    while a is not None or b is not None:
+        if b is None or (a is not None and a[0] < b[0]):
+            yield a, None
+            a = next(left, None)
+        elif a is None or b[0] < a[0]:
+            yield None, b
+            b = next(right, None)
+        else:
+            yield a, b
+            a, b = next(left, None), next(right, None)
+
+
+class SettlementReconciler:
+    CHUNK_ROWS = 200_000
+    FETCH_SIZE = 5000
+    FIX_BATCH = 1000
+    PROGRESS_ROWS = 100_000
+
+    def __init__(self, gateway, since=None, until=None, fix=False, report=None, chunk_rows=None, on_progress=None):
+        """
+        ``since``/``until`` bound the creation time of the rows reported as
+        missing from the file (a daily file only covers its day). With
+        ``fix``, pending or processing rows the file shows as settled or
+        failed, with matching amount and currency, are updated in bulk.
+        ``report`` is a writable text file for the mismatch CSV.
+        """
+        adapter = get_adapter(gateway)
+        self.gateway = gateway
+        self.statuses = {'charge': adapter.PAYMENT_STATUSES, 'refund': adapter.REFUND_STATUSES}
+        self.since, self.until = since, until
+        self.fix = fix
+        self.report = csv.writer(report) if report else None
+        self.chunk_rows = chunk_rows or self.CHUNK_ROWS
+        self.on_progress = on_progress
+        self.stats = Counter()
+        self.fixes = {}
+        self.started = None
+
+    def run(self, path, presorted=False):
+        self.started = time.perf_counter()
+        if self.report:
+            self.report.writerow(REPORT_COLUMNS)
+        with tempfile.TemporaryDirectory(prefix='settlement-') as workdir:
+            streams = self.presorted(path) if presorted else self.sort(path, workdir)
+            for record_type, database in (('charge', self.payments()), ('refund', self.refunds())):
+                self.join(record_type, streams[record_type](), database)
+        self.flush()
+        self.stats['elapsed'] = time.perf_counter() - self.started
+        self.stats['rows_per_sec'] = (self.stats['file_rows'] + self.stats['db_rows']) / max(self.stats['elapsed'], 1e-9)
+        return self.stats
+
+    # Settlement side
+
+    def read(self, path, quiet=False):
+        """``(type, (id, amount, currency, status, line))`` per valid row; invalid rows are reported unless ``quiet``."""
+        with open(path, newline='', encoding='utf-8-sig') as handle:
+            reader = csv.reader(handle)
+            header = [column.strip().lower() for column in next(reader, [])]
+            missing = [column for column in COLUMNS if column not in header]
+            if missing:
+                raise ValueError(f"Settlement file lacks columns: {', '.join(missing)}")
+            index = [header.index(column) for column in COLUMNS]
+            for line, row in enumerate(reader, start=2):
+                try:
+                    record_type, gateway_id, amount, currency, status = (row[i].strip() for i in index)
+                    amount = Decimal(amount)
+                except (IndexError, InvalidOperation):
+                    record_type = gateway_id = ''
+                if record_type.lower() not in self.statuses or not gateway_id:
+                    if not quiet:
+                        self.issue('invalid_row', record_type, gateway_id, None, ','.join(row), '', line)
+                    continue
+                record_type = record_type.lower()
+                status = self.statuses[record_type].get(status, status.lower())
+                yield record_type, (gateway_id, amount, currency.upper(), status, line)
+
+    def sort(self, path, workdir):
+        """External sort: sorted runs of ``chunk_rows`` per type on disk, merged lazily."""
+        runs = {record_type: [] for record_type in self.statuses}
+        rows = self.read(path)
+        while True:
+            chunk = list(islice(rows, self.chunk_rows))
+            if not chunk:
+                break
+            for record_type, paths in runs.items():
+                records = sorted((record for kind, record in chunk if kind == record_type), key=lambda r: r[0])
+                if records:
+                    paths.append(os.path.join(workdir, f'{record_type}-{len(paths)}.csv'))
+                    with open(paths[-1], 'w', newline='') as handle:
+                        csv.writer(handle).writerows(records)
+            del chunk
+
+        def merged(paths):
+            return lambda: heapq.merge(*(self.read_run(run) for run in paths), key=lambda r: r[0])
+        return {record_type: merged(paths) for record_type, paths in runs.items()}
+
+    def read_run(self, path):
+        with open(path, newline='') as handle:
+            for gateway_id, amount, currency, status, line in csv.reader(handle):
+                yield gateway_id, Decimal(amount), currency, status, int(line)
+
+    def presorted(self, path):
+        """Files already sorted by id are read once per type instead of being sorted."""
+        def stream(record_type, quiet):
+            previous = ''
+            for kind, record in self.read(path, quiet):
+                if kind == record_type:
+                    if record[0] < previous:
+                        raise ValueError(f'Settlement file is not sorted by id (line {record[4]})')
+                    previous = record[0]
+                    yield record
+        # Invalid rows are reported on the first pass only
+        return {'charge': lambda: stream('charge', False), 'refund': lambda: stream('refund', True)}
+
+    # Database side, in the same (byte) order as Python sorts strings
+
+    def payments(self):
+        return (
+            Payment.objects.filter(gateway=self.gateway).exclude(gateway_transaction_id='')
+            .order_by(Collate('gateway_transaction_id', 'C'))
+            .values_list('gateway_transaction_id', 'pk', 'amount', 'currency', 'status', 'created_at')
+            .iterator(chunk_size=self.FETCH_SIZE)
+        )
+
+    def refunds(self):
+        return (
+            Refund.objects.filter(payment__gateway=self.gateway).exclude(gateway_refund_id='')
+            .order_by(Collate('gateway_refund_id', 'C'))
+            .values_list('gateway_refund_id', 'pk', 'amount', 'payment__currency', 'status', 'created_at')
+            .iterator(chunk_size=self.FETCH_SIZE)
+        )
+
+    # Join
+
+    def join(self, record_type, settlement, database):
+        previous = None
+        report_at = self.stats['file_rows'] + self.stats['db_rows'] + self.PROGRESS_ROWS
+        for record, row in merge_join(settlement, database):
+            key = (record or row)[0]
+            if record is not None:
+                self.stats['file_rows'] += 1
+            if row is not None:
+                self.stats['db_rows'] += 1
+            if key == previous:
+                if record is not None:
+                    self.issue('duplicate_in_file', record_type, key, None, record[3], '', record[4])
+                if row is not None:
+                    self.issue('duplicate_in_database', record_type, key, row[1], '', row[4], '')
+            elif row is None:
+                self.issue('missing_in_database', record_type, key, None, record[3], '', record[4])
+            elif record is None:
+                if row[4] in SETTLED[record_type] and self.in_window(row[5]):
+                    self.issue('missing_in_file', record_type, key, row[1], '', row[4], '')
+            else:
+                self.compare(record_type, record, row)
+            previous = key
+            processed = self.stats['file_rows'] + self.stats['db_rows']
+            if self.on_progress and processed >= report_at:
+                self.on_progress(processed, time.perf_counter() - self.started)
+                report_at += self.PROGRESS_ROWS
+
+    def compare(self, record_type, record, row):
+        gateway_id, amount, currency, status, line = record
+        _key, pk, db_amount, db_currency, db_status, _created_at = row
+        self.stats['matched'] += 1
+        clean = True
+        if amount != db_amount:
+            clean = self.issue('amount', record_type, gateway_id, pk, amount, db_amount, line)
+        if currency != db_currency:
+            clean = self.issue('currency', record_type, gateway_id, pk, currency, db_currency, line)
+        if SETTLED[record_type].get(db_status, db_status) != status:
+            fixable = clean and db_status in FIXABLE and status in ('completed', 'failed')
+            self.issue('status', record_type, gateway_id, pk, status, db_status, line, fixed=fixable and self.fix)
+            if fixable and self.fix:
+                self.queue_fix(record_type, status, pk)
+
+    def in_window(self, created_at):
+        return (self.since is None or created_at >= self.since) and (self.until is None or created_at < self.until)
+
+    def issue(self, kind, record_type, gateway_id, pk, settlement, database, line, fixed=False):
+        self.stats[kind] += 1
+        if self.report:
+            self.report.writerow((f'{kind} (fixed)' if fixed else kind, record_type, gateway_id, pk or '',
+                                  settlement, database, line))
+        return False
+
+    # Fixes, applied in bulk as they accumulate
+
+    def queue_fix(self, record_type, status, pk):
+        pks = self.fixes.setdefault((record_type, status), [])
+        pks.append(pk)
+        if len(pks) >= self.FIX_BATCH:
+            self.apply_fixes(record_type, status, pks)
+            pks.clear()
+
+    def flush(self):
+        for (record_type, status), pks in self.fixes.items():
+            if pks:
+                self.apply_fixes(record_type, status, pks)
+        self.fixes = {}
+
+    def apply_fixes(self, record_type, status, pks):
+        now = timezone.now()
+        updates = {'status': status, 'updated_at': now}
+        if status == 'completed':
+            updates['completed_at'] = Coalesce(F('completed_at'), now)
+        model = Payment if record_type == 'charge' else Refund
+        with transaction.atomic():
+            # Guarded by status: rows changed since they were read are left alone
+            rows = model.objects.filter(pk__in=pks, status__in=FIXABLE)
+            gateway_ids = dict(rows.select_for_update(of=('self',)).values_list('pk', 'gateway_id' if record_type == 'charge' else 'payment__gateway_id'))
+            changed = list(gateway_ids)
+            rows.filter(pk__in=changed).update(**updates)
+            if record_type == 'charge':
+                orders = Order.objects.filter(payments__pk__in=changed)
+                if status == 'completed':
+                    Order.objects.filter(pk__in=orders.values('pk')).exclude(payment_status='refunded') \
+                        .update(payment_status='completed', updated_at=now)
+                    OrderStateMachine.transition(Order.objects.filter(pk__in=orders.values('pk'), status='pending'),
+                                                 'processing', notes='Payment settled (reconciliation)')
+                else:
+                    Order.objects.filter(pk__in=orders.values('pk'), payment_status='pending') \
+                        .update(payment_status='failed', updated_at=now)
+            elif status == 'completed':
+                RefundRollup.apply(Refund.objects.filter(pk__in=changed).values_list('payment_id', flat=True).distinct())
+            # update() skips the post_save receivers that feed the anomaly detector
+            counter = status if record_type == 'charge' else 'refunded' if status == 'completed' else None
+            if counter:
+                settled = list(gateway_ids.values())
+                transaction.on_commit(lambda: [AnomalyDetector.record(counter, gateway_id) for gateway_id in settled])
+        self.stats['fixed'] += len(changed)
@@ -0,0 +1,230 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from apps.dashboard.events import publish
+from apps.orders.models import Order
+from .gateways import CircuitOpenError, GatewayError, get_adapter
+from .gateways.adapters import ManualAdapter
+from .gateways.client import RETRYABLE_STATUSES
+from .models import Payment, Refund, RefundResponse
+from .monitoring import AnomalyDetector
+
+logger = logging.getLogger(__name__)
+
+
+class RefundRollup:
+    """
+    Set-based payment status rollup after refunds complete outside
+    ``Refund.save`` (bulk updates): payments whose completed refunds cover
+    the amount become refunded, the others partially refunded.
+    """
+
+    SQL = f'''
+        UPDATE {Payment._meta.db_table} AS payment
+        SET status = CASE WHEN refunded.total >= payment.amount THEN 'refunded' ELSE 'partially_refunded' END,
+            updated_at = %s
+        FROM (
+            SELECT payment_id, SUM(amount) AS total FROM {Refund._meta.db_table}
+            WHERE status = 'completed' AND payment_id = ANY(%s)
+            GROUP BY payment_id
+        ) AS refunded
+        WHERE payment.id = refunded.payment_id AND payment.status IN ('completed', 'partially_refunded')
+        RETURNING payment.id, payment.status, payment.order_id
+    '''
+
+    @classmethod
+    def apply(cls, payment_ids):
+        """Roll up ``payment_ids``; returns ``{payment id: new status}``."""
+        if not payment_ids:
+            return {}
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(cls.SQL, [now, list(payment_ids)])
+            rows = cursor.fetchall()
+        refunded_orders = [order_id for _pk, status, order_id in rows if status == 'refunded']
+        if refunded_orders:
+            Order.objects.filter(pk__in=refunded_orders).update(payment_status='refunded', updated_at=now)
+        return {pk: status for pk, status, _order_id in rows}
+
+
+class RateLimiter:
+    """Spaces calls ``rate`` per second apart across threads (``0`` for no limit)."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_at = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+class BulkRefunder:
+    """
+    Refunds for many payments at once, e.g. a cancelled preorder batch.
+
+    ``create`` locks the refundable payments and bulk-creates one refund per
+    payment for its unrefunded balance. ``dispatch`` then calls the gateways
+    from a bounded thread pool, outside any transaction and spaced by a
+    per-gateway rate limit (``PAYMENT_REFUND_RATE_LIMIT`` or the gateway's
+    ``config['refund_rate_limit']``), and applies the results in batches:
+    bulk status updates, the set-based refund rollup and progress events on
+    the dashboard stream. The worker threads never touch the database.
+    Refunds the gateway rejected fail; those whose outcome is unknown
+    (timeouts, 5xx, unexpected errors) stay processing without a gateway
+    id, and ``retry`` sends them again: the idempotency key is the refund
+    id, so the gateway answers a repeat with the refund it already made.
+    """
+
+    BATCH_SIZE = 200
+    REFUNDABLE = ('completed', 'partially_refunded')
+    # A processing refund without a gateway id this long is not in flight any more
+    RETRY_AFTER = timedelta(minutes=15)
+
+    @classmethod
+    def refund(cls, queryset, reason, user=None, notes='', amount=None, workers=None, on_progress=None):
+        """Refund the payments of ``queryset`` (payments or orders); returns the run's stats."""
+        return cls.dispatch(cls.create(queryset, reason, user, notes, amount), workers, on_progress)
+
+    @classmethod
+    def retry(cls, older_than=None, limit=None, workers=None, on_progress=None):
+        """Dispatch again the refunds left processing without a gateway id; returns the run's stats."""
+        now = timezone.now()
+        with transaction.atomic():
+            refunds = [
+                refund for refund in
+                Refund.objects.filter(status='processing', gateway_refund_id='', payment__gateway__isnull=False,
+                                      updated_at__lt=now - (older_than or cls.RETRY_AFTER))
+                .select_for_update(skip_locked=True, of=('self',)).select_related('payment__gateway')
+                .order_by('pk')[:limit]
+                # Bank transfer refunds are confirmed by hand
+                if not isinstance(get_adapter(refund.payment.gateway), ManualAdapter)
+            ]
+            # Pushed back like a lease, so overlapping runs never send the same refunds
+            Refund.objects.filter(pk__in=[refund.pk for refund in refunds]).update(updated_at=now)
+        return cls.dispatch(refunds, workers, on_progress) if refunds else {'total': 0}
+
+    @classmethod
+    def refundable(cls, queryset):
+        payments = queryset if queryset.model is Payment else Payment.objects.filter(order__in=queryset)
+        return payments.filter(status__in=cls.REFUNDABLE, gateway__isnull=False)
+
+    @classmethod
+    def create(cls, queryset, reason, user=None, notes='', amount=None):
+        """
+        Create a processing refund for each refundable payment: its balance
+        not yet refunded or being refunded, capped at ``amount`` if given.
+        """
+        refunded = (
+            Refund.objects.filter(payment=OuterRef('pk')).exclude(status='failed')
+            .order_by().values('payment').annotate(total=Sum('amount')).values('total')
+        )
+        with transaction.atomic():
+            payments = (
+                cls.refundable(queryset).select_for_update(of=('self',)).order_by('pk')
+                .select_related('gateway', 'response_payload')
+                .annotate(refunded=Coalesce(Subquery(refunded), Value(Decimal('0.00')), output_field=DecimalField()))
+            )
+            refunds = []
+            for payment in payments:
+                balance = payment.amount - payment.refunded
+                if balance > 0:
+                    refunds.append(Refund(
+                        refund_id=f'REF-{uuid.uuid4().hex[:16].upper()}', payment=payment, processed_by=user,
+                        amount=min(balance, amount) if amount else balance, reason=reason, status='processing', notes=notes,
+                    ))
+            return Refund.objects.bulk_create(refunds, batch_size=cls.BATCH_SIZE)
+
+    @classmethod
+    def dispatch(cls, refunds, workers=None, on_progress=None):
+        gateways = {refund.payment.gateway_id: refund.payment.gateway for refund in refunds}
+        adapters = {pk: get_adapter(gateway) for pk, gateway in gateways.items()}
+        limiters = {
+            pk: RateLimiter((gateway.config or {}).get('refund_rate_limit', settings.PAYMENT_REFUND_RATE_LIMIT))
+            for pk, gateway in gateways.items()
+        }
+        run = uuid.uuid4().hex[:12]
+        stats = {'run': run, 'total': len(refunds), 'done': 0, 'completed': 0, 'processing': 0, 'failed': 0}
+        started = time.perf_counter()
+
+        def call(refund):
+            gateway_id = refund.payment.gateway_id
+            try:
+                limiters[gateway_id].wait()
+                return refund, adapters[gateway_id].call('refund', refund)
+            except Exception as exc:
+                if not isinstance(exc, GatewayError):
+                    logger.exception(f'Refund {refund.refund_id} could not be dispatched')
+                # Only a refund the gateway surely did not make fails; otherwise it may have gone
+                # through (timeout, 5xx): it stays processing for the webhook or status check
+                status = 'failed' if cls.rejected(exc) else 'processing'
+                return refund, {'status': status, 'gateway_id': '', 'response': {}, 'error': str(exc)}
+
+        results = []
+        with ThreadPoolExecutor(workers or settings.PAYMENT_BULK_REFUND_WORKERS) as pool:
+            for future in as_completed([pool.submit(call, refund) for refund in refunds]):
+                results.append(future.result())
+                if len(results) >= cls.BATCH_SIZE:
+                    cls.apply_results(results, stats)
+                    results = []
+                    cls._progress(stats, started, on_progress)
+        cls.apply_results(results, stats)
+        stats['finished'] = True
+        cls._progress(stats, started, on_progress)
+        return stats
+
+    @classmethod
+    def rejected(cls, exc):
+        """Whether ``exc`` means the refund request was surely not carried out."""
+        if isinstance(exc, CircuitOpenError):
+            return True
+        status = exc.status if isinstance(exc, GatewayError) else None
+        return status is not None and 400 <= status < 500 and status not in RETRYABLE_STATUSES
+
+    @classmethod
+    def apply_results(cls, results, stats):
+        if not results:
+            return
+        now = timezone.now()
+        for refund, result in results:
+            refund.status = result['status'] if result['status'] in ('completed', 'failed') else 'processing'
+            refund.gateway_refund_id = result['gateway_id'] or refund.gateway_refund_id
+            refund.completed_at = now if refund.status == 'completed' else None
+            refund.updated_at = now
+            if result.get('error'):
+                refund.notes = f"{refund.notes}\n{result['error']}".strip()
+            stats[refund.status] += 1
+        stats['done'] += len(results)
+
+        refunds = [refund for refund, _result in results]
+        completed = [refund for refund in refunds if refund.status == 'completed']
+        with transaction.atomic():
+            Refund.objects.bulk_update(refunds, ['status', 'gateway_refund_id', 'completed_at', 'updated_at', 'notes'])
+            RefundResponse.store_many({refund.pk: result['response'] for refund, result in results if result['response']})
+            RefundRollup.apply({refund.payment_id for refund in completed})
+            # bulk_update skips the post_save receiver that feeds the anomaly detector
+            gateway_ids = [refund.payment.gateway_id for refund in completed]
+            transaction.on_commit(lambda: [AnomalyDetector.record('refunded', gateway_id) for gateway_id in gateway_ids])
+
+    @classmethod
+    def _progress(cls, stats, started, on_progress):
+        stats['elapsed'] = round(time.perf_counter() - started, 3)
+        publish('refunds.progress', stats)
+        if on_progress:
+            on_progress(stats)
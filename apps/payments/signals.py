@@ -0,0 +1,19 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .models import Payment, Refund
+from .monitoring import AnomalyDetector
+
+
+@receiver(post_save, sender=Payment)
+def payment_status_changed(sender, instance, **kwargs):
+    if getattr(instance, 'status_changed', False) and instance.status in ('completed', 'failed'):
+        status, gateway_id = instance.status, instance.gateway_id
+        transaction.on_commit(lambda: AnomalyDetector.record(status, gateway_id))
+
+
+@receiver(post_save, sender=Refund)
+def refund_status_changed(sender, instance, **kwargs):
+    if getattr(instance, 'status_changed', False) and instance.status == 'completed':
+        gateway_id = Payment.objects.filter(pk=instance.payment_id).values_list('gateway_id', flat=True).first()
+        transaction.on_commit(lambda: AnomalyDetector.record('refunded', gateway_id))
@@ -0,0 +1,51 @@
+from datetime import timedelta
+from celery import shared_task
+from django.conf import settings
+from django.utils import timezone
+
+
+@shared_task
+def process_webhook_events_task(gateway_id, ordering_key):
+    """Apply the pending webhooks of one payment in order, retrying later if one has to wait."""
+    from .webhooks import WebhookInbox
+
+    retry_in = WebhookInbox.process(gateway_id, ordering_key)
+    if retry_in is not None:
+        process_webhook_events_task.apply_async((gateway_id, ordering_key), countdown=retry_in)
+    return retry_in
+
+
+@shared_task
+def enqueue_stale_webhooks_task():
+    """Pick up stored webhooks whose processing task was lost."""
+    from .webhooks import WebhookInbox
+    return WebhookInbox.enqueue_stale()
+
+
+@shared_task
+def prune_gateway_responses_task():
+    """Delete raw gateway payloads older than ``PAYMENT_RESPONSE_RETENTION_DAYS``."""
+    from .models import PaymentResponse, RefundResponse
+
+    if not settings.PAYMENT_RESPONSE_RETENTION_DAYS:
+        return {}
+    before = timezone.now() - timedelta(days=settings.PAYMENT_RESPONSE_RETENTION_DAYS)
+    return {model.__name__: model.prune(before) for model in (PaymentResponse, RefundResponse)}
+
+
+@shared_task
+def bulk_refund_task(payment_ids, reason, user_id=None, notes=''):
+    """Refund what remains of the given payments; progress goes to the dashboard stream."""
+    from apps.accounts.models import User
+    from .models import Payment
+    from .services import BulkRefunder
+
+    user = User.objects.filter(pk=user_id).first() if user_id else None
+    return BulkRefunder.refund(Payment.objects.filter(pk__in=payment_ids), reason, user=user, notes=notes)
+
+
+@shared_task
+def retry_refunds_task():
+    """Send again the refunds whose gateway call had an unknown outcome."""
+    from .services import BulkRefunder
+    return BulkRefunder.retry()
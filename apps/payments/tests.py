@@ -1,3 +1,352 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+from importlib import import_module
+from unittest import mock
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+import httpx
+from apps.orders.models import Order
+from .gateways.adapters import ManualAdapter, PayPalAdapter, SquareAdapter, StripeAdapter, StubAdapter
+from .gateways.client import CircuitBreaker, CircuitOpenError, GatewayClient, GatewayError, GatewayRequest
+from .models import Payment, PaymentGateway, PaymentResponse, Refund, RefundResponse, WebhookEvent
+from .reconciliation import SettlementReconciler
+from .services import BulkRefunder
+from .webhooks import WebhookInbox
 
-# Create your tests here.
+
+class StatusTrackingTests(TestCase):
+    def setUp(self):
+        self.order = Order.objects.create(order_number='PAY-1', email='pay@example.com', phone_number='0',
+                                          subtotal=Decimal('10.00'), total=Decimal('10.00'))
+
+    def test_status_changed(self):
+        payment = Payment.objects.create(transaction_id='T-1', order=self.order, amount=Decimal('10.00'))
+        self.assertTrue(payment.status_changed)
+        payment.notes = 'checked'
+        payment.save()
+        self.assertFalse(payment.status_changed)
+
+        refund = Refund.objects.create(refund_id='R-1', payment=payment, amount=Decimal('5.00'), reason='other')
+        refund = Refund.objects.get(pk=refund.pk)
+        refund.save()
+        self.assertFalse(refund.status_changed)
+        refund.status = 'completed'
+        refund.save()
+        self.assertTrue(refund.status_changed)
+
+
+class GatewayResponseTests(TestCase):
+    def setUp(self):
+        self.order = Order.objects.create(order_number='RESP-1', email='resp@example.com', phone_number='0',
+                                          subtotal=Decimal('10.00'), total=Decimal('10.00'))
+
+    def payment(self, transaction_id, **fields):
+        return Payment.objects.create(transaction_id=transaction_id, order=self.order, amount=Decimal('10.00'),
+                                      **fields)
+
+    def test_round_trip(self):
+        response = {'id': 'ch_1', 'amount': 1000, 'captured_at': timezone.now()}
+        payment = self.payment('T-RESP', gateway_response=response)
+        stored = PaymentResponse.objects.get(pk=payment.pk)
+        self.assertEqual(stored.payload['id'], 'ch_1')
+
+        payment = Payment.objects.get(pk=payment.pk)
+        self.assertEqual(payment.gateway_response['amount'], 1000)
+        with self.assertNumQueries(1):
+            payment.save()  # unchanged payload: only the payment row
+
+        payment.gateway_response = {**payment.gateway_response, 'amount': 500}
+        payment.save()
+        self.assertEqual(Payment.objects.get(pk=payment.pk).gateway_response['amount'], 500)
+        payment.gateway_response = {}
+        payment.save()
+        self.assertFalse(PaymentResponse.objects.filter(pk=payment.pk).exists())
+
+        # Assigned without reading first: written even if it might be the stored value
+        refund = Refund.objects.create(refund_id='R-RESP', payment=payment, amount=Decimal('1.00'), reason='other')
+        refund = Refund.objects.get(pk=refund.pk)
+        refund.gateway_response = {'id': 're_1'}
+        refund.save()
+        self.assertEqual(RefundResponse.objects.get(pk=refund.pk).payload, {'id': 're_1'})
+
+    def test_update_fields_without_gateway_response(self):
+        payment = self.payment('T-FIELDS', gateway_response={'id': 'ch_1'})
+        payment.gateway_response = {'id': 'ch_2'}
+        payment.notes = 'checked'
+        payment.save(update_fields=['notes'])
+        self.assertEqual(PaymentResponse.objects.get(pk=payment.pk).payload, {'id': 'ch_1'})
+        self.assertEqual(Payment.objects.get(pk=payment.pk).notes, 'checked')
+
+        with self.assertNumQueries(1):
+            payment.save(update_fields=['gateway_response'])  # the side row only
+        self.assertEqual(PaymentResponse.objects.get(pk=payment.pk).payload, {'id': 'ch_2'})
+
+    def test_select_related_without_side_row(self):
+        with_response = self.payment('T-WITH', gateway_response={'id': 'ch_1'})
+        without = self.payment('T-WITHOUT')
+        payments = Payment.objects.select_related('response_payload').in_bulk([with_response.pk, without.pk])
+        with self.assertNumQueries(0):
+            self.assertEqual(payments[with_response.pk].gateway_response, {'id': 'ch_1'})
+            self.assertEqual(payments[without.pk].gateway_response, {})
+
+    def test_prune(self):
+        payments = [self.payment(f'T-PRUNE-{n}', gateway_response={'n': n}) for n in range(3)]
+        cutoff = timezone.now() - timedelta(days=30)
+        PaymentResponse.objects.filter(pk__in=[payments[0].pk, payments[1].pk]).update(
+            stored_at=cutoff - timedelta(days=1))
+        self.assertEqual(PaymentResponse.prune(cutoff, batch_size=1), 2)
+        self.assertEqual(list(PaymentResponse.objects.values_list('pk', flat=True)), [payments[2].pk])
+        self.assertEqual(Payment.objects.count(), 3)
+        self.assertEqual(Payment.objects.get(pk=payments[0].pk).gateway_response, {})
+
+
+class GatewayResponseMigrationTests(TransactionTestCase):
+    before = [('payments', '0004_settlement_order_idx')]
+    after = [('payments', '0005_gateway_response_side_tables')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_payloads_move_to_the_side_tables_and_back(self):
+        old = self.migrate(self.before)
+        order = old.get_model('orders', 'Order').objects.create(
+            order_number='MIG-1', email='mig@example.com', phone_number='0',
+            subtotal=Decimal('10.00'), total=Decimal('10.00'))
+        OldPayment = old.get_model('payments', 'Payment')
+        responses = [{'id': 'ch_1', 'amount': 1000}, {}, {'id': 'ch_3', 'meta': {'risk': 'low'}}]
+        payments = [OldPayment.objects.create(transaction_id=f'T-MIG-{n}', order=order, amount=Decimal('10.00'),
+                                              gateway_response=response)
+                    for n, response in enumerate(responses)]
+        refund = old.get_model('payments', 'Refund').objects.create(
+            refund_id='R-MIG', payment=payments[0], amount=Decimal('1.00'), reason='other',
+            gateway_response={'id': 're_1'})
+
+        # One payment per batch, so the batching loop runs more than once
+        migration = import_module('apps.payments.migrations.0005_gateway_response_side_tables')
+        with mock.patch.object(migration, 'BATCH_SIZE', 1):
+            self.migrate(self.after)
+            stored = sorted(PaymentResponse.objects.values_list('pk', flat=True))
+            self.assertEqual(stored, [payments[0].pk, payments[2].pk])
+            for payment, response in zip(payments, responses):
+                self.assertEqual(Payment.objects.get(pk=payment.pk).gateway_response, response)
+            self.assertEqual(Refund.objects.get(pk=refund.pk).gateway_response, {'id': 're_1'})
+
+            old = self.migrate(self.before)
+        restored = dict(old.get_model('payments', 'Payment').objects.values_list('pk', 'gateway_response'))
+        self.assertEqual(restored, {payment.pk: response for payment, response in zip(payments, responses)})
+
+
+class WebhookSignatureTests(SimpleTestCase):
+    body = b'{"id": "evt_1", "type": "payment_intent.succeeded"}'
+
+    def test_stripe(self):
+        timestamp = str(int(time.time()))
+        signature = hmac.new(b'', timestamp.encode() + b'.' + self.body, hashlib.sha256).hexdigest()
+        headers = {'Stripe-Signature': f't={timestamp},v1={signature}'}
+        self.assertFalse(StripeAdapter(PaymentGateway(name='stripe', config={})).verify_webhook(self.body, headers))
+
+        secret = 'whsec_test'
+        signature = hmac.new(secret.encode(), timestamp.encode() + b'.' + self.body, hashlib.sha256).hexdigest()
+        adapter = StripeAdapter(PaymentGateway(name='stripe', config={'webhook_secret': secret}))
+        self.assertTrue(adapter.verify_webhook(self.body, {'Stripe-Signature': f't={timestamp},v1={signature}'}))
+
+    def test_square_and_stub_without_secret(self):
+        self.assertFalse(SquareAdapter(PaymentGateway(name='square', config={})).verify_webhook(
+            self.body, {'X-Square-Hmacsha256-Signature': ''}))
+        forged = hmac.new(b'', self.body, hashlib.sha256).hexdigest()
+        self.assertFalse(StubAdapter(PaymentGateway(name='stripe', config={})).verify_webhook(
+            self.body, {'X-Stub-Signature': forged}))
+        adapter = StubAdapter(PaymentGateway(name='stripe', config={'webhook_secret': 's'}))
+        self.assertTrue(adapter.verify_webhook(self.body, {'X-Stub-Signature': adapter.sign_webhook(self.body)}))
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_trial_released_after_unexpected_error(self):
+        def handler(request):
+            raise ValueError('malformed request')
+
+        client = GatewayClient('breaker-test', 'http://gateway.test')
+        client.breaker = CircuitBreaker('breaker-test', failure_threshold=1, reset_timeout=1)
+        client.http = httpx.Client(base_url='http://gateway.test', transport=httpx.MockTransport(handler))
+        client.breaker.opened_at = time.monotonic() - 2
+        with self.assertRaises(ValueError):
+            client.send(GatewayRequest('GET', '/charges/1'))
+        self.assertFalse(client.breaker.trial)
+        self.assertTrue(client.breaker.allow())
+
+
+class WebhookInboxTests(TestCase):
+    def setUp(self):
+        self.gateway = PaymentGateway.objects.create(name='paypal', display_name='PayPal')
+        order = Order.objects.create(order_number='HOOK-1', email='hook@example.com', phone_number='0',
+                                     subtotal=Decimal('10.00'), total=Decimal('10.00'))
+        self.payment = Payment.objects.create(transaction_id='T-HOOK', order=order, amount=Decimal('10.00'),
+                                              gateway=self.gateway, gateway_transaction_id='PP-ORDER',
+                                              status='processing')
+
+    def deliver(self, signature):
+        body = json.dumps({
+            'id': 'WH-1', 'event_type': 'PAYMENT.CAPTURE.COMPLETED',
+            'resource': {'id': 'CAP-1', 'supplementary_data': {'related_ids': {'order_id': 'PP-ORDER'}}},
+        }).encode()
+        headers = dict.fromkeys(PayPalAdapter.WEBHOOK_HEADERS, 'x') | {'Paypal-Transmission-Sig': signature}
+        return WebhookInbox.receive(self.gateway, body, headers)
+
+    def confirm(self, method, payload, headers):
+        return headers['Paypal-Transmission-Sig'] == 'genuine'
+
+    def test_forged_delivery_does_not_block_the_genuine_one(self):
+        self.assertEqual(self.deliver('forged'), (200, 'WH-1'))
+        self.assertEqual(self.deliver('genuine'), (200, 'WH-1'))
+        self.assertEqual(self.deliver('genuine'), (200, 'WH-1'))
+        with mock.patch.object(PayPalAdapter, 'call', autospec=True,
+                               side_effect=lambda adapter, *args: self.confirm(*args)):
+            self.assertIsNone(WebhookInbox.process(self.gateway.pk, 'PP-ORDER'))
+
+        events = list(WebhookEvent.objects.order_by('id').values_list('status', 'verified', 'error'))
+        self.assertEqual(events, [
+            ('ignored', False, 'Signature rejected by the gateway'),
+            ('processed', True, ''),
+            ('ignored', False, 'Duplicate of a verified event'),
+        ])
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'completed')
+
+    def test_overdue_retries_are_re_enqueued(self):
+        self.deliver('genuine')
+        now = timezone.now()
+        WebhookEvent.objects.update(attempts=2, received_at=now - timedelta(hours=1), retry_at=now - timedelta(hours=1))
+        with mock.patch.object(WebhookInbox, 'enqueue') as enqueue:
+            self.assertEqual(WebhookInbox.enqueue_stale(), 1)
+            enqueue.assert_called_once_with([(self.gateway.pk, 'PP-ORDER')])
+
+            WebhookEvent.objects.update(retry_at=now + timedelta(minutes=1))
+            self.assertEqual(WebhookInbox.enqueue_stale(), 0)
+
+    def test_early_run_waits_for_the_backing_off_event(self):
+        self.deliver('genuine')
+        retry_at = timezone.now() + timedelta(seconds=90)
+        WebhookEvent.objects.update(attempts=1, error='Payment PP-ORDER not found', retry_at=retry_at)
+        with mock.patch.object(PayPalAdapter, 'call') as call:
+            retry_in = WebhookInbox.process(self.gateway.pk, 'PP-ORDER')
+        self.assertTrue(85 <= retry_in <= 90)
+        call.assert_not_called()
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts, event.retry_at), ('pending', 1, retry_at))
+
+        WebhookEvent.objects.update(retry_at=timezone.now() - timedelta(seconds=1))
+        with mock.patch.object(PayPalAdapter, 'call', autospec=True,
+                               side_effect=lambda adapter, *args: self.confirm(*args)):
+            self.assertIsNone(WebhookInbox.process(self.gateway.pk, 'PP-ORDER'))
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('processed', 2))
+
+
+class ReconciliationFixTests(TestCase):
+    def setUp(self):
+        self.gateway = PaymentGateway.objects.create(name='stripe', display_name='Stripe')
+        # Past 'pending': settling its payments fires no order transition
+        order = Order.objects.create(order_number='REC-1', email='rec@example.com', phone_number='0',
+                                     status='processing', subtotal=Decimal('10.00'), total=Decimal('10.00'))
+        self.payments = [
+            Payment.objects.create(transaction_id=f'T-REC-{n}', order=order, amount=Decimal('5.00'),
+                                   gateway=self.gateway, status='processing')
+            for n in range(2)
+        ]
+
+    def test_fixes_feed_the_anomaly_detector(self):
+        reconciler = SettlementReconciler(self.gateway, fix=True)
+        refund = Refund.objects.create(refund_id='R-REC', payment=self.payments[0], amount=Decimal('5.00'),
+                                       reason='other', status='processing')
+        with mock.patch('apps.payments.reconciliation.AnomalyDetector.record') as record:
+            with self.captureOnCommitCallbacks(execute=True):
+                reconciler.apply_fixes('charge', 'completed', [self.payments[0].pk])
+                reconciler.apply_fixes('charge', 'failed', [self.payments[1].pk])
+                reconciler.apply_fixes('refund', 'completed', [refund.pk])
+                # Already settled: left alone, not counted again
+                reconciler.apply_fixes('charge', 'failed', [self.payments[0].pk])
+        self.assertEqual(record.call_args_list, [
+            mock.call('completed', self.gateway.pk), mock.call('failed', self.gateway.pk),
+            mock.call('refunded', self.gateway.pk),
+        ])
+        self.assertEqual(reconciler.stats['fixed'], 3)
+
+
+class BulkRefundDispatchTests(TestCase):
+    outcomes = {
+        'completed': {'status': 'completed', 'gateway_id': 're_1', 'response': {}},
+        'declined': GatewayError('Gateway returned 402', 402),
+        'timeout': GatewayError('stripe: read timeout'),
+        'unavailable': GatewayError('Gateway returned 503', 503),
+        'circuit': CircuitOpenError('Circuit open for payment gateway stripe'),
+        'bug': KeyError('status'),
+    }
+
+    def setUp(self):
+        gateway = PaymentGateway.objects.create(name='stripe', display_name='Stripe', config={'refund_rate_limit': 0})
+        for name in self.outcomes:
+            order = Order.objects.create(order_number=f'BULK-{name}', email='bulk@example.com', phone_number='0',
+                                         subtotal=Decimal('10.00'), total=Decimal('10.00'))
+            Payment.objects.create(transaction_id=f'T-{name}', order=order, amount=Decimal('10.00'),
+                                   gateway=gateway, status='completed', notes=name)
+
+    def refund(self, refund):
+        outcome = self.outcomes[refund.payment.notes]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def test_only_rejected_refunds_fail(self):
+        refunds = BulkRefunder.create(Payment.objects.all(), 'other')
+        adapter = mock.Mock(call=lambda operation, refund: self.refund(refund))
+        with mock.patch('apps.payments.services.get_adapter', return_value=adapter), \
+                mock.patch('apps.payments.services.publish'), self.assertLogs('apps.payments.services', 'ERROR'):
+            stats = BulkRefunder.dispatch(refunds, workers=2)
+
+        statuses = dict(Refund.objects.values_list('payment__notes', 'status'))
+        self.assertEqual(statuses, {'completed': 'completed', 'declined': 'failed', 'timeout': 'processing',
+                                    'unavailable': 'processing', 'circuit': 'failed', 'bug': 'processing'})
+        self.assertEqual((stats['done'], stats['completed'], stats['failed'], stats['processing']), (6, 1, 2, 3))
+
+    def test_unknown_outcomes_are_sent_again(self):
+        refunds = BulkRefunder.create(Payment.objects.all(), 'other')
+        adapter = mock.Mock(call=lambda operation, refund: self.refund(refund))
+        with mock.patch('apps.payments.services.get_adapter', return_value=adapter), \
+                mock.patch('apps.payments.services.publish'), self.assertLogs('apps.payments.services', 'ERROR'):
+            BulkRefunder.dispatch(refunds, workers=2)
+        manual = PaymentGateway.objects.create(name='manual', display_name='Bank transfer')
+        Payment.objects.filter(notes='unavailable').update(gateway=manual)
+
+        # Still in flight: left alone
+        self.assertEqual(BulkRefunder.retry(), {'total': 0})
+        Refund.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+        sent = []
+
+        def complete(refund):
+            sent.append(refund.refund_id)
+            return {'status': 'completed', 'gateway_id': f'gw-{refund.refund_id}', 'response': {}}
+        adapter = mock.Mock(call=lambda operation, refund: complete(refund))
+        with mock.patch('apps.payments.services.get_adapter',
+                        side_effect=lambda gateway: ManualAdapter(gateway) if gateway == manual else adapter), \
+                mock.patch('apps.payments.services.publish'):
+            stats = BulkRefunder.retry(workers=2)
+
+        retried = Refund.objects.filter(payment__notes__in=['timeout', 'bug'])
+        self.assertEqual(sorted(sent), sorted(retried.values_list('refund_id', flat=True)))
+        self.assertEqual(stats['completed'], 2)
+        self.assertEqual(set(retried.values_list('status', flat=True)), {'completed'})
+        self.assertEqual(Refund.objects.get(payment__notes='unavailable').status, 'processing')
+        self.assertEqual(Payment.objects.get(notes='timeout').status, 'refunded')
+        self.assertEqual(BulkRefunder.retry(), {'total': 0})
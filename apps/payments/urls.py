@@ -0,0 +1,8 @@
+from django.urls import path
+from . import views
+
+app_name = 'payments'
+
+urlpatterns = [
+    path('webhooks/<str:gateway_name>/', views.gateway_webhook, name='webhook'),
+]
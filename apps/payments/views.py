@@ -1,3 +1,16 @@
-from django.shortcuts import render
+from django.http import HttpResponse, HttpResponseNotFound
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from .models import PaymentGateway
+from .webhooks import WebhookInbox
 
-# Create your views here.
+
+@csrf_exempt
+@require_POST
+def gateway_webhook(request, gateway_name):
+    """Store a gateway notification and acknowledge it; workers apply it (see ``WebhookInbox``)."""
+    gateway = PaymentGateway.objects.filter(name=gateway_name, is_active=True).first()
+    if gateway is None:
+        return HttpResponseNotFound()
+    status, _event_id = WebhookInbox.receive(gateway, request.body, request.headers)
+    return HttpResponse(status=status)
@@ -0,0 +1,247 @@
+"""
+Gateway webhook inbox.
+
+``WebhookInbox.receive`` runs in the request: it checks the signature,
+stores the raw event with one ``INSERT ... ON CONFLICT DO NOTHING`` and
+enqueues processing on commit, so the gateway gets its 200 within a couple
+of milliseconds. Redeliveries are dropped by the unique constraints on the
+event id and on (action, gateway object id), which also catches the same
+notification resent under a new event id. The constraints cover verified
+events only: events that only the gateway can authenticate (PayPal) are
+stored unverified and deduplicated once confirmed, so a forged delivery
+cannot take the place of the genuine one.
+
+``WebhookInbox.process`` runs in Celery workers and applies the pending
+events of one payment (its ordering key, the gateway transaction id) in
+arrival order under a transaction-level advisory lock. Events that reach us
+before the payment or refund they are about has its gateway id are retried
+with backoff, holding back the later events of the same payment; a sweep
+re-enqueues pending events whose task was lost.
+"""
+import json
+import logging
+import math
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+from apps.orders.models import Order
+from apps.orders.services import OrderStateMachine
+from .gateways import GatewayError, get_adapter
+from .models import Payment, Refund, WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+
+class RetryLater(Exception):
+    """The event cannot be applied yet, e.g. its payment has no gateway id so far."""
+
+
+class WebhookInbox:
+    INSERT_SQL = (
+        f'INSERT INTO {WebhookEvent._meta.db_table} '
+        '(gateway_id, event_id, event_type, action, object_id, ordering_key, payload, headers, verified, '
+        'status, attempts, error, received_at) '
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 0, '', %s) "
+        'ON CONFLICT DO NOTHING RETURNING id'
+    )
+
+    @classmethod
+    def receive(cls, gateway, body, headers):
+        """
+        Store one webhook delivery. Returns ``(http_status, event_id)``:
+        400 for a bad signature or body, 200 otherwise, duplicates included.
+        """
+        adapter = get_adapter(gateway)
+        verified = adapter.verify_webhook(body, headers)
+        if verified is False:
+            return 400, None
+        try:
+            payload = json.loads(body)
+            event = adapter.parse_webhook(payload)
+        except (ValueError, AttributeError):
+            return 400, None
+        if not event['event_id']:
+            return 400, None
+
+        ordering_key = event['ordering_key'] or event['object_id']
+        actionable = bool(event['action'] and ordering_key)
+        kept_headers = {header: headers.get(header) for header in adapter.WEBHOOK_HEADERS}
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(cls.INSERT_SQL, [
+                    gateway.pk, event['event_id'], event['event_type'][:100], event['action'],
+                    event['object_id'], ordering_key, body.decode(), json.dumps(kept_headers),
+                    verified is True, 'pending' if actionable else 'ignored', timezone.now(),
+                ])
+                inserted = cursor.fetchone() is not None
+            if inserted and actionable:
+                transaction.on_commit(lambda: cls.enqueue([(gateway.pk, ordering_key)]))
+        return 200, event['event_id']
+
+    @classmethod
+    def enqueue(cls, keys):
+        from .tasks import process_webhook_events_task
+
+        for gateway_id, ordering_key in keys:
+            process_webhook_events_task.delay(gateway_id, ordering_key)
+
+    @classmethod
+    def process(cls, gateway_id, ordering_key):
+        """
+        Apply the pending events of one payment in order. Returns the
+        seconds after which to try again when an event had to wait, else ``None``.
+        """
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', [f'webhook:{gateway_id}:{ordering_key}'])
+            events = list(
+                WebhookEvent.objects.filter(gateway_id=gateway_id, ordering_key=ordering_key, status='pending')
+                .select_related('gateway').order_by('id')
+            )
+            now = timezone.now()
+            if events and events[0].retry_at and events[0].retry_at > now:
+                # Woken early (e.g. by a new delivery): the head event is still backing off
+                return math.ceil((events[0].retry_at - now).total_seconds())
+            for event in events:
+                event.attempts += 1
+                # Cleared before applying: an ignored event keeps the reason set by ``apply``
+                event.error = ''
+                try:
+                    with transaction.atomic():
+                        event.status = cls.apply(event)
+                except (RetryLater, GatewayError) as exc:
+                    event.error = str(exc)
+                    if event.attempts < settings.PAYMENT_WEBHOOK_MAX_ATTEMPTS:
+                        delay = settings.PAYMENT_WEBHOOK_RETRY_DELAY * 2 ** (event.attempts - 1)
+                        event.retry_at = timezone.now() + timedelta(seconds=delay)
+                        event.save(update_fields=['attempts', 'error', 'retry_at'])
+                        # Later events of this payment wait for this one
+                        return delay
+                    event.status = 'failed'
+                    logger.error(f'Webhook {event} failed after {event.attempts} attempts: {exc}')
+                except Exception as exc:
+                    logger.exception(f'Webhook {event} could not be applied')
+                    event.status, event.error = 'failed', str(exc)
+                event.processed_at = timezone.now()
+                event.save(update_fields=['status', 'attempts', 'error', 'processed_at'])
+        return None
+
+    @classmethod
+    def apply(cls, event):
+        """Apply one event; returns its new status ('processed' or 'ignored')."""
+        if not event.verified:
+            if cls.verified_duplicates(event).exists():
+                event.error = 'Duplicate of a verified event'
+                return 'ignored'
+            if not get_adapter(event.gateway).call('confirm_webhook', event.payload, event.headers):
+                event.error = 'Signature rejected by the gateway'
+                return 'ignored'
+            event.verified = True
+            try:
+                with transaction.atomic():
+                    event.save(update_fields=['verified'])
+            except IntegrityError:
+                # A copy was confirmed meanwhile (it took the unique slot)
+                event.verified = False
+                event.error = 'Duplicate of a verified event'
+                return 'ignored'
+
+        payment = (
+            Payment.objects.select_for_update().select_related('order')
+            .filter(gateway_id=event.gateway_id, gateway_transaction_id=event.ordering_key).first()
+        )
+        if event.action.startswith('refund.'):
+            refunds = Refund.objects.select_for_update().filter(gateway_refund_id=event.object_id)
+            refund = refunds.filter(payment=payment).first() if payment else refunds.filter(payment__gateway_id=event.gateway_id).first()
+            if refund is None:
+                raise RetryLater(f'Refund {event.object_id} not found')
+            return cls.apply_refund(event, refund)
+        if payment is None:
+            raise RetryLater(f'Payment {event.ordering_key} not found')
+        return cls.apply_payment(event, payment)
+
+    @classmethod
+    def verified_duplicates(cls, event):
+        """Verified events the unique constraints would make ``event`` a duplicate of."""
+        same = Q(event_id=event.event_id)
+        if event.object_id:
+            same |= Q(action=event.action, object_id=event.object_id)
+        return WebhookEvent.objects.filter(same, gateway_id=event.gateway_id, verified=True).exclude(pk=event.pk)
+
+    @classmethod
+    def apply_payment(cls, event, payment):
+        now = timezone.now()
+        order = payment.order
+        if event.action == 'payment.completed':
+            if payment.status not in ('pending', 'processing', 'failed'):
+                return 'ignored'
+            payment.status, payment.completed_at = 'completed', now
+            payment.save(update_fields=['status', 'completed_at', 'updated_at'])
+            Order.objects.filter(pk=order.pk).update(payment_status='completed', updated_at=now)
+            OrderStateMachine.transition(Order.objects.filter(pk=order.pk, status='pending'), 'processing',
+                                         notes=f'Payment {payment.transaction_id} completed')
+            transaction.on_commit(lambda: cls._send_confirmation(order.pk))
+            return 'processed'
+
+        if payment.status not in ('pending', 'processing'):
+            return 'ignored'
+        payment.status = 'failed'
+        payment.save(update_fields=['status', 'updated_at'])
+        Order.objects.filter(pk=order.pk).exclude(payment_status='completed').update(payment_status='failed', updated_at=now)
+        return 'processed'
+
+    @classmethod
+    def apply_refund(cls, event, refund):
+        if refund.status not in ('pending', 'processing'):
+            return 'ignored'
+        now = timezone.now()
+        if event.action == 'refund.failed':
+            refund.status = 'failed'
+            refund.save(update_fields=['status', 'updated_at'])
+            return 'processed'
+
+        refund.status, refund.completed_at = 'completed', now
+        refund.save(update_fields=['status', 'completed_at', 'updated_at'])
+        payment = Payment.objects.select_for_update().get(pk=refund.payment_id)
+        if payment.status in ('completed', 'partially_refunded'):
+            refunded = payment.refunds.filter(status='completed').aggregate(total=Sum('amount'))['total']
+            payment.status = 'refunded' if refunded >= payment.amount else 'partially_refunded'
+            payment.save(update_fields=['status', 'updated_at'])
+            if payment.status == 'refunded':
+                Order.objects.filter(pk=payment.order_id).update(payment_status='refunded', updated_at=now)
+        return 'processed'
+
+    @classmethod
+    def _send_confirmation(cls, order_id):
+        from apps.emails.tasks import send_order_status_emails_task
+        send_order_status_emails_task.delay([order_id], 'order_confirmation')
+
+    @classmethod
+    def replay(cls, queryset):
+        """
+        Reset events to pending and enqueue them again; returns how many.
+        Applying is idempotent, so replaying processed events is harmless.
+        """
+        queryset = queryset.exclude(action='')
+        keys = set(queryset.order_by().values_list('gateway_id', 'ordering_key').distinct())
+        count = queryset.update(status='pending', attempts=0, error='', processed_at=None, retry_at=None)
+        transaction.on_commit(lambda: cls.enqueue(sorted(keys)))
+        return count
+
+    @classmethod
+    def enqueue_stale(cls, older_than=timedelta(minutes=5)):
+        """
+        Re-enqueue payments whose pending events were never picked up, or
+        whose retry is ``older_than`` overdue, e.g. after a broker restart.
+        """
+        cutoff = timezone.now() - older_than
+        keys = (
+            WebhookEvent.objects.filter(status='pending')
+            .filter(Q(attempts=0, received_at__lt=cutoff) | Q(retry_at__lt=cutoff))
+            .order_by().values_list('gateway_id', 'ordering_key').distinct()
+        )
+        keys = list(keys)
+        cls.enqueue(keys)
+        return len(keys)
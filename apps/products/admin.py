@@ -11,7 +11,7 @@ class CategoryAdmin(TranslatableAdmin):
 
 @admin.register(ProductType)
 class ProductTypeAdmin(admin.ModelAdmin):
-    list_display = ['get_name_display']
+    list_display = ['get_name_display','weight_kg','length_cm','width_cm','height_cm']
 
 class ProductImageInline(admin.TabularInline):
     model = ProductImage; extra=1
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:30
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.expressions
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='inventory',
+            index=models.Index(condition=models.Q(('quantity__lte', django.db.models.expressions.CombinedExpression(models.F('low_stock_threshold'), '+', models.F('reserved_quantity')))), fields=['product'], name='inventory_low_stock_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:49
+
+from decimal import Decimal
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_inventory_low_stock_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='height_cm',
+            field=models.DecimalField(blank=True, decimal_places=1, max_digits=6, null=True, validators=[django.core.validators.MinValueValidator(Decimal('0.0'))], verbose_name='height (cm)'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='length_cm',
+            field=models.DecimalField(blank=True, decimal_places=1, max_digits=6, null=True, validators=[django.core.validators.MinValueValidator(Decimal('0.0'))], verbose_name='length (cm)'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='weight_kg',
+            field=models.DecimalField(blank=True, decimal_places=3, max_digits=8, null=True, validators=[django.core.validators.MinValueValidator(Decimal('0.000'))], verbose_name='weight (kg)'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='width_cm',
+            field=models.DecimalField(blank=True, decimal_places=1, max_digits=6, null=True, validators=[django.core.validators.MinValueValidator(Decimal('0.0'))], verbose_name='width (cm)'),
+        ),
+        migrations.AddField(
+            model_name='producttype',
+            name='height_cm',
+            field=models.DecimalField(decimal_places=1, default=Decimal('0.0'), max_digits=6, validators=[django.core.validators.MinValueValidator(Decimal('0.0'))], verbose_name='height (cm)'),
+        ),
+        migrations.AddField(
+            model_name='producttype',
+            name='length_cm',
+            field=models.DecimalField(decimal_places=1, default=Decimal('0.0'), max_digits=6, validators=[django.core.validators.MinValueValidator(Decimal('0.0'))], verbose_name='length (cm)'),
+        ),
+        migrations.AddField(
+            model_name='producttype',
+            name='weight_kg',
+            field=models.DecimalField(decimal_places=3, default=Decimal('0.000'), max_digits=8, validators=[django.core.validators.MinValueValidator(Decimal('0.000'))], verbose_name='weight (kg)'),
+        ),
+        migrations.AddField(
+            model_name='producttype',
+            name='width_cm',
+            field=models.DecimalField(decimal_places=1, default=Decimal('0.0'), max_digits=6, validators=[django.core.validators.MinValueValidator(Decimal('0.0'))], verbose_name='width (cm)'),
+        ),
+    ]
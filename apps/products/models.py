@@ -1,9 +1,12 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils.translation import gettext_lazy as _
 from parler.models import TranslatableModel, TranslatedFields
 from django.core.validators import MinValueValidator
 from decimal import Decimal
 
+# Available stock (quantity - reserved) at or under the threshold
+LOW_STOCK=models.Q(quantity__lte=models.F('low_stock_threshold')+models.F('reserved_quantity'))
+
 class Category(TranslatableModel):
     translations = TranslatedFields(
         name=models.CharField(_('name'), max_length=100),
@@ -30,6 +33,15 @@ class ProductType(models.Model):
         ('other_accessory',_('Other Accessory'))
     ]
     name = models.CharField(_('name'), max_length=50, choices=PRODUCT_TYPE_CHOICES, unique=True)
+    # One unit as packed for shipping (a single in its toploader, a sealed booster box)
+    weight_kg = models.DecimalField(_('weight (kg)'), max_digits=8, decimal_places=3, default=Decimal('0.000'),
+                                    validators=[MinValueValidator(Decimal('0.000'))])
+    length_cm = models.DecimalField(_('length (cm)'), max_digits=6, decimal_places=1, default=Decimal('0.0'),
+                                    validators=[MinValueValidator(Decimal('0.0'))])
+    width_cm = models.DecimalField(_('width (cm)'), max_digits=6, decimal_places=1, default=Decimal('0.0'),
+                                   validators=[MinValueValidator(Decimal('0.0'))])
+    height_cm = models.DecimalField(_('height (cm)'), max_digits=6, decimal_places=1, default=Decimal('0.0'),
+                                    validators=[MinValueValidator(Decimal('0.0'))])
 
     class Meta:
         verbose_name=_('product type'); verbose_name_plural=_('product types')
@@ -59,6 +71,15 @@ class Product(TranslatableModel):
     rarity = models.CharField(_('rarity'), max_length=50, blank=True)
     language = models.CharField(_('language'), max_length=20, default='English')
     condition = models.CharField(_('condition'), max_length=20, blank=True)
+    # Shipping weight and dimensions of one packed unit; empty uses the product type's
+    weight_kg = models.DecimalField(_('weight (kg)'), max_digits=8, decimal_places=3, null=True, blank=True,
+                                    validators=[MinValueValidator(Decimal('0.000'))])
+    length_cm = models.DecimalField(_('length (cm)'), max_digits=6, decimal_places=1, null=True, blank=True,
+                                    validators=[MinValueValidator(Decimal('0.0'))])
+    width_cm = models.DecimalField(_('width (cm)'), max_digits=6, decimal_places=1, null=True, blank=True,
+                                   validators=[MinValueValidator(Decimal('0.0'))])
+    height_cm = models.DecimalField(_('height (cm)'), max_digits=6, decimal_places=1, null=True, blank=True,
+                                    validators=[MinValueValidator(Decimal('0.0'))])
     main_image = models.ImageField(_('main image'), upload_to='products/', null=True, blank=True)
     is_active = models.BooleanField(_('active'), default=True)
     is_featured = models.BooleanField(_('featured'), default=False)
@@ -114,6 +135,23 @@ class Inventory(models.Model):
 
     class Meta:
         verbose_name=_('inventory'); verbose_name_plural=_('inventories')
+        indexes=[models.Index(fields=['product'],condition=LOW_STOCK,name='inventory_low_stock_idx')]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'quantity' in field_names and 'reserved_quantity' in field_names:
+            instance._loaded_available = instance.available_quantity
+        return instance
+
+    def save(self,*args,**kwargs):
+        previous = 0 if self._state.adding else getattr(self, '_loaded_available', None)
+        super().save(*args,**kwargs)
+        if previous is not None and previous<=0 and self.available_quantity>0:
+            from apps.orders.tasks import notify_back_in_stock_task
+            product_id = self.product_id
+            transaction.on_commit(lambda: notify_back_in_stock_task.delay(product_id))
+        self._loaded_available = self.available_quantity
 
     @property
     def available_quantity(self):
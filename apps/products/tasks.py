@@ -0,0 +1,15 @@
+from celery import shared_task
+
+
+@shared_task
+def check_low_stock_task():
+    """Raise (or bump) a low stock alert for every product at or under its threshold."""
+    from apps.dashboard.alerts import AlertBuffer
+    from apps.dashboard.models import SystemAlert
+    from .models import Inventory, LOW_STOCK
+
+    low_stock = Inventory.objects.filter(LOW_STOCK, product__is_active=True).select_related('product')
+    with AlertBuffer() as buffer:
+        for inventory in low_stock.iterator(chunk_size=1000):
+            buffer.add(**SystemAlert.low_stock_alert_kwargs(inventory.product))
+    return len(buffer.alerts)
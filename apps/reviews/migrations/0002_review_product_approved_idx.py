@@ -0,0 +1,20 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:30
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('reviews', '0001_initial'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='review',
+            index=models.Index(condition=models.Q(('is_approved', True)), fields=['product', '-created_at'], name='review_product_approved_idx'),
+        ),
+    ]
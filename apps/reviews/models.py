@@ -18,6 +18,7 @@ class Review(models.Model):
 
     class Meta:
         verbose_name=_('review'); verbose_name_plural=_('reviews'); ordering=['-created_at']; unique_together=('product','user')
+        indexes=[models.Index(fields=['product','-created_at'],condition=models.Q(is_approved=True),name='review_product_approved_idx')]
 
     def __str__(self): return f"{self.user.email} – {self.product} ({self.rating}/5)"
 
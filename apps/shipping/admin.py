@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import ShippingZone, ShippingMethod, ShippingRate
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from .models import ShippingZone, ShippingMethod, ShippingBox, ShippingRate
 
 @admin.register(ShippingZone)
 class ShippingZoneAdmin(admin.ModelAdmin):
@@ -11,7 +13,21 @@ class ShippingMethodAdmin(admin.ModelAdmin):
     list_display = ['name','zone','base_cost','is_active']
     list_filter = ['is_active','zone']
 
+@admin.register(ShippingBox)
+class ShippingBoxAdmin(admin.ModelAdmin):
+    list_display = ['name','length_cm','width_cm','height_cm','max_weight_kg','is_active']
+    list_filter = ['is_active']
+
 @admin.register(ShippingRate)
 class ShippingRateAdmin(admin.ModelAdmin):
-    list_display = ['order','shipping_method','cost','weight_kg']
-    readonly_fields = ['tracking_number','tracking_url']
+    list_display = ['order','shipping_method','cost','weight_kg','parcel_count','carrier','tracking_status','last_event_at','next_poll_at']
+    list_filter = ['tracking_status','carrier']
+    search_fields = ['tracking_number','order__order_number']
+    readonly_fields = ['tracking_number','tracking_url','tracking_status','last_event','last_event_at','delivered_at','last_polled_at','poll_failures']
+    actions = ['poll_now']
+
+    @admin.action(description=_('Poll tracking of selected shipments on the next run'))
+    def poll_now(self, request, queryset):
+        count = queryset.exclude(tracking_number='').exclude(tracking_status__in=ShippingRate.FINAL_TRACKING_STATUSES) \
+            .update(next_poll_at=timezone.now(), poll_failures=0)
+        self.message_user(request, _('%(count)d shipments will be polled on the next run.') % {'count':count})
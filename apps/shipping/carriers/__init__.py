@@ -0,0 +1,20 @@
+from django.conf import settings
+from .adapters import CARRIERS, CarrierAdapter, CarrierError
+
+
+def get_carrier(name):
+    """
+    Adapter of a carrier as named on shipping rates (case-insensitive).
+    ``SHIPPING_CARRIERS[name]`` holds its config, whose ``adapter`` overrides
+    the one named after the carrier (e.g. 'fake').
+    """
+    name = (name or '').strip().lower()
+    config = settings.SHIPPING_CARRIERS.get(name, {})
+    adapter = config.get('adapter', name)
+    try:
+        return CARRIERS[adapter](name, config)
+    except KeyError:
+        raise CarrierError(f'No adapter for carrier {name!r}')
+
+
+__all__ = ['CARRIERS', 'CarrierAdapter', 'CarrierError', 'get_carrier']
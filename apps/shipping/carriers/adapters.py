@@ -0,0 +1,120 @@
+"""
+Adapters of carrier tracking APIs.
+
+``track(numbers)`` asks the carrier about up to ``batch_size`` tracking
+numbers in one call and returns, for each number the carrier has events of::
+
+    {'status': <ShippingRate tracking status>, 'event': <latest event>,
+     'event_at': <its time>, 'delivered_at': <delivery time or None>}
+
+Numbers without events yet are left out. A failed call, or an answer
+that does not parse (missing fields, times without a timezone), raises
+``CarrierError`` and the poller backs the whole batch off, so adapters do
+not retry. Calls go through one keep-alive connection pool per carrier and
+process, shared by the poller's threads.
+"""
+import threading
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+import httpx
+
+
+class CarrierError(Exception):
+    pass
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_http(carrier, base_url):
+    with _clients_lock:
+        client = _clients.get((carrier, base_url))
+        if client is None:
+            client = _clients[(carrier, base_url)] = httpx.Client(
+                base_url=base_url,
+                timeout=httpx.Timeout(settings.SHIPPING_CARRIER_TIMEOUT, connect=settings.SHIPPING_CARRIER_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=settings.SHIPPING_TRACKING_WORKERS,
+                                    max_keepalive_connections=settings.SHIPPING_TRACKING_WORKERS, keepalive_expiry=30),
+            )
+        return client
+
+
+class CarrierAdapter:
+    name = None
+    base_url = None
+    # Tracking numbers per call; 1 for APIs without batch lookups
+    BATCH_SIZE = 1
+    # Public tracking page, formatted with ``number``
+    TRACKING_URL = ''
+    # carrier status -> ShippingRate tracking status
+    STATUSES = {}
+
+    def __init__(self, carrier, config):
+        self.carrier = carrier
+        self.config = config
+        self.base_url = config.get('base_url') or self.base_url
+        self.batch_size = int(config.get('batch_size') or self.BATCH_SIZE)
+
+    def request(self, method, path, **kwargs):
+        try:
+            response = get_http(self.carrier, self.base_url).request(method, path, **kwargs)
+        except httpx.TransportError as exc:
+            raise CarrierError(f'{self.carrier}: {exc}') from exc
+        if response.is_error:
+            raise CarrierError(f'{self.carrier} returned {response.status_code}')
+        try:
+            return response.json()
+        except ValueError:
+            raise CarrierError(f'{self.carrier} returned a non-JSON body')
+
+    def parse_time(self, value):
+        """An aware datetime from an ISO 8601 string; ``ValueError`` otherwise."""
+        moment = parse_datetime(value) if isinstance(value, str) else None
+        if moment is None or moment.tzinfo is None:
+            raise ValueError(f'bad event time {value!r}')
+        return moment
+
+    def tracking_url(self, number):
+        template = self.config.get('tracking_url', self.TRACKING_URL)
+        return template.format(number=number) if template else ''
+
+    def track(self, numbers):
+        raise NotImplementedError
+
+
+class FakeCarrierAdapter(CarrierAdapter):
+    """Client of ``FakeCarrierServer`` (``carriers.fake``), for tests and load runs."""
+
+    name = 'fake'
+    base_url = 'http://127.0.0.1:8766'
+    BATCH_SIZE = 100
+    STATUSES = {
+        'pre_transit': 'pending', 'in_transit': 'in_transit', 'out_for_delivery': 'out_for_delivery',
+        'delivered': 'delivered', 'failure': 'exception', 'return_to_sender': 'returned',
+    }
+
+    def tracking_url(self, number):
+        return super().tracking_url(number) or f'{self.base_url}/t/{number}'
+
+    def track(self, numbers):
+        headers = {'Authorization': f"Bearer {self.config['api_key']}"} if self.config.get('api_key') else {}
+        body = self.request('POST', '/v1/track', json={'tracking_numbers': list(numbers)}, headers=headers)
+        results = {}
+        try:
+            for shipment in body['shipments']:
+                scans = [(self.parse_time(event['occurred_at']), event) for event in shipment.get('events') or []]
+                if not scans:
+                    continue
+                event_at, latest = max(scans, key=lambda scan: scan[0])
+                status = self.STATUSES.get(str(latest.get('status')), 'in_transit')
+                results[str(shipment['tracking_number'])] = {
+                    'status': status, 'event': str(latest.get('description') or '')[:255], 'event_at': event_at,
+                    'delivered_at': event_at if status == 'delivered' else None,
+                }
+        except (KeyError, TypeError, AttributeError, ValueError) as exc:
+            raise CarrierError(f'{self.carrier} returned a malformed answer: {exc!r}') from exc
+        return results
+
+
+CARRIERS = {adapter.name: adapter for adapter in (FakeCarrierAdapter,)}
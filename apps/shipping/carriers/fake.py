@@ -0,0 +1,85 @@
+"""
+A local stand-in for a carrier tracking API, for offline tests and load runs.
+
+``FakeCarrierServer`` speaks the API of ``FakeCarrierAdapter`` over
+keep-alive HTTP/1.1, one thread per connection, with configurable latency,
+error rate (HTTP 503) and batch limit (HTTP 413 above it)::
+
+    POST /v1/track  {"tracking_numbers": [...]}
+    -> {"shipments": [{"tracking_number": ..., "events": [{"status", "description", "occurred_at"}]}]}
+
+Shipments live in memory; ``add_event`` moves one along.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeCarrierHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        server = self.server
+        time.sleep(max(0.0, random.gauss(server.latency, server.latency * server.jitter)))
+        numbers = body.get('tracking_numbers') or []
+        with server.lock:
+            server.requests += 1
+            server.numbers_requested += len(numbers)
+        if random.random() < server.error_rate:
+            return self.reply(503, {'error': 'unavailable'})
+        if self.path != '/v1/track':
+            return self.reply(404, {'error': 'not found'})
+        if len(numbers) > server.max_batch:
+            return self.reply(413, {'error': f'at most {server.max_batch} tracking numbers per request'})
+        with server.lock:
+            shipments = [{'tracking_number': number, 'events': list(server.shipments.get(number, ()))}
+                         for number in numbers]
+        self.reply(200, {'shipments': shipments})
+
+
+class FakeCarrierServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address=('127.0.0.1', 8766), latency=0.1, jitter=0.2, error_rate=0.0, max_batch=100):
+        super().__init__(address, FakeCarrierHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_batch = max_batch
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.numbers_requested = 0
+        self.shipments = {}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def add_event(self, number, status, occurred_at, description=''):
+        """Record a scan of shipment ``number``; ``occurred_at`` is an aware datetime."""
+        with self.lock:
+            self.shipments.setdefault(number, []).append({
+                'status': status, 'description': description or status.replace('_', ' ').capitalize(),
+                'occurred_at': occurred_at.isoformat(),
+            })
+
+    def start(self):
+        """Serve from a background thread; returns the server."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
@@ -0,0 +1,112 @@
+import random
+import time
+from collections import Counter
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from apps.orders.models import Order, OrderItem
+from apps.products.models import Product, ProductType
+from apps.shipping.models import ShippingBox, ShippingMethod, ShippingZone
+from apps.shipping.packing import Packer
+from apps.shipping.services import ShippingIndex, ShippingRates
+
+PREFIX = 'bench-packing'
+
+# Packed units: weight (kg), length, width, height (cm)
+TYPES = {
+    'single_card': ('0.008', '10.2', '7.6', '0.3'),       # in a toploader
+    'booster_pack': ('0.025', '12.0', '7.5', '0.5'),
+    'other_accessory': ('0.150', '20.0', '10.0', '5.0'),
+}
+BOOSTER_BOX = ('0.900', '19.0', '14.0', '7.0')
+BOXES = [
+    # name, length, width, height, empty weight, max weight
+    ('Envelope', '25.0', '17.0', '2.0', '0.020', '0.500'),
+    ('Small box', '30.0', '20.0', '10.0', '0.150', '5.000'),
+    ('Large box', '50.0', '40.0', '30.0', '0.500', '10.000'),
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Time packing random carts (200 lines by default) into shipping boxes and rating a 200-line order; '
+        'seeded in a rolled-back transaction. Correctness is covered by apps.shipping.tests'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--carts', type=int, default=200)
+        parser.add_argument('--lines', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        try:
+            with transaction.atomic():
+                products, boxes = self.seed(options['products'])
+                ShippingIndex.invalidate()
+                self.time_carts(rng, products, boxes, options['carts'], options['lines'])
+                self.time_rate(rng, products)
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            ShippingIndex.invalidate()
+
+    def seed(self, count):
+        types = {}
+        for name, (weight, length, width, height) in TYPES.items():
+            types[name], _created = ProductType.objects.update_or_create(name=name, defaults={
+                'weight_kg': Decimal(weight), 'length_cm': Decimal(length), 'width_cm': Decimal(width),
+                'height_cm': Decimal(height),
+            })
+        names = list(TYPES)
+        products = Product.objects.bulk_create([
+            Product(slug=f'{PREFIX}-{i}', sku=f'{PREFIX}-{i}', product_type=types[names[i % 3]],
+                    cost_price=Decimal('1.00'), selling_price=Decimal('2.50'))
+            for i in range(count)
+        ])
+        # Booster boxes among the random products too
+        Product.objects.filter(pk__in=[p.pk for p in products[2::30]]).update(
+            weight_kg=Decimal(BOOSTER_BOX[0]), length_cm=Decimal(BOOSTER_BOX[1]),
+            width_cm=Decimal(BOOSTER_BOX[2]), height_cm=Decimal(BOOSTER_BOX[3]))
+        boxes = ShippingBox.objects.bulk_create([
+            ShippingBox(name=name, length_cm=Decimal(length), width_cm=Decimal(width), height_cm=Decimal(height),
+                        weight_kg=Decimal(weight), max_weight_kg=Decimal(max_weight))
+            for name, length, width, height, weight, max_weight in BOXES
+        ])
+        return products, Packer.boxes(boxes)
+
+    def time_carts(self, rng, products, boxes, carts, lines):
+        carts = [[(rng.choice(products).pk, rng.choice([1, 1, 1, 2, 3, 4, 10])) for _ in range(lines)]
+                 for _ in range(carts)]
+        started = time.perf_counter()
+        packings = [Packer.pack(cart, boxes) for cart in carts]
+        elapsed = time.perf_counter() - started
+        parcels = Counter(parcel['box_name'] for packing in packings for parcel in packing['parcels'])
+        self.stdout.write(
+            f'{len(carts)} carts of {lines} lines: {elapsed / len(carts) * 1000:.2f} ms per cart with its product query, '
+            f"{sum(p['parcel_count'] for p in packings) / len(carts):.1f} parcels per cart ({dict(parcels)})"
+        )
+
+    def time_rate(self, rng, products):
+        zone = ShippingZone.objects.create(name=f'{PREFIX}-zone', countries=['ZZ'])
+        method = ShippingMethod.objects.create(name='Tracked', zone=zone, base_cost=Decimal('4.90'),
+                                               cost_per_kg=Decimal('1.25'), provider='bench')
+        ShippingIndex.invalidate()
+        order = Order.objects.create(order_number=f'{PREFIX}-order', email='packing@example.com', phone_number='0',
+                                     subtotal=Decimal('500.00'), total=Decimal('500.00'))
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, product_name='x', product_sku=product.sku, cost_price=Decimal('1.00'),
+                      selling_price=Decimal('2.50'), quantity=rng.randint(1, 4))
+            for product in rng.sample(products, 200)
+        ])
+        started = time.perf_counter()
+        rate = ShippingRates.assign(order, method.pk, country='zz')
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'ShippingRates.assign (200 lines): {elapsed * 1000:.1f} ms, {rate.parcel_count} parcels, '
+                          f'{rate.weight_kg} kg, {rate.cost}')
@@ -0,0 +1,114 @@
+import random
+import string
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from apps.shipping.models import ShippingMethod, ShippingZone
+from apps.shipping.services import CENT, ShippingIndex, ShippingQuotes
+
+COUNTRIES = [a + b for a in string.ascii_uppercase for b in string.ascii_uppercase]
+
+
+class Command(BaseCommand):
+    help = (
+        'Quote shipping for random carts by scanning zones (as before) and from the zone index, '
+        'checking both agree and that the index needs no query; seeded in a rolled-back transaction'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--zones', type=int, default=250)
+        parser.add_argument('--countries-per-zone', type=int, default=30)
+        parser.add_argument('--methods-per-zone', type=int, default=4)
+        parser.add_argument('--quotes', type=int, default=5000)
+        parser.add_argument('--scanned', type=int, default=200, help='Quotes also computed by the zone scan')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        failures = []
+        with transaction.atomic():
+            self.seed(rng, options['zones'], options['countries_per_zone'], options['methods_per_zone'])
+            ShippingIndex.invalidate()
+            carts = [(rng.choice(COUNTRIES), Decimal(rng.randrange(500, 20000)) / 100,
+                      Decimal(rng.randrange(0, 30000)) / 1000) for _ in range(options['quotes'])]
+
+            started = time.perf_counter()
+            expected = [self.scan(*cart) for cart in carts[:options['scanned']]]
+            self.report('zone scan + calculate_cost', len(expected), time.perf_counter() - started)
+
+            started = time.perf_counter()
+            ShippingIndex.get()
+            self.stdout.write(f'index build: {(time.perf_counter() - started) * 1000:.1f} ms')
+
+            connection.queries_log.clear()
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                got = [[(q['id'], q['cost']) for q in ShippingQuotes.quote(*cart)] for cart in carts]
+                self.report('ShippingQuotes.quote', len(carts), time.perf_counter() - started)
+            if len(queries):
+                failures.append(f'{len(queries)} queries while quoting from the index')
+            mismatches = sum(a != b for a, b in zip(expected, got))
+            if mismatches:
+                failures.append(f'{mismatches} quotes differ from the zone scan')
+
+            failures += self.check_invalidation(carts)
+            transaction.set_rollback(True)
+        ShippingIndex.invalidate()
+
+        for failure in failures:
+            self.stdout.write(self.style.ERROR(f'FAIL {failure}'))
+        if failures:
+            raise CommandError(f'{len(failures)} shipping quote checks failed')
+        self.stdout.write(self.style.SUCCESS('All shipping quote checks passed.'))
+
+    def report(self, label, count, elapsed):
+        self.stdout.write(f'{label}: {elapsed * 1000:.1f} ms total, {elapsed / count * 1e6:.1f} us per quote')
+
+    def seed(self, rng, zones, per_zone, methods):
+        zones = ShippingZone.objects.bulk_create([
+            ShippingZone(name=f'Bench zone {i:04}', countries=rng.sample(COUNTRIES, per_zone), is_active=i % 10 != 0)
+            for i in range(zones)
+        ])
+        ShippingMethod.objects.bulk_create([
+            ShippingMethod(name=f'Method {j}', zone=zone, order=j, is_active=j != 3,
+                           base_cost=Decimal(rng.randrange(0, 3000)) / 100, cost_per_kg=Decimal(rng.randrange(0, 500)) / 100,
+                           free_shipping_threshold=rng.choice([None, Decimal('50.00'), Decimal('100.00')]))
+            for zone in zones for j in range(methods)
+        ])
+
+    def scan(self, country, total, weight):
+        """What finding a zone took before the index: every zone's list, then its methods."""
+        quotes = []
+        for zone in ShippingZone.objects.filter(is_active=True):
+            if country in zone.countries:
+                for method in zone.shipping_methods.filter(is_active=True).order_by('order', 'name'):
+                    quotes.append((method.id, method.calculate_cost(total, weight).quantize(CENT, ROUND_HALF_UP)))
+        return quotes
+
+    def check_invalidation(self, carts):
+        failures = []
+        country, total, weight = next(cart for cart in carts if ShippingQuotes.quote(*cart))
+        method = ShippingMethod.objects.get(pk=ShippingQuotes.quote(country, total, weight)[0]['id'])
+
+        # A save in this process drops the index once the change commits
+        method.free_shipping_threshold, method.base_cost, method.cost_per_kg = None, Decimal('123.45'), Decimal('0.00')
+        with TestCase.captureOnCommitCallbacks(execute=True):
+            method.save()
+        if ShippingQuotes.quote_method(method.id, country, total, weight)['cost'] != Decimal('123.45'):
+            failures.append('method change not seen by the process making it')
+
+        # Another process's change is seen once the check interval has passed
+        zone = method.zone
+        zone.countries = [code for code in zone.countries if code != country]
+        ShippingZone.objects.filter(pk=zone.pk).update(countries=zone.countries)
+        cache.incr(ShippingIndex.VERSION_KEY)
+        if ShippingQuotes.quote_method(method.id, country, total, weight) is None:
+            failures.append('index rebuilt before the check interval')
+        ShippingIndex._checked_at = 0.0
+        if ShippingQuotes.quote_method(method.id, country, total, weight) is not None:
+            failures.append('zone change from another process not seen after the check interval')
+        return failures
@@ -0,0 +1,196 @@
+import time
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from apps.orders.models import Order, OrderStatusHistory
+from apps.orders.services import OrderStateMachine
+from apps.shipping.carriers.fake import FakeCarrierServer
+from apps.shipping.models import ShippingRate
+from apps.shipping.tracking import TrackingPoller
+
+PREFIX = 'bench-tracking'
+
+# Scenario per shipment (by index), and the interval expected before its next poll
+SCENARIOS = [
+    ('delivered', None), ('delivered', None), ('delivered', None),
+    ('out_for_delivery', TrackingPoller.OUT_FOR_DELIVERY_INTERVAL),
+    ('scanned 2h ago', timedelta(hours=1)), ('scanned 2h ago', timedelta(hours=1)),
+    ('scanned 12h ago', timedelta(hours=3)),
+    ('scanned 2 days ago', timedelta(hours=6)),
+    ('scanned 5 days ago', TrackingPoller.IDLE_INTERVAL),
+    ('no scan yet', TrackingPoller.NO_SCAN_INTERVAL),
+    ('returned', None),
+    ('delivered, order not shipped', None),
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Track shipments against an in-process fake carrier: batched and one call per shipment, '
+        'checking statuses, delivered orders and the adaptive poll intervals; everything is rolled back'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shipments', type=int, default=6000)
+        parser.add_argument('--unbatched', type=int, default=400, help='Shipments of the one-call-per-shipment run')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--latency-ms', type=float, default=100)
+
+    def handle(self, *args, **options):
+        server = FakeCarrierServer(('127.0.0.1', 0), latency=options['latency_ms'] / 1000,
+                                   max_batch=options['batch_size']).start()
+        carriers = {
+            'fakeship': {'adapter': 'fake', 'base_url': server.url, 'batch_size': options['batch_size']},
+            'fakeship-single': {'adapter': 'fake', 'base_url': server.url, 'batch_size': 1},
+        }
+        failures = []
+        try:
+            with transaction.atomic(), override_settings(SHIPPING_CARRIERS=carriers):
+                now = timezone.now()
+                rates = self.seed(server, 'FakeShip', options['shipments'], now)
+                unknown = self.seed(server, 'Pigeon Post', 10, now, prefix='unknown')
+                stats = self.run('batched', server, options['shipments'] + 10, options['workers'])
+                failures += self.verify(rates, unknown, stats)
+
+                self.seed(server, 'fakeship-single', options['unbatched'], now, prefix='single')
+                self.run('one call per shipment', server, options['unbatched'], options['workers'])
+
+                if TrackingPoller.poll()['polled']:
+                    failures.append('shipments polled again right away')
+                failures += self.check_failures(server, rates)
+                failures += self.check_schedule(now)
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            server.shutdown()
+        for failure in failures:
+            self.stdout.write(self.style.ERROR(f'FAIL {failure}'))
+        if failures:
+            raise CommandError(f'{len(failures)} tracking checks failed')
+        self.stdout.write(self.style.SUCCESS('All tracking checks passed.'))
+
+    def seed(self, server, carrier, count, now, prefix='ship'):
+        orders = Order.objects.bulk_create([
+            Order(order_number=f'{PREFIX}-{prefix}-{i}', email='tracking@example.com', phone_number='0',
+                  subtotal=Decimal('20.00'), total=Decimal('20.00'),
+                  status='processing' if SCENARIOS[i % len(SCENARIOS)][0].endswith('not shipped') else 'shipped',
+                  shipped_at=now - timedelta(days=6))
+            for i in range(count)
+        ])
+        rates = ShippingRate.objects.bulk_create([
+            ShippingRate(order=order, cost=Decimal('4.90'), carrier=carrier, tracking_number=f'{prefix.upper()}{i:07}',
+                         next_poll_at=now - timedelta(seconds=1))
+            for i, order in enumerate(orders)
+        ])
+        with connection.cursor() as cursor:
+            # Let the planner see the seeded rows, as it would see real tables
+            cursor.execute(f'ANALYZE {Order._meta.db_table}, {ShippingRate._meta.db_table}')
+        for i, rate in enumerate(rates):
+            scenario, _interval = SCENARIOS[i % len(SCENARIOS)]
+            number = rate.tracking_number
+            if scenario != 'no scan yet':
+                server.add_event(number, 'in_transit', now - timedelta(days=5, minutes=i % 50), 'Picked up')
+            if scenario.startswith('delivered'):
+                server.add_event(number, 'delivered', now - timedelta(hours=3, minutes=i % 50), 'Delivered to mailbox')
+            elif scenario == 'out_for_delivery':
+                server.add_event(number, 'out_for_delivery', now - timedelta(hours=2))
+            elif scenario == 'returned':
+                server.add_event(number, 'return_to_sender', now - timedelta(days=1))
+            elif scenario.startswith('scanned') and scenario != 'scanned 5 days ago':
+                age = {'scanned 2h ago': timedelta(hours=2), 'scanned 12h ago': timedelta(hours=12),
+                       'scanned 2 days ago': timedelta(days=2)}[scenario]
+                server.add_event(number, 'in_transit', now - age, 'Arrived at sorting center')
+        return rates
+
+    def run(self, label, server, count, workers):
+        requests = server.requests
+        started = time.perf_counter()
+        stats = TrackingPoller.poll(limit=count, workers=workers)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{label}: {stats['polled']} shipments in {elapsed:.2f}s = {stats['polled'] / elapsed:.0f}/s, "
+            f"{server.requests - requests} carrier calls, {stats['updated']} updated, {stats['delivered']} delivered, "
+            f"{stats['failed']} failed, {stats['unknown_carrier']} of unknown carriers"
+        )
+        return stats
+
+    def verify(self, rates, unknown, stats):
+        failures = []
+        rows = {rate.pk: rate for rate in ShippingRate.objects.filter(pk__in=[r.pk for r in rates]).select_related('order')}
+        wrong = Counter()
+        for i, rate in enumerate(rates):
+            scenario, interval = SCENARIOS[i % len(SCENARIOS)]
+            row = rows[rate.pk]
+            if scenario.startswith('delivered'):
+                expected_order = 'processing' if scenario.endswith('not shipped') else 'delivered'
+                if row.tracking_status != 'delivered' or row.next_poll_at is not None or row.order.status != expected_order:
+                    wrong[scenario] += 1
+                elif expected_order == 'delivered' and row.order.delivered_at != row.delivered_at:
+                    wrong['delivered_at not the carrier scan'] += 1
+            elif scenario == 'returned':
+                if row.tracking_status != 'returned' or row.next_poll_at is not None or row.order.status != 'shipped':
+                    wrong[scenario] += 1
+            else:
+                ratio = (row.next_poll_at - row.last_polled_at) / interval
+                if not 1 - TrackingPoller.JITTER - 0.01 <= ratio <= 1 + TrackingPoller.JITTER + 0.01:
+                    wrong[f'{scenario} interval'] += 1
+                if not row.tracking_url:
+                    wrong['tracking url'] += 1
+        failures += [f'{count} shipments wrong: {what}' for what, count in wrong.items()]
+
+        delivered = sum(SCENARIOS[i % len(SCENARIOS)][0] == 'delivered' for i in range(len(rates)))
+        if stats['delivered'] != delivered:
+            failures.append(f"{stats['delivered']} orders delivered, expected {delivered}")
+        history = OrderStatusHistory.objects.filter(order__shipping_rate__in=rates, status='delivered').count()
+        if history != delivered:
+            failures.append(f'{history} delivered history rows, expected {delivered}')
+        later = timezone.now() + TrackingPoller.UNKNOWN_CARRIER_INTERVAL * 0.99
+        if ShippingRate.objects.filter(pk__in=[r.pk for r in unknown], next_poll_at__lt=later).exists():
+            failures.append('shipments of an unknown carrier not put off')
+        return failures
+
+    def check_failures(self, server, rates):
+        """A carrier outage backs the batch off; the next success resets it."""
+        pending = ShippingRate.objects.filter(pk__in=[r.pk for r in rates], next_poll_at__isnull=False)[:250]
+        pks = [rate.pk for rate in pending]
+        failures = []
+        for attempt in (1, 2):
+            ShippingRate.objects.filter(pk__in=pks).update(next_poll_at=timezone.now())
+            server.error_rate = 1.0
+            stats = TrackingPoller.poll(limit=len(pks))
+            server.error_rate = 0.0
+            expected = TrackingPoller.RETRY_INTERVAL * 2 ** (attempt - 1)
+            bad = [row for row in ShippingRate.objects.filter(pk__in=pks)
+                   if row.poll_failures != attempt
+                   or not 0.89 <= (row.next_poll_at - row.last_polled_at) / expected <= 1.11]
+            if stats['failed'] != len(pks) or bad:
+                failures.append(f"outage {attempt}: {stats['failed']} failed, {len(bad)} not backed off")
+        ShippingRate.objects.filter(pk__in=pks).update(next_poll_at=timezone.now())
+        TrackingPoller.poll(limit=len(pks))
+        if ShippingRate.objects.filter(pk__in=pks, poll_failures__gt=0).exists():
+            failures.append('failures not reset after a successful poll')
+        return failures
+
+    def check_schedule(self, now):
+        """Shipping an order starts tracking its rate, taking the order's tracking number."""
+        order = Order.objects.create(order_number=f'{PREFIX}-schedule', email='tracking@example.com', phone_number='0',
+                                     subtotal=Decimal('20.00'), total=Decimal('20.00'), status='processing')
+        ShippingRate.objects.create(order=order, cost=Decimal('4.90'), carrier='FakeShip')
+        with TestCase.captureOnCommitCallbacks(execute=True):
+            OrderStateMachine.transition(Order.objects.filter(pk=order.pk), 'shipped',
+                                         tracking_numbers={order.order_number: 'SCHED0001'}, notify=False)
+        rate = ShippingRate.objects.get(order=order)
+        if rate.tracking_number != 'SCHED0001' or rate.next_poll_at is None \
+                or abs(rate.next_poll_at - now - TrackingPoller.FIRST_POLL) > timedelta(minutes=5):
+            return ['shipped order not scheduled for tracking']
+        return []
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:49
+
+from decimal import Decimal
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shipping', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShippingBox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='name')),
+                ('length_cm', models.DecimalField(decimal_places=1, max_digits=6, validators=[django.core.validators.MinValueValidator(Decimal('0.1'))], verbose_name='inner length (cm)')),
+                ('width_cm', models.DecimalField(decimal_places=1, max_digits=6, validators=[django.core.validators.MinValueValidator(Decimal('0.1'))], verbose_name='inner width (cm)')),
+                ('height_cm', models.DecimalField(decimal_places=1, max_digits=6, validators=[django.core.validators.MinValueValidator(Decimal('0.1'))], verbose_name='inner height (cm)')),
+                ('weight_kg', models.DecimalField(decimal_places=3, default=Decimal('0.000'), max_digits=8, validators=[django.core.validators.MinValueValidator(Decimal('0.000'))], verbose_name='empty weight (kg)')),
+                ('max_weight_kg', models.DecimalField(blank=True, decimal_places=3, help_text='Packed weight limit, box included; empty for no limit', max_digits=8, null=True, validators=[django.core.validators.MinValueValidator(Decimal('0.001'))], verbose_name='maximum weight (kg)')),
+                ('is_active', models.BooleanField(default=True, verbose_name='active')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='updated at')),
+            ],
+            options={
+                'verbose_name': 'shipping box',
+                'verbose_name_plural': 'shipping boxes',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='shippingrate',
+            name='parcel_count',
+            field=models.PositiveIntegerField(default=1, verbose_name='parcels'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:52
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('orders', '0001_initial'),
+        ('shipping', '0002_shippingbox_parcel_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shippingrate',
+            name='delivered_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='delivered at'),
+        ),
+        migrations.AddField(
+            model_name='shippingrate',
+            name='last_event',
+            field=models.CharField(blank=True, max_length=255, verbose_name='last tracking event'),
+        ),
+        migrations.AddField(
+            model_name='shippingrate',
+            name='last_event_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='last tracking event at'),
+        ),
+        migrations.AddField(
+            model_name='shippingrate',
+            name='last_polled_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='last polled at'),
+        ),
+        migrations.AddField(
+            model_name='shippingrate',
+            name='next_poll_at',
+            field=models.DateTimeField(blank=True, help_text='Empty when the shipment is not tracked', null=True, verbose_name='next poll at'),
+        ),
+        migrations.AddField(
+            model_name='shippingrate',
+            name='poll_failures',
+            field=models.PositiveIntegerField(default=0, verbose_name='failed polls in a row'),
+        ),
+        migrations.AddField(
+            model_name='shippingrate',
+            name='tracking_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('in_transit', 'In transit'), ('out_for_delivery', 'Out for delivery'), ('delivered', 'Delivered'), ('exception', 'Exception'), ('returned', 'Returned')], default='pending', max_length=20, verbose_name='tracking status'),
+        ),
+        # Shipments already on their way are polled from the next run
+        migrations.RunSQL(
+            """
+            UPDATE shipping_shippingrate AS rate SET next_poll_at = now()
+            FROM orders_order AS o
+            WHERE o.id = rate.order_id AND o.status = 'shipped' AND rate.tracking_number <> ''
+            """,
+            migrations.RunSQL.noop,
+        ),
+        AddIndexConcurrently(
+            model_name='shippingrate',
+            index=models.Index(condition=models.Q(('next_poll_at__isnull', False)), fields=['next_poll_at'], name='shipping_rate_next_poll_idx'),
+        ),
+    ]
@@ -36,24 +36,53 @@ class ShippingMethod(models.Model):
 
     def __str__(self): return f"{self.name} – {self.zone}"
 
-    def calculate_cost(self, order_total, weight_kg=0):
+    def calculate_cost(self, order_total, weight_kg=0, parcels=1):
+        """The base cost is charged per parcel, the cost per kg on the total weight."""
         if self.free_shipping_threshold and order_total>=self.free_shipping_threshold:
             return Decimal('0.00')
-        return self.base_cost + (self.cost_per_kg*Decimal(str(weight_kg)))
+        return self.base_cost*max(parcels,1) + (self.cost_per_kg*Decimal(str(weight_kg)))
+
+class ShippingBox(models.Model):
+    name=models.CharField(_('name'),max_length=100)
+    length_cm=models.DecimalField(_('inner length (cm)'),max_digits=6,decimal_places=1,validators=[MinValueValidator(Decimal('0.1'))])
+    width_cm=models.DecimalField(_('inner width (cm)'),max_digits=6,decimal_places=1,validators=[MinValueValidator(Decimal('0.1'))])
+    height_cm=models.DecimalField(_('inner height (cm)'),max_digits=6,decimal_places=1,validators=[MinValueValidator(Decimal('0.1'))])
+    weight_kg=models.DecimalField(_('empty weight (kg)'),max_digits=8,decimal_places=3,default=Decimal('0.000'),validators=[MinValueValidator(Decimal('0.000'))])
+    max_weight_kg=models.DecimalField(_('maximum weight (kg)'),max_digits=8,decimal_places=3,null=True,blank=True,validators=[MinValueValidator(Decimal('0.001'))],help_text=_('Packed weight limit, box included; empty for no limit'))
+    is_active=models.BooleanField(_('active'),default=True)
+    created_at=models.DateTimeField(_('created at'),auto_now_add=True)
+    updated_at=models.DateTimeField(_('updated at'),auto_now=True)
+
+    class Meta:
+        verbose_name=_('shipping box'); verbose_name_plural=_('shipping boxes'); ordering=['name']
+
+    def __str__(self): return f"{self.name} ({self.length_cm}×{self.width_cm}×{self.height_cm} cm)"
 
 class ShippingRate(models.Model):
+    TRACKING_STATUS_CHOICES=[('pending',_('Pending')),('in_transit',_('In transit')),('out_for_delivery',_('Out for delivery')),('delivered',_('Delivered')),('exception',_('Exception')),('returned',_('Returned'))]
+    # Statuses after which the carrier is no longer polled
+    FINAL_TRACKING_STATUSES=('delivered','returned')
     order=models.OneToOneField('orders.Order',on_delete=models.CASCADE,related_name='shipping_rate',verbose_name=_('order'))
     shipping_method=models.ForeignKey(ShippingMethod,on_delete=models.SET_NULL,null=True,verbose_name=_('shipping method'))
     cost=models.DecimalField(_('cost'),max_digits=10,decimal_places=2,validators=[MinValueValidator(Decimal('0.00'))])
     weight_kg=models.DecimalField(_('weight (kg)'),max_digits=10,decimal_places=3,default=Decimal('0.000'),validators=[MinValueValidator(Decimal('0.000'))])
+    parcel_count=models.PositiveIntegerField(_('parcels'),default=1)
     tracking_number=models.CharField(_('tracking number'),max_length=100,blank=True)
     tracking_url=models.URLField(_('tracking URL'),blank=True)
     carrier=models.CharField(_('carrier'),max_length=100,blank=True)
     service_name=models.CharField(_('service name'),max_length=100,blank=True)
+    tracking_status=models.CharField(_('tracking status'),max_length=20,choices=TRACKING_STATUS_CHOICES,default='pending')
+    last_event=models.CharField(_('last tracking event'),max_length=255,blank=True)
+    last_event_at=models.DateTimeField(_('last tracking event at'),null=True,blank=True)
+    delivered_at=models.DateTimeField(_('delivered at'),null=True,blank=True)
+    last_polled_at=models.DateTimeField(_('last polled at'),null=True,blank=True)
+    next_poll_at=models.DateTimeField(_('next poll at'),null=True,blank=True,help_text=_('Empty when the shipment is not tracked'))
+    poll_failures=models.PositiveIntegerField(_('failed polls in a row'),default=0)
     created_at=models.DateTimeField(_('created at'),auto_now_add=True)
     updated_at=models.DateTimeField(_('updated at'),auto_now=True)
 
     class Meta:
         verbose_name=_('shipping rate'); verbose_name_plural=_('shipping rates')
+        indexes=[models.Index(fields=['next_poll_at'],condition=models.Q(next_poll_at__isnull=False),name='shipping_rate_next_poll_idx')]
 
     def __str__(self): return f"Shipping for Order #{self.order.order_number}"
@@ -0,0 +1,147 @@
+"""
+Packing cart lines into parcels for shipping quotes.
+
+A unit ships with its product's packed weight and dimensions (the product's
+own, else its product type's: a single in its toploader, a sealed booster
+box). Units are placed first-fit decreasing: by volume, largest first, into
+the first open parcel with room left, that is volume up to ``FILL`` of the
+box, the box's weight limit, and the unit's sorted dimensions within the
+box's. When none has room, the largest box the unit fits in is opened. Each
+parcel is then shrunk to the smallest box holding its contents. Identical
+units are placed as a group, so a line of 500 singles costs one pass over
+the open parcels rather than 500.
+
+Units larger than every box ship as parcels of their own; with no box
+configured, the whole cart is one parcel.
+"""
+import math
+from collections import Counter
+from decimal import Decimal, ROUND_HALF_UP
+from apps.products.models import Product
+
+GRAM = Decimal('0.001')
+DIMENSIONS = ('length_cm', 'width_cm', 'height_cm')
+
+
+def _fits(dims, box_dims):
+    return all(side <= box_side for side, box_side in zip(dims, box_dims))
+
+
+class Packer:
+    FILL = 0.9
+
+    @classmethod
+    def units(cls, product_ids):
+        """``{product id: (weight, sorted dimensions, volume)}`` of one packed unit of each product."""
+        fields = ('weight_kg',) + DIMENSIONS
+        rows = Product.objects.filter(pk__in=product_ids).values_list(
+            'pk', *fields, *(f'product_type__{field}' for field in fields)
+        )
+        units = {}
+        for pk, *values in rows:
+            own, inherited = values[:len(fields)], values[len(fields):]
+            weight, *dims = (float(a if a is not None else b or 0) for a, b in zip(own, inherited))
+            dims = tuple(sorted(dims, reverse=True))
+            units[pk] = (weight, dims, math.prod(dims))
+        return units
+
+    @classmethod
+    def boxes(cls, boxes):
+        """Shipping boxes compiled for ``pack``, smallest first."""
+        compiled = []
+        for box in boxes:
+            dims = tuple(sorted((float(getattr(box, field)) for field in DIMENSIONS), reverse=True))
+            compiled.append({'id': box.pk, 'name': box.name, 'dims': dims, 'volume': math.prod(dims),
+                             'weight': float(box.weight_kg),
+                             'max_weight': float(box.max_weight_kg) if box.max_weight_kg else math.inf})
+        return sorted(compiled, key=lambda box: (box['volume'], box['max_weight'], box['id']))
+
+    @classmethod
+    def pack(cls, lines, boxes):
+        """
+        Parcels for ``(product id, quantity)`` lines::
+
+            {'parcels': [{'box': id or None, 'box_name', 'weight_kg', 'items': {product id: quantity}}, ...],
+             'parcel_count': 2, 'weight_kg': Decimal('3.125')}
+
+        ``boxes`` are compiled by ``boxes``, e.g. ``ShippingIndex.boxes()``.
+        """
+        quantities = Counter()
+        for product_id, quantity in lines:
+            quantities[product_id] += quantity
+        units = cls.units(list(quantities))
+        groups = sorted(
+            ((units.get(product_id, (0.0, (0.0, 0.0, 0.0), 0.0)), product_id, quantity)
+             for product_id, quantity in quantities.items() if quantity > 0),
+            key=lambda group: (-group[0][2], -group[0][0], group[1]),
+        )
+
+        parcels = []
+        if not boxes:
+            if groups:
+                parcels.append(cls._parcel(None))
+                for unit, product_id, quantity in groups:
+                    cls._place(parcels[0], unit, product_id, quantity)
+            return cls._result(parcels)
+
+        for unit, product_id, quantity in groups:
+            weight, dims, volume = unit
+            for parcel in parcels:
+                if parcel['box'] is not None and _fits(dims, parcel['box']['dims']):
+                    count = min(quantity, cls._room(parcel, weight, volume))
+                    if count:
+                        cls._place(parcel, unit, product_id, count)
+                        quantity -= count
+                        if not quantity:
+                            break
+            fitting = [box for box in boxes if _fits(dims, box['dims']) and box['weight'] + weight <= box['max_weight']]
+            while quantity:
+                parcel = cls._parcel(fitting[-1] if fitting else None)
+                # A unit too large for FILL of the box still ships alone in it
+                count = max(1, min(quantity, cls._room(parcel, weight, volume))) if fitting else 1
+                cls._place(parcel, unit, product_id, count)
+                parcels.append(parcel)
+                quantity -= count
+
+        for parcel in parcels:
+            if parcel['box'] is not None:
+                parcel['box'] = next(box for box in boxes if cls._holds(box, parcel))
+        return cls._result(parcels)
+
+    @classmethod
+    def _parcel(cls, box):
+        return {'box': box, 'items': Counter(), 'units': 0, 'weight': 0.0, 'volume': 0.0, 'dims': (0.0, 0.0, 0.0)}
+
+    @classmethod
+    def _room(cls, parcel, weight, volume):
+        box = parcel['box']
+        by_volume = (box['volume'] * cls.FILL - parcel['volume']) / volume if volume else math.inf
+        by_weight = (box['max_weight'] - box['weight'] - parcel['weight']) / weight if weight else math.inf
+        room = min(by_volume, by_weight)
+        return max(0, math.floor(room + 1e-9)) if room != math.inf else math.inf
+
+    @classmethod
+    def _place(cls, parcel, unit, product_id, count):
+        weight, dims, volume = unit
+        parcel['items'][product_id] += count
+        parcel['units'] += count
+        parcel['weight'] += weight * count
+        parcel['volume'] += volume * count
+        parcel['dims'] = tuple(max(a, b) for a, b in zip(parcel['dims'], dims))
+
+    @classmethod
+    def _holds(cls, box, parcel):
+        capacity = box['volume'] if parcel['units'] == 1 else box['volume'] * cls.FILL
+        return (parcel['volume'] <= capacity + 1e-9 and _fits(parcel['dims'], box['dims'])
+                and box['weight'] + parcel['weight'] <= box['max_weight'] + 1e-9)
+
+    @classmethod
+    def _result(cls, parcels):
+        packed = []
+        for parcel in parcels:
+            box = parcel['box']
+            weight = parcel['weight'] + (box['weight'] if box else 0)
+            packed.append({'box': box['id'] if box else None, 'box_name': box['name'] if box else '',
+                           'weight_kg': Decimal(weight).quantize(GRAM, ROUND_HALF_UP), 'items': dict(parcel['items'])})
+        return {'parcels': packed, 'parcel_count': len(packed),
+                'weight_kg': sum((parcel['weight_kg'] for parcel in packed), Decimal('0.000'))}
@@ -0,0 +1,155 @@
+"""
+Shipping quotes from an in-process index of zones and methods.
+
+Zones keep their countries in a JSON list, so finding a destination's zone
+means scanning every zone. ``ShippingIndex`` compiles the active zones and
+methods once per process into ``{country: (method, ...)}`` and keeps it
+until the shared version number, bumped on commit of any zone, method or
+box change, moves. Other processes read the version from the cache at most
+every ``SHIPPING_INDEX_CHECK_SECONDS``; the process making the change drops
+its index at once. Quoting a cart is then a dict lookup and arithmetic, with
+no query and usually no cache round trip.
+
+The active shipping boxes are compiled alongside, for ``Packer``: carts are
+packed into parcels whose count and weight drive the quoted cost.
+"""
+import threading
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from apps.orders.models import Order
+from .models import ShippingBox, ShippingMethod, ShippingRate
+from .packing import Packer
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+
+class ShippingIndex:
+    VERSION_KEY = 'shipping_index_version'
+
+    FIELDS = ['id', 'name', 'zone_id', 'zone__name', 'zone__countries', 'base_cost', 'cost_per_kg',
+              'free_shipping_threshold', 'estimated_days_min', 'estimated_days_max', 'provider', 'provider_service_code']
+
+    _lock = threading.Lock()
+    _index = None
+    _version = None
+    _checked_at = 0.0
+
+    @classmethod
+    def version(cls):
+        return cache.get_or_set(cls.VERSION_KEY, 1, None)
+
+    @classmethod
+    def invalidate(cls):
+        try:
+            cache.incr(cls.VERSION_KEY)
+        except ValueError:
+            cache.set(cls.VERSION_KEY, 1, None)
+        cls._index = None
+
+    @classmethod
+    def get(cls):
+        """``{country code: (method, ...)}``."""
+        return cls.load()['countries']
+
+    @classmethod
+    def boxes(cls):
+        """The active shipping boxes compiled by ``Packer.boxes``."""
+        return cls.load()['boxes']
+
+    @classmethod
+    def load(cls):
+        """The compiled index, rebuilt when missing or outdated."""
+        index, now = cls._index, time.monotonic()
+        if index is not None and now - cls._checked_at < settings.SHIPPING_INDEX_CHECK_SECONDS:
+            return index
+        with cls._lock:
+            version = cls.version()
+            if cls._index is None or cls._version != version:
+                # Read the version first: a change committed during the build bumps it again
+                cls._index, cls._version = cls.build(), version
+            cls._checked_at = now
+            return cls._index
+
+    @classmethod
+    def build(cls):
+        index = {}
+        methods = (
+            ShippingMethod.objects.filter(is_active=True, zone__is_active=True)
+            .order_by('zone__name', 'zone_id', 'order', 'name').values(*cls.FIELDS)
+        )
+        for method in methods:
+            countries = method.pop('zone__countries') or []
+            method['zone'] = method.pop('zone__name')
+            for country in {str(code).strip().upper() for code in countries}:
+                index.setdefault(country, []).append(method)
+        return {
+            'countries': {country: tuple(methods) for country, methods in index.items()},
+            'boxes': Packer.boxes(ShippingBox.objects.filter(is_active=True)),
+        }
+
+
+class ShippingQuotes:
+    @classmethod
+    def quote(cls, country, order_total, weight_kg=0, parcels=1):
+        """
+        Every active method shipping to ``country`` with its cost for the
+        cart, in the zones' and methods' display order. The cost is waived
+        from the method's free shipping threshold, as in
+        ``ShippingMethod.calculate_cost``.
+        """
+        methods = ShippingIndex.get().get((country or '').strip().upper(), ())
+        weight, parcels = Decimal(str(weight_kg)), max(parcels, 1)
+        quotes = []
+        for method in methods:
+            threshold = method['free_shipping_threshold']
+            free = bool(threshold) and order_total >= threshold
+            cost = ZERO if free else (method['base_cost'] * parcels + method['cost_per_kg'] * weight).quantize(CENT, ROUND_HALF_UP)
+            quotes.append({**method, 'cost': cost, 'free_shipping': free})
+        return quotes
+
+    @classmethod
+    def quote_method(cls, method_id, country, order_total, weight_kg=0, parcels=1):
+        """The quote of one method, or ``None`` if it doesn't ship to ``country``."""
+        return next((quote for quote in cls.quote(country, order_total, weight_kg, parcels) if quote['id'] == method_id),
+                    None)
+
+    @classmethod
+    def quote_cart(cls, country, order_total, lines):
+        """Pack ``(product id, quantity)`` lines and quote them; returns ``(packing, quotes)``."""
+        packing = Packer.pack(lines, ShippingIndex.boxes())
+        return packing, cls.quote(country, order_total, packing['weight_kg'], packing['parcel_count'])
+
+
+class ShippingRates:
+    @classmethod
+    def assign(cls, order, method_id, country=None):
+        """
+        Pack the order's items, price them with ``method_id`` and record the
+        order's shipping rate; the order's shipping cost and total follow.
+        ``country`` defaults to the shipping address's. Returns the rate, or
+        ``None`` if the method doesn't ship there.
+        """
+        if country is None:
+            country = order.shipping_address.country if order.shipping_address_id else ''
+        lines = order.items.filter(product__isnull=False).values_list('product_id', 'quantity')
+        packing, quotes = ShippingQuotes.quote_cart(country, order.subtotal, lines)
+        quote = next((quote for quote in quotes if quote['id'] == method_id), None)
+        if quote is None:
+            return None
+        with transaction.atomic():
+            rate, _created = ShippingRate.objects.update_or_create(order=order, defaults={
+                'shipping_method_id': method_id, 'cost': quote['cost'], 'weight_kg': packing['weight_kg'],
+                'parcel_count': packing['parcel_count'], 'carrier': quote['provider'], 'service_name': quote['name'],
+            })
+            # The total moves by the change of shipping cost (SET uses the row's previous shipping cost)
+            Order.objects.filter(pk=order.pk).update(shipping_cost=quote['cost'],
+                                                     total=F('total') - F('shipping_cost') + quote['cost'],
+                                                     updated_at=timezone.now())
+        order.refresh_from_db(fields=['shipping_cost', 'total', 'updated_at'])
+        return rate
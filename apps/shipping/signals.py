@@ -0,0 +1,23 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from apps.orders.signals import order_status_changed
+from .models import ShippingBox, ShippingMethod, ShippingZone
+from .services import ShippingIndex
+from .tracking import TrackingPoller
+
+
+@receiver(post_save, sender=ShippingZone)
+@receiver(post_delete, sender=ShippingZone)
+@receiver(post_save, sender=ShippingMethod)
+@receiver(post_delete, sender=ShippingMethod)
+@receiver(post_save, sender=ShippingBox)
+@receiver(post_delete, sender=ShippingBox)
+def shipping_changed(sender, **kwargs):
+    transaction.on_commit(ShippingIndex.invalidate)
+
+
+@receiver(order_status_changed)
+def orders_shipped(sender, order_ids, status, **kwargs):
+    if status == 'shipped':
+        TrackingPoller.schedule(order_ids)
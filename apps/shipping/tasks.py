@@ -0,0 +1,13 @@
+from celery import shared_task
+from django.conf import settings
+
+
+@shared_task
+def poll_tracking_task():
+    """Poll the carriers about the shipments due, continuing right away while more are due."""
+    from .tracking import TrackingPoller
+
+    stats = TrackingPoller.poll()
+    if stats['polled'] >= settings.SHIPPING_TRACKING_BATCH:
+        poll_tracking_task.delay()
+    return stats
@@ -1,3 +1,371 @@
-from django.test import TestCase
+import math
+import random
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from unittest import mock
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from apps.orders.models import Order, OrderItem
+from apps.products.models import Product, ProductType
+from .carriers.adapters import FakeCarrierAdapter
+from .carriers.fake import FakeCarrierServer
+from .models import ShippingBox, ShippingMethod, ShippingRate, ShippingZone
+from .packing import Packer
+from .services import CENT, ShippingIndex, ShippingQuotes, ShippingRates
+from .tracking import TrackingPoller
 
-# Create your tests here.
+# Packed units: weight (kg), length, width, height (cm)
+SINGLE_CARD = ('0.008', '10.2', '7.6', '0.3')       # in a toploader
+BOOSTER_PACK = ('0.025', '12.0', '7.5', '0.5')
+ACCESSORY = ('0.150', '20.0', '10.0', '5.0')
+BOOSTER_BOX = ('0.900', '19.0', '14.0', '7.0')
+PLAYMAT_TUBE = ('0.600', '70.0', '8.0', '8.0')
+BOXES = [
+    # name, length, width, height, empty weight, max weight
+    ('Envelope', '25.0', '17.0', '2.0', '0.020', '0.500'),
+    ('Small box', '30.0', '20.0', '10.0', '0.150', '5.000'),
+    ('Large box', '50.0', '40.0', '30.0', '0.500', '10.000'),
+]
+
+
+def dimensions(dims):
+    weight, length, width, height = (Decimal(value) for value in dims)
+    return {'weight_kg': weight, 'length_cm': length, 'width_cm': width, 'height_cm': height}
+
+
+class PackingTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        types = [ProductType.objects.create(name=name, **dimensions(dims)) for name, dims in
+                 (('single_card', SINGLE_CARD), ('booster_pack', BOOSTER_PACK), ('other_accessory', ACCESSORY))]
+        cls.products = Product.objects.bulk_create([
+            Product(slug=f'pack-{i}', sku=f'PACK-{i}', product_type=types[i % 3],
+                    cost_price=Decimal('1.00'), selling_price=Decimal('2.50'), **(dimensions(BOOSTER_BOX) if i % 30 == 2 else {}))
+            for i in range(300)
+        ])
+
+        def product(key, dims=None, product_type=None):
+            return Product.objects.create(slug=f'pack-{key}', sku=f'PACK-{key}', product_type=product_type,
+                                          cost_price=Decimal('1.00'), selling_price=Decimal('2.50'),
+                                          **(dimensions(dims) if dims else {})).pk
+        cls.single = product('single', product_type=types[0])
+        cls.booster_box = product('booster-box', BOOSTER_BOX, types[2])
+        cls.playmat = product('playmat', PLAYMAT_TUBE, types[2])
+        cls.unknown = product('unknown')
+        cls.box_rows = ShippingBox.objects.bulk_create([
+            ShippingBox(name=name, length_cm=Decimal(length), width_cm=Decimal(width), height_cm=Decimal(height),
+                        weight_kg=Decimal(weight), max_weight_kg=Decimal(max_weight))
+            for name, length, width, height, weight, max_weight in BOXES
+        ])
+
+    def setUp(self):
+        ShippingIndex.invalidate()
+        self.boxes = Packer.boxes(self.box_rows)
+        self.units = Packer.units([product.pk for product in self.products]
+                                  + [self.single, self.booster_box, self.playmat, self.unknown])
+
+    def tearDown(self):
+        # Nothing cached from the rolled-back test rows stays current
+        ShippingIndex.invalidate()
+
+    def pack(self, lines, boxes=None):
+        boxes = self.boxes if boxes is None else boxes
+        packing = Packer.pack(lines, boxes)
+        self.assertValid(lines, packing, boxes)
+        return packing
+
+    def assertValid(self, lines, packing, boxes):
+        """Every unit packed once, each parcel within its box, the weights adding up."""
+        wanted = Counter()
+        for product_id, quantity in lines:
+            wanted[product_id] += quantity
+        packed = Counter()
+        by_id = {box['id']: box for box in boxes}
+        for parcel in packing['parcels']:
+            packed.update(parcel['items'])
+            content = [(self.units[pk], quantity) for pk, quantity in parcel['items'].items()]
+            weight = sum(unit[0] * quantity for unit, quantity in content)
+            box = by_id.get(parcel['box'])
+            if box:
+                weight += box['weight']
+                volume = sum(unit[2] * quantity for unit, quantity in content)
+                self.assertLessEqual(weight, box['max_weight'] + 1e-6, f"parcel overweight for {box['name']}")
+                self.assertLessEqual(volume, box['volume'] + 1e-6, f"parcel overflows {box['name']}")
+                for unit, _quantity in content:
+                    self.assertTrue(all(side <= limit for side, limit in zip(unit[1], box['dims'])),
+                                    f"unit does not fit {box['name']}")
+            elif boxes and len(content) == 1 and content[0][1] == 1:
+                self.assertFalse(any(all(a <= b for a, b in zip(content[0][0][1], box['dims'])) for box in boxes),
+                                 'unit fitting a box shipped unboxed')
+            self.assertAlmostEqual(Decimal(weight).quantize(Decimal('0.001'), ROUND_HALF_UP), parcel['weight_kg'],
+                                   delta=Decimal('0.001'))
+        self.assertEqual(packed, +wanted, 'units lost or duplicated')
+        self.assertEqual(packing['weight_kg'], sum((p['weight_kg'] for p in packing['parcels']), Decimal('0')))
+
+
+class PackerTests(PackingTestCase):
+    def box_names(self, packing):
+        return [parcel['box_name'] for parcel in packing['parcels']]
+
+    def test_one_single_in_an_envelope(self):
+        packing = self.pack([(self.single, 1)])
+        self.assertEqual(self.box_names(packing), ['Envelope'])
+        self.assertEqual(packing['weight_kg'], Decimal('0.028'))
+
+    def test_forty_singles_in_a_small_box(self):
+        self.assertEqual(self.box_names(self.pack([(self.single, 40)])), ['Small box'])
+
+    def test_one_booster_box_in_a_small_box(self):
+        self.assertEqual(self.box_names(self.pack([(self.booster_box, 1)])), ['Small box'])
+
+    def test_booster_boxes_split_by_weight(self):
+        self.assertEqual(self.pack([(self.booster_box, 30)])['parcel_count'], math.ceil(30 * 0.9 / (10 - 0.5)))
+
+    def test_booster_box_and_singles_share_a_box(self):
+        self.assertEqual(self.pack([(self.booster_box, 1), (self.single, 20)])['parcel_count'], 1)
+
+    def test_oversized_playmat_tube_ships_alone(self):
+        packing = self.pack([(self.playmat, 2), (self.single, 1)])
+        self.assertEqual(packing['parcel_count'], 3)
+        self.assertEqual(sum(parcel['box'] is None for parcel in packing['parcels']), 2)
+
+    def test_product_without_data_weighs_nothing(self):
+        packing = self.pack([(self.unknown, 3)])
+        self.assertEqual(packing['parcel_count'], 1)
+        self.assertEqual(packing['weight_kg'], Decimal('0.020'))
+
+    def test_no_boxes_one_parcel(self):
+        packing = self.pack([(self.booster_box, 30), (self.single, 5)], boxes=[])
+        self.assertEqual(packing['parcel_count'], 1)
+        self.assertEqual(packing['weight_kg'], Decimal('27.040'))
+
+    def test_empty_cart(self):
+        self.assertEqual(self.pack([])['parcel_count'], 0)
+
+    def test_large_carts(self):
+        rng = random.Random(42)
+        for _cart in range(20):
+            self.pack([(rng.choice(self.products).pk, rng.choice([1, 1, 1, 2, 3, 4, 10])) for _ in range(200)])
+
+
+class ShippingRatesTests(PackingTestCase):
+    def test_assign_rates_a_large_order(self):
+        zone = ShippingZone.objects.create(name='Packing zone', countries=['ZZ'])
+        method = ShippingMethod.objects.create(name='Tracked', zone=zone, base_cost=Decimal('4.90'),
+                                               cost_per_kg=Decimal('1.25'), provider='bench')
+        ShippingIndex.invalidate()
+        order = Order.objects.create(order_number='PACK-ORDER', email='packing@example.com', phone_number='0',
+                                     subtotal=Decimal('500.00'), total=Decimal('500.00'))
+        rng = random.Random(42)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, product_name='x', product_sku=product.sku, cost_price=Decimal('1.00'),
+                      selling_price=Decimal('2.50'), quantity=rng.randint(1, 4))
+            for product in rng.sample(self.products, 200)
+        ])
+
+        rate = ShippingRates.assign(order, method.pk, country='zz')
+        expected = method.calculate_cost(order.subtotal, rate.weight_kg, rate.parcel_count).quantize(CENT, ROUND_HALF_UP)
+        self.assertEqual(rate.cost, expected)
+        self.assertEqual(order.shipping_cost, expected)
+        self.assertEqual(order.total, Decimal('500.00') + expected)
+        self.assertGreater(rate.weight_kg, 0)
+        self.assertEqual(rate.carrier, 'bench')
+        self.assertIsNone(ShippingRates.assign(order, method.pk, country='AA'))
+
+
+class ShippingQuotesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        europe = ShippingZone.objects.create(name='Europe', countries=['de', ' FR '])
+        closed = ShippingZone.objects.create(name='Closed', countries=['IT'], is_active=False)
+        cls.standard = ShippingMethod.objects.create(name='Standard', zone=europe, base_cost=Decimal('5.00'),
+                                                     cost_per_kg=Decimal('2.00'),
+                                                     free_shipping_threshold=Decimal('50.00'))
+        cls.express = ShippingMethod.objects.create(name='Express', zone=europe, base_cost=Decimal('15.00'), order=1)
+        ShippingMethod.objects.create(name='Retired', zone=europe, base_cost=Decimal('1.00'), is_active=False)
+        ShippingMethod.objects.create(name='Standard', zone=closed, base_cost=Decimal('1.00'))
+
+    def setUp(self):
+        ShippingIndex.invalidate()
+
+    def tearDown(self):
+        ShippingIndex.invalidate()
+
+    def costs(self, country, order_total, weight_kg=0, parcels=1):
+        return [(quote['name'], quote['cost'], quote['free_shipping'])
+                for quote in ShippingQuotes.quote(country, Decimal(order_total), weight_kg, parcels)]
+
+    def test_costs_and_free_shipping_threshold(self):
+        self.assertEqual(self.costs('DE', '20.00', Decimal('1.5'), 2),
+                         [('Standard', Decimal('13.00'), False), ('Express', Decimal('30.00'), False)])
+        self.assertEqual(self.costs(' fr', '49.99'), [('Standard', Decimal('5.00'), False),
+                                                      ('Express', Decimal('15.00'), False)])
+        # The threshold is inclusive and waives weight and parcels too; methods without one never ship free
+        self.assertEqual(self.costs('DE', '50.00', 3, 4),
+                         [('Standard', Decimal('0.00'), True), ('Express', Decimal('60.00'), False)])
+        self.assertEqual(self.costs('IT', '20.00'), [])
+        self.assertEqual(self.costs('', '20.00'), [])
+        express = ShippingQuotes.quote_method(self.express.pk, 'DE', Decimal('80.00'))
+        self.assertEqual(express['cost'], Decimal('15.00'))
+        self.assertIsNone(ShippingQuotes.quote_method(self.express.pk, 'US', Decimal('80.00')))
+
+    def test_warm_quote_runs_no_query(self):
+        ShippingIndex.load()
+        with self.assertNumQueries(0):
+            self.assertEqual(len(ShippingQuotes.quote('DE', Decimal('20.00'), 1)), 2)
+
+    @override_settings(SHIPPING_INDEX_CHECK_SECONDS=60)
+    def test_index_follows_the_shared_version(self):
+        index = ShippingIndex.load()
+        # Changed without signals, as by another process: served from the index until the version moves
+        ShippingMethod.objects.filter(pk=self.express.pk).update(base_cost=Decimal('12.00'))
+        self.assertEqual(self.costs('DE', '20.00')[1][1], Decimal('15.00'))
+        with override_settings(SHIPPING_INDEX_CHECK_SECONDS=0):
+            self.assertIs(ShippingIndex.load(), index)
+            cache.incr(ShippingIndex.VERSION_KEY)
+            self.assertEqual(self.costs('DE', '20.00')[1][1], Decimal('12.00'))
+
+        # A change made here drops the index on commit, without waiting for the check
+        zone = self.standard.zone
+        zone.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            zone.save()
+        self.assertEqual(self.costs('DE', '20.00'), [])
+
+
+class TrackingPollerTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeCarrierServer(('127.0.0.1', 0), latency=0, jitter=0).start()
+        cls.settings = override_settings(
+            SHIPPING_CARRIERS={'fake': {'adapter': 'fake', 'base_url': cls.server.url}}, SHIPPING_TRACKING_BATCH=100,
+            SHIPPING_TRACKING_WORKERS=2, SHIPPING_TRACKING_MAX_DAYS=60, SHIPPING_CARRIER_TIMEOUT=5.0,
+            SHIPPING_CARRIER_CONNECT_TIMEOUT=1.0,
+        )
+        cls.settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.shipments.clear()
+        self.server.error_rate = 0.0
+        self.now = timezone.now()
+
+    def shipment(self, number, carrier='fake', shipped_days_ago=2):
+        order = Order.objects.create(order_number=f'TRACK-{number}', email='track@example.com', phone_number='0',
+                                     status='shipped', shipped_at=self.now - timedelta(days=shipped_days_ago),
+                                     tracking_number=number, subtotal=Decimal('10.00'), total=Decimal('10.00'))
+        return ShippingRate.objects.create(order=order, cost=Decimal('4.90'), carrier=carrier, tracking_number=number,
+                                           next_poll_at=self.now - timedelta(minutes=1))
+
+    def poll(self):
+        stats = TrackingPoller.poll(workers=2)
+        return stats, {rate.tracking_number: rate for rate in ShippingRate.objects.select_related('order')}
+
+    def assertPolledAgainIn(self, rate, interval):
+        jitter = interval * TrackingPoller.JITTER + timedelta(minutes=1)
+        self.assertAlmostEqual(rate.next_poll_at, rate.last_polled_at + interval, delta=jitter)
+
+    def test_schedule_takes_the_order_tracking_number(self):
+        rate = self.shipment('S1')
+        ShippingRate.objects.filter(pk=rate.pk).update(tracking_number='', next_poll_at=None)
+        self.assertEqual(TrackingPoller.schedule([rate.order_id]), 1)
+        rate.refresh_from_db()
+        self.assertEqual(rate.tracking_number, 'S1')
+        self.assertGreater(rate.next_poll_at, self.now)
+
+    def test_scans_update_shipments_and_deliver_orders(self):
+        for number in ('T1', 'T2', 'T3', 'T4'):
+            self.shipment(number)
+        self.server.add_event('T1', 'in_transit', self.now - timedelta(hours=30))
+        self.server.add_event('T1', 'delivered', self.now - timedelta(hours=1), 'Left at the door')
+        self.server.add_event('T2', 'out_for_delivery', self.now - timedelta(minutes=20))
+        self.server.add_event('T3', 'in_transit', self.now - timedelta(days=2))
+
+        stats, rates = self.poll()
+        self.assertEqual((stats['polled'], stats['calls'], stats['updated'], stats['delivered'], stats['failed']),
+                         (4, 1, 3, 1, 0))
+        delivered = rates['T1']
+        self.assertEqual((delivered.tracking_status, delivered.last_event), ('delivered', 'Left at the door'))
+        self.assertIsNone(delivered.next_poll_at)
+        self.assertEqual(delivered.order.status, 'delivered')
+        self.assertEqual(delivered.order.delivered_at, delivered.delivered_at)
+        self.assertEqual(rates['T2'].tracking_status, 'out_for_delivery')
+        self.assertPolledAgainIn(rates['T2'], TrackingPoller.OUT_FOR_DELIVERY_INTERVAL)
+        self.assertPolledAgainIn(rates['T3'], TrackingPoller.INTERVALS[2][1])
+        self.assertEqual(rates['T4'].tracking_status, 'pending')
+        self.assertPolledAgainIn(rates['T4'], TrackingPoller.NO_SCAN_INTERVAL)
+
+    def test_older_scan_never_replaces_a_newer_one(self):
+        rate = self.shipment('O1')
+        ShippingRate.objects.filter(pk=rate.pk).update(tracking_status='out_for_delivery', last_event_at=self.now)
+        self.server.add_event('O1', 'in_transit', self.now - timedelta(hours=5))
+        _stats, rates = self.poll()
+        self.assertEqual(rates['O1'].tracking_status, 'out_for_delivery')
+
+    def test_carrier_outage_backs_off(self):
+        self.shipment('E1')
+        self.server.error_rate = 1.0
+        for failures in (1, 2):
+            ShippingRate.objects.update(next_poll_at=self.now - timedelta(minutes=1))
+            with self.assertLogs('apps.shipping.tracking', 'WARNING'):
+                stats, rates = self.poll()
+            self.assertEqual(stats['failed'], 1)
+            self.assertEqual(rates['E1'].poll_failures, failures)
+            self.assertPolledAgainIn(rates['E1'], TrackingPoller.RETRY_INTERVAL * 2 ** (failures - 1))
+
+    def test_malformed_answers_back_off(self):
+        self.shipment('M1')
+        self.shipment('M2', carrier='Fake ')
+        cases = [
+            [{'status': 'in_transit', 'description': 'Sorted'}],
+            [{'status': 'in_transit', 'occurred_at': None}],
+            [{'status': 'in_transit', 'occurred_at': '2026-10-19T08:00:00'}],
+            [{'status': 'in_transit', 'occurred_at': 'yesterday'}],
+            ['in_transit'],
+        ]
+        for events in cases:
+            with self.subTest(events=events):
+                ShippingRate.objects.update(next_poll_at=self.now - timedelta(minutes=1), poll_failures=0)
+                self.server.shipments['M1'] = events
+                with self.assertLogs('apps.shipping.tracking', 'WARNING'):
+                    stats, rates = self.poll()
+                self.assertEqual(stats['failed'], 2)
+                self.assertEqual([rates[number].poll_failures for number in ('M1', 'M2')], [1, 1])
+                self.assertPolledAgainIn(rates['M1'], TrackingPoller.RETRY_INTERVAL)
+
+    def test_unexpected_errors_back_off(self):
+        self.shipment('X1')
+        with mock.patch.object(FakeCarrierAdapter, 'track', side_effect=RuntimeError('adapter bug')), \
+                self.assertLogs('apps.shipping.tracking', 'WARNING') as logs:
+            stats, rates = self.poll()
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(rates['X1'].poll_failures, 1)
+        self.assertIn('adapter bug', '\n'.join(logs.output))
+
+    def test_unknown_carrier_waits_a_day(self):
+        self.shipment('U1', carrier='Pigeon post')
+        with self.assertLogs('apps.shipping.tracking', 'WARNING'):
+            stats, rates = self.poll()
+        self.assertEqual(stats['unknown_carrier'], 1)
+        self.assertAlmostEqual(rates['U1'].next_poll_at, self.now + TrackingPoller.UNKNOWN_CARRIER_INTERVAL,
+                               delta=timedelta(minutes=1))
+
+    def test_unknown_carrier_stops_after_max_days(self):
+        self.shipment('U2', carrier='Pigeon post', shipped_days_ago=61)
+        self.shipment('U3', carrier='', shipped_days_ago=61)
+        self.shipment('U4', carrier='', shipped_days_ago=59)
+        with self.assertLogs('apps.shipping.tracking', 'WARNING'):
+            stats, rates = self.poll()
+        self.assertEqual(stats['unknown_carrier'], 3)
+        self.assertIsNone(rates['U2'].next_poll_at)
+        self.assertIsNone(rates['U3'].next_poll_at)
+        self.assertIsNotNone(rates['U4'].next_poll_at)
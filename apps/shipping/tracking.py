@@ -0,0 +1,197 @@
+"""
+Carrier tracking of shipped orders.
+
+A shipment is polled when its ``next_poll_at`` comes due. ``poll`` claims
+the due shipments (``FOR UPDATE SKIP LOCKED``, then pushed back by a lease
+so overlapping runs never poll the same ones) and groups them per carrier
+into batches of the adapter's size. The carriers are called from a bounded
+thread pool, outside any transaction. Results are applied in bulk: one
+UPDATE of the shipping rates, and one state machine transition for
+the orders delivered, stamped with the carrier's delivery time.
+
+How soon a shipment is polled again depends on the age of its last scan
+(``INTERVALS``). Parcels out for delivery or scanned within hours are polled
+often, parcels idle for days rarely, with jitter so batches spread out.
+Failed calls back off exponentially. Tracking stops once a parcel is
+delivered or returned, or ``SHIPPING_TRACKING_MAX_DAYS`` after shipping.
+"""
+import logging
+import random
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from apps.orders.models import Order
+from apps.orders.services import OrderStateMachine
+from .carriers import CarrierError, get_carrier
+from .models import ShippingRate
+
+logger = logging.getLogger(__name__)
+
+
+class TrackingPoller:
+    # (last scan younger than, poll again after)
+    INTERVALS = (
+        (timedelta(hours=6), timedelta(hours=1)),
+        (timedelta(days=1), timedelta(hours=3)),
+        (timedelta(days=3), timedelta(hours=6)),
+    )
+    IDLE_INTERVAL = timedelta(hours=12)
+    OUT_FOR_DELIVERY_INTERVAL = timedelta(minutes=30)
+    # Labels are often printed well before the first scan
+    FIRST_POLL = timedelta(hours=2)
+    NO_SCAN_INTERVAL = timedelta(hours=4)
+    RETRY_INTERVAL = timedelta(minutes=15)
+    UNKNOWN_CARRIER_INTERVAL = timedelta(days=1)
+    LEASE = timedelta(minutes=10)
+    JITTER = 0.1
+
+    FIELDS = ['tracking_url', 'tracking_status', 'last_event', 'last_event_at', 'delivered_at', 'last_polled_at',
+              'next_poll_at', 'poll_failures']
+
+    # One statement for the whole run (bulk_update's CASE per field and row is far slower)
+    UPDATE_SQL = f'''
+        UPDATE {ShippingRate._meta.db_table} AS rate
+        SET {', '.join(f'{field} = polled.{field}' for field in FIELDS)}, updated_at = %s
+        FROM unnest(%s::bigint[], %s::varchar[], %s::varchar[], %s::varchar[], %s::timestamptz[], %s::timestamptz[],
+                    %s::timestamptz[], %s::timestamptz[], %s::integer[]) AS polled(id, {', '.join(FIELDS)})
+        WHERE rate.id = polled.id
+    '''
+
+    @classmethod
+    def schedule(cls, order_ids):
+        """Start tracking the shipments of newly shipped orders; rates without a tracking number take the order's."""
+        now = timezone.now()
+        rates = ShippingRate.objects.filter(order_id__in=order_ids)
+        rates.filter(tracking_number='').update(
+            tracking_number=Subquery(Order.objects.filter(pk=OuterRef('order_id')).values('tracking_number')[:1]),
+            updated_at=now,
+        )
+        return (
+            rates.exclude(tracking_number='').exclude(tracking_status__in=ShippingRate.FINAL_TRACKING_STATUSES)
+            .filter(next_poll_at__isnull=True).update(next_poll_at=now + cls.FIRST_POLL, poll_failures=0, updated_at=now)
+        )
+
+    @classmethod
+    def poll(cls, limit=None, workers=None):
+        """Poll the carriers about the shipments due; returns the run's stats."""
+        started = time.perf_counter()
+        rates = cls.claim(limit or settings.SHIPPING_TRACKING_BATCH)
+        stats = {'polled': len(rates), 'calls': 0, 'updated': 0, 'delivered': 0, 'failed': 0, 'unknown_carrier': 0}
+
+        by_carrier = defaultdict(list)
+        for rate in rates:
+            by_carrier[rate.carrier.strip().lower()].append(rate)
+        batches, unknown = [], []
+        for name, group in by_carrier.items():
+            try:
+                adapter = get_carrier(name)
+            except CarrierError as exc:
+                logger.warning(f'Not tracking {len(group)} shipments: {exc}')
+                unknown += group
+                continue
+            size = adapter.batch_size
+            batches += [(adapter, group[start:start + size]) for start in range(0, len(group), size)]
+
+        def call(batch):
+            adapter, group = batch
+            try:
+                return adapter, group, adapter.track([rate.tracking_number for rate in group]), None
+            except Exception as exc:
+                # Whatever went wrong, the batch backs off instead of failing the run
+                if not isinstance(exc, CarrierError):
+                    logger.exception(f'Tracking {len(group)} {adapter.carrier} shipments raised')
+                return adapter, group, None, exc
+
+        if batches:
+            with ThreadPoolExecutor(min(workers or settings.SHIPPING_TRACKING_WORKERS, len(batches))) as pool:
+                results = list(pool.map(call, batches))
+        else:
+            results = []
+        stats['calls'] = len(batches)
+        cls.apply(results, unknown, stats)
+        stats['elapsed'] = round(time.perf_counter() - started, 3)
+        return stats
+
+    @classmethod
+    def claim(cls, limit):
+        now = timezone.now()
+        with transaction.atomic():
+            rates = list(
+                ShippingRate.objects.filter(next_poll_at__lte=now).order_by('next_poll_at')
+                .select_for_update(skip_locked=True, of=('self',)).select_related('order')
+                .only('carrier', 'tracking_number', 'created_at', 'order__status', 'order__shipped_at', *cls.FIELDS)[:limit]
+            )
+            ShippingRate.objects.filter(pk__in=[rate.pk for rate in rates]).update(next_poll_at=now + cls.LEASE)
+        return rates
+
+    @classmethod
+    def apply(cls, results, unknown, stats):
+        now = timezone.now()
+        rates, delivered = [], {}
+        for adapter, group, tracked, error in results:
+            if error is not None:
+                logger.warning(f'Tracking {len(group)} shipments failed: {error}')
+                stats['failed'] += len(group)
+            for rate in group:
+                rate.tracking_url = rate.tracking_url or adapter.tracking_url(rate.tracking_number)
+                rate.last_polled_at = now
+                if error is not None:
+                    rate.poll_failures += 1
+                else:
+                    rate.poll_failures = 0
+                    event = tracked.get(rate.tracking_number)
+                    # Carriers may answer from a lagging replica: never step back to an older scan
+                    if event and (rate.last_event_at is None or event['event_at'] > rate.last_event_at):
+                        rate.tracking_status, rate.last_event, rate.last_event_at = \
+                            event['status'], event['event'], event['event_at']
+                        rate.delivered_at = event['delivered_at'] or rate.delivered_at
+                        stats['updated'] += 1
+                    if rate.tracking_status == 'delivered' and rate.order.status == 'shipped':
+                        delivered[rate.order_id] = rate.delivered_at or rate.last_event_at
+                rate.next_poll_at = cls.next_poll(rate, now)
+                rates.append(rate)
+        for rate in unknown:
+            rate.next_poll_at = None if cls.expired(rate, now) else now + cls.UNKNOWN_CARRIER_INTERVAL
+            rates.append(rate)
+        stats['unknown_carrier'] = len(unknown)
+
+        with transaction.atomic():
+            if rates:
+                with connection.cursor() as cursor:
+                    cursor.execute(cls.UPDATE_SQL, [now, [rate.pk for rate in rates]] + [
+                        [getattr(rate, field) for rate in rates] for field in cls.FIELDS
+                    ])
+            if delivered:
+                result = OrderStateMachine.transition(
+                    Order.objects.filter(pk__in=list(delivered)), 'delivered',
+                    notes='Delivered (carrier tracking)', timestamps=delivered,
+                )
+                stats['delivered'] = len(result['updated'])
+
+    @classmethod
+    def expired(cls, rate, now):
+        """Whether ``rate`` shipped more than ``SHIPPING_TRACKING_MAX_DAYS`` ago."""
+        return now - (rate.order.shipped_at or rate.created_at) > timedelta(days=settings.SHIPPING_TRACKING_MAX_DAYS)
+
+    @classmethod
+    def next_poll(cls, rate, now):
+        """When to poll ``rate`` again, ``None`` to stop tracking it."""
+        if rate.tracking_status in ShippingRate.FINAL_TRACKING_STATUSES:
+            return None
+        if cls.expired(rate, now):
+            return None
+        if rate.poll_failures:
+            interval = min(cls.RETRY_INTERVAL * 2 ** min(rate.poll_failures - 1, 10), cls.IDLE_INTERVAL)
+        elif rate.tracking_status == 'out_for_delivery':
+            interval = cls.OUT_FOR_DELIVERY_INTERVAL
+        elif rate.last_event_at is None:
+            interval = cls.NO_SCAN_INTERVAL
+        else:
+            age = now - rate.last_event_at
+            interval = next((every for younger, every in cls.INTERVALS if age < younger), cls.IDLE_INTERVAL)
+        return now + interval * random.uniform(1 - cls.JITTER, 1 + cls.JITTER)
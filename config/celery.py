@@ -28,4 +28,36 @@ app.conf.beat_schedule = {
         'task': 'apps.orders.tasks.cleanup_old_carts_task',
         'schedule': crontab(hour=0, minute=0),
     },
+    'maintain-partitions-daily': {
+        'task': 'apps.orders.tasks.maintain_partitions_task',
+        'schedule': crontab(hour=1, minute=30),
+    },
+    'rebuild-recent-sales-rollups-nightly': {
+        'task': 'apps.dashboard.tasks.rebuild_recent_sales_rollups_task',
+        'schedule': crontab(hour=2, minute=0),
+    },
+    'schedule-sale-boundaries-hourly': {
+        'task': 'apps.discounts.tasks.schedule_sale_boundaries_task',
+        'schedule': crontab(minute=0),
+    },
+    'enqueue-stale-webhooks-every-5-minutes': {
+        'task': 'apps.payments.tasks.enqueue_stale_webhooks_task',
+        'schedule': crontab(minute='*/5'),
+    },
+    'retry-refunds-every-15-minutes': {
+        'task': 'apps.payments.tasks.retry_refunds_task',
+        'schedule': crontab(minute='*/15'),
+    },
+    'prune-gateway-responses-nightly': {
+        'task': 'apps.payments.tasks.prune_gateway_responses_task',
+        'schedule': crontab(hour=3, minute=30),
+    },
+    'poll-carrier-tracking-every-5-minutes': {
+        'task': 'apps.shipping.tasks.poll_tracking_task',
+        'schedule': crontab(minute='*/5'),
+    },
+    'rescore-customers-nightly': {
+        'task': 'apps.dashboard.tasks.rescore_customers_task',
+        'schedule': crontab(hour=2, minute=30),
+    },
 }
@@ -163,10 +163,12 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+REDIS_URL = env('REDIS_URL')
+
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
-        'LOCATION': env('REDIS_URL'),
+        'LOCATION': REDIS_URL,
     }
 }
 SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
@@ -181,6 +183,85 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
 
+# Monthly partitions of orders_orderitem, orders_orderstatushistory and emails_emaillog
+PARTITION_MONTHS_AHEAD = env.int('PARTITION_MONTHS_AHEAD', default=3)
+PARTITION_RETENTION_MONTHS = {
+    'emails_emaillog': env.int('EMAIL_LOG_RETENTION_MONTHS', default=12),
+}
+
+
+# Threads computing cache-missed dashboard widgets in one batched request
+DASHBOARD_WIDGET_WORKERS = env.int('DASHBOARD_WIDGET_WORKERS', default=4)
+
+# Live dashboard stream (served by the ASGI process)
+DASHBOARD_STREAM_HEARTBEAT = env.int('DASHBOARD_STREAM_HEARTBEAT', default=15)
+DASHBOARD_STREAM_MAX_SECONDS = env.int('DASHBOARD_STREAM_MAX_SECONDS', default=300)
+DASHBOARD_STREAM_QUEUE_SIZE = env.int('DASHBOARD_STREAM_QUEUE_SIZE', default=100)
+
+
+# Payment anomaly detection: rates over a short window against an hourly baseline.
+# An alert fires when the window has at least MIN_EVENTS and its rate reaches
+# both the absolute RATE and MULTIPLIER x the baseline rate.
+PAYMENT_ANOMALY_WINDOW_MINUTES = env.int('PAYMENT_ANOMALY_WINDOW_MINUTES', default=15)
+PAYMENT_ANOMALY_BASELINE_HOURS = env.int('PAYMENT_ANOMALY_BASELINE_HOURS', default=24)
+PAYMENT_ANOMALY_MIN_EVENTS = env.int('PAYMENT_ANOMALY_MIN_EVENTS', default=20)
+PAYMENT_ANOMALY_COOLDOWN_MINUTES = env.int('PAYMENT_ANOMALY_COOLDOWN_MINUTES', default=15)
+PAYMENT_ANOMALY_FAILURE_RATE = env.float('PAYMENT_ANOMALY_FAILURE_RATE', default=0.2)
+PAYMENT_ANOMALY_FAILURE_MULTIPLIER = env.float('PAYMENT_ANOMALY_FAILURE_MULTIPLIER', default=3.0)
+PAYMENT_ANOMALY_REFUND_RATE = env.float('PAYMENT_ANOMALY_REFUND_RATE', default=0.1)
+PAYMENT_ANOMALY_REFUND_MULTIPLIER = env.float('PAYMENT_ANOMALY_REFUND_MULTIPLIER', default=3.0)
+
+
+# Payment gateway HTTP clients: pooled keep-alive connections per gateway and
+# process, strict timeouts (seconds), retries with full-jitter backoff, and a
+# circuit breaker that fails fast after consecutive failures
+PAYMENT_GATEWAY_TIMEOUT = env.float('PAYMENT_GATEWAY_TIMEOUT', default=10.0)
+PAYMENT_GATEWAY_CONNECT_TIMEOUT = env.float('PAYMENT_GATEWAY_CONNECT_TIMEOUT', default=3.0)
+PAYMENT_GATEWAY_POOL_SIZE = env.int('PAYMENT_GATEWAY_POOL_SIZE', default=20)
+PAYMENT_GATEWAY_RETRIES = env.int('PAYMENT_GATEWAY_RETRIES', default=2)
+PAYMENT_GATEWAY_BACKOFF = env.float('PAYMENT_GATEWAY_BACKOFF', default=0.2)
+PAYMENT_GATEWAY_BACKOFF_MAX = env.float('PAYMENT_GATEWAY_BACKOFF_MAX', default=2.0)
+PAYMENT_GATEWAY_BREAKER_FAILURES = env.int('PAYMENT_GATEWAY_BREAKER_FAILURES', default=5)
+PAYMENT_GATEWAY_BREAKER_RESET_SECONDS = env.int('PAYMENT_GATEWAY_BREAKER_RESET_SECONDS', default=30)
+
+# Gateway webhooks: accepted signature age (seconds), and attempts of events
+# that arrive before their payment or refund, retried after a doubling delay
+PAYMENT_WEBHOOK_TOLERANCE_SECONDS = env.int('PAYMENT_WEBHOOK_TOLERANCE_SECONDS', default=300)
+PAYMENT_WEBHOOK_MAX_ATTEMPTS = env.int('PAYMENT_WEBHOOK_MAX_ATTEMPTS', default=8)
+PAYMENT_WEBHOOK_RETRY_DELAY = env.int('PAYMENT_WEBHOOK_RETRY_DELAY', default=15)
+
+# Days raw gateway payloads of payments and refunds are kept (0 keeps them forever).
+# PayPal refunds read the capture id from the payment's payload.
+PAYMENT_RESPONSE_RETENTION_DAYS = env.int('PAYMENT_RESPONSE_RETENTION_DAYS', default=400)
+
+# Bulk refunds: concurrent gateway calls, and calls per second per gateway
+# (a gateway's config['refund_rate_limit'] overrides it, 0 for no limit)
+PAYMENT_BULK_REFUND_WORKERS = env.int('PAYMENT_BULK_REFUND_WORKERS', default=8)
+PAYMENT_REFUND_RATE_LIMIT = env.float('PAYMENT_REFUND_RATE_LIMIT', default=20.0)
+
+
+# Seconds a process serves shipping quotes from its zone index before checking
+# whether another process changed a zone or method
+SHIPPING_INDEX_CHECK_SECONDS = env.float('SHIPPING_INDEX_CHECK_SECONDS', default=5.0)
+
+# Carrier tracking. SHIPPING_CARRIERS configures carriers by their name on shipping
+# rates, in lower case, e.g. {"fakeship": {"adapter": "fake", "base_url": "...", "batch_size": 100}};
+# then shipments polled per run, concurrent carrier calls, timeouts (seconds),
+# and the days after shipping when tracking gives up
+SHIPPING_CARRIERS = env.json('SHIPPING_CARRIERS', default={})
+SHIPPING_TRACKING_BATCH = env.int('SHIPPING_TRACKING_BATCH', default=5000)
+SHIPPING_TRACKING_WORKERS = env.int('SHIPPING_TRACKING_WORKERS', default=4)
+SHIPPING_CARRIER_TIMEOUT = env.float('SHIPPING_CARRIER_TIMEOUT', default=10.0)
+SHIPPING_CARRIER_CONNECT_TIMEOUT = env.float('SHIPPING_CARRIER_CONNECT_TIMEOUT', default=3.0)
+SHIPPING_TRACKING_MAX_DAYS = env.int('SHIPPING_TRACKING_MAX_DAYS', default=60)
+
+
+# Sale boundaries: warm-up tasks are enqueued for boundaries within the horizon
+# and run this many seconds before the sale starts or ends
+SALE_SCHEDULE_HORIZON_HOURS = env.int('SALE_SCHEDULE_HORIZON_HOURS', default=2)
+SALE_WARMUP_LEAD_SECONDS = env.int('SALE_WARMUP_LEAD_SECONDS', default=120)
+
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework_simplejwt.authentication.JWTAuthentication',